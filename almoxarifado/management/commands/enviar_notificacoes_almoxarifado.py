@@ -296,52 +296,29 @@ class Command(BaseCommand):
                 try:
                     self.stdout.write(f"📤 Enviando para {numero} ({dept_nome})...")
                     
-                    # Registrar no histórico
+                    # Enviar mensagem
+                    success, response = service.enviar_mensagem(numero, mensagem)
+                    
+                    if success:
+                        resultados.append({'numero': numero, 'success': True})
+                        self.stdout.write(self.style.SUCCESS(f"  ✅ Resumo enviado para {numero}"))
+                    else:
+                        self.stdout.write(self.style.ERROR(f"  ❌ Falha ao enviar para {numero}: {response}"))
+                    
+                    # Registrar no histórico já com o status final (um registro
+                    # 'pendente' seria enviado de novo pela fila de notificações)
                     try:
                         HistoricoNotificacaoAlmoxarifado.objects.create(
                             item=itens['baixo'][0] if itens['baixo'] else itens['zerado'][0],
                             tipo='baixo' if itens['baixo'] else 'zerado',
                             destinatario=numero,
                             mensagem=mensagem[:500],
-                            status='pendente'
+                            status='enviado' if success else 'erro',
+                            enviado_em=timezone.now() if success else None,
+                            erro=None if success else str(response)[:500],
                         )
                     except Exception as hist_error:
                         self.stdout.write(f"   ⚠️ Erro ao registrar histórico: {hist_error}")
-                    
-                    # Enviar mensagem
-                    success, response = service.enviar_mensagem(numero, mensagem)
-                    
-                    if success:
-                        resultados.append({'numero': numero, 'success': True})
-                        self.stdout.write(self.style.SUCCESS(f"  ✅ Resumo enviado para {numero}"))
-                        
-                        # Atualizar histórico
-                        try:
-                            hist = HistoricoNotificacaoAlmoxarifado.objects.filter(
-                                destinatario=numero,
-                                status='pendente'
-                            ).last()
-                            if hist:
-                                hist.status = 'enviado'
-                                hist.enviado_em = timezone.now()
-                                hist.save()
-                        except:
-                            pass
-                    else:
-                        self.stdout.write(self.style.ERROR(f"  ❌ Falha ao enviar para {numero}: {response}"))
-                        
-                        # Atualizar histórico com erro
-                        try:
-                            hist = HistoricoNotificacaoAlmoxarifado.objects.filter(
-                                destinatario=numero,
-                                status='pendente'
-                            ).last()
-                            if hist:
-                                hist.status = 'erro'
-                                hist.erro = str(response)[:500]
-                                hist.save()
-                        except:
-                            pass
                 except Exception as e:
                     self.stdout.write(self.style.ERROR(f"  ❌ Erro ao enviar para {numero}: {e}"))
         
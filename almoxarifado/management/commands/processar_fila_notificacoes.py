@@ -0,0 +1,50 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from ...services_notificacao import LIMITE_LOTE, processar_fila_notificacoes
+
+
+class Command(BaseCommand):
+    help = (
+        'Envia as notificações WhatsApp pendentes do almoxarifado '
+        '(fila gravada pelas alterações de estoque).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Continua rodando e processa a fila a cada intervalo.',
+        )
+        parser.add_argument(
+            '--intervalo',
+            type=float,
+            default=5,
+            help='Segundos entre passadas quando a fila está vazia (com --loop).',
+        )
+        parser.add_argument(
+            '--limite',
+            type=int,
+            default=LIMITE_LOTE,
+            help='Registros processados por passada.',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            resumo = processar_fila_notificacoes(limite=options['limite'])
+
+            if any(resumo.values()):
+                self.stdout.write(
+                    f"📤 Enviadas: {resumo['enviados']} | ❌ Falhas: {resumo['falhas']} | "
+                    f"⏳ Adiadas: {resumo['adiados']} | 🗑️ Expiradas: {resumo['expirados']}"
+                )
+
+            if not options['loop']:
+                break
+
+            # Lote cheio: provavelmente tem mais na fila, segue sem esperar
+            if resumo['enviados'] + resumo['falhas'] + resumo['adiados'] < options['limite']:
+                time.sleep(options['intervalo'])
+
+        self.stdout.write(self.style.SUCCESS('✅ Fila de notificações processada.'))
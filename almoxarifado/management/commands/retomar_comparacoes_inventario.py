@@ -0,0 +1,69 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils import timezone
+
+from ...models import ImportacaoInventario
+from ...services_inventario import (
+    MAX_TENTATIVAS_COMPARACAO,
+    TAMANHO_LOTE_COMPARACAO,
+    TEMPO_SEM_SINAL_COMPARACAO,
+    processar_comparacao,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Retoma comparações de inventário interrompidas (status PROCESSANDO '
+        'ou ERRO) a partir do último lote gravado. Importações com sinal '
+        'recente de outro processo (processando_desde) são puladas, assim '
+        'como as que já falharam MAX_TENTATIVAS_COMPARACAO vezes (a não ser '
+        'que sejam pedidas pelo id).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'ids',
+            nargs='*',
+            type=int,
+            help='Importações a retomar (padrão: todas as interrompidas).',
+        )
+        parser.add_argument(
+            '--tamanho-lote',
+            type=int,
+            default=TAMANHO_LOTE_COMPARACAO,
+            help='Linhas gravadas por vez.',
+        )
+
+    def handle(self, *args, **options):
+        importacoes = ImportacaoInventario.objects.filter(
+            Q(processando_desde__isnull=True)
+            | Q(processando_desde__lte=timezone.now() - TEMPO_SEM_SINAL_COMPARACAO),
+            status__in=['PROCESSANDO', 'ERRO'],
+        ).exclude(arquivo='')
+
+        if options['ids']:
+            importacoes = importacoes.filter(pk__in=options['ids'])
+        else:
+            importacoes = importacoes.filter(tentativas__lt=MAX_TENTATIVAS_COMPARACAO)
+
+        for importacao_id in importacoes.order_by('criado_em').values_list('pk', flat=True):
+            try:
+                importacao = processar_comparacao(
+                    importacao_id,
+                    tamanho_lote=options['tamanho_lote'],
+                )
+            except Exception as e:
+                self.stdout.write(self.style.ERROR(f'❌ Importação #{importacao_id}: {e}'))
+                continue
+
+            if importacao.status == 'PROCESSANDO':
+                # Outro processo reivindicou a importação nesse meio tempo
+                self.stdout.write(self.style.WARNING(f'⏭️ Importação #{importacao_id} em andamento em outro processo.'))
+                continue
+
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f'✅ Importação #{importacao_id}: {importacao.total_linhas} linha(s), '
+                    f'{importacao.linhas_lidas} lida(s) do arquivo.'
+                )
+            )
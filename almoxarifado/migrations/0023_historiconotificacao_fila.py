@@ -0,0 +1,34 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('almoxarifado', '0022_regranotificacaoalmoxarifado_dadosvalidadeitem_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='historiconotificacaoalmoxarifado',
+            name='tentativas',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='historiconotificacaoalmoxarifado',
+            name='proxima_tentativa',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='historiconotificacaoalmoxarifado',
+            name='chave_dedup',
+            field=models.CharField(blank=True, default='', max_length=120),
+        ),
+        migrations.AddIndex(
+            model_name='historiconotificacaoalmoxarifado',
+            index=models.Index(condition=models.Q(('status', 'pendente')), fields=['proxima_tentativa', 'criado_em'], name='notif_almox_fila_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='historiconotificacaoalmoxarifado',
+            index=models.Index(condition=models.Q(('status', 'pendente')), fields=['chave_dedup'], name='notif_almox_dedup_idx'),
+        ),
+    ]
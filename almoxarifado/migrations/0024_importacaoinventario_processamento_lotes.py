@@ -0,0 +1,26 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('almoxarifado', '0023_historiconotificacao_fila'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importacaoinventario',
+            name='arquivo',
+            field=models.FileField(blank=True, upload_to='inventario/importacoes/%Y/%m/'),
+        ),
+        migrations.AddField(
+            model_name='importacaoinventario',
+            name='linhas_lidas',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='importacaoinventario',
+            name='leitura_concluida',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,32 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('almoxarifado', '0024_importacaoinventario_processamento_lotes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importacaoinventario',
+            name='processando_desde',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='linhacomparacaoinventario',
+            constraint=models.UniqueConstraint(
+                condition=models.Q(('status', 'SO_SISTEMA'), _negated=True),
+                fields=('importacao', 'chave'),
+                name='linha_comparacao_chave_unica',
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name='linhacomparacaoinventario',
+            constraint=models.UniqueConstraint(
+                condition=models.Q(('status', 'SO_SISTEMA')),
+                fields=('importacao', 'chave', 'item'),
+                name='linha_comparacao_item_unico',
+            ),
+        ),
+    ]
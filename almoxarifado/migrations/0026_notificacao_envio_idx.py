@@ -0,0 +1,15 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('almoxarifado', '0025_comparacao_reivindicada'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='historiconotificacaoalmoxarifado',
+            index=models.Index(condition=models.Q(('status', 'enviado')), fields=['destinatario', 'enviado_em'], name='notif_almox_envio_idx'),
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('almoxarifado', '0026_notificacao_envio_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importacaoinventario',
+            name='tentativas',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+    ]
@@ -2,6 +2,8 @@ import re
 from django.db import models
 from django.core.validators import MinValueValidator
 
+from sapp.rastreamento import RastreiaAlteracoesMixin
+
 
 class Departamento(models.TextChoices):
     ADMINISTRATIVO = 'ADM', 'Administrativo'
@@ -31,7 +33,7 @@ class UnidadeMedida(models.TextChoices):
     FOLHA = 'FL', 'FL'
 
 
-class Item(models.Model):
+class Item(RastreiaAlteracoesMixin, models.Model):
     codigo = models.CharField(max_length=20, blank=True, null=True, verbose_name='Código')
     tamanho = models.CharField(max_length=50, blank=True, null=True, verbose_name='Tamanho/Medida')
     nome = models.CharField(max_length=200)
@@ -319,10 +321,35 @@ class HistoricoNotificacaoAlmoxarifado(models.Model):
     enviado_em = models.DateTimeField(blank=True, null=True)
     criado_em = models.DateTimeField(auto_now_add=True)
     
+    # Fila de envio (services_notificacao): registros 'pendente' são
+    # enviados pelo worker; o signal só grava, nunca chama a API
+    tentativas = models.PositiveSmallIntegerField(default=0)
+    proxima_tentativa = models.DateTimeField(blank=True, null=True)
+    chave_dedup = models.CharField(max_length=120, blank=True, default='')
+    
     class Meta:
         verbose_name = 'Histórico de Notificação'
         verbose_name_plural = 'Históricos de Notificações'
         ordering = ['-criado_em']
+        indexes = [
+            # Leitura da fila pelo worker
+            models.Index(
+                fields=['proxima_tentativa', 'criado_em'],
+                condition=models.Q(status='pendente'),
+                name='notif_almox_fila_idx',
+            ),
+            models.Index(
+                fields=['chave_dedup'],
+                condition=models.Q(status='pendente'),
+                name='notif_almox_dedup_idx',
+            ),
+            # Último envio por número (intervalo mínimo entre envios)
+            models.Index(
+                fields=['destinatario', 'enviado_em'],
+                condition=models.Q(status='enviado'),
+                name='notif_almox_envio_idx',
+            ),
+        ]
     
     def __str__(self):
         return f"{self.get_tipo_display()} - {self.item.nome} - {self.status}"
@@ -470,6 +497,16 @@ class ImportacaoInventario(models.Model):
     resumo = models.JSONField(default=dict, blank=True)
     erro = models.TextField(blank=True, default='')
 
+    # Processamento em lotes (processar_comparacao): o arquivo fica
+    # guardado até o fim e linhas_lidas marca onde retomar
+    arquivo = models.FileField(upload_to='inventario/importacoes/%Y/%m/', blank=True)
+    linhas_lidas = models.PositiveIntegerField(default=0)
+    leitura_concluida = models.BooleanField(default=False)
+    # Sinal de vida de quem está processando (renovado a cada lote)
+    processando_desde = models.DateTimeField(null=True, blank=True)
+    # Quantas vezes o processamento foi iniciado (limite na retomada)
+    tentativas = models.PositiveSmallIntegerField(default=0)
+
     class Meta:
         ordering = ['-criado_em']
 
@@ -527,6 +564,20 @@ class LinhaComparacaoInventario(models.Model):
 
     class Meta:
         ordering = ['status', 'codigo', 'lote', 'id']
+        constraints = [
+            # Uma linha por chave do arquivo; as "somente no sistema"
+            # têm uma linha por item da chave
+            models.UniqueConstraint(
+                fields=['importacao', 'chave'],
+                condition=~models.Q(status='SO_SISTEMA'),
+                name='linha_comparacao_chave_unica',
+            ),
+            models.UniqueConstraint(
+                fields=['importacao', 'chave', 'item'],
+                condition=models.Q(status='SO_SISTEMA'),
+                name='linha_comparacao_item_unico',
+            ),
+        ]
 
 
 class RegraNotificacaoAlmoxarifado(models.Model):
@@ -157,18 +157,19 @@ class WhatsAppNotificacaoService:
         
         return []
     
-    def notificar_item(self, item, tipo, adicionado=0):
-        """Envia notificação para um item (agora com base no departamento)"""
+    def montar_notificacao(self, item, tipo, adicionado=0):
+        """
+        Mensagem e números de destino de uma notificação do item, sem
+        enviar nada. Retorna (mensagem, numeros) ou None se não se aplica.
+        """
         if not self.config or not self.config.ativo:
-            return []
+            return None
         
         # Verificar se o departamento está ativo para notificações
         depts_ativos = getattr(self.config, 'departamentos_ativos', [])
         if depts_ativos and item.departamento not in depts_ativos:
             logger.info(f"Departamento {item.departamento} não está ativo para notificações")
-            return []
-        
-        resultados = []
+            return None
         
         # Seleciona template
         if tipo == 'baixo' and getattr(self.config, 'notificar_baixo', self.config.notificar_estoque_baixo):
@@ -178,7 +179,7 @@ class WhatsAppNotificacaoService:
         elif tipo == 'reposicao' and getattr(self.config, 'notificar_reposicao', self.config.notificar_reposicao):
             template = self.config.template_reposicao
         else:
-            return resultados
+            return None
         
         # Preparar kwargs extras
         kwargs = {}
@@ -194,30 +195,44 @@ class WhatsAppNotificacaoService:
         # Obter números baseado no departamento do item
         numeros = self.get_numeros_destino(item.departamento)
         
-        logger.info(f"📢 Enviando notificação de {tipo} para {item.nome}")
-        logger.info(f"   Departamento: {item.departamento}")
-        logger.info(f"   Números: {numeros}")
-        
         if not numeros:
             logger.warning(f"⚠️ Nenhum número configurado para o departamento {item.departamento}")
+            return None
+        
+        return mensagem, numeros
+    
+    def notificar_item(self, item, tipo, adicionado=0):
+        """
+        Envia notificação para um item na hora (agora com base no departamento).
+        Alterações de estoque usam a fila (services_notificacao), não este método.
+        """
+        resultados = []
+        
+        notificacao = self.montar_notificacao(item, tipo, adicionado)
+        if not notificacao:
             return resultados
         
+        mensagem, numeros = notificacao
+        
+        logger.info(f"📢 Enviando notificação de {tipo} para {item.nome}")
+        logger.info(f"   Departamento: {item.departamento}")
+        logger.info(f"   Números: {numeros}")
+        
         HistoricoModel = self._get_historico_model()
         
         for numero in numeros:
             try:
-                # Registrar histórico
-                historico = HistoricoModel.objects.create(
+                # Enviar mensagem (o histórico já nasce com o status final,
+                # para não ficar 'pendente' e ser pego pela fila de envio)
+                success, response = self.enviar_mensagem(numero, mensagem)
+                
+                historico = HistoricoModel(
                     item=item,
                     tipo=tipo,
                     destinatario=numero,
                     mensagem=mensagem,
-                    status='pendente'
                 )
                 
-                # Enviar mensagem
-                success, response = self.enviar_mensagem(numero, mensagem)
-                
                 if success:
                     historico.status = 'enviado'
                     historico.enviado_em = timezone.now()
@@ -2,15 +2,19 @@
 
 from __future__ import annotations
 
+import codecs
 import csv
-import io
+import logging
 import re
 import unicodedata
 import xml.etree.ElementTree as ET
-from datetime import datetime
+from datetime import datetime, timedelta
 from decimal import Decimal, InvalidOperation
+from itertools import islice
 
 from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
 from openpyxl import load_workbook
 
 from .models import (
@@ -20,6 +24,7 @@ from .models import (
     LinhaComparacaoInventario,
 )
 
+logger = logging.getLogger(__name__)
 
 # ============================================================
 # COLUNAS ACEITAS NA PLANILHA
@@ -303,7 +308,11 @@ def _valor_linha(
 # LEITURA DA PLANILHA
 # ============================================================
 
-def ler_planilha(upload):
+def _abrir_linhas_planilha(upload):
+    """
+    Linhas cruas (listas) do CSV/XLSX, lidas sob demanda: o arquivo
+    não é carregado inteiro na memória.
+    """
     nome = (
         getattr(
             upload,
@@ -313,20 +322,26 @@ def ler_planilha(upload):
         or ''
     ).lower()
 
-    conteudo = upload.read()
+    bruto = getattr(
+        upload,
+        'file',
+        upload,
+    )
+
+    bruto.seek(0)
 
     if nome.endswith(
         '.csv'
     ):
 
-        texto = conteudo.decode(
+        amostra = bruto.read(
+            4096
+        ).decode(
             'utf-8-sig',
             errors='replace',
         )
 
-        amostra = texto[
-            :4096
-        ]
+        bruto.seek(0)
 
         delimitador = (
             ';'
@@ -335,16 +350,21 @@ def ler_planilha(upload):
             else ','
         )
 
-        linhas = list(
-            csv.reader(
-                io.StringIO(
-                    texto
-                ),
-                delimiter=delimitador,
-            )
+        # StreamReader (e não TextIOWrapper): não fecha o arquivo
+        # original quando é descartado
+        texto = codecs.getreader(
+            'utf-8-sig'
+        )(
+            bruto,
+            errors='replace',
+        )
+
+        return csv.reader(
+            texto,
+            delimiter=delimitador,
         )
 
-    elif (
+    if (
         nome.endswith(
             '.xlsx'
         )
@@ -354,209 +374,244 @@ def ler_planilha(upload):
     ):
 
         workbook = load_workbook(
-            io.BytesIO(
-                conteudo
-            ),
+            bruto,
             data_only=True,
             read_only=True,
         )
 
-        planilha = (
-            workbook.active
-        )
-
-        linhas = [
+        return (
             list(
                 linha
             )
-            for linha in planilha.iter_rows(
+            for linha in workbook.active.iter_rows(
                 values_only=True
             )
-        ]
-
-    else:
-        raise ValueError(
-            'Envie um arquivo '
-            '.xlsx, .xlsm ou .csv.'
         )
 
-    if not linhas:
-        return []
-
-    mapa = mapear_cabecalho(
-        linhas[0]
+    raise ValueError(
+        'Envie um arquivo '
+        '.xlsx, .xlsm ou .csv.'
     )
 
-    if 'codigo' not in mapa:
-        raise ValueError(
-            'A planilha precisa '
-            'possuir uma coluna '
-            'de código.'
-        )
 
-    if (
-        'quantidade'
-        not in mapa
-    ):
-        raise ValueError(
-            'A planilha precisa '
-            'possuir uma coluna '
-            'de quantidade.'
+def _dados_linha_planilha(
+    linha,
+    mapa,
+):
+    codigo = str(
+        _valor_linha(
+            linha,
+            mapa,
+            'codigo',
+            '',
         )
+        or ''
+    ).strip()
 
-    resultado = []
+    if not codigo:
+        return None
 
-    for linha in linhas[
-        1:
-    ]:
+    fabricacao = (
+        data_segura(
+            _valor_linha(
+                linha,
+                mapa,
+                'fabricacao',
+                None,
+            )
+        )
+    )
 
-        codigo = str(
+    vencimento = (
+        data_segura(
             _valor_linha(
                 linha,
                 mapa,
-                'codigo',
-                '',
+                'vencimento',
+                None,
             )
-            or ''
-        ).strip()
+        )
+    )
 
-        if not codigo:
-            continue
+    return {
+        'codigo':
+            codigo,
 
-        fabricacao = (
-            data_segura(
+        'nome':
+            str(
                 _valor_linha(
                     linha,
                     mapa,
-                    'fabricacao',
-                    None,
+                    'nome',
+                    '',
                 )
-            )
-        )
+                or ''
+            ).strip(),
+
+        'quantidade':
+            str(
+                decimal_seguro(
+                    _valor_linha(
+                        linha,
+                        mapa,
+                        'quantidade',
+                        0,
+                    )
+                )
+            ),
 
-        vencimento = (
-            data_segura(
+        'unidade':
+            str(
                 _valor_linha(
                     linha,
                     mapa,
-                    'vencimento',
-                    None,
+                    'unidade',
+                    '',
                 )
-            )
-        )
+                or ''
+            ).strip(),
 
-        resultado.append({
-            'codigo':
-                codigo,
+        'lote':
+            str(
+                _valor_linha(
+                    linha,
+                    mapa,
+                    'lote',
+                    '',
+                )
+                or ''
+            ).strip(),
 
-            'nome':
-                str(
-                    _valor_linha(
-                        linha,
-                        mapa,
-                        'nome',
-                        '',
-                    )
-                    or ''
-                ).strip(),
+        'data_fabricacao':
+            (
+                fabricacao
+                .isoformat()
+                if fabricacao
+                else ''
+            ),
 
-            'quantidade':
-                str(
-                    decimal_seguro(
-                        _valor_linha(
-                            linha,
-                            mapa,
-                            'quantidade',
-                            0,
-                        )
-                    )
-                ),
+        'data_vencimento':
+            (
+                vencimento
+                .isoformat()
+                if vencimento
+                else ''
+            ),
 
-            'unidade':
-                str(
-                    _valor_linha(
-                        linha,
-                        mapa,
-                        'unidade',
-                        '',
-                    )
-                    or ''
-                ).strip(),
+        'localizacao':
+            str(
+                _valor_linha(
+                    linha,
+                    mapa,
+                    'localizacao',
+                    '',
+                )
+                or ''
+            ).strip(),
 
-            'lote':
-                str(
+        'departamento':
+            str(
+                _valor_linha(
+                    linha,
+                    mapa,
+                    'departamento',
+                    '',
+                )
+                or ''
+            ).strip(),
+
+        'estoque_minimo':
+            str(
+                decimal_seguro(
                     _valor_linha(
                         linha,
                         mapa,
-                        'lote',
-                        '',
+                        'estoque_minimo',
+                        0,
                     )
-                    or ''
-                ).strip(),
+                )
+            ),
 
-            'data_fabricacao':
-                (
-                    fabricacao
-                    .isoformat()
-                    if fabricacao
-                    else ''
-                ),
+        'fornecedor':
+            str(
+                _valor_linha(
+                    linha,
+                    mapa,
+                    'fornecedor',
+                    '',
+                )
+                or ''
+            ).strip(),
+    }
 
-            'data_vencimento':
-                (
-                    vencimento
-                    .isoformat()
-                    if vencimento
-                    else ''
-                ),
 
-            'localizacao':
-                str(
-                    _valor_linha(
-                        linha,
-                        mapa,
-                        'localizacao',
-                        '',
-                    )
-                    or ''
-                ).strip(),
+def _gerar_dados_planilha(
+    linhas,
+    mapa,
+):
+    for linha in linhas:
 
-            'departamento':
-                str(
-                    _valor_linha(
-                        linha,
-                        mapa,
-                        'departamento',
-                        '',
-                    )
-                    or ''
-                ).strip(),
+        dados = _dados_linha_planilha(
+            linha,
+            mapa,
+        )
 
-            'estoque_minimo':
-                str(
-                    decimal_seguro(
-                        _valor_linha(
-                            linha,
-                            mapa,
-                            'estoque_minimo',
-                            0,
-                        )
-                    )
-                ),
+        if dados:
+            yield dados
 
-            'fornecedor':
-                str(
-                    _valor_linha(
-                        linha,
-                        mapa,
-                        'fornecedor',
-                        '',
-                    )
-                    or ''
-                ).strip(),
-        })
 
-    return resultado
+def iterar_planilha(upload):
+    """
+    Valida o cabeçalho na hora e devolve um gerador com os dados de
+    cada linha (mesmo formato de ler_planilha).
+    """
+    linhas = iter(
+        _abrir_linhas_planilha(
+            upload
+        )
+    )
+
+    cabecalho = next(
+        linhas,
+        None,
+    )
+
+    if cabecalho is None:
+        return iter(())
+
+    mapa = mapear_cabecalho(
+        cabecalho
+    )
+
+    if 'codigo' not in mapa:
+        raise ValueError(
+            'A planilha precisa '
+            'possuir uma coluna '
+            'de código.'
+        )
+
+    if (
+        'quantidade'
+        not in mapa
+    ):
+        raise ValueError(
+            'A planilha precisa '
+            'possuir uma coluna '
+            'de quantidade.'
+        )
+
+    return _gerar_dados_planilha(
+        linhas,
+        mapa,
+    )
+
+
+def ler_planilha(upload):
+    return list(
+        iterar_planilha(
+            upload
+        )
+    )
 
 
 # ============================================================
@@ -1173,10 +1228,8 @@ def _kwargs_item(
     return resultado
 
 
-def atualizar_validade(
-    item,
-    dados,
-):
+def datas_validade(dados):
+    """(fabricação, vencimento) do arquivo, já validadas"""
     fabricacao = data_segura(
         dados.get(
             'data_fabricacao'
@@ -1200,6 +1253,17 @@ def atualizar_validade(
             'ao vencimento.'
         )
 
+    return fabricacao, vencimento
+
+
+def atualizar_validade(
+    item,
+    dados,
+):
+    fabricacao, vencimento = datas_validade(
+        dados
+    )
+
     objeto, _ = (
         DadosValidadeItem
         .objects
@@ -1226,498 +1290,1041 @@ def atualizar_validade(
 
 
 # ============================================================
-# CRIAÇÃO DA COMPARAÇÃO
+# COMPARAÇÃO EM LOTES
 # ============================================================
+#
+# O arquivo é guardado na importação e lido sob demanda; as linhas de
+# comparação são gravadas em lotes de TAMANHO_LOTE_COMPARACAO, cada lote
+# numa transação junto com o progresso (linhas_lidas, total_linhas,
+# resumo). Se o processo cair, processar_comparacao continua do último
+# lote gravado (comando retomar_comparacoes_inventario).
+#
+# PROCESSANDO também vale para uma comparação em andamento: quem
+# processa reivindica a importação (select_for_update) e marca
+# processando_desde a cada lote gravado. Enquanto essa marca for mais
+# recente que TEMPO_SEM_SINAL_COMPARACAO, ninguém mais a processa.
+#
+# Cada reivindicação conta uma tentativa; o comando de retomada deixa de
+# lado as importações que já falharam MAX_TENTATIVAS_COMPARACAO vezes
+# (arquivo inválido, por exemplo, falharia sempre).
+
+TAMANHO_LOTE_COMPARACAO = 1000
+TEMPO_SEM_SINAL_COMPARACAO = timedelta(
+    minutes=10
+)
+MAX_TENTATIVAS_COMPARACAO = 3
+
+CHAVES_RESUMO = {
+    'IGUAL': 'iguais',
+    'SALDO_DIVERGENTE': 'saldo_divergente',
+    'UNIDADE_DIVERGENTE': 'unidade_divergente',
+    'DADOS_DIVERGENTES': 'dados_divergentes',
+    'SO_SISTEMA': 'so_sistema',
+    'SO_ARQUIVO': 'so_arquivo',
+    'AMBIGUO': 'ambiguos',
+}
 
-def criar_comparacao(
-    upload,
-    usuario,
-    modo='COM_LOTE',
-    tipo='PLANILHA',
-):
-    modo = (
-        modo
-        if modo in {
-            'COM_LOTE',
-            'SEM_LOTE',
-        }
-        else 'COM_LOTE'
-    )
 
-    tipo = (
-        tipo
-        if tipo in {
-            'PLANILHA',
-            'NFE_XML',
-        }
-        else 'PLANILHA'
-    )
+def _resumo_vazio():
+    return {
+        chave: 0
+        for chave in CHAVES_RESUMO.values()
+    }
 
-    if tipo == 'NFE_XML':
-        dados_arquivo = (
-            ler_nfe_xml(
-                upload
-            )
-        )
-    else:
-        dados_arquivo = (
-            ler_planilha(
-                upload
-            )
-        )
 
-    importacao = (
-        ImportacaoInventario
-        .objects
-        .create(
-            tipo=tipo,
-            modo_comparacao=modo,
-            nome_arquivo=getattr(
-                upload,
-                'name',
-                '',
-            ),
-            criado_por=usuario,
-            status='PROCESSANDO',
+def _em_lotes(
+    iteravel,
+    tamanho,
+):
+    lote = []
+
+    for valor in iteravel:
+
+        lote.append(
+            valor
         )
-    )
 
-    arquivo_por_chave = {}
+        if len(
+            lote
+        ) >= tamanho:
+            yield lote
+            lote = []
 
-    for dados in dados_arquivo:
+    if lote:
+        yield lote
 
-        chave = chave_item(
-            dados.get(
-                'codigo'
-            ),
-            dados.get(
-                'lote'
-            ),
-            modo,
-        )
 
-        if chave in arquivo_por_chave:
+def _dados_do_arquivo(importacao):
+    """Gerador com os dados de cada linha do arquivo guardado"""
+    importacao.arquivo.open(
+        'rb'
+    )
 
-            anterior = (
-                arquivo_por_chave[
-                    chave
-                ]
+    try:
+        if importacao.tipo == 'NFE_XML':
+            # NF-e tem no máximo 990 itens: cabe na memória
+            yield from ler_nfe_xml(
+                importacao.arquivo
             )
-
-            anterior[
-                'quantidade'
-            ] = str(
-                decimal_seguro(
-                    anterior.get(
-                        'quantidade'
-                    )
-                )
-                +
-                decimal_seguro(
-                    dados.get(
-                        'quantidade'
-                    )
-                )
+        else:
+            yield from iterar_planilha(
+                importacao.arquivo
             )
+    finally:
+        importacao.arquivo.close()
 
-        else:
-            arquivo_por_chave[
-                chave
-            ] = dados
 
-    sistema_por_chave = {}
+def _indice_sistema(modo):
+    """
+    Itens ativos por chave, numa única consulta values() (sem montar
+    instâncias do model).
+    """
+    indice = {}
 
     for item in (
         Item.objects
         .filter(
             ativo=True
         )
-        .iterator()
+        .values(
+            'id',
+            'codigo',
+            'lote',
+            'quantidade',
+            'unidade',
+        )
+        .iterator(
+            chunk_size=2000
+        )
     ):
 
         chave = chave_item(
-            getattr(
-                item,
-                'codigo',
-                '',
-            ),
-            getattr(
-                item,
-                'lote',
-                '',
-            ),
+            item['codigo'],
+            item['lote'],
             modo,
         )
 
-        sistema_por_chave.setdefault(
+        indice.setdefault(
             chave,
             [],
         ).append(
             item
         )
 
-    chaves = (
-        set(
-            arquivo_por_chave
-        )
-        |
-        set(
-            sistema_por_chave
-        )
-    )
-
-    objetos = []
-
-    resumo = {
-        'iguais': 0,
-        'saldo_divergente': 0,
-        'unidade_divergente': 0,
-        'dados_divergentes': 0,
-        'so_sistema': 0,
-        'so_arquivo': 0,
-        'ambiguos': 0,
-    }
+    return indice
 
-    for chave in sorted(
-        chaves
-    ):
 
-        arquivo = (
-            arquivo_por_chave
-            .get(
-                chave
-            )
-        )
+# ============================================================
+# MONTAGEM DAS LINHAS
+# ============================================================
 
-        encontrados = (
-            sistema_por_chave
-            .get(
-                chave,
-                [],
-            )
+def _linhas_so_sistema(
+    importacao,
+    chave,
+    encontrados,
+):
+    return [
+        LinhaComparacaoInventario(
+            importacao=importacao,
+            item_id=item['id'],
+            chave=chave,
+            codigo=str(
+                item['codigo']
+                or ''
+            ),
+            lote=str(
+                item['lote']
+                or ''
+            ),
+            quantidade_sistema=(
+                decimal_seguro(
+                    item['quantidade']
+                )
+            ),
+            unidade_sistema=str(
+                item['unidade']
+                or ''
+            ),
+            status='SO_SISTEMA',
         )
+        for item in encontrados
+    ]
 
-        # ----------------------------------------------------
-        # SOMENTE NO SISTEMA
-        # ----------------------------------------------------
-        if arquivo is None:
-
-            for item in encontrados:
-
-                objetos.append(
-                    LinhaComparacaoInventario(
-                        importacao=importacao,
-                        item=item,
-                        chave=chave,
-                        codigo=str(
-                            getattr(
-                                item,
-                                'codigo',
-                                '',
-                            )
-                            or ''
-                        ),
-                        lote=str(
-                            getattr(
-                                item,
-                                'lote',
-                                '',
-                            )
-                            or ''
-                        ),
-                        quantidade_sistema=(
-                            decimal_seguro(
-                                getattr(
-                                    item,
-                                    'quantidade',
-                                    0,
-                                )
-                            )
-                        ),
-                        unidade_sistema=str(
-                            getattr(
-                                item,
-                                'unidade',
-                                '',
-                            )
-                            or ''
-                        ),
-                        status='SO_SISTEMA',
-                    )
-                )
 
-                resumo[
-                    'so_sistema'
-                ] += 1
+def _status_item_unico(
+    qtd_sistema,
+    qtd_arquivo,
+    unidade_sistema,
+    unidade_arquivo,
+):
+    if (
+        qtd_sistema
+        == qtd_arquivo
+        and (
+            not unidade_arquivo
+            or unidade_sistema
+            == unidade_arquivo
+        )
+    ):
+        return 'IGUAL'
 
-            continue
+    if (
+        qtd_sistema
+        != qtd_arquivo
+        and unidade_arquivo
+        and unidade_sistema
+        != unidade_arquivo
+    ):
+        return 'DADOS_DIVERGENTES'
 
-        # ----------------------------------------------------
-        # SOMENTE NO ARQUIVO
-        # ----------------------------------------------------
-        if not encontrados:
-
-            objetos.append(
-                LinhaComparacaoInventario(
-                    importacao=importacao,
-                    chave=chave,
-                    codigo=arquivo.get(
-                        'codigo',
-                        '',
-                    ),
-                    lote=arquivo.get(
-                        'lote',
-                        '',
-                    ),
-                    nome_arquivo=arquivo.get(
-                        'nome',
-                        '',
-                    ),
-                    quantidade_arquivo=(
-                        decimal_seguro(
-                            arquivo.get(
-                                'quantidade'
-                            )
-                        )
-                    ),
-                    unidade_arquivo=(
-                        arquivo.get(
-                            'unidade',
-                            '',
-                        )
-                    ),
-                    dados_arquivo=arquivo,
-                    status='SO_ARQUIVO',
-                )
-            )
+    if (
+        qtd_sistema
+        != qtd_arquivo
+    ):
+        return 'SALDO_DIVERGENTE'
 
-            resumo[
-                'so_arquivo'
-            ] += 1
+    return 'UNIDADE_DIVERGENTE'
 
-            continue
 
-        # ----------------------------------------------------
-        # AMBÍGUO
-        # ----------------------------------------------------
-        if len(
-            encontrados
-        ) > 1:
-
-            objetos.append(
-                LinhaComparacaoInventario(
-                    importacao=importacao,
-                    chave=chave,
-                    codigo=arquivo.get(
-                        'codigo',
-                        '',
-                    ),
-                    lote=arquivo.get(
-                        'lote',
-                        '',
-                    ),
-                    nome_arquivo=arquivo.get(
-                        'nome',
-                        '',
-                    ),
-                    quantidade_arquivo=(
-                        decimal_seguro(
-                            arquivo.get(
-                                'quantidade'
-                            )
-                        )
-                    ),
-                    unidade_arquivo=(
-                        arquivo.get(
-                            'unidade',
-                            '',
-                        )
-                    ),
-                    dados_arquivo=arquivo,
-                    status='AMBIGUO',
-                    mensagem=(
-                        f'{len(encontrados)} '
-                        f'itens do sistema '
-                        f'possuem a mesma chave.'
-                    ),
+def _linha_do_arquivo(
+    importacao,
+    chave,
+    arquivo,
+    encontrados,
+):
+    linha = LinhaComparacaoInventario(
+        importacao=importacao,
+        chave=chave,
+        codigo=arquivo.get(
+            'codigo',
+            '',
+        ),
+        lote=arquivo.get(
+            'lote',
+            '',
+        ),
+        nome_arquivo=arquivo.get(
+            'nome',
+            '',
+        ),
+        quantidade_arquivo=(
+            decimal_seguro(
+                arquivo.get(
+                    'quantidade'
                 )
             )
+        ),
+        unidade_arquivo=(
+            arquivo.get(
+                'unidade',
+                '',
+            )
+        ),
+        dados_arquivo=arquivo,
+    )
 
-            resumo[
-                'ambiguos'
-            ] += 1
+    # ----------------------------------------------------
+    # SOMENTE NO ARQUIVO
+    # ----------------------------------------------------
+    if not encontrados:
+        linha.status = 'SO_ARQUIVO'
+        return linha
 
-            continue
+    # ----------------------------------------------------
+    # AMBÍGUO
+    # ----------------------------------------------------
+    if len(
+        encontrados
+    ) > 1:
+        linha.status = 'AMBIGUO'
+        linha.mensagem = (
+            f'{len(encontrados)} '
+            f'itens do sistema '
+            f'possuem a mesma chave.'
+        )
+        return linha
 
-        # ----------------------------------------------------
-        # ITEM ÚNICO
-        # ----------------------------------------------------
-        item = encontrados[
-            0
-        ]
+    # ----------------------------------------------------
+    # ITEM ÚNICO
+    # ----------------------------------------------------
+    item = encontrados[
+        0
+    ]
 
-        qtd_sistema = (
-            decimal_seguro(
-                getattr(
-                    item,
-                    'quantidade',
-                    0,
-                )
-            )
-        )
+    unidade_sistema = str(
+        item['unidade']
+        or ''
+    ).strip().upper()
 
-        qtd_arquivo = (
-            decimal_seguro(
+    try:
+        unidade_arquivo = (
+            normalizar_unidade(
                 arquivo.get(
-                    'quantidade'
+                    'unidade'
                 )
             )
+            if arquivo.get(
+                'unidade'
+            )
+            else ''
         )
-
-        unidade_sistema = str(
-            getattr(
-                item,
+    except ValueError:
+        unidade_arquivo = str(
+            arquivo.get(
                 'unidade',
                 '',
             )
             or ''
         ).strip().upper()
 
-        try:
-            unidade_arquivo = (
-                normalizar_unidade(
-                    arquivo.get(
-                        'unidade'
-                    )
-                )
-                if arquivo.get(
-                    'unidade'
-                )
-                else ''
-            )
-        except ValueError:
-            unidade_arquivo = str(
-                arquivo.get(
-                    'unidade',
-                    '',
-                )
-                or ''
-            ).strip().upper()
+    linha.item_id = item['id']
+    linha.quantidade_sistema = decimal_seguro(
+        item['quantidade']
+    )
+    linha.unidade_sistema = unidade_sistema
+    linha.unidade_arquivo = unidade_arquivo
+    linha.status = _status_item_unico(
+        linha.quantidade_sistema,
+        linha.quantidade_arquivo,
+        unidade_sistema,
+        unidade_arquivo,
+    )
 
-        if (
-            qtd_sistema
-            == qtd_arquivo
-            and (
-                not unidade_arquivo
-                or unidade_sistema
-                == unidade_arquivo
+    return linha
+
+
+def _somar_quantidade(
+    anterior,
+    dados,
+):
+    anterior[
+        'quantidade'
+    ] = str(
+        decimal_seguro(
+            anterior.get(
+                'quantidade'
             )
-        ):
-            status = 'IGUAL'
-
-            resumo[
-                'iguais'
-            ] += 1
-
-        elif (
-            qtd_sistema
-            != qtd_arquivo
-            and unidade_arquivo
-            and unidade_sistema
-            != unidade_arquivo
-        ):
-            status = (
-                'DADOS_DIVERGENTES'
+        )
+        +
+        decimal_seguro(
+            dados.get(
+                'quantidade'
             )
+        )
+    )
 
-            resumo[
-                'dados_divergentes'
-            ] += 1
 
-        elif (
-            qtd_sistema
-            != qtd_arquivo
-        ):
-            status = (
-                'SALDO_DIVERGENTE'
-            )
+# ============================================================
+# GRAVAÇÃO DOS LOTES
+# ============================================================
+
+def _salvar_progresso(
+    importacao,
+    **campos,
+):
+    for campo, valor in campos.items():
+        setattr(
+            importacao,
+            campo,
+            valor,
+        )
+
+    ImportacaoInventario.objects.filter(
+        pk=importacao.pk
+    ).update(
+        **campos
+    )
+
 
-            resumo[
-                'saldo_divergente'
-            ] += 1
+def _gravar_lote_arquivo(
+    importacao,
+    lote,
+    sistema,
+):
+    """
+    Grava um lote de linhas do arquivo. Chaves repetidas somam a
+    quantidade, inclusive com linhas já gravadas em lotes anteriores.
+    Retorna (linhas novas, {status: variação}).
+    """
+    arquivo_por_chave = {}
+
+    for dados in lote:
+
+        chave = chave_item(
+            dados.get(
+                'codigo'
+            ),
+            dados.get(
+                'lote'
+            ),
+            importacao.modo_comparacao,
+        )
 
+        if chave in arquivo_por_chave:
+            _somar_quantidade(
+                arquivo_por_chave[
+                    chave
+                ],
+                dados,
+            )
         else:
-            status = (
-                'UNIDADE_DIVERGENTE'
+            arquivo_por_chave[
+                chave
+            ] = dict(
+                dados
             )
 
-            resumo[
-                'unidade_divergente'
-            ] += 1
-
-        objetos.append(
-            LinhaComparacaoInventario(
+    existentes = {
+        linha.chave: linha
+        for linha in (
+            LinhaComparacaoInventario.objects
+            .filter(
                 importacao=importacao,
-                item=item,
-                chave=chave,
-                codigo=arquivo.get(
-                    'codigo',
-                    '',
-                ),
-                lote=arquivo.get(
-                    'lote',
-                    '',
-                ),
-                nome_arquivo=arquivo.get(
-                    'nome',
-                    '',
-                ),
-                quantidade_sistema=(
-                    qtd_sistema
+                chave__in=list(
+                    arquivo_por_chave
                 ),
-                quantidade_arquivo=(
-                    qtd_arquivo
-                ),
-                unidade_sistema=(
-                    unidade_sistema
-                ),
-                unidade_arquivo=(
-                    unidade_arquivo
-                ),
-                dados_arquivo=arquivo,
-                status=status,
             )
         )
+    }
 
-    LinhaComparacaoInventario.objects.bulk_create(
-        objetos,
-        batch_size=500,
-    )
+    novas = []
+    alteradas = []
+    variacao = {}
 
-    importacao.total_linhas = len(
-        objetos
-    )
+    for chave, arquivo in arquivo_por_chave.items():
+
+        anterior = existentes.get(
+            chave
+        )
+
+        if anterior is not None:
+            _somar_quantidade(
+                arquivo,
+                anterior.dados_arquivo,
+            )
+
+        linha = _linha_do_arquivo(
+            importacao,
+            chave,
+            arquivo,
+            sistema.get(
+                chave,
+                [],
+            ),
+        )
+
+        variacao[
+            linha.status
+        ] = variacao.get(
+            linha.status,
+            0,
+        ) + 1
+
+        if anterior is None:
+            novas.append(
+                linha
+            )
+            continue
+
+        variacao[
+            anterior.status
+        ] = variacao.get(
+            anterior.status,
+            0,
+        ) - 1
 
-    importacao.resumo = resumo
+        linha.pk = anterior.pk
+        alteradas.append(
+            linha
+        )
 
-    importacao.status = (
-        'PRONTA'
+    LinhaComparacaoInventario.objects.bulk_create(
+        novas
     )
 
-    importacao.save(
-        update_fields=[
-            'total_linhas',
-            'resumo',
+    LinhaComparacaoInventario.objects.bulk_update(
+        alteradas,
+        [
+            'nome_arquivo',
+            'quantidade_arquivo',
+            'quantidade_sistema',
+            'unidade_arquivo',
+            'unidade_sistema',
+            'dados_arquivo',
             'status',
-        ]
+            'mensagem',
+        ],
     )
 
-    return importacao
+    return len(
+        novas
+    ), variacao
 
 
-# ============================================================
-# APLICAÇÃO DA DECISÃO
-# ============================================================
+def _aplicar_variacao(
+    resumo,
+    variacao,
+):
+    resumo = dict(
+        resumo
+    )
+
+    for status, quantidade in variacao.items():
+        chave = CHAVES_RESUMO[
+            status
+        ]
+        resumo[
+            chave
+        ] = resumo.get(
+            chave,
+            0,
+        ) + quantidade
+
+    return resumo
+
+
+def _importar_linhas_arquivo(
+    importacao,
+    sistema,
+    tamanho_lote,
+):
+    dados = islice(
+        _dados_do_arquivo(
+            importacao
+        ),
+        importacao.linhas_lidas,
+        None,
+    )
+
+    for lote in _em_lotes(
+        dados,
+        tamanho_lote,
+    ):
+
+        with transaction.atomic():
+
+            novas, variacao = _gravar_lote_arquivo(
+                importacao,
+                lote,
+                sistema,
+            )
+
+            _salvar_progresso(
+                importacao,
+                processando_desde=timezone.now(),
+                linhas_lidas=(
+                    importacao.linhas_lidas
+                    + len(lote)
+                ),
+                total_linhas=(
+                    importacao.total_linhas
+                    + novas
+                ),
+                resumo=_aplicar_variacao(
+                    importacao.resumo,
+                    variacao,
+                ),
+            )
+
+    _salvar_progresso(
+        importacao,
+        leitura_concluida=True,
+    )
+
+
+def _importar_linhas_sistema(
+    importacao,
+    sistema,
+    tamanho_lote,
+):
+    """Itens do sistema que não apareceram no arquivo (retomável)"""
+    gravadas = set(
+        LinhaComparacaoInventario.objects
+        .filter(
+            importacao=importacao
+        )
+        .values_list(
+            'chave',
+            flat=True,
+        )
+    )
+
+    linhas = []
+
+    for chave in sorted(
+        set(sistema)
+        - gravadas
+    ):
+
+        # Todos os itens de uma chave entram no mesmo lote
+        linhas.extend(
+            _linhas_so_sistema(
+                importacao,
+                chave,
+                sistema[
+                    chave
+                ],
+            )
+        )
+
+        if len(
+            linhas
+        ) >= tamanho_lote:
+            _gravar_lote_sistema(
+                importacao,
+                linhas,
+            )
+            linhas = []
+
+    if linhas:
+        _gravar_lote_sistema(
+            importacao,
+            linhas,
+        )
+
+
+def _gravar_lote_sistema(
+    importacao,
+    linhas,
+):
+    with transaction.atomic():
+
+        LinhaComparacaoInventario.objects.bulk_create(
+            linhas
+        )
+
+        _salvar_progresso(
+            importacao,
+            processando_desde=timezone.now(),
+            total_linhas=(
+                importacao.total_linhas
+                + len(linhas)
+            ),
+            resumo=_aplicar_variacao(
+                importacao.resumo,
+                {
+                    'SO_SISTEMA': len(
+                        linhas
+                    ),
+                },
+            ),
+        )
+
+
+def _finalizar_comparacao(importacao):
+    """Confere os totais com uma consulta agrupada e libera a comparação"""
+    resumo = _resumo_vazio()
+    total = 0
+
+    for status, quantidade in (
+        importacao.linhas
+        .order_by()
+        .values_list(
+            'status'
+        )
+        .annotate(
+            quantidade=Count(
+                'id'
+            )
+        )
+    ):
+        resumo[
+            CHAVES_RESUMO[
+                status
+            ]
+        ] = quantidade
+        total += quantidade
+
+    _salvar_progresso(
+        importacao,
+        total_linhas=total,
+        resumo=resumo,
+        status='PRONTA',
+        erro='',
+        processando_desde=None,
+    )
+
+    # O arquivo só era necessário para retomar o processamento
+    if importacao.arquivo:
+        importacao.arquivo.delete(
+            save=False
+        )
+        _salvar_progresso(
+            importacao,
+            arquivo='',
+        )
+
+
+def comparacao_em_andamento(
+    importacao,
+    agora=None,
+):
+    """True se outro processo deu sinal há menos de TEMPO_SEM_SINAL_COMPARACAO"""
+    agora = agora or timezone.now()
+
+    return (
+        importacao.processando_desde is not None
+        and importacao.processando_desde
+        > agora - TEMPO_SEM_SINAL_COMPARACAO
+    )
+
+
+def _reivindicar_comparacao(importacao_id):
+    """
+    Trava a importação e marca processando_desde. Retorna
+    (importacao, reivindicada); sem reivindicar se ela não está
+    pendente ou se outro processo está com ela.
+    """
+    with transaction.atomic():
+
+        importacao = (
+            ImportacaoInventario
+            .objects
+            .select_for_update()
+            .filter(
+                pk=importacao_id
+            )
+            .first()
+        )
+
+        if (
+            importacao is None
+            or importacao.status
+            not in {
+                'PROCESSANDO',
+                'ERRO',
+            }
+            or comparacao_em_andamento(
+                importacao
+            )
+        ):
+            return importacao, False
+
+        _salvar_progresso(
+            importacao,
+            status='PROCESSANDO',
+            processando_desde=timezone.now(),
+            tentativas=(
+                importacao.tentativas
+                + 1
+            ),
+            resumo=(
+                importacao.resumo
+                or _resumo_vazio()
+            ),
+        )
+
+    return importacao, True
+
+
+def processar_comparacao(
+    importacao_id,
+    tamanho_lote=TAMANHO_LOTE_COMPARACAO,
+):
+    """
+    Processa (ou retoma) a comparação de uma importação. Importações
+    já prontas/aplicadas, ou em processamento por outro worker, são
+    devolvidas sem alteração.
+    """
+    importacao, reivindicada = _reivindicar_comparacao(
+        importacao_id
+    )
+
+    if not reivindicada:
+        return importacao
+
+    try:
+        sistema = _indice_sistema(
+            importacao.modo_comparacao
+        )
+
+        if not importacao.leitura_concluida:
+            _importar_linhas_arquivo(
+                importacao,
+                sistema,
+                tamanho_lote,
+            )
+
+        _importar_linhas_sistema(
+            importacao,
+            sistema,
+            tamanho_lote,
+        )
+
+        _finalizar_comparacao(
+            importacao
+        )
+
+    except Exception as exc:
+        _salvar_progresso(
+            importacao,
+            status='ERRO',
+            processando_desde=None,
+            erro=str(
+                exc
+            )[:2000],
+        )
+        raise
+
+    return importacao
+
+
+def enfileirar_comparacao(importacao):
+    """
+    Envia o processamento ao Celery depois do commit (mesmo esquema
+    da exportação do estoque). Em modo eager roda no próprio processo.
+    Com o broker fora do ar a importação fica em PROCESSANDO, sem
+    processando_desde, e o comando retomar_comparacoes_inventario a pega.
+    """
+    from .tasks import processar_comparacao_inventario_task
+
+    def _enviar():
+        try:
+            if processar_comparacao_inventario_task.app.conf.task_always_eager:
+                processar_comparacao_inventario_task.apply(
+                    args=(
+                        importacao.pk,
+                    )
+                )
+            else:
+                processar_comparacao_inventario_task.delay(
+                    importacao.pk
+                )
+        except Exception as e:
+            logger.warning(
+                "Broker indisponível, comparação #%s fica para o comando de retomada: %s",
+                importacao.pk,
+                e,
+            )
+
+    transaction.on_commit(
+        _enviar
+    )
+
+
+# ============================================================
+# CRIAÇÃO DA COMPARAÇÃO
+# ============================================================
+
+def _validar_arquivo(
+    upload,
+    tipo,
+):
+    """Erros de formato aparecem na hora, antes de enfileirar"""
+    if tipo == 'NFE_XML':
+        ler_nfe_xml(
+            upload
+        )
+    else:
+        iterar_planilha(
+            upload
+        )
+
+    upload.seek(0)
+
+
+def criar_comparacao(
+    upload,
+    usuario,
+    modo='COM_LOTE',
+    tipo='PLANILHA',
+):
+    modo = (
+        modo
+        if modo in {
+            'COM_LOTE',
+            'SEM_LOTE',
+        }
+        else 'COM_LOTE'
+    )
+
+    tipo = (
+        tipo
+        if tipo in {
+            'PLANILHA',
+            'NFE_XML',
+        }
+        else 'PLANILHA'
+    )
+
+    _validar_arquivo(
+        upload,
+        tipo,
+    )
+
+    nome_arquivo = getattr(
+        upload,
+        'name',
+        '',
+    )
+
+    importacao = ImportacaoInventario(
+        tipo=tipo,
+        modo_comparacao=modo,
+        nome_arquivo=nome_arquivo,
+        criado_por=usuario,
+        status='PROCESSANDO',
+        resumo=_resumo_vazio(),
+    )
+
+    importacao.arquivo.save(
+        nome_arquivo
+        or 'inventario.csv',
+        upload,
+        save=False,
+    )
+
+    importacao.save()
+
+    enfileirar_comparacao(
+        importacao
+    )
+
+    # Em modo eager (ou fora de transação) já terminou aqui
+    importacao.refresh_from_db()
+
+    return importacao
+
+
+# ============================================================
+# APLICAÇÃO DA DECISÃO
+# ============================================================
+
+def aplicar_dados_item(
+    item,
+    dados,
+    campos,
+):
+    """
+    Copia para o item (sem salvar) os dados do arquivo e devolve
+    a lista de campos alterados.
+    """
+    unidade = (
+        normalizar_unidade(
+            dados.get(
+                'unidade'
+            )
+        )
+        if dados.get(
+            'unidade'
+        )
+        else getattr(
+            item,
+            'unidade',
+            '',
+        )
+    )
+
+    departamento = (
+        normalizar_departamento(
+            dados.get(
+                'departamento'
+            )
+        )
+        if dados.get(
+            'departamento'
+        )
+        else ''
+    )
+
+    mapeamento = {
+        'codigo':
+            dados.get(
+                'codigo'
+            ),
+
+        'nome':
+            dados.get(
+                'nome'
+            ),
+
+        'quantidade':
+            decimal_seguro(
+                dados.get(
+                    'quantidade'
+                )
+            ),
+
+        'unidade':
+            unidade,
+
+        'lote':
+            dados.get(
+                'lote'
+            ),
+
+        'localizacao':
+            dados.get(
+                'localizacao'
+            ),
+
+        'estoque_minimo':
+            decimal_seguro(
+                dados.get(
+                    'estoque_minimo'
+                )
+            ),
+
+        'fornecedor':
+            dados.get(
+                'fornecedor'
+            ),
+    }
+
+    if departamento:
+        mapeamento[
+            'departamento'
+        ] = departamento
+
+    alterados = []
+
+    for campo, valor in (
+        mapeamento.items()
+    ):
+
+        if campo not in campos:
+            continue
+
+        # Campo vazio vindo da
+        # planilha não apaga
+        # dados importantes,
+        # exceto lote/localização.
+        if (
+            valor in (
+                None,
+                '',
+            )
+            and campo
+            not in {
+                'lote',
+                'localizacao',
+            }
+        ):
+            continue
+
+        if isinstance(
+            valor,
+            str,
+        ):
+            valor = (
+                _limite_charfield(
+                    campo,
+                    valor,
+                )
+            )
+
+        setattr(
+            item,
+            campo,
+            valor,
+        )
+
+        alterados.append(
+            campo
+        )
+
+    return alterados
+
 
 @transaction.atomic
 def aplicar_linha(
@@ -1776,39 +2383,280 @@ def aplicar_linha(
                 'no arquivo.'
             )
 
-        item = Item.objects.create(
-            **_kwargs_item(
-                dados
-            )
-        )
-
-        atualizar_validade(
-            item,
-            dados,
-        )
-
-        linha.item = item
-        linha.acao = acao
-        linha.aplicado = True
-
-        linha.save(
-            update_fields=[
-                'item',
-                'acao',
-                'aplicado',
-            ]
+        item = Item.objects.create(
+            **_kwargs_item(
+                dados
+            )
+        )
+
+        atualizar_validade(
+            item,
+            dados,
+        )
+
+        linha.item = item
+        linha.acao = acao
+        linha.aplicado = True
+
+        linha.save(
+            update_fields=[
+                'item',
+                'acao',
+                'aplicado',
+            ]
+        )
+
+        return linha
+
+    # --------------------------------------------------------
+    # USAR ARQUIVO
+    # --------------------------------------------------------
+    if acao == 'USAR_ARQUIVO':
+
+        # Se ainda estiver ambígua e
+        # nenhuma escolha foi vinculada,
+        # bloqueia.
+        if (
+            linha.status
+            == 'AMBIGUO'
+            and not linha.item_id
+        ):
+            raise ValueError(
+                'Esta linha é ambígua. '
+                'Escolha primeiro qual '
+                'item do sistema deve '
+                'receber os dados '
+                'do arquivo.'
+            )
+
+        # ----------------------------------------
+        # ITEM EXISTENTE
+        # ----------------------------------------
+        if linha.item_id:
+
+            item = linha.item
+
+            alterados = aplicar_dados_item(
+                item,
+                dados,
+                campos,
+            )
+
+            if alterados:
+                item.save(
+                    update_fields=list(
+                        dict.fromkeys(
+                            alterados
+                        )
+                    )
+                )
+
+            atualizar_validade(
+                item,
+                dados,
+            )
+
+        # ----------------------------------------
+        # ITEM NÃO EXISTENTE
+        # ----------------------------------------
+        else:
+
+            if (
+                linha.status
+                != 'SO_ARQUIVO'
+            ):
+                raise ValueError(
+                    'Não foi possível '
+                    'identificar um item '
+                    'único para esta linha.'
+                )
+
+            item = Item.objects.create(
+                **_kwargs_item(
+                    dados
+                )
+            )
+
+            atualizar_validade(
+                item,
+                dados,
+            )
+
+            linha.item = item
+
+        linha.acao = acao
+        linha.aplicado = True
+
+        linha.save(
+            update_fields=[
+                'item',
+                'acao',
+                'aplicado',
+            ]
+        )
+
+        return linha
+
+    raise ValueError(
+        f'Ação inválida: {acao}'
+    )
+
+
+# ============================================================
+# APLICAÇÃO EM LOTE
+# ============================================================
+#
+# aplicar_decisoes valida todas as decisões primeiro (erros voltam por
+# linha) e grava agrupado por ação: itens novos e validades com
+# bulk_create; itens existentes, validades e linhas com bulk_update.
+# Como bulk_* não dispara o signal de notificação do Item, no fim entra
+# na fila um único resumo por departamento com os itens que ficaram com
+# estoque baixo/zerado.
+
+TAMANHO_LOTE_APLICACAO = 500
+
+
+def _erro_decisao(
+    decisao,
+    exc,
+    linha=None,
+):
+    return {
+        'linha_id':
+            decisao.get(
+                'linha_id'
+            ),
+
+        'acao':
+            decisao.get(
+                'acao'
+            ),
+
+        'item_id':
+            decisao.get(
+                'item_id'
+            ),
+
+        'tipo_erro':
+            exc.__class__.__name__,
+
+        'erro':
+            str(
+                exc
+            ),
+
+        'linha':
+            (
+                {
+                    'id': linha.id,
+                    'codigo': linha.codigo,
+                    'lote': linha.lote,
+                    'status': linha.status,
+                    'item_id': linha.item_id,
+                }
+                if linha is not None
+                else None
+            ),
+    }
+
+
+def _inteiro(valor):
+    try:
+        return int(
+            valor
+        )
+    except (
+        TypeError,
+        ValueError,
+    ):
+        return None
+
+
+def validar_candidato(
+    importacao,
+    linha,
+    item,
+):
+    """Item escolhido para uma linha ambígua precisa ter o mesmo código (e lote)"""
+    if (
+        str(
+            item.codigo
+            or ''
+        ).strip().upper()
+        !=
+        str(
+            linha.codigo
+            or ''
+        ).strip().upper()
+    ):
+        raise ValueError(
+            'O item escolhido '
+            'possui código '
+            'diferente da '
+            'linha comparada.'
+        )
+
+    if (
+        importacao
+        .modo_comparacao
+        == 'COM_LOTE'
+        and str(
+            item.lote
+            or ''
+        ).strip().upper()
+        !=
+        str(
+            linha.lote
+            or ''
+        ).strip().upper()
+    ):
+        raise ValueError(
+            'O item escolhido '
+            'possui lote '
+            'diferente da '
+            'linha comparada.'
+        )
+
+
+def _validar_decisao(
+    linha,
+    acao,
+):
+    """Mesmas regras de aplicar_linha, sem gravar nada"""
+    dados = (
+        linha.dados_arquivo
+        or {}
+    )
+
+    if acao in {
+        'IGNORAR',
+        'MANTER_SISTEMA',
+    }:
+        return
+
+    if acao == 'CRIAR_ITEM':
+
+        if linha.item_id:
+            raise ValueError(
+                'Esta linha já está '
+                'vinculada a um item '
+                'do sistema.'
+            )
+
+        if linha.status != 'SO_ARQUIVO':
+            raise ValueError(
+                'Criar item só é '
+                'permitido para linhas '
+                'que existem apenas '
+                'no arquivo.'
+            )
+
+        _kwargs_item(
+            dados
         )
 
-        return linha
-
-    # --------------------------------------------------------
-    # USAR ARQUIVO
-    # --------------------------------------------------------
-    if acao == 'USAR_ARQUIVO':
+    elif acao == 'USAR_ARQUIVO':
 
-        # Se ainda estiver ambígua e
-        # nenhuma escolha foi vinculada,
-        # bloqueia.
         if (
             linha.status
             == 'AMBIGUO'
@@ -1822,192 +2670,471 @@ def aplicar_linha(
                 'do arquivo.'
             )
 
-        # ----------------------------------------
-        # ITEM EXISTENTE
-        # ----------------------------------------
-        if linha.item_id:
+        if (
+            not linha.item_id
+            and linha.status
+            != 'SO_ARQUIVO'
+        ):
+            raise ValueError(
+                'Não foi possível '
+                'identificar um item '
+                'único para esta linha.'
+            )
+
+        if not linha.item_id:
+            _kwargs_item(
+                dados
+            )
+
+    else:
+        raise ValueError(
+            f'Ação inválida: {acao}'
+        )
+
+    datas_validade(
+        dados
+    )
 
-            item = linha.item
 
-            unidade = (
-                normalizar_unidade(
-                    dados.get(
-                        'unidade'
+def _planejar_decisoes(
+    importacao,
+    decisoes,
+):
+    """
+    Carrega linhas e itens escolhidos em duas consultas e valida cada
+    decisão. Retorna (planejadas, já aplicadas, erros).
+    """
+    linhas = (
+        importacao
+        .linhas
+        .select_related(
+            'item'
+        )
+        .in_bulk(
+            [
+                _inteiro(
+                    decisao.get(
+                        'linha_id'
                     )
                 )
-                if dados.get(
-                    'unidade'
-                )
-                else getattr(
-                    item,
-                    'unidade',
-                    '',
+                for decisao in decisoes
+                if _inteiro(
+                    decisao.get(
+                        'linha_id'
+                    )
                 )
-            )
+                is not None
+            ]
+        )
+    )
 
-            departamento = (
-                normalizar_departamento(
-                    dados.get(
-                        'departamento'
+    candidatos = (
+        Item.objects
+        .filter(
+            ativo=True
+        )
+        .in_bulk(
+            [
+                _inteiro(
+                    decisao.get(
+                        'item_id'
                     )
                 )
-                if dados.get(
-                    'departamento'
+                for decisao in decisoes
+                if decisao.get(
+                    'item_id'
                 )
-                else ''
-            )
-
-            mapeamento = {
-                'codigo':
-                    dados.get(
-                        'codigo'
-                    ),
-
-                'nome':
-                    dados.get(
-                        'nome'
-                    ),
-
-                'quantidade':
-                    decimal_seguro(
-                        dados.get(
-                            'quantidade'
-                        )
-                    ),
-
-                'unidade':
-                    unidade,
+            ]
+        )
+    )
 
-                'lote':
-                    dados.get(
-                        'lote'
-                    ),
+    planejadas = []
+    ja_aplicadas = 0
+    erros = []
+    vistas = set()
 
-                'localizacao':
-                    dados.get(
-                        'localizacao'
-                    ),
+    for decisao in decisoes:
 
-                'estoque_minimo':
-                    decimal_seguro(
-                        dados.get(
-                            'estoque_minimo'
-                        )
-                    ),
+        linha = linhas.get(
+            _inteiro(
+                decisao.get(
+                    'linha_id'
+                )
+            )
+        )
 
-                'fornecedor':
-                    dados.get(
-                        'fornecedor'
-                    ),
-            }
+        try:
+            if linha is None:
+                raise LinhaComparacaoInventario.DoesNotExist(
+                    'Linha não encontrada '
+                    'nesta importação.'
+                )
 
-            if departamento:
-                mapeamento[
-                    'departamento'
-                ] = departamento
+            if (
+                linha.aplicado
+                or linha.pk in vistas
+            ):
+                ja_aplicadas += 1
+                continue
 
-            alterados = []
+            item_id = decisao.get(
+                'item_id'
+            )
 
-            for campo, valor in (
-                mapeamento.items()
-            ):
+            # Usuário escolheu um candidato para a linha ambígua
+            if item_id:
 
-                if campo not in campos:
-                    continue
-
-                # Campo vazio vindo da
-                # planilha não apaga
-                # dados importantes,
-                # exceto lote/localização.
-                if (
-                    valor in (
-                        None,
-                        '',
+                item = candidatos.get(
+                    _inteiro(
+                        item_id
                     )
-                    and campo
-                    not in {
-                        'lote',
-                        'localizacao',
-                    }
-                ):
-                    continue
-
-                if isinstance(
-                    valor,
-                    str,
-                ):
-                    valor = (
-                        _limite_charfield(
-                            campo,
-                            valor,
-                        )
+                )
+
+                if item is None:
+                    raise Item.DoesNotExist(
+                        'Item escolhido '
+                        'não encontrado.'
                     )
 
-                setattr(
+                validar_candidato(
+                    importacao,
+                    linha,
                     item,
-                    campo,
-                    valor,
                 )
 
-                alterados.append(
-                    campo
+                linha.item = item
+                linha.quantidade_sistema = (
+                    item.quantidade
+                    or 0
+                )
+                linha.unidade_sistema = (
+                    item.unidade
+                    or ''
                 )
 
-            if alterados:
-                item.save(
-                    update_fields=list(
-                        dict.fromkeys(
-                            alterados
-                        )
-                    )
+            _validar_decisao(
+                linha,
+                decisao.get(
+                    'acao'
+                ),
+            )
+
+        except Exception as exc:
+            erros.append(
+                _erro_decisao(
+                    decisao,
+                    exc,
+                    linha,
                 )
+            )
+            continue
 
-            atualizar_validade(
-                item,
-                dados,
+        vistas.add(
+            linha.pk
+        )
+
+        planejadas.append((
+            linha,
+            decisao.get(
+                'acao'
+            ),
+        ))
+
+    return planejadas, ja_aplicadas, erros
+
+
+def _gravar_validades(validades):
+    """validades: {item_id: (fabricação, vencimento)}"""
+    agora = timezone.now()
+
+    existentes = (
+        DadosValidadeItem.objects
+        .filter(
+            item_id__in=list(
+                validades
             )
+        )
+        .in_bulk(
+            field_name='item_id'
+        )
+    )
 
-        # ----------------------------------------
-        # ITEM NÃO EXISTENTE
-        # ----------------------------------------
-        else:
+    alterar = []
+    criar = []
 
-            if (
-                linha.status
-                != 'SO_ARQUIVO'
-            ):
-                raise ValueError(
-                    'Não foi possível '
-                    'identificar um item '
-                    'único para esta linha.'
-                )
+    for item_id, (fabricacao, vencimento) in validades.items():
 
-            item = Item.objects.create(
-                **_kwargs_item(
-                    dados
+        objeto = existentes.get(
+            item_id
+        )
+
+        if objeto is None:
+            criar.append(
+                DadosValidadeItem(
+                    item_id=item_id,
+                    data_fabricacao=fabricacao,
+                    data_vencimento=vencimento,
                 )
             )
+            continue
 
-            atualizar_validade(
-                item,
-                dados,
+        objeto.data_fabricacao = fabricacao
+        objeto.data_vencimento = vencimento
+        objeto.atualizado_em = agora
+        alterar.append(
+            objeto
+        )
+
+    DadosValidadeItem.objects.bulk_create(
+        criar,
+        batch_size=TAMANHO_LOTE_APLICACAO,
+    )
+
+    DadosValidadeItem.objects.bulk_update(
+        alterar,
+        [
+            'data_fabricacao',
+            'data_vencimento',
+            'atualizado_em',
+        ],
+        batch_size=TAMANHO_LOTE_APLICACAO,
+    )
+
+
+def _itens_em_alerta(
+    novos,
+    alterados,
+    quantidades_anteriores,
+):
+    """Itens que passaram a ficar com estoque baixo/zerado"""
+    alerta = [
+        item
+        for item in novos
+        if item.quantidade
+        <= item.estoque_minimo
+    ]
+
+    for item in alterados:
+
+        anterior = quantidades_anteriores[
+            item.pk
+        ]
+
+        if (
+            item.quantidade <= 0
+            < anterior
+        ) or (
+            item.quantidade
+            <= item.estoque_minimo
+            < anterior
+        ):
+            alerta.append(
+                item
             )
 
-            linha.item = item
+    return alerta
+
+
+def _gravar_decisoes(planejadas):
+    from .services_notificacao import enfileirar_resumo_estoque
+
+    campos = _campos_item()
+    agora = timezone.now()
+
+    itens_existentes = {}
+    campos_alterados = set()
+    quantidades_anteriores = {}
+    validades = {}
+    novos = []
+
+    for linha, acao in planejadas:
 
         linha.acao = acao
         linha.aplicado = True
 
-        linha.save(
-            update_fields=[
-                'item',
-                'acao',
-                'aplicado',
-            ]
+        if acao not in {
+            'CRIAR_ITEM',
+            'USAR_ARQUIVO',
+        }:
+            continue
+
+        dados = (
+            linha.dados_arquivo
+            or {}
         )
 
-        return linha
+        if linha.item_id:
 
-    raise ValueError(
-        f'Ação inválida: {acao}'
+            # Várias linhas do mesmo item: vale a última, como no
+            # processamento linha a linha
+            item = itens_existentes.setdefault(
+                linha.item_id,
+                linha.item,
+            )
+
+            quantidades_anteriores.setdefault(
+                item.pk,
+                item.quantidade,
+            )
+
+            campos_alterados.update(
+                aplicar_dados_item(
+                    item,
+                    dados,
+                    campos,
+                )
+            )
+
+            validades[
+                item.pk
+            ] = datas_validade(
+                dados
+            )
+
+            linha.item = item
+
+        else:
+            novos.append((
+                linha,
+                Item(
+                    **_kwargs_item(
+                        dados
+                    )
+                ),
+                datas_validade(
+                    dados
+                ),
+            ))
+
+    Item.objects.bulk_create(
+        [
+            item
+            for _, item, _ in novos
+        ],
+        batch_size=TAMANHO_LOTE_APLICACAO,
+    )
+
+    for linha, item, datas in novos:
+        linha.item = item
+        validades[
+            item.pk
+        ] = datas
+
+    if campos_alterados:
+
+        for item in itens_existentes.values():
+            item.updated_at = agora
+
+        Item.objects.bulk_update(
+            list(
+                itens_existentes.values()
+            ),
+            sorted(
+                campos_alterados
+                | {
+                    'updated_at',
+                }
+            ),
+            batch_size=TAMANHO_LOTE_APLICACAO,
+        )
+
+    _gravar_validades(
+        validades
+    )
+
+    LinhaComparacaoInventario.objects.bulk_update(
+        [
+            linha
+            for linha, _ in planejadas
+        ],
+        [
+            'item',
+            'quantidade_sistema',
+            'unidade_sistema',
+            'acao',
+            'aplicado',
+        ],
+        batch_size=TAMANHO_LOTE_APLICACAO,
+    )
+
+    enfileirar_resumo_estoque(
+        _itens_em_alerta(
+            [
+                item
+                for _, item, _ in novos
+            ],
+            (
+                itens_existentes.values()
+                if campos_alterados
+                else []
+            ),
+            quantidades_anteriores,
+        ),
+        'INVENTÁRIO APLICADO',
+    )
+
+
+def aplicar_decisoes(
+    importacao,
+    decisoes,
+):
+    """
+    Aplica as decisões da tela de comparação de uma vez.
+    Retorna {'aplicadas', 'erros', 'pendentes'}.
+    """
+    planejadas, ja_aplicadas, erros = _planejar_decisoes(
+        importacao,
+        decisoes,
+    )
+
+    if planejadas:
+        try:
+            with transaction.atomic():
+                _gravar_decisoes(
+                    planejadas
+                )
+
+        except Exception as exc:
+            # Falha na gravação: nada do lote foi aplicado
+            erros.extend(
+                _erro_decisao(
+                    {
+                        'linha_id': linha.pk,
+                        'acao': acao,
+                    },
+                    exc,
+                    linha,
+                )
+                for linha, acao in planejadas
+            )
+            planejadas = []
+
+    pendentes = (
+        importacao
+        .linhas
+        .filter(
+            aplicado=False
+        )
+        .count()
     )
+
+    if pendentes == 0:
+        _salvar_progresso(
+            importacao,
+            status='APLICADA',
+            aplicado_em=timezone.now(),
+        )
+
+    return {
+        'aplicadas':
+            len(
+                planejadas
+            )
+            + ja_aplicadas,
+
+        'erros':
+            erros,
+
+        'pendentes':
+            pendentes,
+    }
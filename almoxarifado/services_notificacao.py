@@ -0,0 +1,378 @@
+# almoxarifado/services_notificacao.py
+
+import logging
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Max, Q
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+
+# ============================================================
+# FILA DE NOTIFICAÇÕES WHATSAPP (OUTBOX)
+# ============================================================
+#
+# O signal do Item não chama a Evolution API: grava as mensagens em
+# HistoricoNotificacaoAlmoxarifado com status 'pendente', na mesma
+# transação da alteração do estoque (se houver rollback, a notificação
+# some junto). Um worker drena a fila:
+#
+#   python manage.py processar_fila_notificacoes --loop
+#
+# ou a tarefa Celery almoxarifado.processar_fila_notificacoes, disparada
+# após o commit quando o Celery roda com broker (fora do modo eager).
+#
+# - Deduplicação: notificação igual (item + tipo + destinatário) ainda
+#   pendente é atualizada com a mensagem nova em vez de duplicada. Só
+#   vale para registros prontos: os reservados por um worker (e os que
+#   esperam nova tentativa) já podem ter sido lidos, então entra um novo.
+# - Agrupamento: mensagens pendentes para o mesmo número saem juntas.
+# - Limite por destinatário: no máximo um envio a cada
+#   INTERVALO_MINIMO_DESTINATARIO segundos para o mesmo número.
+# - Falhas: nova tentativa com espera exponencial até MAX_TENTATIVAS.
+
+MAX_TENTATIVAS = 5
+ESPERA_BASE_TENTATIVA = 60  # segundos (60, 120, 240, ...)
+INTERVALO_MINIMO_DESTINATARIO = 20  # segundos entre envios ao mesmo número
+RESERVA_ENVIO = 5 * 60  # segundos; evita dois workers com o mesmo registro
+VALIDADE_NOTIFICACAO = timedelta(hours=24)
+
+LIMITE_LOTE = 50
+MAX_MENSAGENS_AGRUPADAS = 10
+SEPARADOR_MENSAGENS = '\n\n━━━━━━━━━━━━━━━━━━━━\n\n'
+
+
+def _historico_model():
+    from .models import HistoricoNotificacaoAlmoxarifado
+    return HistoricoNotificacaoAlmoxarifado
+
+
+def chave_dedup(item, tipo, numero):
+    from .services import get_notificacao_service
+
+    numero_formatado = get_notificacao_service().formatar_numero(numero) or str(numero)
+    return f'{item.pk}:{tipo}:{numero_formatado}'[:120]
+
+
+# ============================================================
+# ENFILEIRAR
+# ============================================================
+
+def enfileirar_notificacao_item(item, tipo, adicionado=0, config=None):
+    """
+    Grava a notificação do item na fila (um registro por número).
+    Não faz chamada HTTP. Retorna quantos registros novos entraram.
+
+    config: ConfiguracaoWhatsApp já carregada (evita reler a cada item).
+    """
+    from .services import get_notificacao_service
+
+    service = get_notificacao_service()
+    if config is not None:
+        service._config = config
+
+    notificacao = service.montar_notificacao(item, tipo, adicionado)
+    if not notificacao:
+        return 0
+
+    mensagem, numeros = notificacao
+    Historico = _historico_model()
+    novos = []
+
+    for numero in numeros:
+        chave = chave_dedup(item, tipo, numero)
+
+        # Já existe uma igual esperando envio: vale a mensagem mais recente
+        atualizados = _fila_pronta(timezone.now()).filter(
+            chave_dedup=chave,
+        ).update(mensagem=mensagem)
+
+        if not atualizados:
+            novos.append(Historico(
+                item=item,
+                tipo=tipo,
+                destinatario=numero,
+                mensagem=mensagem,
+                status='pendente',
+                chave_dedup=chave,
+            ))
+
+    if novos:
+        Historico.objects.bulk_create(novos)
+        agendar_processamento_fila()
+
+    logger.info(f"📥 Notificação de {tipo} para {item.nome} na fila ({len(novos)} nova(s))")
+    return len(novos)
+
+
+MAX_ITENS_RESUMO = 30
+
+
+def _linhas_resumo(itens, formatar):
+    linhas = [formatar(item) for item in itens[:MAX_ITENS_RESUMO]]
+    if len(itens) > MAX_ITENS_RESUMO:
+        linhas.append(f"... e mais {len(itens) - MAX_ITENS_RESUMO} item(ns)")
+    return linhas
+
+
+def _mensagem_resumo(titulo, departamento, baixos, zerados):
+    partes = [f"📊 *{titulo} - {departamento}*"]
+
+    if baixos:
+        partes.append(f"\n⚠️ *ESTOQUE BAIXO* ({len(baixos)})")
+        partes.extend(_linhas_resumo(
+            baixos,
+            lambda i: f"• *{i.nome}* ➜ {float(i.quantidade):g} {i.unidade} (mín: {float(i.estoque_minimo):g})",
+        ))
+
+    if zerados:
+        partes.append(f"\n🚨 *ITENS ZERADOS* ({len(zerados)})")
+        partes.extend(_linhas_resumo(zerados, lambda i: f"• *{i.nome}*"))
+
+    return '\n'.join(partes)
+
+
+def enfileirar_resumo_estoque(itens, titulo):
+    """
+    Um resumo por departamento com os itens em estoque baixo/zerado, no
+    lugar de uma mensagem por item (usado por operações em massa que
+    gravam com bulk_update e não passam pelo signal do Item).
+    Retorna quantos registros entraram na fila.
+    """
+    from .services import get_notificacao_service
+
+    service = get_notificacao_service()
+    service._config = None
+    config = service.config
+
+    if not itens or not config or not config.ativo:
+        return 0
+
+    depts_ativos = config.departamentos_ativos or []
+    por_departamento = {}
+
+    for item in itens:
+        if depts_ativos and item.departamento not in depts_ativos:
+            continue
+        por_departamento.setdefault(item.departamento, []).append(item)
+
+    Historico = _historico_model()
+    novos = []
+
+    for departamento, itens_dept in por_departamento.items():
+        zerados = [i for i in itens_dept if i.quantidade <= 0] if config.notificar_zerado else []
+        baixos = [i for i in itens_dept if i.quantidade > 0] if config.notificar_baixo else []
+
+        if not zerados and not baixos:
+            continue
+
+        numeros = service.get_numeros_destino(departamento)
+        if not numeros:
+            logger.warning(f"⚠️ Nenhum número configurado para o departamento {departamento}")
+            continue
+
+        mensagem = _mensagem_resumo(
+            titulo,
+            itens_dept[0].get_departamento_display(),
+            baixos,
+            zerados,
+        )
+
+        for numero in numeros:
+            novos.append(Historico(
+                item=(zerados or baixos)[0],
+                tipo='zerado' if zerados else 'baixo',
+                destinatario=numero,
+                mensagem=mensagem,
+                status='pendente',
+            ))
+
+    if novos:
+        Historico.objects.bulk_create(novos)
+        agendar_processamento_fila()
+
+    logger.info(f"📥 Resumo de estoque ({titulo}) na fila ({len(novos)} registro(s))")
+    return len(novos)
+
+
+def agendar_processamento_fila():
+    """
+    Após o commit, pede ao Celery para drenar a fila. Em modo eager
+    (padrão local) não faz nada: a tarefa rodaria dentro da requisição,
+    e quem drena a fila é o comando processar_fila_notificacoes.
+    """
+    conexao = transaction.get_connection()
+
+    # Um pedido por transação (mesmo esquema de incrementar_versao)
+    for _, funcao, *_ in conexao.run_on_commit:
+        if getattr(funcao, 'fila_notificacoes', False):
+            return
+
+    def _enviar():
+        from .tasks import processar_fila_notificacoes_task
+
+        try:
+            if processar_fila_notificacoes_task.app.conf.task_always_eager:
+                return
+            processar_fila_notificacoes_task.delay()
+        except Exception as e:
+            # O worker em loop pega a fila na próxima passada
+            logger.warning(f"⚠️ Broker indisponível para a fila de notificações: {e}")
+
+    _enviar.fila_notificacoes = True
+    transaction.on_commit(_enviar)
+
+
+# ============================================================
+# PROCESSAR
+# ============================================================
+
+def _fila_pronta(agora):
+    return _historico_model().objects.filter(
+        status='pendente',
+    ).filter(
+        Q(proxima_tentativa__isnull=True) | Q(proxima_tentativa__lte=agora)
+    )
+
+
+def _reservar_lote(agora, limite):
+    """
+    Marca até `limite` registros prontos como reservados (proxima_tentativa
+    no futuro) e os devolve. Com PostgreSQL, SKIP LOCKED deixa workers
+    paralelos pegarem registros diferentes.
+    """
+    Historico = _historico_model()
+
+    with transaction.atomic():
+        ids = list(
+            _fila_pronta(agora)
+            .select_for_update(skip_locked=True)
+            .order_by('criado_em', 'id')
+            .values_list('id', flat=True)[:limite]
+        )
+        Historico.objects.filter(id__in=ids).update(
+            proxima_tentativa=agora + timedelta(seconds=RESERVA_ENVIO)
+        )
+
+    return list(
+        Historico.objects
+        .filter(id__in=ids)
+        .select_related('item')
+        .order_by('criado_em', 'id')
+    )
+
+
+def _ultimos_envios(numeros, desde):
+    """
+    Último envio bem-sucedido de cada número a partir de `desde`, numa
+    consulta (índice notif_almox_envio_idx). Só a janela do intervalo
+    mínimo importa; envios mais antigos não entram na agregação.
+    """
+    return dict(
+        _historico_model().objects
+        .filter(destinatario__in=numeros, status='enviado', enviado_em__gte=desde)
+        .values('destinatario')
+        .annotate(ultimo=Max('enviado_em'))
+        .values_list('destinatario', 'ultimo')
+    )
+
+
+def _expirar(agora):
+    """Pendentes antigos demais (gateway fora do ar por muito tempo) não são mais enviados"""
+    return _historico_model().objects.filter(
+        status='pendente',
+        criado_em__lt=agora - VALIDADE_NOTIFICACAO,
+    ).update(
+        status='erro',
+        erro='Expirada na fila de envio',
+        proxima_tentativa=None,
+    )
+
+
+def _registrar_falha(registros, erro, agora):
+    Historico = _historico_model()
+
+    for registro in registros:
+        registro.tentativas += 1
+        registro.erro = str(erro)[:500]
+
+        if registro.tentativas >= MAX_TENTATIVAS:
+            registro.status = 'erro'
+            registro.proxima_tentativa = None
+        else:
+            espera = ESPERA_BASE_TENTATIVA * 2 ** (registro.tentativas - 1)
+            registro.proxima_tentativa = agora + timedelta(seconds=espera)
+
+    Historico.objects.bulk_update(registros, ['tentativas', 'erro', 'status', 'proxima_tentativa'])
+
+
+def processar_fila_notificacoes(limite=LIMITE_LOTE, agora=None):
+    """
+    Envia um lote da fila. Retorna {'enviados', 'falhas', 'adiados', 'expirados'}
+    (em registros da fila; várias mensagens agrupadas são um envio só).
+    """
+    from .services import get_notificacao_service
+
+    agora = agora or timezone.now()
+    Historico = _historico_model()
+    resumo = {'enviados': 0, 'falhas': 0, 'adiados': 0, 'expirados': _expirar(agora)}
+
+    registros = _reservar_lote(agora, limite)
+    if not registros:
+        return resumo
+
+    service = get_notificacao_service()
+    service._config = None  # relê a configuração a cada lote
+
+    por_numero = {}
+    for registro in registros:
+        por_numero.setdefault(registro.destinatario, []).append(registro)
+
+    intervalo = timedelta(seconds=INTERVALO_MINIMO_DESTINATARIO)
+    ultimos = _ultimos_envios(list(por_numero), agora - intervalo)
+
+    for numero, pendentes in por_numero.items():
+        ultimo = ultimos.get(numero)
+
+        # Enviado há pouco para este número: espera o intervalo mínimo
+        if ultimo and ultimo + intervalo > agora:
+            Historico.objects.filter(id__in=[r.id for r in pendentes]).update(
+                proxima_tentativa=ultimo + intervalo
+            )
+            resumo['adiados'] += len(pendentes)
+            continue
+
+        agrupados = pendentes[:MAX_MENSAGENS_AGRUPADAS]
+        restantes = pendentes[MAX_MENSAGENS_AGRUPADAS:]
+
+        if restantes:
+            Historico.objects.filter(id__in=[r.id for r in restantes]).update(
+                proxima_tentativa=agora + intervalo
+            )
+            resumo['adiados'] += len(restantes)
+
+        mensagem = SEPARADOR_MENSAGENS.join(r.mensagem for r in agrupados)
+
+        try:
+            sucesso, resposta = service.enviar_mensagem(numero, mensagem)
+        except Exception as e:
+            sucesso, resposta = False, str(e)
+
+        if sucesso:
+            Historico.objects.filter(id__in=[r.id for r in agrupados]).update(
+                status='enviado',
+                enviado_em=timezone.now(),
+                proxima_tentativa=None,
+                erro=None,
+                api_response=str(resposta)[:500] if isinstance(resposta, dict) else None,
+            )
+            resumo['enviados'] += len(agrupados)
+            logger.info(f"✅ {len(agrupados)} notificação(ões) enviada(s) para {numero}")
+        else:
+            _registrar_falha(agrupados, resposta, agora)
+            resumo['falhas'] += len(agrupados)
+            logger.error(f"❌ Falha ao enviar para {numero}: {resposta}")
+
+    return resumo
@@ -1,3 +1,4 @@
+from django.db import transaction
 from django.db.models.signals import post_save, post_migrate
 from django.dispatch import receiver
 from django.contrib.auth.models import Group, Permission
@@ -37,42 +38,50 @@ def configurar_grupos_almoxarifado(sender, **kwargs):
 # Signal para notificações
 @receiver(post_save, sender='almoxarifado.Item')
 def verificar_estoque_notificacao(sender, instance, created, **kwargs):
-    """Dispara notificações quando o estoque muda"""
+    """
+    Coloca na fila as notificações quando o estoque muda (gravadas na
+    mesma transação; o envio é feito por processar_fila_notificacoes)
+
+    Tudo roda num savepoint: se a gravação na fila falhar, só ela é
+    desfeita e a transação de quem salvou o Item continua utilizável.
+    """
     
     try:
-        from .services import get_notificacao_service
-        from .models import ConfiguracaoWhatsApp
-        
-        config = ConfiguracaoWhatsApp.get_config()
-        if not config.ativo:
+        with transaction.atomic():
+            _enfileirar_notificacoes_do_item(instance, created)
+    except Exception as e:
+        logger.error(f"Erro no signal de notificação: {e}")
+
+
+def _enfileirar_notificacoes_do_item(instance, created):
+    from .services_notificacao import enfileirar_notificacao_item
+    from .models import ConfiguracaoWhatsApp
+    
+    config = ConfiguracaoWhatsApp.get_config()
+    if not config.ativo:
+        return
+    
+    if created:
+        # Novo item - verifica se já está baixo
+        if instance.quantidade <= 0:
+            enfileirar_notificacao_item(instance, 'zerado', config=config)
+        elif instance.quantidade <= instance.estoque_minimo:
+            enfileirar_notificacao_item(instance, 'baixo', config=config)
+    else:
+        # Item editado - verificar mudanças
+        # Quantidade de antes do save (RastreiaAlteracoesMixin); reler o
+        # Item aqui traria o valor já salvo
+        quantidade_anterior = instance.valor_original('quantidade')
+        if quantidade_anterior is None:
             return
         
-        service = get_notificacao_service()
+        # Verifica reposição (quantidade aumentou)
+        if quantidade_anterior < instance.quantidade:
+            adicionado = instance.quantidade - quantidade_anterior
+            enfileirar_notificacao_item(instance, 'reposicao', adicionado, config=config)
         
-        if created:
-            # Novo item - verifica se já está baixo
-            if instance.quantidade <= 0:
-                service.notificar_item(instance, 'zerado')
-            elif instance.quantidade <= instance.estoque_minimo:
-                service.notificar_item(instance, 'baixo')
-        else:
-            # Item editado - verificar mudanças
-            try:
-                original = sender.objects.get(pk=instance.pk)
-                
-                # Verifica reposição (quantidade aumentou)
-                if original.quantidade < instance.quantidade:
-                    adicionado = instance.quantidade - original.quantidade
-                    service.notificar_item(instance, 'reposicao', adicionado)
-                
-                # Verifica estoque baixo/zerado
-                if instance.quantidade <= 0 and original.quantidade > 0:
-                    service.notificar_item(instance, 'zerado')
-                elif instance.quantidade <= instance.estoque_minimo and original.quantidade > instance.estoque_minimo:
-                    service.notificar_item(instance, 'baixo')
-                    
-            except sender.DoesNotExist:
-                pass
-                
-    except Exception as e:
-        logger.error(f"Erro no signal de notificação: {e}")
\ No newline at end of file
+        # Verifica estoque baixo/zerado
+        if instance.quantidade <= 0 and quantidade_anterior > 0:
+            enfileirar_notificacao_item(instance, 'zerado', config=config)
+        elif instance.quantidade <= instance.estoque_minimo and quantidade_anterior > instance.estoque_minimo:
+            enfileirar_notificacao_item(instance, 'baixo', config=config)
\ No newline at end of file
@@ -0,0 +1,18 @@
+# almoxarifado/tasks.py
+
+from celery import shared_task
+
+from .services_notificacao import processar_fila_notificacoes
+
+
+@shared_task(name='almoxarifado.processar_fila_notificacoes')
+def processar_fila_notificacoes_task():
+    return processar_fila_notificacoes()
+
+
+@shared_task(name='almoxarifado.processar_comparacao_inventario')
+def processar_comparacao_inventario_task(importacao_id):
+    from .services_inventario import processar_comparacao
+
+    importacao = processar_comparacao(importacao_id)
+    return importacao.status if importacao else None
@@ -0,0 +1,327 @@
+# almoxarifado/tests.py
+
+import shutil
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from .models import ConfiguracaoWhatsApp, HistoricoNotificacaoAlmoxarifado, Item
+
+
+class FilaNotificacoesAlmoxarifadoTests(TestCase):
+    """Notificações do almoxarifado gravadas na fila e enviadas pelo worker"""
+
+    @classmethod
+    def setUpTestData(cls):
+        ConfiguracaoWhatsApp.objects.create(
+            ativo=True,
+            api_url='https://whatsapp.example.com',
+            api_key='chave',
+            instance_name='almox',
+            numeros_padrao='11 99999-0001, 11 99999-0002',
+        )
+
+    def setUp(self):
+        self.item = Item.objects.create(nome='Luva', quantidade=Decimal('20'), estoque_minimo=Decimal('5'))
+
+    def _baixar_estoque(self, quantidade):
+        item = Item.objects.get(pk=self.item.pk)
+        item.quantidade = Decimal(quantidade)
+        item.save()
+
+    def test_alteracao_de_estoque_so_grava_na_fila(self):
+        with mock.patch('almoxarifado.services.requests.post') as post:
+            self._baixar_estoque('3')
+            self._baixar_estoque('20')
+            self._baixar_estoque('2')
+
+        post.assert_not_called()
+
+        pendentes = HistoricoNotificacaoAlmoxarifado.objects.filter(status='pendente', tipo='baixo')
+        # Segunda queda com a primeira ainda pendente: atualiza, não duplica
+        self.assertEqual(pendentes.count(), 2)
+        self.assertIn('2,00', pendentes.first().mensagem)
+
+    def test_worker_agrupa_por_numero_e_reagenda_falhas(self):
+        from .services import WhatsAppNotificacaoService
+        from .services_notificacao import processar_fila_notificacoes
+
+        self._baixar_estoque('3')
+        self._baixar_estoque('0')
+
+        respostas = {'11 99999-0001': (True, {'ok': 1}), '11 99999-0002': (False, 'HTTP 500')}
+
+        with mock.patch.object(
+            WhatsAppNotificacaoService,
+            'enviar_mensagem',
+            side_effect=lambda numero, mensagem: respostas[numero],
+        ) as enviar:
+            resumo = processar_fila_notificacoes()
+
+        # Baixo + zerado para cada número: um envio por número
+        self.assertEqual(enviar.call_count, 2)
+        self.assertEqual(resumo['enviados'], 2)
+        self.assertEqual(resumo['falhas'], 2)
+
+        falhas = HistoricoNotificacaoAlmoxarifado.objects.filter(destinatario='11 99999-0002')
+        for registro in falhas:
+            self.assertEqual(registro.status, 'pendente')
+            self.assertEqual(registro.tentativas, 1)
+            self.assertGreater(registro.proxima_tentativa, timezone.now())
+
+        # Reposição: o número que acabou de receber espera o intervalo mínimo
+        self._baixar_estoque('20')
+
+        with mock.patch.object(WhatsAppNotificacaoService, 'enviar_mensagem', return_value=(True, {})) as enviar:
+            resumo = processar_fila_notificacoes()
+
+        enviar.assert_called_once()
+        self.assertEqual(enviar.call_args.args[0], '11 99999-0002')
+        self.assertEqual(resumo['adiados'], 1)
+
+        # Mais tarde: sai a reposição adiada e as falhas reagendadas
+        with mock.patch.object(WhatsAppNotificacaoService, 'enviar_mensagem', return_value=(True, {})):
+            resumo = processar_fila_notificacoes(agora=timezone.now() + timedelta(minutes=10))
+
+        self.assertEqual(resumo['enviados'], 3)
+        self.assertFalse(HistoricoNotificacaoAlmoxarifado.objects.filter(status='pendente').exists())
+
+    def test_registro_reservado_pelo_worker_nao_recebe_a_mensagem_nova(self):
+        self._baixar_estoque('3')
+
+        # Worker pegou os registros (reserva no futuro) e ainda não enviou
+        reservados = HistoricoNotificacaoAlmoxarifado.objects.filter(status='pendente', tipo='baixo')
+        reservados.update(proxima_tentativa=timezone.now() + timedelta(minutes=5))
+
+        self._baixar_estoque('20')
+        self._baixar_estoque('2')
+
+        pendentes = HistoricoNotificacaoAlmoxarifado.objects.filter(status='pendente', tipo='baixo')
+        self.assertEqual(pendentes.count(), 4)
+        self.assertEqual(pendentes.filter(mensagem__contains='2,00').count(), 2)
+
+    def test_falha_ao_enfileirar_desfaz_so_o_savepoint_do_signal(self):
+        def gravar_e_falhar(item, tipo, *args, **kwargs):
+            HistoricoNotificacaoAlmoxarifado.objects.create(
+                item=item, tipo=tipo, destinatario='11 99999-0001', mensagem='parcial',
+            )
+            raise RuntimeError('fila indisponível')
+
+        with mock.patch('almoxarifado.services_notificacao.enfileirar_notificacao_item', side_effect=gravar_e_falhar):
+            self._baixar_estoque('3')
+
+        self.assertEqual(Item.objects.get(pk=self.item.pk).quantidade, Decimal('3'))
+        self.assertFalse(HistoricoNotificacaoAlmoxarifado.objects.filter(mensagem='parcial').exists())
+
+
+MEDIA_TESTE = tempfile.mkdtemp(prefix='almoxarifado-testes-')
+
+
+@override_settings(MEDIA_ROOT=MEDIA_TESTE)
+class ComparacaoInventarioTests(TestCase):
+    """Comparação de inventário gravada em lotes e retomável"""
+
+    CSV = (
+        'codigo;quantidade\n'
+        'A1;10\n'
+        'A2;3\n'
+        'X9;1\n'
+        'A2;4\n'
+        ';99\n'
+        'A1;0\n'
+    )
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_user('inventario', password='Inventario-12345!')
+
+        for codigo, quantidade in (('A1', 10), ('A2', 7), ('B1', 2)):
+            Item.objects.create(nome=f'Item {codigo}', codigo=codigo, quantidade=Decimal(quantidade))
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_TESTE, ignore_errors=True)
+
+    def _criar(self, csv=None):
+        from .services_inventario import criar_comparacao
+
+        upload = SimpleUploadedFile('inventario.csv', (csv or self.CSV).encode('utf-8'))
+
+        # Sem executar o on_commit: o processamento é chamado pelo teste
+        return criar_comparacao(upload, self.usuario, modo='SEM_LOTE')
+
+    def _status(self, importacao):
+        return dict(importacao.linhas.values_list('codigo', 'status'))
+
+    def test_chaves_repetidas_entre_lotes_somam(self):
+        from .services_inventario import processar_comparacao
+
+        importacao = processar_comparacao(self._criar().pk, tamanho_lote=2)
+
+        self.assertEqual(importacao.status, 'PRONTA')
+        self.assertEqual(importacao.linhas_lidas, 5)
+        self.assertFalse(importacao.arquivo)
+        self.assertEqual(
+            self._status(importacao),
+            {'A1': 'IGUAL', 'A2': 'IGUAL', 'X9': 'SO_ARQUIVO', 'B1': 'SO_SISTEMA'},
+        )
+        self.assertEqual(importacao.total_linhas, 4)
+        self.assertEqual(importacao.resumo['iguais'], 2)
+        self.assertEqual(importacao.resumo['so_sistema'], 1)
+
+    def test_retoma_do_ultimo_lote_gravado(self):
+        from . import services_inventario
+        from .services_inventario import processar_comparacao
+
+        importacao = self._criar()
+        original = services_inventario._gravar_lote_arquivo
+        chamadas = []
+
+        def cair_no_segundo_lote(*args, **kwargs):
+            chamadas.append(1)
+            if len(chamadas) == 2:
+                raise RuntimeError('worker caiu')
+            return original(*args, **kwargs)
+
+        with mock.patch.object(services_inventario, '_gravar_lote_arquivo', side_effect=cair_no_segundo_lote):
+            with self.assertRaises(RuntimeError):
+                processar_comparacao(importacao.pk, tamanho_lote=2)
+
+        importacao.refresh_from_db()
+        self.assertEqual(importacao.status, 'ERRO')
+        self.assertEqual(importacao.linhas_lidas, 2)
+
+        importacao = processar_comparacao(importacao.pk, tamanho_lote=2)
+
+        self.assertEqual(importacao.status, 'PRONTA')
+        self.assertEqual(importacao.resumo['iguais'], 2)
+        self.assertEqual(self._status(importacao)['A2'], 'IGUAL')
+        self.assertEqual(importacao.linhas.count(), 4)
+
+    def test_importacao_com_sinal_recente_nao_e_processada_de_novo(self):
+        from .models import ImportacaoInventario
+        from .services_inventario import TEMPO_SEM_SINAL_COMPARACAO, processar_comparacao
+
+        importacao = self._criar()
+        ImportacaoInventario.objects.filter(pk=importacao.pk).update(processando_desde=timezone.now())
+
+        saida = StringIO()
+        call_command('retomar_comparacoes_inventario', stdout=saida)
+        importacao = processar_comparacao(importacao.pk)
+
+        self.assertEqual(saida.getvalue(), '')
+        self.assertEqual(importacao.status, 'PROCESSANDO')
+        self.assertFalse(importacao.linhas.exists())
+
+        # Sem sinal há mais que o limite: o worker caiu, o comando retoma
+        ImportacaoInventario.objects.filter(pk=importacao.pk).update(
+            processando_desde=timezone.now() - TEMPO_SEM_SINAL_COMPARACAO - timedelta(minutes=1),
+        )
+        call_command('retomar_comparacoes_inventario', stdout=saida)
+        importacao.refresh_from_db()
+
+        self.assertEqual(importacao.status, 'PRONTA')
+        self.assertIsNone(importacao.processando_desde)
+        self.assertEqual(importacao.linhas.count(), 4)
+
+    def test_broker_fora_do_ar_deixa_a_importacao_para_a_retomada(self):
+        from .services_inventario import enfileirar_comparacao
+        from .tasks import processar_comparacao_inventario_task
+
+        importacao = self._criar()
+
+        with mock.patch.object(processar_comparacao_inventario_task, 'apply', side_effect=ConnectionError('sem broker')), \
+                self.assertLogs('almoxarifado.services_inventario', 'WARNING'), \
+                self.captureOnCommitCallbacks(execute=True):
+            enfileirar_comparacao(importacao)
+
+        importacao.refresh_from_db()
+        self.assertEqual(importacao.status, 'PROCESSANDO')
+        self.assertEqual(importacao.tentativas, 0)
+        self.assertFalse(importacao.linhas.exists())
+
+        call_command('retomar_comparacoes_inventario', stdout=StringIO())
+        importacao.refresh_from_db()
+
+        self.assertEqual(importacao.status, 'PRONTA')
+        self.assertEqual(importacao.tentativas, 1)
+
+    def test_retomada_desiste_depois_do_limite_de_tentativas(self):
+        from . import services_inventario
+        from .services_inventario import MAX_TENTATIVAS_COMPARACAO
+
+        importacao = self._criar()
+
+        with mock.patch.object(services_inventario, '_indice_sistema', side_effect=ValueError('arquivo inválido')):
+            for _ in range(MAX_TENTATIVAS_COMPARACAO + 2):
+                call_command('retomar_comparacoes_inventario', stdout=StringIO())
+
+        importacao.refresh_from_db()
+        self.assertEqual(importacao.status, 'ERRO')
+        self.assertEqual(importacao.tentativas, MAX_TENTATIVAS_COMPARACAO)
+
+        # Pedida pelo id, a importação é retomada mesmo assim
+        call_command('retomar_comparacoes_inventario', str(importacao.pk), stdout=StringIO())
+        importacao.refresh_from_db()
+
+        self.assertEqual(importacao.status, 'PRONTA')
+        self.assertEqual(importacao.tentativas, MAX_TENTATIVAS_COMPARACAO + 1)
+
+    def test_aplica_decisoes_em_lote(self):
+        from .models import DadosValidadeItem
+        from .services_inventario import aplicar_decisoes, processar_comparacao
+
+        config = ConfiguracaoWhatsApp.get_config()
+        config.ativo = True
+        config.numeros_padrao = '11 99999-0001'
+        config.save()
+        csv = (
+            'codigo;nome;quantidade;estoque_minimo;data_vencimento\n'
+            'A1;Item A1;2;5;31/12/2030\n'
+            'A2;Item A2;7;5;\n'
+            'X9;Novo;1;5;\n'
+        )
+        importacao = processar_comparacao(self._criar(csv).pk)
+        linhas = dict(importacao.linhas.values_list('codigo', 'pk'))
+
+        decisoes = [
+            {'linha_id': linhas['A1'], 'acao': 'USAR_ARQUIVO'},
+            {'linha_id': linhas['A2'], 'acao': 'IGNORAR'},
+            {'linha_id': linhas['X9'], 'acao': 'CRIAR_ITEM'},
+            {'linha_id': linhas['B1'], 'acao': 'CRIAR_ITEM'},
+            {'linha_id': linhas['B1'], 'acao': 'MANTER_SISTEMA'},
+        ]
+
+        with mock.patch('almoxarifado.services.requests.post') as post:
+            resultado = aplicar_decisoes(importacao, decisoes)
+
+        post.assert_not_called()
+        self.assertEqual(resultado['aplicadas'], 4)
+        self.assertEqual([erro['linha_id'] for erro in resultado['erros']], [linhas['B1']])
+        self.assertEqual(resultado['pendentes'], 0)
+
+        importacao.refresh_from_db()
+        self.assertEqual(importacao.status, 'APLICADA')
+
+        a1 = Item.objects.get(codigo='A1')
+        novo = Item.objects.get(codigo='X9')
+        self.assertEqual(a1.quantidade, Decimal('2'))
+        self.assertEqual(novo.quantidade, Decimal('1'))
+        self.assertEqual(importacao.linhas.get(codigo='X9').item_id, novo.pk)
+        self.assertEqual(str(DadosValidadeItem.objects.get(item=a1).data_vencimento), '2030-12-31')
+        self.assertTrue(DadosValidadeItem.objects.filter(item=novo).exists())
+
+        # Um resumo só com os dois itens abaixo do mínimo (sem uma mensagem por item)
+        pendentes = HistoricoNotificacaoAlmoxarifado.objects.filter(status='pendente')
+        self.assertEqual(pendentes.count(), 1)
+        self.assertIn('Item A1', pendentes.get().mensagem)
+        self.assertIn('Novo', pendentes.get().mensagem)
@@ -46,7 +46,8 @@ def lista_itens(request):
     filtro_status = request.GET.get('status', '')
     ordenar = request.GET.get('ordenar', 'vencimento')  # padrão vencimento
 
-    itens = Item.objects.filter(ativo=True)
+    # dados_validade é lido linha a linha no template: vem no mesmo JOIN
+    itens = Item.objects.filter(ativo=True).select_related('dados_validade')
     hoje = date.today()
 
     # Anotar dados de validade
@@ -9,7 +9,6 @@ from django.shortcuts import (
     get_object_or_404,
     render,
 )
-from django.utils import timezone
 from django.views.decorators.http import (
     require_GET,
     require_POST,
@@ -23,7 +22,7 @@ from .models import (
 )
 
 from .services_inventario import (
-    aplicar_linha,
+    aplicar_decisoes,
     criar_comparacao,
 )
 
@@ -426,6 +425,9 @@ def api_importar_comparacao(
             'importacao_id':
                 importacao.id,
 
+            'status':
+                importacao.status,
+
             'total':
                 importacao
                 .total_linhas,
@@ -805,267 +807,72 @@ def api_aplicar_decisoes(
             status=400,
         )
 
-    aplicadas = 0
-    erros = []
-
-    for decisao in decisoes:
-
-        linha_id = decisao.get(
-            'linha_id'
-        )
-
-        acao = decisao.get(
-            'acao'
-        )
-
-        item_id = decisao.get(
-            'item_id'
-        )
-
-        try:
-            linha = (
-                importacao
-                .linhas
-                .select_related(
-                    'item'
-                )
-                .get(
-                    pk=linha_id
-                )
-            )
-
-            # ------------------------------------------------
-            # SE O USUÁRIO ESCOLHEU UM CANDIDATO AMBÍGUO
-            # ------------------------------------------------
-            if item_id:
-
-                item = get_object_or_404(
-                    Item,
-                    pk=item_id,
-                    ativo=True,
-                )
-
-                # Confirma o código.
-                if (
-                    str(
-                        getattr(
-                            item,
-                            'codigo',
-                            '',
-                        )
-                        or ''
-                    ).strip().upper()
-                    !=
-                    str(
-                        linha.codigo
-                        or ''
-                    ).strip().upper()
-                ):
-                    raise ValueError(
-                        'O item escolhido '
-                        'possui código '
-                        'diferente da '
-                        'linha comparada.'
-                    )
-
-                # Confirma o lote quando
-                # o modo usa lote.
-                if (
-                    importacao
-                    .modo_comparacao
-                    == 'COM_LOTE'
-                ):
-
-                    if (
-                        str(
-                            getattr(
-                                item,
-                                'lote',
-                                '',
-                            )
-                            or ''
-                        ).strip().upper()
-                        !=
-                        str(
-                            linha.lote
-                            or ''
-                        ).strip().upper()
-                    ):
-                        raise ValueError(
-                            'O item escolhido '
-                            'possui lote '
-                            'diferente da '
-                            'linha comparada.'
-                        )
-
-                linha.item = item
-
-                # Atualiza os dados visuais
-                # do "lado sistema" também.
-                linha.quantidade_sistema = (
-                    getattr(
-                        item,
-                        'quantidade',
-                        0,
-                    )
-                    or 0
-                )
-
-                linha.unidade_sistema = (
-                    getattr(
-                        item,
-                        'unidade',
-                        '',
-                    )
-                    or ''
-                )
-
-                linha.save(
-                    update_fields=[
-                        'item',
-                        'quantidade_sistema',
-                        'unidade_sistema',
-                    ]
-                )
-
-            aplicar_linha(
-                linha,
-                acao,
-            )
-
-            aplicadas += 1
-
-        except Exception as exc:
-
-            try:
-                linha_info = (
-                    importacao
-                    .linhas
-                    .filter(
-                        pk=linha_id
-                    )
-                    .values(
-                        'id',
-                        'codigo',
-                        'lote',
-                        'status',
-                        'item_id',
-                    )
-                    .first()
-                )
-
-            except Exception:
-                linha_info = None
-
-            erro = {
-                'linha_id':
-                    linha_id,
-
-                'acao':
-                    acao,
-
-                'item_id':
-                    item_id,
-
-                'tipo_erro':
-                    (
-                        exc
-                        .__class__
-                        .__name__
-                    ),
-
-                'erro':
-                    str(
-                        exc
-                    ),
-
-                'linha':
-                    linha_info,
-            }
-
-            erros.append(
-                erro
-            )
+    resultado = aplicar_decisoes(
+        importacao,
+        decisoes,
+    )
 
-            print(
-                '\n'
-                '======================'
-            )
+    aplicadas = resultado[
+        'aplicadas'
+    ]
 
-            print(
-                'ERRO INVENTÁRIO'
-            )
+    erros = resultado[
+        'erros'
+    ]
 
-            print(
-                'Importação:',
-                importacao_id,
-            )
+    pendentes = resultado[
+        'pendentes'
+    ]
 
-            print(
-                'Linha:',
-                linha_id,
-            )
+    for erro in erros:
 
-            print(
-                'Ação:',
-                acao,
-            )
-
-            print(
-                'Item escolhido:',
-                item_id,
-            )
+        print(
+            '\n'
+            '======================'
+        )
 
-            print(
-                'Dados:',
-                linha_info,
-            )
+        print(
+            'ERRO INVENTÁRIO'
+        )
 
-            print(
-                'Tipo:',
-                (
-                    exc
-                    .__class__
-                    .__name__
-                ),
-            )
+        print(
+            'Importação:',
+            importacao_id,
+        )
 
-            print(
-                'Erro:',
-                str(
-                    exc
-                ),
-            )
+        print(
+            'Linha:',
+            erro['linha_id'],
+        )
 
-            print(
-                '======================'
-                '\n'
-            )
+        print(
+            'Ação:',
+            erro['acao'],
+        )
 
-    pendentes = (
-        importacao
-        .linhas
-        .filter(
-            aplicado=False
+        print(
+            'Item escolhido:',
+            erro['item_id'],
         )
-        .count()
-    )
 
-    if pendentes == 0:
+        print(
+            'Dados:',
+            erro['linha'],
+        )
 
-        importacao.status = (
-            'APLICADA'
+        print(
+            'Tipo:',
+            erro['tipo_erro'],
         )
 
-        importacao.aplicado_em = (
-            timezone.now()
+        print(
+            'Erro:',
+            erro['erro'],
         )
 
-        importacao.save(
-            update_fields=[
-                'status',
-                'aplicado_em',
-            ]
+        print(
+            '======================'
+            '\n'
         )
 
     return JsonResponse({
@@ -108,4 +108,15 @@ class ConfiguracaoLogoAdmin(admin.ModelAdmin):
     
     def has_delete_permission(self, request, obj=None):
         # Permite exclusão apenas para superusuários
-        return request.user.is_superuser
\ No newline at end of file
+        return request.user.is_superuser
+
+
+# --- Exportações em segundo plano ---
+from .models import TarefaExportacao
+
+@admin.register(TarefaExportacao)
+class TarefaExportacaoAdmin(admin.ModelAdmin):
+    list_display = ('id', 'tipo', 'formato', 'status', 'usuario', 'criado_em', 'total_linhas', 'segundos_na_fila', 'segundos_execucao')
+    list_filter = ('status', 'tipo', 'formato')
+    readonly_fields = ('criado_em', 'iniciado_em', 'concluido_em', 'total_linhas', 'tamanho_bytes', 'celery_task_id', 'erro')
+
@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+
+from sapp.models import ElementoMapa, Endereco, Estoque
+from sapp.services_mapa import atualizar_enderecos_do_estoque, atualizar_enderecos_estruturados
+
+
+class Command(BaseCommand):
+    help = (
+        'Recalcula rua/linha/posição (e o endereço normalizado do estoque) '
+        'de Estoque, Endereco e ElementoMapa '
+        '(necessário após alterações feitas fora do save()).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--tamanho-lote',
+            type=int,
+            default=1000,
+            help='Quantidade de registros gravados por vez.',
+        )
+
+    def handle(self, *args, **options):
+        tamanho_lote = options['tamanho_lote']
+
+        totais = {
+            'Estoque': atualizar_enderecos_do_estoque(
+                Estoque.objects.all(),
+                tamanho_lote=tamanho_lote,
+            ),
+            'Endereco': atualizar_enderecos_estruturados(
+                Endereco.objects.all(),
+                'codigo',
+                tamanho_lote=tamanho_lote,
+            ),
+            'ElementoMapa': atualizar_enderecos_estruturados(
+                ElementoMapa.objects.all(),
+                'identificador',
+                tamanho_lote=tamanho_lote,
+            ),
+        }
+
+        for modelo, total in totais.items():
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f'✅ {modelo}: {total} registro(s) alterado(s).'
+                )
+            )
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from sapp.services_kanban import atualizar_totais_empenho
+
+
+class Command(BaseCommand):
+    help = (
+        'Refaz o kg e as embalagens empenhados gravados nas solicitações '
+        'a partir dos itens pendentes dos empenhos (necessário após '
+        'cargas ou correções feitas fora do save()).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'solicitacoes',
+            nargs='*',
+            type=int,
+            help='Ids das solicitações (padrão: todas).',
+        )
+
+    def handle(self, *args, **options):
+        total = atualizar_totais_empenho(options['solicitacoes'] or None)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'✅ Totais empenhados refeitos: {total} solicitação(ões).'
+            )
+        )
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from sapp.services_historico import reconstruir_livro
+
+
+class Command(BaseCommand):
+    help = (
+        'Refaz o livro unificado de movimentações a partir do '
+        'HistoricoMovimentacao e do HistoricoItemEmpenho '
+        '(necessário após cargas feitas fora do save()).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--tamanho-lote',
+            type=int,
+            default=1000,
+            help='Quantidade de lançamentos gravados por vez.',
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            total = reconstruir_livro(
+                tamanho_lote=options['tamanho_lote'],
+                stdout=self.stdout,
+            )
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'✅ Livro de movimentações refeito: {total} lançamento(s).'
+            )
+        )
@@ -0,0 +1,52 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from sapp.services_dashboard import DIAS_POR_LOTE_RECONSTRUCAO, reconstruir_resumo
+
+
+def _data(valor):
+    try:
+        return datetime.strptime(valor, '%Y-%m-%d').date()
+    except ValueError:
+        raise CommandError(f'Data inválida: {valor} (use AAAA-MM-DD).')
+
+
+class Command(BaseCommand):
+    help = (
+        'Refaz o resumo diário de movimentações usado pelo dashboard a '
+        'partir do HistoricoMovimentacao (necessário após cargas feitas '
+        'fora do save()). Sem datas, refaz todo o histórico.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--data-inicio',
+            type=_data,
+            help='Primeiro dia a refazer (AAAA-MM-DD).',
+        )
+        parser.add_argument(
+            '--data-fim',
+            type=_data,
+            help='Último dia a refazer (AAAA-MM-DD).',
+        )
+        parser.add_argument(
+            '--dias-por-lote',
+            type=int,
+            default=DIAS_POR_LOTE_RECONSTRUCAO,
+            help='Quantidade de dias recalculados por transação.',
+        )
+
+    def handle(self, *args, **options):
+        total = reconstruir_resumo(
+            data_inicio=options['data_inicio'],
+            data_fim=options['data_fim'],
+            dias_por_lote=max(1, options['dias_por_lote']),
+            stdout=self.stdout,
+        )
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'✅ Resumo diário de movimentações refeito: {total} linha(s).'
+            )
+        )
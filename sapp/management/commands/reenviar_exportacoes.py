@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from sapp.services_exportacao import limpar_exportacoes_antigas, reenviar_exportacoes_pendentes
+
+
+class Command(BaseCommand):
+    help = (
+        'Reenvia ao Celery as exportações que ficaram na fila (broker fora '
+        'do ar ou mensagem perdida), marca como erro as que esperam há mais '
+        'de 1 hora ou ficaram presas processando e apaga as tarefas '
+        'finalizadas há mais de 7 dias, com os arquivos. Agende no cron '
+        '(ex.: a cada 5 minutos).'
+    )
+
+    def handle(self, *args, **options):
+        reenviadas, expiradas = reenviar_exportacoes_pendentes()
+        apagadas = limpar_exportacoes_antigas()
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'✅ Exportações reenviadas: {reenviadas} | expiradas: {expiradas} | '
+                f'apagadas: {apagadas}.'
+            )
+        )
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from sapp.models import Estoque
+from sapp.services_estoque import atualizar_busca_estoque
+
+
+class Command(BaseCommand):
+    help = (
+        'Recalcula a coluna de busca normalizada do estoque '
+        '(necessário após alterações feitas fora do save()).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--tamanho-lote',
+            type=int,
+            default=1000,
+            help='Quantidade de registros gravados por vez.',
+        )
+
+    def handle(self, *args, **options):
+        total = atualizar_busca_estoque(
+            Estoque.objects.all(),
+            tamanho_lote=options['tamanho_lote'],
+        )
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'✅ Busca do estoque atualizada: {total} registro(s) alterado(s).'
+            )
+        )
@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand
+
+from sapp.services_estoque import divergencias_resumo_lotes, recalcular_resumo_lotes
+
+
+class Command(BaseCommand):
+    help = (
+        'Compara o resumo por lote (saldo, empenhado e disponível) com a '
+        'soma do Estoque e lista os lotes divergentes. Com --corrigir, '
+        'refaz os lotes divergentes a partir do Estoque.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--corrigir',
+            action='store_true',
+            help='Refaz os lotes divergentes.',
+        )
+        parser.add_argument(
+            '--refazer-tudo',
+            action='store_true',
+            help='Refaz o resumo de todos os lotes, sem comparar.',
+        )
+
+    def handle(self, *args, **options):
+        if options['refazer_tudo']:
+            total = recalcular_resumo_lotes()
+            self.stdout.write(self.style.SUCCESS(f'✅ Resumo refeito: {total} lote(s).'))
+            return
+
+        divergencias = divergencias_resumo_lotes()
+
+        if not divergencias:
+            self.stdout.write(self.style.SUCCESS('✅ Resumo por lote consistente com o Estoque.'))
+            return
+
+        for divergencia in divergencias:
+            self.stdout.write(
+                f"⚠️ {divergencia['lote']}: esperado {divergencia['esperado'] or 'nada'}, "
+                f"gravado {divergencia['gravado'] or 'nada'} (saldo, empenhado, disponível, registro recente)"
+            )
+
+        if not options['corrigir']:
+            self.stdout.write(
+                self.style.WARNING(
+                    f'⚠️ {len(divergencias)} lote(s) divergente(s). Use --corrigir para refazer.'
+                )
+            )
+            return
+
+        recalcular_resumo_lotes([divergencia['lote'] for divergencia in divergencias])
+
+        self.stdout.write(
+            self.style.SUCCESS(f'✅ {len(divergencias)} lote(s) corrigido(s).')
+        )
@@ -10,6 +10,7 @@ from urllib.parse import urlparse
 from django.shortcuts import redirect
 from django.urls import reverse
 from django.contrib.auth.hashers import check_password
+from django.contrib.auth import HASH_SESSION_KEY
 
 # sapp/middleware.py
 from django.shortcuts import redirect
@@ -83,6 +84,36 @@ class Smart404FallbackMiddleware:
 
 
 SENHA_PADRAO = 'conceito123'
+SESSAO_TROCA_SENHA = 'deve_trocar_senha'
+
+
+def atualizar_marcador_troca_senha(request, user, deve_trocar=None):
+    """
+    Grava na sessão se o usuário ainda usa a senha padrão.
+
+    O marcador fica vinculado ao hash de autenticação da sessão, que muda
+    sempre que a senha é alterada; assim o check_password (PBKDF2) roda só
+    no login ou após uma troca de senha, nunca a cada requisição.
+    """
+    if deve_trocar is None:
+        deve_trocar = check_password(SENHA_PADRAO, user.password)
+
+    request.session[SESSAO_TROCA_SENHA] = {
+        'hash': request.session.get(HASH_SESSION_KEY),
+        'deve_trocar': bool(deve_trocar),
+    }
+    return bool(deve_trocar)
+
+
+def deve_trocar_senha(request):
+    marcador = request.session.get(SESSAO_TROCA_SENHA)
+
+    if marcador and marcador.get('hash') == request.session.get(HASH_SESSION_KEY):
+        return marcador.get('deve_trocar', False)
+
+    # Sessão antiga ou senha alterada: recalcula uma única vez
+    return atualizar_marcador_troca_senha(request, request.user)
+
 
 class ForcarTrocaSenhaMiddleware:
     def __init__(self, get_response):
@@ -90,7 +121,7 @@ class ForcarTrocaSenhaMiddleware:
 
     def __call__(self, request):
         if request.user.is_authenticated:
-            if check_password(SENHA_PADRAO, request.user.password):
+            if deve_trocar_senha(request):
                 urls_permitidas = [
                     reverse('sapp:mudar_senha'),
                     reverse('sapp:logout'),
@@ -0,0 +1,99 @@
+# Generated by Django 5.2 on 2026-10-18 01:17
+
+import unicodedata
+
+from django.db import migrations, models, transaction
+
+
+# Cópia congelada de services_estoque (CAMPOS_BUSCA, normalizar_busca e
+# atualizar_busca_estoque) na data desta migration: o código vivo pode
+# mudar e usar campos que o modelo histórico ainda não tem
+CAMPOS_BUSCA = (
+    'lote',
+    'produto',
+    'cultivar__nome',
+    'peneira__nome',
+    'categoria__nome',
+    'especie__nome',
+    'endereco',
+    'az',
+    'cliente',
+    'empresa',
+    'observacao',
+    'conferente__username',
+    'conferente__first_name',
+    'conferente__last_name',
+)
+
+
+def _normalizar_busca(valor):
+    texto = unicodedata.normalize('NFKD', str(valor or ''))
+    texto = ''.join(caractere for caractere in texto if not unicodedata.combining(caractere))
+    return ' '.join(texto.lower().split())
+
+
+def preencher_busca_normalizada(apps, schema_editor):
+    Estoque = apps.get_model('sapp', 'Estoque')
+    pendentes = []
+
+    linhas = (
+        Estoque.objects
+        .order_by()
+        .values('id', *CAMPOS_BUSCA)
+        .iterator(chunk_size=1000)
+    )
+
+    for linha in linhas:
+        texto = _normalizar_busca(
+            ' '.join(str(linha[campo]) for campo in CAMPOS_BUSCA if linha[campo])
+        )
+        pendentes.append(Estoque(id=linha['id'], busca_normalizada=texto))
+
+        if len(pendentes) >= 1000:
+            Estoque.objects.bulk_update(pendentes, ['busca_normalizada'])
+            pendentes = []
+
+    if pendentes:
+        Estoque.objects.bulk_update(pendentes, ['busca_normalizada'])
+
+
+def criar_indice_trigram(apps, schema_editor):
+    # Só o PostgreSQL possui pg_trgm; no SQLite a busca usa a coluna sem índice
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    try:
+        with transaction.atomic():
+            schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    except Exception as e:
+        print(f"⚠️ Extensão pg_trgm indisponível, índice trigram não criado: {e}")
+        return
+
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS sapp_estoque_busca_trgm '
+        'ON sapp_estoque USING gin (busca_normalizada gin_trgm_ops)'
+    )
+
+
+def remover_indice_trigram(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    schema_editor.execute('DROP INDEX IF EXISTS sapp_estoque_busca_trgm')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sapp', '0037_historicoitemempenho_az_origem_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='estoque',
+            name='busca_normalizada',
+            field=models.TextField(blank=True, default='', editable=False, verbose_name='Texto de busca'),
+        ),
+        migrations.RunPython(preencher_busca_normalizada, migrations.RunPython.noop),
+        migrations.RunPython(criar_indice_trigram, remover_indice_trigram),
+    ]
@@ -0,0 +1,277 @@
+# Generated by Django 5.2 on 2026-10-18 01:21
+
+import heapq
+import unicodedata
+from itertools import islice
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models, transaction
+
+
+# Cópia congelada de services_historico (montagem dos lançamentos e
+# reconstrução do livro) na data desta migration: o código vivo pode
+# mudar e usar campos que os modelos históricos ainda não têm
+
+TIPOS_NORMALIZADOS = {
+    'entrada': 'entrada',
+    'nova entrada': 'entrada',
+    'saida': 'saida',
+    'saída': 'saida',
+    'baixa': 'saida',
+    'transferencia': 'transferencia',
+    'transferência': 'transferencia',
+    'expedicao': 'expedicao',
+    'expedição': 'expedicao',
+    'edicao': 'edicao',
+    'edição': 'edicao',
+    'exclusao': 'exclusao',
+    'exclusão': 'exclusao',
+}
+
+
+def _normalizar_tipo(tipo):
+    tipo = str(tipo or '').strip().lower()
+    return TIPOS_NORMALIZADOS.get(tipo, tipo.replace(' ', '_'))
+
+
+def _texto_busca(valores):
+    texto = unicodedata.normalize('NFKD', ' '.join(str(valor) for valor in valores if valor))
+    texto = ''.join(caractere for caractere in texto if not unicodedata.combining(caractere))
+    return ' '.join(texto.lower().split())
+
+
+def _nome_usuario(usuario):
+    if not usuario:
+        return 'Sistema'
+    nome = f'{usuario.first_name or ""} {usuario.last_name or ""}'.strip()
+    return nome or usuario.username or 'Sistema'
+
+
+def _nome(relacionado):
+    return relacionado.nome if relacionado else ''
+
+
+def _chave_dedup(lancamento):
+    data_hora = lancamento.data_hora
+    return '|'.join([
+        str(lancamento.lote or '').strip().upper(),
+        lancamento.tipo or '',
+        str(int(lancamento.quantidade or 0)),
+        data_hora.strftime('%Y-%m-%d %H:%M') if data_hora else '',
+        str(lancamento.numero_carga or '').strip().upper(),
+    ])[:255]
+
+
+def _busca_lancamento(lancamento, usuario, extras=()):
+    return _texto_busca([
+        lancamento.lote,
+        lancamento.produto,
+        lancamento.cultivar,
+        lancamento.cliente,
+        lancamento.empresa,
+        lancamento.tipo_original,
+        lancamento.observacao,
+        lancamento.numero_carga,
+        lancamento.motorista,
+        lancamento.placa,
+        lancamento.ordem_entrega,
+        lancamento.endereco_origem,
+        lancamento.endereco_destino,
+        usuario.username if usuario else '',
+        usuario.first_name if usuario else '',
+        usuario.last_name if usuario else '',
+        *extras,
+    ])
+
+
+def _lancamento_movimentacao(Livro, mov):
+    estoque = mov.estoque
+    tipo = _normalizar_tipo(mov.tipo)
+    cliente_estoque = (estoque.cliente if estoque else '') or ''
+
+    # Histórico antigo: só o endereço do estoque (destino na entrada)
+    endereco = (estoque.endereco if estoque else '') or ''
+    end_orig, end_dest = ('', endereco) if tipo == 'entrada' else (endereco, '')
+
+    lancamento = Livro(
+        origem='HISTORICO',
+        origem_id=mov.pk,
+        data_hora=mov.data_hora,
+        lote=(mov.lote_ref or (estoque.lote if estoque else '') or 'Sem lote').strip()[:100],
+        tipo=tipo,
+        tipo_original=(mov.tipo or '')[:50],
+        quantidade=mov.quantidade or 0,
+        produto=(estoque.produto if estoque else '') or '',
+        cliente=mov.cliente or cliente_estoque,
+        empresa=(estoque.empresa if estoque else '') or '',
+        cultivar=_nome(estoque.cultivar) if estoque else '',
+        peneira=_nome(estoque.peneira) if estoque else '',
+        categoria=_nome(estoque.categoria) if estoque else '',
+        tratamento=_nome(estoque.tratamento) if estoque else '',
+        especie=_nome(estoque.especie) if estoque else '',
+        embalagem=(estoque.embalagem if estoque else '') or '',
+        endereco_origem=end_orig,
+        endereco_destino=end_dest,
+        usuario_id=mov.usuario_id,
+        usuario_nome=_nome_usuario(mov.usuario),
+        observacao=mov.descricao or '',
+        numero_carga=mov.numero_carga or '',
+        motorista=mov.motorista or '',
+        placa=mov.placa or '',
+        ordem_entrega=mov.ordem_entrega or '',
+    )
+    lancamento.busca_normalizada = _busca_lancamento(lancamento, mov.usuario, extras=[cliente_estoque])
+    return lancamento
+
+
+def _lancamento_item_empenho(Livro, item):
+    lancamento = Livro(
+        origem='EMPENHO',
+        origem_id=item.pk,
+        data_hora=item.processado_em,
+        lote=(item.lote or 'Sem lote').strip()[:100],
+        tipo=_normalizar_tipo(item.tipo),
+        tipo_original=(item.tipo or '')[:50],
+        quantidade=item.quantidade or 0,
+        produto=item.produto or '',
+        cliente=item.cliente or '',
+        empresa=item.empresa or '',
+        cultivar=item.cultivar or '',
+        peneira=item.peneira or '',
+        categoria=item.categoria or '',
+        tratamento=item.tratamento or '',
+        especie=item.especie or '',
+        embalagem=item.embalagem or '',
+        endereco_origem=item.endereco_origem or '',
+        endereco_destino=item.endereco_destino or '',
+        usuario_id=item.processado_por_id,
+        usuario_nome=_nome_usuario(item.processado_por),
+        observacao=item.observacao or '',
+        numero_carga=item.numero_carga or '',
+        motorista=(item.empenho.motorista if item.empenho else '') or '',
+        placa=item.placa or '',
+        ordem_entrega='',
+    )
+    lancamento.busca_normalizada = _busca_lancamento(lancamento, item.processado_por)
+    return lancamento
+
+
+def preencher_livro(apps, schema_editor):
+    Livro = apps.get_model('sapp', 'LivroMovimentacao')
+    HistoricoMovimentacao = apps.get_model('sapp', 'HistoricoMovimentacao')
+    HistoricoItemEmpenho = apps.get_model('sapp', 'HistoricoItemEmpenho')
+
+    antigos = (
+        HistoricoMovimentacao.objects
+        .select_related(
+            'estoque__cultivar',
+            'estoque__peneira',
+            'estoque__categoria',
+            'estoque__tratamento',
+            'estoque__especie',
+            'usuario',
+        )
+        .order_by(models.F('data_hora').asc(nulls_last=True), 'id')
+    )
+    novos = (
+        HistoricoItemEmpenho.objects
+        .select_related('empenho', 'processado_por')
+        .order_by(models.F('processado_em').asc(nulls_last=True), 'id')
+    )
+
+    # Ordem cronológica (sem data no fim; no mesmo instante o histórico
+    # antigo primeiro); a primeira ocorrência de cada evento é a exibida
+    lancamentos = heapq.merge(
+        (_lancamento_movimentacao(Livro, mov) for mov in antigos.iterator(chunk_size=1000)),
+        (_lancamento_item_empenho(Livro, item) for item in novos.iterator(chunk_size=1000)),
+        key=lambda l: (l.data_hora is None, l.data_hora, l.origem != 'HISTORICO'),
+    )
+    vistas = set()
+
+    while bloco := list(islice(lancamentos, 1000)):
+        for lancamento in bloco:
+            lancamento.chave_dedup = _chave_dedup(lancamento)
+            lancamento.duplicado = lancamento.chave_dedup in vistas
+            vistas.add(lancamento.chave_dedup)
+
+        Livro.objects.bulk_create(bloco, ignore_conflicts=True)
+
+
+def criar_indice_trigram(apps, schema_editor):
+    # Só o PostgreSQL possui pg_trgm; no SQLite a busca usa a coluna sem índice
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    try:
+        with transaction.atomic():
+            schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    except Exception as e:
+        print(f"⚠️ Extensão pg_trgm indisponível, índice trigram não criado: {e}")
+        return
+
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS sapp_livro_busca_trgm '
+        'ON sapp_livromovimentacao USING gin (busca_normalizada gin_trgm_ops)'
+    )
+
+
+def remover_indice_trigram(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    schema_editor.execute('DROP INDEX IF EXISTS sapp_livro_busca_trgm')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sapp', '0038_estoque_busca_normalizada'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LivroMovimentacao',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('origem', models.CharField(choices=[('HISTORICO', 'Histórico geral'), ('EMPENHO', 'Cards e empenhos')], max_length=10)),
+                ('origem_id', models.PositiveBigIntegerField()),
+                ('data_hora', models.DateTimeField(blank=True, null=True)),
+                ('lote', models.CharField(blank=True, default='', max_length=100)),
+                ('tipo', models.CharField(blank=True, default='', max_length=50)),
+                ('tipo_original', models.CharField(blank=True, default='', max_length=50)),
+                ('quantidade', models.IntegerField(default=0)),
+                ('produto', models.CharField(blank=True, default='', max_length=255)),
+                ('cliente', models.CharField(blank=True, default='', max_length=255)),
+                ('empresa', models.CharField(blank=True, default='', max_length=255)),
+                ('cultivar', models.CharField(blank=True, default='', max_length=255)),
+                ('peneira', models.CharField(blank=True, default='', max_length=100)),
+                ('categoria', models.CharField(blank=True, default='', max_length=100)),
+                ('tratamento', models.CharField(blank=True, default='', max_length=255)),
+                ('especie', models.CharField(blank=True, default='', max_length=100)),
+                ('embalagem', models.CharField(blank=True, default='', max_length=100)),
+                ('endereco_origem', models.CharField(blank=True, default='', max_length=100)),
+                ('endereco_destino', models.CharField(blank=True, default='', max_length=100)),
+                ('usuario_nome', models.CharField(blank=True, default='', max_length=255)),
+                ('observacao', models.TextField(blank=True, default='')),
+                ('numero_carga', models.CharField(blank=True, default='', max_length=100)),
+                ('motorista', models.CharField(blank=True, default='', max_length=100)),
+                ('placa', models.CharField(blank=True, default='', max_length=20)),
+                ('ordem_entrega', models.CharField(blank=True, default='', max_length=50)),
+                ('chave_dedup', models.CharField(blank=True, db_index=True, default='', max_length=255)),
+                ('duplicado', models.BooleanField(default=False)),
+                ('busca_normalizada', models.TextField(blank=True, default='', editable=False)),
+                ('usuario', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='livro_movimentacoes', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Lançamento do livro de movimentações',
+                'verbose_name_plural': 'Livro de movimentações',
+                'ordering': ['-data_hora', '-id'],
+                'indexes': [models.Index(fields=['-data_hora', '-id'], name='livro_data_idx'), models.Index(fields=['lote', '-data_hora'], name='livro_lote_data_idx'), models.Index(fields=['tipo', '-data_hora'], name='livro_tipo_data_idx'), models.Index(fields=['usuario', '-data_hora'], name='livro_usuario_data_idx'), models.Index(fields=['cliente', '-data_hora'], name='livro_cliente_data_idx')],
+                'constraints': [models.UniqueConstraint(fields=('origem', 'origem_id'), name='livro_origem_unica')],
+            },
+        ),
+        migrations.RunPython(preencher_livro, migrations.RunPython.noop),
+        migrations.RunPython(criar_indice_trigram, remover_indice_trigram),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2 on 2026-10-18 01:28
+
+import django.db.models.deletion
+import sapp.models
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sapp', '0039_livromovimentacao'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TarefaExportacao',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(choices=[('estoque_simples', 'Estoque (planilha simples)'), ('estoque_filtrado', 'Estoque com filtros'), ('estoque_pdf', 'Relatório de estoque (PDF)')], max_length=30)),
+                ('formato', models.CharField(choices=[('xlsx', 'Excel (.xlsx)'), ('csv', 'CSV (.csv)'), ('pdf', 'PDF (.pdf)')], default='xlsx', max_length=10)),
+                ('parametros', models.JSONField(blank=True, default=dict)),
+                ('status', models.CharField(choices=[('pendente', 'Na fila'), ('processando', 'Processando'), ('concluida', 'Concluída'), ('erro', 'Erro')], db_index=True, default='pendente', max_length=20)),
+                ('arquivo', models.FileField(blank=True, max_length=255, upload_to=sapp.models.caminho_arquivo_exportacao)),
+                ('nome_arquivo', models.CharField(blank=True, default='', max_length=150)),
+                ('celery_task_id', models.CharField(blank=True, default='', max_length=255)),
+                ('erro', models.TextField(blank=True, default='')),
+                ('total_linhas', models.PositiveIntegerField(blank=True, null=True)),
+                ('tamanho_bytes', models.PositiveBigIntegerField(blank=True, null=True)),
+                ('criado_em', models.DateTimeField(auto_now_add=True)),
+                ('iniciado_em', models.DateTimeField(blank=True, null=True)),
+                ('concluido_em', models.DateTimeField(blank=True, null=True)),
+                ('usuario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tarefas_exportacao', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Tarefa de exportação',
+                'verbose_name_plural': 'Tarefas de exportação',
+                'ordering': ['-criado_em'],
+                'indexes': [models.Index(fields=['usuario', '-criado_em'], name='exportacao_usuario_idx')],
+            },
+        ),
+    ]
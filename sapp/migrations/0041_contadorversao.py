@@ -0,0 +1,26 @@
+# Generated by Django 5.2 on 2026-10-18 01:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sapp', '0040_tarefaexportacao'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContadorVersao',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('chave', models.CharField(max_length=50, unique=True)),
+                ('valor', models.PositiveBigIntegerField(default=0)),
+                ('atualizado_em', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Contador de versão',
+                'verbose_name_plural': 'Contadores de versão',
+            },
+        ),
+    ]
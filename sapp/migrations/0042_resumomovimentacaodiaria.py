@@ -0,0 +1,139 @@
+# Generated by Django 5.2 on 2026-10-18 01:34
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# Cópia congelada de services_dashboard/services_historico (agregação do
+# resumo e normalização do tipo) na data desta migration
+
+TERMOS_SAIDA = ('saída', 'saida', 'expedição', 'expedicao')
+
+TIPOS_NORMALIZADOS = {
+    'entrada': 'entrada',
+    'nova entrada': 'entrada',
+    'saida': 'saida',
+    'saída': 'saida',
+    'baixa': 'saida',
+    'transferencia': 'transferencia',
+    'transferência': 'transferencia',
+    'expedicao': 'expedicao',
+    'expedição': 'expedicao',
+    'edicao': 'edicao',
+    'edição': 'edicao',
+    'exclusao': 'exclusao',
+    'exclusão': 'exclusao',
+}
+
+
+def _campos_resumo(dia, tipo_original, cultivar_id, peneira_id, especie_id, az, embalagem):
+    tipo_lower = str(tipo_original or '').strip().lower()
+    tipo = TIPOS_NORMALIZADOS.get(tipo_lower, tipo_lower.replace(' ', '_'))[:50]
+    tipo_classificado = str(tipo_original or '').lower()
+
+    chave = '|'.join(
+        str(valor if valor is not None else '')
+        for valor in (dia.isoformat(), tipo, cultivar_id, peneira_id, especie_id, az or '', embalagem or '')
+    )[:255]
+
+    return {
+        'chave': chave,
+        'dia': dia,
+        'tipo': tipo,
+        'entrada': 'entrada' in tipo_classificado,
+        'saida': any(termo in tipo_classificado for termo in TERMOS_SAIDA),
+        'cultivar_id': cultivar_id,
+        'peneira_id': peneira_id,
+        'especie_id': especie_id,
+        'az': (az or '')[:20],
+        'embalagem': (embalagem or '')[:10],
+    }
+
+
+def preencher_resumo(apps, schema_editor):
+    from django.db.models import Count, Sum
+    from django.db.models.functions import TruncDate
+
+    Historico = apps.get_model('sapp', 'HistoricoMovimentacao')
+    Resumo = apps.get_model('sapp', 'ResumoMovimentacaoDiaria')
+
+    linhas = (
+        Historico.objects
+        .order_by()
+        .annotate(dia=TruncDate('data_hora'))
+        .values(
+            'dia',
+            'tipo',
+            'estoque__cultivar_id',
+            'estoque__peneira_id',
+            'estoque__especie_id',
+            'estoque__az',
+            'estoque__embalagem',
+        )
+        .annotate(soma=Sum('quantidade'), total=Count('id'))
+    )
+
+    resumo = {}
+
+    for linha in linhas.iterator(chunk_size=2000):
+        if linha['dia'] is None:
+            continue
+
+        campos = _campos_resumo(
+            linha['dia'],
+            linha['tipo'],
+            linha['estoque__cultivar_id'],
+            linha['estoque__peneira_id'],
+            linha['estoque__especie_id'],
+            linha['estoque__az'],
+            linha['estoque__embalagem'],
+        )
+
+        # Grafias de tipo diferentes que normalizam para o mesmo valor
+        atual = resumo.setdefault(campos['chave'], {**campos, 'quantidade': 0, 'eventos': 0})
+        atual['quantidade'] += linha['soma'] or 0
+        atual['eventos'] += linha['total'] or 0
+
+    Resumo.objects.bulk_create([Resumo(**campos) for campos in resumo.values()], batch_size=1000)
+
+    if resumo:
+        print(f"\n   📊 Resumo diário de movimentações: {len(resumo)} linhas")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sapp', '0041_contadorversao'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResumoMovimentacaoDiaria',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dia', models.DateField()),
+                ('tipo', models.CharField(blank=True, default='', max_length=50)),
+                ('entrada', models.BooleanField(default=False)),
+                ('saida', models.BooleanField(default=False)),
+                ('az', models.CharField(blank=True, default='', max_length=20)),
+                ('embalagem', models.CharField(blank=True, default='', max_length=10)),
+                ('quantidade', models.BigIntegerField(default=0)),
+                ('eventos', models.PositiveIntegerField(default=0)),
+                ('chave', models.CharField(max_length=255, unique=True)),
+                ('cultivar', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='sapp.cultivar')),
+                ('especie', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='sapp.especie')),
+                ('peneira', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='sapp.peneira')),
+            ],
+            options={
+                'verbose_name': 'Resumo diário de movimentações',
+                'verbose_name_plural': 'Resumos diários de movimentações',
+                'ordering': ['dia'],
+                'indexes': [models.Index(fields=['dia'], name='resumo_mov_dia_idx')],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='historicomovimentacao',
+            index=models.Index(fields=['data_hora'], name='historico_data_hora_idx'),
+        ),
+        migrations.RunPython(preencher_resumo, migrations.RunPython.noop),
+    ]
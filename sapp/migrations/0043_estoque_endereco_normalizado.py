@@ -0,0 +1,42 @@
+# Generated by Django 5.2 on 2026-10-18 02:10
+
+from django.db import migrations, models
+
+
+def preencher_endereco_normalizado(apps, schema_editor):
+    # Cópia congelada da regra de services_mapa.normalizar_endereco
+    Estoque = apps.get_model('sapp', 'Estoque')
+    alterados = []
+
+    for pk, endereco in Estoque.objects.order_by('pk').values_list(
+        'pk', 'endereco'
+    ).iterator(chunk_size=1000):
+        normalizado = ' '.join(str(endereco or '').split()).upper()[:50]
+        alterados.append(Estoque(pk=pk, endereco_normalizado=normalizado))
+
+        if len(alterados) >= 1000:
+            Estoque.objects.bulk_update(alterados, ['endereco_normalizado'])
+            alterados = []
+
+    if alterados:
+        Estoque.objects.bulk_update(alterados, ['endereco_normalizado'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sapp', '0042_resumomovimentacaodiaria'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='estoque',
+            name='endereco_normalizado',
+            field=models.CharField(blank=True, default='', editable=False, max_length=50),
+        ),
+        migrations.RunPython(preencher_endereco_normalizado, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='estoque',
+            index=models.Index(condition=models.Q(('saldo__gt', 0)), fields=['endereco_normalizado'], name='estoque_ocupacao_end_idx'),
+        ),
+    ]
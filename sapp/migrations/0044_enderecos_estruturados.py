@@ -0,0 +1,111 @@
+# Generated by Django 5.2 on 2026-10-18 01:56
+
+import re
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+# Cópia congelada de services_mapa.decompor_endereco na data desta migration
+PADRAO_ENDERECO = re.compile(r'^(R-[A-Z]+)(?:\s+(LN\d+|GERAL)(?:\s+P(\d+))?)?$')
+
+
+def _decompor_endereco(endereco):
+    match = PADRAO_ENDERECO.match(' '.join(str(endereco or '').split()).upper())
+
+    if not match:
+        return {'rua': '', 'linha': '', 'posicao': None}
+
+    rua, linha, posicao = match.groups()
+    return {'rua': rua, 'linha': linha or '', 'posicao': int(posicao) if posicao else None}
+
+
+def _preencher(Modelo, campo_origem):
+    alterados = []
+
+    for pk, endereco in Modelo.objects.order_by('pk').values_list(
+        'pk', campo_origem
+    ).iterator(chunk_size=1000):
+        alterados.append(Modelo(pk=pk, **_decompor_endereco(endereco)))
+
+        if len(alterados) >= 1000:
+            Modelo.objects.bulk_update(alterados, ['rua', 'linha', 'posicao'])
+            alterados = []
+
+    if alterados:
+        Modelo.objects.bulk_update(alterados, ['rua', 'linha', 'posicao'])
+
+
+def preencher_enderecos_estruturados(apps, schema_editor):
+    _preencher(apps.get_model('sapp', 'Estoque'), 'endereco')
+    _preencher(apps.get_model('sapp', 'Endereco'), 'codigo')
+    _preencher(apps.get_model('sapp', 'ElementoMapa'), 'identificador')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sapp', '0043_estoque_endereco_normalizado'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='elementomapa',
+            name='linha',
+            field=models.CharField(blank=True, default='', editable=False, max_length=10),
+        ),
+        migrations.AddField(
+            model_name='elementomapa',
+            name='posicao',
+            field=models.PositiveSmallIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='elementomapa',
+            name='rua',
+            field=models.CharField(blank=True, default='', editable=False, max_length=10),
+        ),
+        migrations.AddField(
+            model_name='endereco',
+            name='linha',
+            field=models.CharField(blank=True, default='', editable=False, max_length=10),
+        ),
+        migrations.AddField(
+            model_name='endereco',
+            name='posicao',
+            field=models.PositiveSmallIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='endereco',
+            name='rua',
+            field=models.CharField(blank=True, default='', editable=False, max_length=10),
+        ),
+        migrations.AddField(
+            model_name='estoque',
+            name='linha',
+            field=models.CharField(blank=True, default='', editable=False, max_length=10),
+        ),
+        migrations.AddField(
+            model_name='estoque',
+            name='posicao',
+            field=models.PositiveSmallIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='estoque',
+            name='rua',
+            field=models.CharField(blank=True, default='', editable=False, max_length=10),
+        ),
+        migrations.RunPython(preencher_enderecos_estruturados, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='elementomapa',
+            index=models.Index(fields=['rua', 'linha', 'posicao'], name='elemento_rua_linha_pos_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='endereco',
+            index=models.Index(fields=['rua', 'linha', 'posicao'], name='endereco_rua_linha_pos_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='estoque',
+            index=models.Index(fields=['rua', 'linha', 'posicao'], name='estoque_rua_linha_pos_idx'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2 on 2026-10-18 02:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sapp', '0044_enderecos_estruturados'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CardKanbanRemovido',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('card_id', models.PositiveBigIntegerField()),
+                ('versao', models.PositiveBigIntegerField(db_index=True)),
+                ('removido_em', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+            options={
+                'verbose_name': 'Card removido do quadro',
+                'verbose_name_plural': 'Cards removidos do quadro',
+            },
+        ),
+        migrations.AddField(
+            model_name='solicitacao',
+            name='versao_kanban',
+            field=models.PositiveBigIntegerField(db_index=True, default=0, editable=False, verbose_name='Versão no quadro'),
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.2 on 2026-10-18 02:24
+
+from django.db import migrations, models
+
+
+def preencher_resumo_lote(apps, schema_editor):
+    # Cópia congelada do recálculo (só com os campos desta migration)
+    from django.db.models import Sum
+
+    Estoque = apps.get_model('sapp', 'Estoque')
+    ResumoLote = apps.get_model('sapp', 'ResumoLote')
+
+    totais = (
+        Estoque.objects
+        .order_by()
+        .values('lote')
+        .annotate(saldo=Sum('saldo'), empenhado=Sum('empenhado'))
+    )
+
+    ResumoLote.objects.bulk_create(
+        [
+            ResumoLote(
+                lote=linha['lote'],
+                saldo=linha['saldo'] or 0,
+                empenhado=linha['empenhado'] or 0,
+                disponivel=(linha['saldo'] or 0) - (linha['empenhado'] or 0),
+            )
+            for linha in totais.iterator(chunk_size=1000)
+            if linha['lote']
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sapp', '0045_kanban_delta'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResumoLote',
+            fields=[
+                ('lote', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('saldo', models.IntegerField(default=0)),
+                ('empenhado', models.IntegerField(default=0)),
+                ('disponivel', models.IntegerField(default=0)),
+                ('atualizado_em', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Resumo do lote',
+                'verbose_name_plural': 'Resumos dos lotes',
+            },
+        ),
+        migrations.RunPython(preencher_resumo_lote, migrations.RunPython.noop),
+    ]
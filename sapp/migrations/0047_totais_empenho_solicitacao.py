@@ -0,0 +1,58 @@
+# Generated by Django 5.2 on 2026-10-18 02:28
+
+from decimal import Decimal
+from django.db import migrations, models
+
+
+def preencher_totais_empenho(apps, schema_editor):
+    # Cópia congelada de services_kanban.atualizar_totais_empenho
+    from django.db.models import F, IntegerField, OuterRef, Subquery, Sum, Value
+    from django.db.models.functions import Coalesce
+
+    Solicitacao = apps.get_model('sapp', 'Solicitacao')
+    ItemEmpenho = apps.get_model('sapp', 'ItemEmpenho')
+    campo_kg = models.DecimalField(max_digits=18, decimal_places=2)
+
+    itens = (
+        ItemEmpenho.objects
+        .filter(empenho__solicitacao_id=OuterRef('pk'))
+        .order_by()
+        .values('empenho__solicitacao_id')
+    )
+    kg = Subquery(
+        itens
+        .filter(estoque__isnull=False)
+        .annotate(total=Sum(F('quantidade') * F('estoque__peso_unitario'), output_field=campo_kg))
+        .values('total')[:1],
+        output_field=campo_kg,
+    )
+    embalagens = Subquery(
+        itens.annotate(total=Sum('quantidade')).values('total')[:1],
+        output_field=IntegerField(),
+    )
+
+    Solicitacao.objects.update(
+        total_kg_empenhado=Coalesce(kg, Value(Decimal('0.00')), output_field=campo_kg),
+        total_embalagens_empenhadas=Coalesce(embalagens, Value(0)),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sapp', '0046_resumo_lote'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='solicitacao',
+            name='total_embalagens_empenhadas',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Embalagens empenhadas'),
+        ),
+        migrations.AddField(
+            model_name='solicitacao',
+            name='total_kg_empenhado',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), editable=False, max_digits=14, verbose_name='Kg empenhado'),
+        ),
+        migrations.RunPython(preencher_totais_empenho, migrations.RunPython.noop),
+    ]
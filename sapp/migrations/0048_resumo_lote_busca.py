@@ -0,0 +1,93 @@
+# Generated by Django 5.2 on 2026-10-18 02:32
+
+import unicodedata
+
+import django.db.models.deletion
+from django.db import migrations, models, transaction
+
+
+def _normalizar_busca(valor):
+    # Cópia de services_estoque.normalizar_busca na data desta migration
+    texto = unicodedata.normalize('NFKD', str(valor or ''))
+    texto = ''.join(caractere for caractere in texto if not unicodedata.combining(caractere))
+    return ' '.join(texto.lower().split())
+
+
+def preencher_indice_lotes(apps, schema_editor):
+    from django.db.models import Max
+
+    Estoque = apps.get_model('sapp', 'Estoque')
+    ResumoLote = apps.get_model('sapp', 'ResumoLote')
+
+    recentes = dict(
+        Estoque.objects
+        .order_by()
+        .values('lote')
+        .annotate(recente=Max('id'))
+        .values_list('lote', 'recente')
+    )
+
+    alterados = []
+
+    for resumo in ResumoLote.objects.order_by('pk').iterator(chunk_size=1000):
+        resumo.lote_busca = _normalizar_busca(resumo.lote)[:50]
+        resumo.estoque_recente_id = recentes.get(resumo.lote)
+        alterados.append(resumo)
+
+        if len(alterados) >= 1000:
+            ResumoLote.objects.bulk_update(alterados, ['lote_busca', 'estoque_recente'])
+            alterados = []
+
+    if alterados:
+        ResumoLote.objects.bulk_update(alterados, ['lote_busca', 'estoque_recente'])
+
+
+def criar_indice_trigram(apps, schema_editor):
+    # Segundo passo do autocomplete ("contém"); só o PostgreSQL possui pg_trgm
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    try:
+        with transaction.atomic():
+            schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    except Exception as e:
+        print(f"⚠️ Extensão pg_trgm indisponível, índice trigram não criado: {e}")
+        return
+
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS sapp_resumolote_busca_trgm '
+        'ON sapp_resumolote USING gin (lote_busca gin_trgm_ops)'
+    )
+
+
+def remover_indice_trigram(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    schema_editor.execute('DROP INDEX IF EXISTS sapp_resumolote_busca_trgm')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sapp', '0047_totais_empenho_solicitacao'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='resumolote',
+            name='estoque_recente',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='sapp.estoque'),
+        ),
+        migrations.AddField(
+            model_name='resumolote',
+            name='lote_busca',
+            field=models.CharField(blank=True, default='', editable=False, max_length=50),
+        ),
+        migrations.AddIndex(
+            model_name='resumolote',
+            index=models.Index(fields=['lote_busca'], name='resumo_lote_busca_idx', opclasses=['varchar_pattern_ops']),
+        ),
+        migrations.RunPython(preencher_indice_lotes, migrations.RunPython.noop),
+        migrations.RunPython(criar_indice_trigram, remover_indice_trigram),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2 on 2026-10-18 02:53
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sapp', '0048_resumo_lote_busca'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='livromovimentacao',
+            name='duplicado',
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2 on 2026-10-18 03:29
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sapp', '0049_livro_sem_flag_duplicado'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='estoque',
+            index=models.Index(fields=['lote'], name='estoque_lote_idx'),
+        ),
+    ]
@@ -1,10 +1,20 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
 from django.utils import timezone
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 from decimal import Decimal, InvalidOperation
 import json  # <-- ADICIONE ESTA LINHA
+import uuid
+from .services_estoque import atualizar_resumo_lotes, montar_texto_busca, recalcular_resumo_lotes
+from .services_mapa import (
+    CAMPOS_ENDERECO_ESTRUTURADO,
+    normalizar_endereco,
+    preencher_endereco_estruturado,
+)
+from .services_historico import ORIGEM_CHOICES, ORIGEM_HISTORICO, nome_tipo_historico
+from .rastreamento import RastreiaAlteracoesMixin
+from django.core.cache import cache
 from django.db import models
 from django.conf import settings
 from django.contrib.auth.models import User
@@ -54,16 +64,31 @@ class Endereco(models.Model):
     armazem = models.ForeignKey(Armazem, on_delete=models.CASCADE, related_name='enderecos', null=True, blank=True)
     criado_em = models.DateTimeField(auto_now_add=True)
     
+    # Partes do código (R-A / LN10 / 2), mantidas pelo save()
+    rua = models.CharField(max_length=10, blank=True, default='', editable=False)
+    linha = models.CharField(max_length=10, blank=True, default='', editable=False)
+    posicao = models.PositiveSmallIntegerField(null=True, blank=True, editable=False)
+    
     class Meta:
         verbose_name = "Endereço"
         verbose_name_plural = "Endereços"
         ordering = ['armazem__nome', 'codigo']
+        indexes = [
+            models.Index(fields=['rua', 'linha', 'posicao'], name='endereco_rua_linha_pos_idx'),
+        ]
     
     def __str__(self):
         if self.armazem:
             return f"{self.codigo} ({self.armazem.nome})"
         return self.codigo
     
+    def save(self, *args, **kwargs):
+        preencher_endereco_estruturado(self, self.codigo)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'codigo' in update_fields:
+            kwargs['update_fields'] = set(update_fields) | set(CAMPOS_ENDERECO_ESTRUTURADO)
+        super().save(*args, **kwargs)
+    
 
     
 
@@ -92,7 +117,7 @@ class Configuracao(models.Model):
 # ESTOQUE E MOVIMENTAÇÃO
 # ============================================================================
 
-class Estoque(models.Model):
+class Estoque(RastreiaAlteracoesMixin, models.Model):
     lote = models.CharField(max_length=50)
     produto = models.CharField(max_length=100, blank=True, null=True, default='')
     
@@ -103,6 +128,14 @@ class Estoque(models.Model):
     especie = models.ForeignKey(Especie, on_delete=models.PROTECT, null=True, blank=True)
     
     endereco = models.CharField(max_length=50, verbose_name="Endereço")
+    # Endereço em maiúsculo e sem espaços extras (mantido pelo save()),
+    # usado para cruzar o estoque com os retângulos do mapa
+    endereco_normalizado = models.CharField(max_length=50, blank=True, default='', editable=False)
+    # Partes do endereço (R-A / LN10 / 2), também mantidas pelo save(),
+    # para consultar uma linha inteira pelo índice
+    rua = models.CharField(max_length=10, blank=True, default='', editable=False)
+    linha = models.CharField(max_length=10, blank=True, default='', editable=False)
+    posicao = models.PositiveSmallIntegerField(null=True, blank=True, editable=False)
     
     entrada = models.IntegerField(default=0)
     saida = models.IntegerField(default=0)
@@ -142,6 +175,44 @@ class Estoque(models.Model):
     status_sistemico_alterado_em = models.DateTimeField(null=True, blank=True)
     status_sistemico_observacao = models.TextField(blank=True, null=True)
     
+    # Texto normalizado (minúsculo, sem acento) usado pela busca global.
+    # Mantido pelo save(); no PostgreSQL possui índice trigram (pg_trgm).
+    busca_normalizada = models.TextField(blank=True, default='', editable=False, verbose_name="Texto de busca")
+    
+    # Campos que alimentam busca_normalizada
+    CAMPOS_ORIGEM_BUSCA = {
+        'lote', 'produto', 'cultivar', 'peneira', 'categoria', 'especie',
+        'endereco', 'az', 'cliente', 'empresa', 'observacao', 'conferente',
+    }
+    
+    # Relações que entram em busca_normalizada e os campos lidos de cada uma
+    RELACOES_BUSCA = {
+        'cultivar': ('nome',),
+        'peneira': ('nome',),
+        'categoria': ('nome',),
+        'especie': ('nome',),
+        'conferente': ('username', 'first_name', 'last_name'),
+    }
+    
+    # Atributos do lote usados no ResumoMovimentacaoDiaria
+    CAMPOS_RESUMO_MOVIMENTACAO = ('cultivar_id', 'peneira_id', 'especie_id', 'az', 'embalagem')
+    # Campos que entram no ResumoLote (ver save)
+    CAMPOS_TOTAIS_LOTE = {'lote', 'saldo', 'empenhado'}
+    
+    class Meta:
+        indexes = [
+            # Ocupação do mapa: só interessam os lotes com saldo
+            models.Index(
+                fields=['endereco_normalizado'],
+                condition=models.Q(saldo__gt=0),
+                name='estoque_ocupacao_end_idx',
+            ),
+            # Posições de uma linha (R-A LN10, P > 04, ...)
+            models.Index(fields=['rua', 'linha', 'posicao'], name='estoque_rua_linha_pos_idx'),
+            # Somas por lote do ResumoLote (atualizar_resumo_lotes)
+            models.Index(fields=['lote'], name='estoque_lote_idx'),
+        ]
+    
     def get_status_display_completo(self):
         """Retorna o status com ícone e cor"""
         if self.status_sistemico:
@@ -175,14 +246,75 @@ class Estoque(models.Model):
         """Saldo físico menos total empenhado ativo"""
         return self.saldo - self.empenhado
     
+    def _textos_relacoes_busca(self):
+        """
+        Textos das relações de RELACOES_BUSCA. As que já estão carregadas
+        não consultam o banco; as demais vêm juntas em UMA consulta
+        (UNION ALL), apenas com os campos necessários.
+        """
+        textos = {}
+        consultas = []
+        
+        for relacao, campos in self.RELACOES_BUSCA.items():
+            campo = self._meta.get_field(relacao)
+            relacionado_id = getattr(self, campo.attname)
+            
+            if relacionado_id is None:
+                textos[relacao] = ()
+            elif campo.is_cached(self):
+                relacionado = getattr(self, relacao)
+                textos[relacao] = tuple(getattr(relacionado, nome) for nome in campos)
+            else:
+                colunas = {
+                    f'texto_{posicao}': (
+                        models.F(campos[posicao])
+                        if posicao < len(campos)
+                        else models.Value('', output_field=models.CharField())
+                    )
+                    for posicao in range(3)
+                }
+                consultas.append(
+                    campo.related_model._base_manager
+                    .filter(pk=relacionado_id)
+                    .annotate(
+                        relacao_busca=models.Value(relacao, output_field=models.CharField()),
+                        **colunas,
+                    )
+                    .values_list('relacao_busca', *colunas)
+                )
+        
+        if consultas:
+            primeira, *demais = consultas
+            if demais:
+                primeira = primeira.union(*demais, all=True)
+            for relacao, *valores in primeira:
+                textos[relacao] = tuple(valores[:len(self.RELACOES_BUSCA[relacao])])
+        
+        return textos
+    
+    def montar_busca_normalizada(self):
+        """Monta o texto da coluna busca_normalizada a partir do registro"""
+        textos = self._textos_relacoes_busca()
+        
+        return montar_texto_busca([
+            self.lote,
+            self.produto,
+            *textos.get('cultivar', ()),
+            *textos.get('peneira', ()),
+            *textos.get('categoria', ()),
+            *textos.get('especie', ()),
+            self.endereco,
+            self.az,
+            self.cliente,
+            self.empresa,
+            self.observacao,
+            *textos.get('conferente', ()),
+        ])
+    
     # NOVO: Sobrescrever save para definir status padrão
     def save(self, *args, **kwargs):
-        original = None
-        if self.pk:
-            try:
-                original = Estoque.objects.get(pk=self.pk)
-            except Estoque.DoesNotExist:
-                original = None
+        # Valores originais vêm do RastreiaAlteracoesMixin (sem SELECT extra)
+        novo = self.pk is None
 
         self.saldo = self.entrada - self.saida
         self.status = 'ESGOTADO' if self.saldo <= 0 else 'ATIVO'
@@ -196,22 +328,64 @@ class Estoque(models.Model):
             self.peso_total = Decimal('0.00')
 
         # Se não tiver status definido, define como Crítico (padrão)
-        if not self.status_sistemico:
-            try:
-                status_critico = StatusSistemico.objects.get(nome='Crítico')
-                self.status_sistemico = status_critico
-            except StatusSistemico.DoesNotExist:
-                StatusSistemico.get_status_padrao()
-                try:
-                    status_critico = StatusSistemico.objects.get(nome='Crítico')
-                    self.status_sistemico = status_critico
-                except:
-                    pass
-
-        if original and original.endereco != self.endereco and original.ultimo_lote_linha:
+        if not self.status_sistemico_id:
+            self.status_sistemico_id = StatusSistemico.obter_id_status_inicial()
+
+        if (
+            not novo
+            and self.campo_alterado('endereco')
+            and self.valor_original('ultimo_lote_linha')
+        ):
             self.ultimo_lote_linha = False
 
-        super().save(*args, **kwargs)
+        # Lote mudou de cultivar/peneira/espécie/AZ/embalagem: os signals
+        # recalculam o resumo diário dos dias em que ele foi movimentado
+        self._resumo_dimensoes_alteradas = not novo and any(
+            (self.valor_original(campo) or '') != (getattr(self, campo) or '')
+            for campo in self.CAMPOS_RESUMO_MOVIMENTACAO
+        )
+
+        # Mantém a coluna de busca sincronizada (apenas se algum campo de origem mudou)
+        update_fields = kwargs.get('update_fields')
+        
+        self.endereco_normalizado = normalizar_endereco(self.endereco)
+        preencher_endereco_estruturado(self, self.endereco)
+        if update_fields is not None and 'endereco' in update_fields:
+            update_fields = set(update_fields) | {'endereco_normalizado', *CAMPOS_ENDERECO_ESTRUTURADO}
+            kwargs['update_fields'] = update_fields
+        campos_busca = (
+            self.CAMPOS_ORIGEM_BUSCA
+            if update_fields is None
+            else self.CAMPOS_ORIGEM_BUSCA.intersection(update_fields)
+        )
+        if novo or any(self.campo_alterado(campo) for campo in campos_busca):
+            self.busca_normalizada = self.montar_busca_normalizada()
+            if update_fields is not None:
+                kwargs['update_fields'] = set(update_fields) | {'busca_normalizada'}
+
+        update_fields = kwargs.get('update_fields')
+        mexe_no_resumo = novo or update_fields is None or bool(self.CAMPOS_TOTAIS_LOTE.intersection(update_fields))
+
+        # Lote gravado antes deste save (RastreiaAlteracoesMixin, sem SELECT)
+        lote_antes = None if novo else self.valor_original('lote')
+
+        with transaction.atomic(savepoint=False):
+            super().save(*args, **kwargs)
+
+            if mexe_no_resumo:
+                lote = self.lote if update_fields is None or 'lote' in update_fields else lote_antes
+                self._atualizar_resumo_lote(lote_antes, lote)
+
+    def _atualizar_resumo_lote(self, lote_antes, lote):
+        """
+        Totais do lote refeitos pelo banco (UPDATE com soma do Estoque),
+        sem depender dos valores carregados nesta instância
+        """
+        if lote_antes is not None and lote_antes != lote:
+            # O registro mais recente dos dois lotes pode mudar
+            recalcular_resumo_lotes([lote_antes, lote])
+        else:
+            atualizar_resumo_lotes([lote])
 
 # sapp/models.py - Adicione no final do arquivo
 
@@ -235,6 +409,34 @@ class StatusSistemico(models.Model):
     def __str__(self):
         return f"{self.icone or ''} {self.nome} ({self.cor})"
     
+    # Status atribuído aos lotes novos
+    NOME_STATUS_INICIAL = 'Crítico'
+    CHAVE_CACHE_STATUS_INICIAL = 'status_sistemico:inicial_id'
+    TEMPO_CACHE_STATUS_INICIAL = 60  # segundos; signals limpam ao alterar
+    
+    @classmethod
+    def obter_id_status_inicial(cls):
+        """Id do status 'Crítico' (cria os padrões se faltar), com cache"""
+        status_id = cache.get(cls.CHAVE_CACHE_STATUS_INICIAL)
+        if status_id is not None:
+            return status_id
+        
+        consulta = cls.objects.filter(nome=cls.NOME_STATUS_INICIAL).values_list('id', flat=True)
+        status_id = consulta.first()
+        
+        if status_id is None:
+            cls.get_status_padrao()
+            status_id = consulta.first()
+        
+        if status_id is not None:
+            cache.set(cls.CHAVE_CACHE_STATUS_INICIAL, status_id, cls.TEMPO_CACHE_STATUS_INICIAL)
+        
+        return status_id
+    
+    @classmethod
+    def limpar_cache_status_inicial(cls):
+        cache.delete(cls.CHAVE_CACHE_STATUS_INICIAL)
+    
     @classmethod
     def get_status_padrao(cls):
         """Cria os status padrão se não existirem"""
@@ -305,7 +507,12 @@ class HistoricoMovimentacao(models.Model):
     cliente = models.CharField(max_length=255, blank=True, null=True)
     ordem_entrega = models.CharField(max_length=50, blank=True, null=True)
     
-    class Meta: ordering = ['-data_hora']
+    class Meta:
+        ordering = ['-data_hora']
+        indexes = [
+            # Recálculo do resumo diário por faixa de data_hora (services_dashboard)
+            models.Index(fields=['data_hora'], name='historico_data_hora_idx'),
+        ]
     
     def save(self, *args, **kwargs):
         if self.estoque: self.lote_ref = f"{self.estoque.lote}"
@@ -362,12 +569,28 @@ class ElementoMapa(models.Model):
     identificador = models.CharField(max_length=50, blank=True, null=True)
     ordem_z = models.IntegerField(default=1)
     
+    # Partes do identificador (R-A / LN10 / 2), mantidas pelo save();
+    # o bulk_create do editor chama preencher_endereco_estruturado
+    rua = models.CharField(max_length=10, blank=True, default='', editable=False)
+    linha = models.CharField(max_length=10, blank=True, default='', editable=False)
+    posicao = models.PositiveSmallIntegerField(null=True, blank=True, editable=False)
+    
     class Meta:
         verbose_name = "Elemento do Mapa"
         verbose_name_plural = "Elementos do Mapa"
         ordering = ['armazem', 'ordem_z']
+        indexes = [
+            models.Index(fields=['rua', 'linha', 'posicao'], name='elemento_rua_linha_pos_idx'),
+        ]
     
     def __str__(self): return f"{self.get_tipo_display()} - {self.identificador or 'Sem ID'}"
+    
+    def save(self, *args, **kwargs):
+        preencher_endereco_estruturado(self, self.identificador)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'identificador' in update_fields:
+            kwargs['update_fields'] = set(update_fields) | set(CAMPOS_ENDERECO_ESTRUTURADO)
+        super().save(*args, **kwargs)
 
 # ============================================================================
 # SISTEMA DE EMPENHO
@@ -480,7 +703,7 @@ class Empenho(models.Model):
             item.quantidade
             for item in self.itens.all()
         )
-class ItemEmpenho(models.Model):
+class ItemEmpenho(RastreiaAlteracoesMixin, models.Model):
     """
     Item reservado para um Empenho.
 
@@ -755,16 +978,11 @@ class ItemEmpenho(models.Model):
         old_quantidade = 0
 
         if not is_new:
-            try:
-                old = ItemEmpenho.objects.get(
-                    pk=self.pk
-                )
-                old_quantidade = (
-                    old.quantidade
-                    or 0
-                )
-            except ItemEmpenho.DoesNotExist:
-                pass
+            # Quantidade no banco (RastreiaAlteracoesMixin, sem SELECT)
+            old_quantidade = (
+                self.valor_original('quantidade')
+                or 0
+            )
 
         if is_new:
             self._preencher_snapshot_inicial()
@@ -1123,6 +1341,336 @@ class HistoricoItemEmpenho(models.Model):
             == self.TIPO_EXPEDICAO
         )
 
+class LivroMovimentacao(models.Model):
+    """
+    Livro unificado de movimentações (somente leitura para a tela).
+
+    Cada linha espelha um HistoricoMovimentacao ou um
+    HistoricoItemEmpenho, já normalizado: tipo padronizado, nomes
+    copiados e texto de busca pronto. É mantido pelos signals das
+    duas tabelas de origem e pode ser refeito com o comando
+    reconstruir_livro_movimentacoes.
+
+    O mesmo evento gravado nas duas origens tem a mesma chave_dedup;
+    a tela exibe apenas a primeira ocorrência entre as linhas filtradas.
+    """
+
+    origem = models.CharField(
+        max_length=10,
+        choices=ORIGEM_CHOICES,
+    )
+
+    origem_id = models.PositiveBigIntegerField()
+
+    data_hora = models.DateTimeField(
+        null=True,
+        blank=True,
+    )
+
+    lote = models.CharField(
+        max_length=100,
+        blank=True,
+        default='',
+    )
+
+    # Tipo normalizado (entrada, saida, transferencia, ...)
+    tipo = models.CharField(
+        max_length=50,
+        blank=True,
+        default='',
+    )
+
+    # Tipo como foi gravado na origem
+    tipo_original = models.CharField(
+        max_length=50,
+        blank=True,
+        default='',
+    )
+
+    quantidade = models.IntegerField(default=0)
+
+    produto = models.CharField(max_length=255, blank=True, default='')
+    cliente = models.CharField(max_length=255, blank=True, default='')
+    empresa = models.CharField(max_length=255, blank=True, default='')
+    cultivar = models.CharField(max_length=255, blank=True, default='')
+    peneira = models.CharField(max_length=100, blank=True, default='')
+    categoria = models.CharField(max_length=100, blank=True, default='')
+    tratamento = models.CharField(max_length=255, blank=True, default='')
+    especie = models.CharField(max_length=100, blank=True, default='')
+    embalagem = models.CharField(max_length=100, blank=True, default='')
+
+    endereco_origem = models.CharField(max_length=100, blank=True, default='')
+    endereco_destino = models.CharField(max_length=100, blank=True, default='')
+
+    usuario = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='livro_movimentacoes',
+    )
+
+    usuario_nome = models.CharField(max_length=255, blank=True, default='')
+
+    observacao = models.TextField(blank=True, default='')
+    numero_carga = models.CharField(max_length=100, blank=True, default='')
+    motorista = models.CharField(max_length=100, blank=True, default='')
+    placa = models.CharField(max_length=20, blank=True, default='')
+    ordem_entrega = models.CharField(max_length=50, blank=True, default='')
+
+    # lote|tipo|quantidade|minuto|carga (ver chave_dedup_historico)
+    chave_dedup = models.CharField(
+        max_length=255,
+        blank=True,
+        default='',
+        db_index=True,
+    )
+
+    busca_normalizada = models.TextField(
+        blank=True,
+        default='',
+        editable=False,
+    )
+
+    class Meta:
+        verbose_name = 'Lançamento do livro de movimentações'
+        verbose_name_plural = 'Livro de movimentações'
+        ordering = [
+            '-data_hora',
+            '-id',
+        ]
+
+        constraints = [
+            models.UniqueConstraint(
+                fields=[
+                    'origem',
+                    'origem_id',
+                ],
+                name='livro_origem_unica',
+            ),
+        ]
+
+        indexes = [
+            models.Index(
+                fields=[
+                    '-data_hora',
+                    '-id',
+                ],
+                name='livro_data_idx',
+            ),
+            models.Index(
+                fields=[
+                    'lote',
+                    '-data_hora',
+                ],
+                name='livro_lote_data_idx',
+            ),
+            models.Index(
+                fields=[
+                    'tipo',
+                    '-data_hora',
+                ],
+                name='livro_tipo_data_idx',
+            ),
+            models.Index(
+                fields=[
+                    'usuario',
+                    '-data_hora',
+                ],
+                name='livro_usuario_data_idx',
+            ),
+            models.Index(
+                fields=[
+                    'cliente',
+                    '-data_hora',
+                ],
+                name='livro_cliente_data_idx',
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.lote} - {self.tipo_exibicao} - {self.quantidade} un'
+
+    # Atributos usados pelo template do histórico geral
+
+    @property
+    def chave(self):
+        prefixo = 'antigo' if self.origem == ORIGEM_HISTORICO else 'novo'
+        return f'{prefixo}-{self.origem_id}'
+
+    @property
+    def origem_historico(self):
+        return self.get_origem_display()
+
+    @property
+    def cliente_exibicao(self):
+        return self.cliente
+
+    @property
+    def usuario_exibicao(self):
+        return self.usuario_nome or 'Sistema'
+
+    @property
+    def tipo_exibicao(self):
+        return nome_tipo_historico(self.tipo)
+
+    @property
+    def processado_em(self):
+        return self.data_hora
+
+
+class ResumoMovimentacaoDiaria(models.Model):
+    """
+    Movimentações do HistoricoMovimentacao somadas por dia.
+
+    Uma linha por (dia, tipo normalizado, cultivar, peneira, espécie,
+    AZ, embalagem), com os atributos do lote movimentado. Alimenta a
+    tendência e os KPIs de período do dashboard, que passam a ler
+    algumas centenas de linhas em vez de todo o histórico.
+
+    Mantido pelos signals (soma incremental a cada movimentação nova,
+    recálculo do dia em edições/exclusões) e refeito pelo comando
+    reconstruir_resumo_movimentacoes.
+    """
+
+    dia = models.DateField()
+
+    # Tipo normalizado (ver normalizar_tipo_historico)
+    tipo = models.CharField(
+        max_length=50,
+        blank=True,
+        default='',
+    )
+
+    # Mesma regra de _dashboard_q_entrada / _dashboard_q_saida
+    entrada = models.BooleanField(default=False)
+    saida = models.BooleanField(default=False)
+
+    cultivar = models.ForeignKey(
+        Cultivar,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='+',
+    )
+
+    peneira = models.ForeignKey(
+        Peneira,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='+',
+    )
+
+    especie = models.ForeignKey(
+        Especie,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='+',
+    )
+
+    az = models.CharField(max_length=20, blank=True, default='')
+    embalagem = models.CharField(max_length=10, blank=True, default='')
+
+    quantidade = models.BigIntegerField(default=0)
+    eventos = models.PositiveIntegerField(default=0)
+
+    # dia|tipo|cultivar|peneira|especie|az|embalagem (ver chave_resumo).
+    # Texto único porque as colunas nulas não entrariam num UNIQUE composto.
+    chave = models.CharField(
+        max_length=255,
+        unique=True,
+    )
+
+    class Meta:
+        verbose_name = 'Resumo diário de movimentações'
+        verbose_name_plural = 'Resumos diários de movimentações'
+        ordering = [
+            'dia',
+        ]
+
+        indexes = [
+            models.Index(
+                fields=[
+                    'dia',
+                ],
+                name='resumo_mov_dia_idx',
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.dia:%d/%m/%Y} - {self.tipo} - {self.quantidade} un ({self.eventos} eventos)'
+
+
+class ResumoLote(models.Model):
+    """
+    Totais de um lote somando todos os endereços do Estoque.
+
+    A checagem de reserva (quanto do lote já está empenhado / ainda
+    está disponível) vira uma leitura pela chave, em vez de um
+    Sum('empenhado') sobre o Estoque a cada tela ou transferência.
+
+    Mantido na mesma transação pelo Estoque.save() (que também cobre o
+    ItemEmpenho, que grava o empenhado pelo save do Estoque) e pelo
+    post_delete do Estoque. Atualizações em massa (queryset.update,
+    bulk_create) chamam recalcular_resumo_lotes. O comando
+    verificar_resumo_lotes compara com o Estoque e corrige.
+
+    Também é o índice de lotes distintos do autocomplete
+    (services_lotes.buscar_lotes): uma linha por lote, com o código
+    normalizado e o registro mais recente do lote no Estoque.
+    """
+
+    lote = models.CharField(
+        max_length=50,
+        primary_key=True,
+    )
+
+    saldo = models.IntegerField(default=0)
+    empenhado = models.IntegerField(default=0)
+    disponivel = models.IntegerField(default=0)
+
+    # Código normalizado (normalizar_busca): prefixo pelo índice
+    lote_busca = models.CharField(
+        max_length=50,
+        blank=True,
+        default='',
+        editable=False,
+    )
+
+    # Registro do lote com maior id; os atributos do autocomplete vêm dele
+    estoque_recente = models.ForeignKey(
+        Estoque,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='+',
+    )
+
+    atualizado_em = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Resumo do lote'
+        verbose_name_plural = 'Resumos dos lotes'
+
+        indexes = [
+            # LIKE 'prefixo%' no PostgreSQL (nos outros bancos opclasses é ignorado)
+            models.Index(
+                fields=[
+                    'lote_busca',
+                ],
+                name='resumo_lote_busca_idx',
+                opclasses=[
+                    'varchar_pattern_ops',
+                ],
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.lote}: saldo {self.saldo}, empenhado {self.empenhado}, disponível {self.disponivel}'
+
+
 class Produto(models.Model):
     cultivar = models.ForeignKey(Cultivar, on_delete=models.PROTECT, verbose_name="Cultivar")
     tipo = models.CharField(max_length=50, verbose_name="Tipo", blank=True, null=True)
@@ -1384,7 +1932,7 @@ class ConfiguracaoLogo(models.Model):
 # FASE 2 - SISTEMA DE SOLICITAÇÃO E KANBAN
 # ============================================================================
 
-class Solicitacao(models.Model):
+class Solicitacao(RastreiaAlteracoesMixin, models.Model):
     """
     Representa uma solicitação/card no sistema.
 
@@ -1596,6 +2144,39 @@ class Solicitacao(models.Model):
         verbose_name='Data/hora da finalização',
     )
 
+    # Versão do quadro em que o card mudou pela última vez (carimbada
+    # após o commit por services_kanban.marcar_cards_alterados); o modo
+    # since=<versão> do api_kanban_dados filtra por ela.
+    versao_kanban = models.PositiveBigIntegerField(
+        default=0,
+        db_index=True,
+        editable=False,
+        verbose_name='Versão no quadro',
+    )
+
+    # Totais dos itens ainda pendentes nos empenhos (ItemEmpenho),
+    # mantidos na mesma transação pelos signals do ItemEmpenho
+    # (services_kanban.atualizar_totais_empenho). Os cards leem daqui
+    # em vez de somar os itens a cada acesso; o comando
+    # recalcular_totais_empenho refaz tudo.
+    total_kg_empenhado = models.DecimalField(
+        max_digits=14,
+        decimal_places=2,
+        default=Decimal('0.00'),
+        editable=False,
+        verbose_name='Kg empenhado',
+    )
+
+    total_embalagens_empenhadas = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Embalagens empenhadas',
+    )
+
+    # Gravados só por UPDATE direto: um save() completo com a instância
+    # carregada antes do empenho não pode voltar o valor antigo
+    CAMPOS_TOTAIS_EMPENHO = ('total_kg_empenhado', 'total_embalagens_empenhadas')
+
     class Meta:
         verbose_name = 'Solicitação'
         verbose_name_plural = 'Solicitações'
@@ -1639,14 +2220,9 @@ class Solicitacao(models.Model):
         status_anterior = None
 
         if self.pk:
-            status_anterior = (
-                type(self).objects
-                .filter(pk=self.pk)
-                .values_list(
-                    'status',
-                    flat=True,
-                )
-                .first()
+            # Status no banco (RastreiaAlteracoesMixin, sem SELECT)
+            status_anterior = self.valor_original(
+                'status'
             )
 
         entrou_em_concluido = (
@@ -1670,6 +2246,17 @@ class Solicitacao(models.Model):
             campos.add('data_finalizacao')
             kwargs['update_fields'] = list(campos)
 
+        if (
+            update_fields is None
+            and not self._state.adding
+        ):
+            kwargs['update_fields'] = [
+                campo.name
+                for campo in self._meta.concrete_fields
+                if not campo.primary_key
+                and campo.name not in self.CAMPOS_TOTAIS_EMPENHO
+            ]
+
         super().save(*args, **kwargs)
 
     # ============================================================
@@ -1802,55 +2389,18 @@ class Solicitacao(models.Model):
     @property
     def quantidade_empenhada_kg(self):
         """
-        Calcula o peso total dos itens ainda pendentes nos
-        empenhos vinculados a esta solicitação.
+        Peso total dos itens ainda pendentes nos empenhos vinculados
+        a esta solicitação (Empenho.solicitacao).
 
-        Não utiliza mais o título ou a observação do empenho.
-        O vínculo é feito pelo campo Empenho.solicitacao.
+        Lê o total mantido em total_kg_empenhado, sem consulta.
         """
 
         if self.unidade_controle != 'QUILOGRAMA':
             return Decimal('0.00')
 
-        if not self.pk:
-            return Decimal('0.00')
-
-        total = Decimal('0.00')
-
-        empenhos = (
-            Empenho.objects
-            .filter(
-                solicitacao_id=self.pk,
-            )
-            .prefetch_related(
-                'itens__estoque',
-            )
-        )
-
-        for empenho in empenhos:
-            for item in empenho.itens.all():
-                estoque = item.estoque
-
-                if not estoque:
-                    continue
-
-                quantidade = Decimal(
-                    str(item.quantidade or 0)
-                )
-
-                peso_unitario = Decimal(
-                    str(
-                        estoque.peso_unitario
-                        or 0
-                    )
-                )
-
-                total += (
-                    quantidade
-                    * peso_unitario
-                )
-
-        return total.quantize(
+        return Decimal(
+            str(self.total_kg_empenhado or 0)
+        ).quantize(
             Decimal('0.01')
         )
 
@@ -2102,3 +2652,151 @@ class ConfiguracaoAtualizacao(models.Model):
         return f"Config de {self.usuario.username}"
 
 
+class ContadorVersao(models.Model):
+    """
+    Contador monotônico de versão (ex.: quadro Kanban).
+
+    É incrementado pelos signals quando algo muda; o valor corrente
+    fica no cache e este registro é a fonte da verdade quando o cache
+    expira ou é limpo.
+    """
+    chave = models.CharField(max_length=50, unique=True)
+    valor = models.PositiveBigIntegerField(default=0)
+    atualizado_em = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Contador de versão"
+        verbose_name_plural = "Contadores de versão"
+
+    def __str__(self):
+        return f"{self.chave} = {self.valor}"
+
+
+class CardKanbanRemovido(models.Model):
+    """
+    Card excluído do quadro (tombstone). O modo since=<versão> do
+    api_kanban_dados devolve os ids removidos depois da versão do
+    cliente. Registros antigos são apagados (RETENCAO_REMOVIDOS).
+    """
+    card_id = models.PositiveBigIntegerField()
+    versao = models.PositiveBigIntegerField(db_index=True)
+    removido_em = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        verbose_name = "Card removido do quadro"
+        verbose_name_plural = "Cards removidos do quadro"
+
+    def __str__(self):
+        return f"Card #{self.card_id} removido na versão {self.versao}"
+
+
+# ============================================================================
+# EXPORTAÇÕES EM SEGUNDO PLANO
+# ============================================================================
+
+def caminho_arquivo_exportacao(instance, filename):
+    # Pasta aleatória: a mídia é servida sem login, o caminho não pode ser adivinhável
+    return f"exportacoes/{timezone.now():%Y/%m}/{uuid.uuid4().hex}/{filename}"
+
+
+class TarefaExportacao(models.Model):
+    """
+    Exportação pesada executada pelo Celery (ou localmente, no modo eager).
+
+    O navegador cria a tarefa, consulta o status e baixa o arquivo pronto,
+    sem prender o worker web enquanto a planilha/PDF é gerado.
+    """
+
+    TIPO_ESTOQUE_SIMPLES = 'estoque_simples'
+    TIPO_ESTOQUE_FILTRADO = 'estoque_filtrado'
+    TIPO_ESTOQUE_PDF = 'estoque_pdf'
+
+    TIPO_CHOICES = [
+        (TIPO_ESTOQUE_SIMPLES, 'Estoque (planilha simples)'),
+        (TIPO_ESTOQUE_FILTRADO, 'Estoque com filtros'),
+        (TIPO_ESTOQUE_PDF, 'Relatório de estoque (PDF)'),
+    ]
+
+    FORMATO_CHOICES = [
+        ('xlsx', 'Excel (.xlsx)'),
+        ('csv', 'CSV (.csv)'),
+        ('pdf', 'PDF (.pdf)'),
+    ]
+
+    STATUS_PENDENTE = 'pendente'
+    STATUS_PROCESSANDO = 'processando'
+    STATUS_CONCLUIDA = 'concluida'
+    STATUS_ERRO = 'erro'
+
+    STATUS_CHOICES = [
+        (STATUS_PENDENTE, 'Na fila'),
+        (STATUS_PROCESSANDO, 'Processando'),
+        (STATUS_CONCLUIDA, 'Concluída'),
+        (STATUS_ERRO, 'Erro'),
+    ]
+
+    usuario = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='tarefas_exportacao',
+    )
+
+    tipo = models.CharField(max_length=30, choices=TIPO_CHOICES)
+    formato = models.CharField(max_length=10, choices=FORMATO_CHOICES, default='xlsx')
+
+    # Filtros da tela no momento do pedido ({parâmetro: [valores]})
+    parametros = models.JSONField(default=dict, blank=True)
+
+    status = models.CharField(
+        max_length=20,
+        choices=STATUS_CHOICES,
+        default=STATUS_PENDENTE,
+        db_index=True,
+    )
+
+    arquivo = models.FileField(
+        upload_to=caminho_arquivo_exportacao,
+        blank=True,
+        max_length=255,
+    )
+    nome_arquivo = models.CharField(max_length=150, blank=True, default='')
+
+    celery_task_id = models.CharField(max_length=255, blank=True, default='')
+    erro = models.TextField(blank=True, default='')
+
+    # Métricas da execução
+    total_linhas = models.PositiveIntegerField(null=True, blank=True)
+    tamanho_bytes = models.PositiveBigIntegerField(null=True, blank=True)
+    criado_em = models.DateTimeField(auto_now_add=True)
+    iniciado_em = models.DateTimeField(null=True, blank=True)
+    concluido_em = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Tarefa de exportação"
+        verbose_name_plural = "Tarefas de exportação"
+        ordering = ['-criado_em']
+        indexes = [
+            models.Index(
+                fields=['usuario', '-criado_em'],
+                name='exportacao_usuario_idx',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.get_tipo_display()} ({self.get_status_display()}) - {self.usuario}"
+
+    @property
+    def finalizada(self):
+        return self.status in (self.STATUS_CONCLUIDA, self.STATUS_ERRO)
+
+    @property
+    def segundos_na_fila(self):
+        if not self.iniciado_em:
+            return None
+        return round((self.iniciado_em - self.criado_em).total_seconds(), 3)
+
+    @property
+    def segundos_execucao(self):
+        if not (self.iniciado_em and self.concluido_em):
+            return None
+        return round((self.concluido_em - self.iniciado_em).total_seconds(), 3)
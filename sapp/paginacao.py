@@ -0,0 +1,231 @@
+# sapp/paginacao.py
+
+import base64
+import json
+
+from django.db import connections
+from django.db.models import F, Q
+
+
+# ============================================================
+# PAGINAÇÃO POR CURSOR (KEYSET)
+# ============================================================
+#
+# O Paginator do Django faz COUNT(*) sobre todo o filtro e depois
+# OFFSET, que fica mais lento a cada página. Aqui a página seguinte
+# é obtida a partir dos valores da última linha exibida
+# (ex.: data_ultima_movimentacao, id), então a página 500 custa o
+# mesmo que a página 1. Não há número de página nem "ir para a última".
+#
+# Ativada por ?paginacao=cursor; o total é opcional (?contagem=estimada
+# usa a estimativa do planejador do PostgreSQL, ?contagem=exata faz COUNT).
+
+DIRECAO_PROXIMA = 'p'
+DIRECAO_ANTERIOR = 'a'
+
+
+def usar_paginacao_cursor(request):
+    return request.GET.get('paginacao') == 'cursor'
+
+
+def _serializar(valor):
+    if hasattr(valor, 'isoformat'):
+        return valor.isoformat()
+    return str(valor)
+
+
+def codificar_cursor(direcao, valores):
+    texto = json.dumps([direcao, *valores], default=_serializar)
+    return base64.urlsafe_b64encode(texto.encode()).decode().rstrip('=')
+
+
+def decodificar_cursor(cursor):
+    """Retorna (direcao, valores) ou (None, None) se o cursor for inválido."""
+    if not cursor:
+        return None, None
+
+    try:
+        texto = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        direcao, *valores = json.loads(texto)
+    except (ValueError, TypeError):
+        return None, None
+
+    if direcao not in (DIRECAO_PROXIMA, DIRECAO_ANTERIOR):
+        return None, None
+
+    return direcao, valores
+
+
+def contar_estimado(queryset):
+    """
+    Total aproximado pelo plano de execução (PostgreSQL), sem varrer a tabela.
+    Nos demais bancos faz o COUNT normal.
+    """
+    conexao = connections[queryset.db]
+
+    if conexao.vendor != 'postgresql':
+        return queryset.count()
+
+    sql, params = queryset.order_by().query.sql_with_params()
+
+    with conexao.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plano = cursor.fetchone()[0]
+
+    if isinstance(plano, str):
+        plano = json.loads(plano)
+
+    return int(plano[0]['Plan']['Plan Rows'])
+
+
+class PaginaCursor:
+    """
+    Página de resultados da paginação por cursor.
+
+    Imita a parte do Page do Django usada nos templates (object_list,
+    has_next, has_previous, iteração) e acrescenta os cursores.
+    """
+
+    modo_cursor = True
+    paginator = None
+
+    def __init__(self, object_list, cursor_proximo=None, cursor_anterior=None,
+                 total=None, total_estimado=False):
+        self.object_list = object_list
+        self.cursor_proximo = cursor_proximo
+        self.cursor_anterior = cursor_anterior
+        self.total = total
+        self.total_estimado = total_estimado
+
+    def has_next(self):
+        return self.cursor_proximo is not None
+
+    def has_previous(self):
+        return self.cursor_anterior is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, indice):
+        return self.object_list[indice]
+
+
+def _campo_e_direcao(ordem):
+    if ordem.startswith('-'):
+        return ordem[1:], True
+    return ordem, False
+
+
+def _ordenacao(campo, descendente, invertida, nulos):
+    descendente = descendente != invertida
+    expressao = F(campo)
+
+    if not nulos:
+        return expressao.desc() if descendente else expressao.asc()
+
+    # Nulos no fim da ordem normal (e no início da invertida)
+    nulos_no_fim = {'nulls_first': True} if invertida else {'nulls_last': True}
+
+    if descendente:
+        return expressao.desc(**nulos_no_fim)
+    return expressao.asc(**nulos_no_fim)
+
+
+def _filtro_depois_de(principal, desempate, valor_principal, valor_desempate, invertida):
+    """
+    Linhas que vêm depois de (valor_principal, valor_desempate) na ordenação.
+
+    Na ordem normal os nulos do campo principal ficam no fim; na
+    invertida (página anterior), no início. O desempate nunca é nulo.
+    """
+    campo_p, desc_p = principal
+    campo_d, desc_d = desempate
+
+    op_p = 'lt' if desc_p != invertida else 'gt'
+    op_d = 'lt' if desc_d != invertida else 'gt'
+
+    mesmo_principal_depois = Q(**{f'{campo_d}__{op_d}': valor_desempate})
+
+    if valor_principal is None:
+        filtro = Q(**{f'{campo_p}__isnull': True}) & mesmo_principal_depois
+        if invertida:
+            filtro |= Q(**{f'{campo_p}__isnull': False})
+        return filtro
+
+    filtro = (
+        Q(**{f'{campo_p}__{op_p}': valor_principal})
+        | (Q(**{campo_p: valor_principal}) & mesmo_principal_depois)
+    )
+    if not invertida:
+        filtro |= Q(**{f'{campo_p}__isnull': True})
+    return filtro
+
+
+def paginar_por_cursor(queryset, ordenacao, tamanho, cursor=None, contagem=None):
+    """
+    Pagina o queryset pela ordenação informada, ex.:
+    ('-data_ultima_movimentacao', '-id') ou ('-ultima_data', 'lote').
+
+    O primeiro campo pode ser nulo (nulos ficam no fim); o segundo
+    precisa ser único e não nulo dentro do queryset, servindo de desempate.
+
+    contagem: None (sem total), 'estimada' ou 'exata'.
+    """
+    principal = _campo_e_direcao(ordenacao[0])
+    desempate = _campo_e_direcao(ordenacao[1])
+
+    direcao, valores = decodificar_cursor(cursor)
+    invertida = direcao == DIRECAO_ANTERIOR
+
+    total = None
+    if contagem == 'estimada':
+        total = contar_estimado(queryset)
+    elif contagem == 'exata':
+        total = queryset.order_by().count()
+
+    pagina = queryset.order_by(
+        _ordenacao(principal[0], principal[1], invertida, nulos=True),
+        _ordenacao(desempate[0], desempate[1], invertida, nulos=False),
+    )
+
+    if valores and len(valores) == 2:
+        pagina = pagina.filter(
+            _filtro_depois_de(principal, desempate, valores[0], valores[1], invertida)
+        )
+
+    linhas = list(pagina[:tamanho + 1])
+    tem_mais = len(linhas) > tamanho
+    linhas = linhas[:tamanho]
+
+    if invertida:
+        linhas.reverse()
+
+    def _chave(linha):
+        if isinstance(linha, dict):
+            return [linha[principal[0]], linha[desempate[0]]]
+        return [getattr(linha, principal[0]), getattr(linha, desempate[0])]
+
+    cursor_proximo = None
+    cursor_anterior = None
+
+    if linhas:
+        # Indo para frente: existe anterior se veio de um cursor.
+        # Voltando: existe próxima sempre, anterior só se sobrou linha.
+        if tem_mais or invertida:
+            cursor_proximo = codificar_cursor(DIRECAO_PROXIMA, _chave(linhas[-1]))
+        if (valores and not invertida) or (invertida and tem_mais):
+            cursor_anterior = codificar_cursor(DIRECAO_ANTERIOR, _chave(linhas[0]))
+
+    return PaginaCursor(
+        linhas,
+        cursor_proximo=cursor_proximo,
+        cursor_anterior=cursor_anterior,
+        total=total,
+        total_estimado=contagem == 'estimada',
+    )
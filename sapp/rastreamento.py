@@ -0,0 +1,156 @@
+# sapp/rastreamento.py
+
+import copy
+
+from django.core.exceptions import FieldDoesNotExist
+
+
+# ============================================================
+# RASTREAMENTO DE CAMPOS ALTERADOS
+# ============================================================
+#
+# Guarda os valores dos campos como vieram do banco (from_db) e
+# depois de cada save. Assim o save() e os signals conseguem saber o
+# que mudou sem fazer um SELECT do registro original.
+#
+# Uso:
+#     class Estoque(RastreiaAlteracoesMixin, models.Model):
+#         ...
+#         if self.campo_alterado('endereco'):
+#             ...
+#
+# Nos signals post_save o estado original ainda é o de antes do save;
+# ele só é atualizado quando o save termina.
+
+
+class RastreiaAlteracoesMixin:
+    """Expõe valor_original(), campo_alterado() e campos_alterados"""
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instancia = super().from_db(db, field_names, values)
+        instancia._registrar_estado_original()
+        return instancia
+
+    def save(self, *args, **kwargs):
+        # Instância montada à mão com pk (sem vir do banco): busca o
+        # original uma única vez, como o save() fazia antes
+        if self.pk is not None and '_estado_original' not in self.__dict__:
+            self._carregar_estado_original()
+
+        super().save(*args, **kwargs)
+
+        self._registrar_estado_original(kwargs.get('update_fields'))
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        super().refresh_from_db(
+            using=using,
+            fields=fields,
+            from_queryset=from_queryset,
+        )
+        self._registrar_estado_original(fields)
+
+    # ------------------------------------------------------------
+    # Estado original
+    # ------------------------------------------------------------
+
+    def _attname(self, campo):
+        try:
+            return self._meta.get_field(campo).attname
+        except FieldDoesNotExist:
+            return campo
+
+    def _attnames_concretos(self):
+        return [campo.attname for campo in self._meta.concrete_fields]
+
+    def _registrar_estado_original(self, campos=None):
+        """Copia os valores carregados (todos ou só os campos informados)"""
+        estado = self.__dict__.setdefault('_estado_original', {})
+
+        if campos is None:
+            attnames = self._attnames_concretos()
+        else:
+            attnames = {self._attname(campo) for campo in campos}
+
+        for attname in attnames:
+            if attname in self.__dict__:
+                estado[attname] = copy.deepcopy(self.__dict__[attname])
+
+    def _carregar_estado_original(self, attnames=None):
+        """
+        Lê do banco os campos que não estão no estado original.
+        Só acontece com instâncias que não vieram de uma consulta.
+        """
+        estado = self.__dict__.setdefault('_estado_original', {})
+
+        if self.pk is None:
+            return estado
+
+        faltando = [
+            attname
+            for attname in (attnames or self._attnames_concretos())
+            if attname not in estado
+        ]
+
+        if not faltando:
+            return estado
+
+        valores = (
+            type(self)._base_manager
+            .using(self._state.db or 'default')
+            .filter(pk=self.pk)
+            .values(*faltando)
+            .first()
+        )
+
+        if valores:
+            estado.update(valores)
+
+        return estado
+
+    # ------------------------------------------------------------
+    # API
+    # ------------------------------------------------------------
+
+    def valor_original(self, campo):
+        """Valor do campo no banco (None para registros novos)"""
+        attname = self._attname(campo)
+        estado = self.__dict__.get('_estado_original') or {}
+
+        if attname not in estado:
+            estado = self._carregar_estado_original([attname])
+
+        return estado.get(attname)
+
+    def campo_alterado(self, campo):
+        """True se o valor atual difere do banco (sempre True se novo)"""
+        if self.pk is None:
+            return True
+
+        attname = self._attname(campo)
+
+        # Campo adiado (defer/only) e não tocado: não mudou
+        if attname not in self.__dict__:
+            return False
+
+        return self.__dict__[attname] != self.valor_original(attname)
+
+    @property
+    def campos_alterados(self):
+        """Conjunto de attnames com valor diferente do banco"""
+        carregados = [
+            attname
+            for attname in self._attnames_concretos()
+            if attname in self.__dict__
+        ]
+
+        if self.pk is None:
+            return set(carregados)
+
+        self._carregar_estado_original(carregados)
+
+        return {
+            attname
+            for attname in carregados
+            if self.campo_alterado(attname)
+        }
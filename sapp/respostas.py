@@ -0,0 +1,52 @@
+# sapp/respostas.py
+
+from asgiref.sync import sync_to_async
+from django.http import FileResponse, StreamingHttpResponse
+
+
+# ============================================================
+# STREAMING SOB ASGI
+# ============================================================
+#
+# Sob ASGI (produção: gunicorn + UvicornWorker) o Django consome o
+# iterador síncrono de um StreamingHttpResponse/FileResponse com
+# sync_to_async(list): o corpo inteiro vai para a memória antes do
+# primeiro byte sair. Nestas respostas o iterador continua síncrono
+# (sob WSGI nada muda), mas sob ASGI é lido em blocos de até
+# BYTES_POR_LEITURA, cada bloco numa ida à thread síncrona da requisição
+# (a mesma conexão com o banco que a view usou).
+
+BYTES_POR_LEITURA = 256 * 1024
+
+
+class StreamingAsgiMixin:
+    async def __aiter__(self):
+        if self.is_async:
+            async for parte in super().__aiter__():
+                yield parte
+            return
+
+        partes = iter(self.streaming_content)
+
+        def ler_bloco():
+            bloco, tamanho = [], 0
+            for parte in partes:
+                bloco.append(parte)
+                tamanho += len(parte)
+                if tamanho >= BYTES_POR_LEITURA:
+                    break
+            return bloco
+
+        ler_bloco = sync_to_async(ler_bloco, thread_sensitive=True)
+
+        while bloco := await ler_bloco():
+            for parte in bloco:
+                yield parte
+
+
+class RespostaStreaming(StreamingAsgiMixin, StreamingHttpResponse):
+    pass
+
+
+class RespostaArquivo(StreamingAsgiMixin, FileResponse):
+    pass
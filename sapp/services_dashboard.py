@@ -0,0 +1,520 @@
+# sapp/services_dashboard.py
+
+import hashlib
+import json
+import time
+from datetime import datetime, timedelta
+
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .services_historico import normalizar_tipo_historico
+from .services_versao import CHAVE_VERSAO_DASHBOARD, obter_versao
+
+
+# ============================================================
+# RESUMO DIÁRIO DE MOVIMENTAÇÕES
+# ============================================================
+#
+# ResumoMovimentacaoDiaria guarda o HistoricoMovimentacao já somado
+# por dia e pelos atributos do lote usados nos filtros do dashboard.
+#
+# - movimentação nova: soma incremental na linha do dia (mesma transação);
+# - movimentação editada/excluída ou lote com atributos alterados:
+#   os dias afetados são recalculados após o commit;
+# - reconstruir_resumo refaz a tabela inteira (ou um período).
+
+TERMOS_SAIDA = ('saída', 'saida', 'expedição', 'expedicao')
+
+DIAS_POR_LOTE_RECONSTRUCAO = 31
+
+
+def _modelos():
+    from .models import HistoricoMovimentacao, ResumoMovimentacaoDiaria
+    return HistoricoMovimentacao, ResumoMovimentacaoDiaria
+
+
+def classificar_tipo_movimentacao(tipo):
+    """
+    (é_entrada, é_saída) com a mesma regra de _dashboard_q_entrada e
+    _dashboard_q_saida: Transferência (Entrada) conta como entrada;
+    Transferência (Saída) e Expedição contam como saída.
+    """
+    tipo = str(tipo or '').lower()
+
+    return (
+        'entrada' in tipo,
+        any(termo in tipo for termo in TERMOS_SAIDA),
+    )
+
+
+def chave_resumo(dia, tipo, cultivar_id, peneira_id, especie_id, az, embalagem):
+    return '|'.join(
+        str(valor if valor is not None else '')
+        for valor in (
+            dia.isoformat(),
+            tipo,
+            cultivar_id,
+            peneira_id,
+            especie_id,
+            az or '',
+            embalagem or '',
+        )
+    )[:255]
+
+
+def dia_local(data_hora):
+    """Dia da movimentação no fuso do sistema (o mesmo usado pelo TruncDate)."""
+    if not data_hora:
+        return None
+    if timezone.is_aware(data_hora):
+        data_hora = timezone.localtime(data_hora)
+    return data_hora.date()
+
+
+def inicio_do_dia(dia):
+    """Meia-noite do dia no fuso do sistema (datetime com fuso)."""
+    return timezone.make_aware(datetime.combine(dia, datetime.min.time()))
+
+
+def q_periodo_dias(inicio, fim):
+    """
+    data_hora entre os dias inicio e fim (inclusive), no fuso local.
+    Comparação direta com a coluna (>= / <): usa o índice de data_hora,
+    ao contrário de data_hora__date, que converte a coluna.
+    """
+    return Q(
+        data_hora__gte=inicio_do_dia(inicio),
+        data_hora__lt=inicio_do_dia(fim + timedelta(days=1)),
+    )
+
+
+def q_dias(dias):
+    """data_hora em algum dos dias; dias seguidos viram uma única faixa."""
+    filtro = Q()
+    faixa = None
+
+    for dia in sorted(set(dias)):
+        if faixa and dia == faixa[1] + timedelta(days=1):
+            faixa[1] = dia
+            continue
+        if faixa:
+            filtro |= q_periodo_dias(*faixa)
+        faixa = [dia, dia]
+
+    if faixa:
+        filtro |= q_periodo_dias(*faixa)
+
+    return filtro
+
+
+def _campos_resumo(dia, tipo_original, cultivar_id, peneira_id, especie_id, az, embalagem):
+    tipo = normalizar_tipo_historico(tipo_original)[:50]
+    entrada, saida = classificar_tipo_movimentacao(tipo_original)
+
+    return {
+        'chave': chave_resumo(
+            dia, tipo, cultivar_id, peneira_id, especie_id, az, embalagem
+        ),
+        'dia': dia,
+        'tipo': tipo,
+        'entrada': entrada,
+        'saida': saida,
+        'cultivar_id': cultivar_id,
+        'peneira_id': peneira_id,
+        'especie_id': especie_id,
+        'az': (az or '')[:20],
+        'embalagem': (embalagem or '')[:10],
+    }
+
+
+def somar_movimentacao_no_resumo(movimentacao):
+    """
+    Soma uma movimentação recém-criada na linha do seu dia.
+
+    Roda dentro da transação que gravou a movimentação: o UPDATE com F()
+    trava a linha até o commit, então gravações simultâneas não se perdem.
+    """
+    _, Resumo = _modelos()
+
+    if not movimentacao.data_hora:
+        return
+
+    estoque = movimentacao.estoque if movimentacao.estoque_id else None
+
+    campos = _campos_resumo(
+        dia_local(movimentacao.data_hora),
+        movimentacao.tipo,
+        estoque.cultivar_id if estoque else None,
+        estoque.peneira_id if estoque else None,
+        estoque.especie_id if estoque else None,
+        estoque.az if estoque else '',
+        estoque.embalagem if estoque else '',
+    )
+
+    quantidade = movimentacao.quantidade or 0
+
+    def _atualizar():
+        return (
+            Resumo.objects
+            .filter(chave=campos['chave'])
+            .update(
+                quantidade=F('quantidade') + quantidade,
+                eventos=F('eventos') + 1,
+            )
+        )
+
+    if _atualizar():
+        return
+
+    try:
+        with transaction.atomic():
+            Resumo.objects.create(
+                quantidade=quantidade,
+                eventos=1,
+                **campos,
+            )
+    except IntegrityError:
+        # Outra transação criou a linha ao mesmo tempo
+        _atualizar()
+
+
+def _linhas_agregadas(movimentacoes):
+    """
+    Agrupa o histórico por dia e atributos do lote no banco e junta em
+    Python as grafias de tipo que normalizam para o mesmo valor.
+    """
+    linhas = (
+        movimentacoes
+        .order_by()
+        .annotate(dia=TruncDate('data_hora'))
+        .values(
+            'dia',
+            'tipo',
+            'estoque__cultivar_id',
+            'estoque__peneira_id',
+            'estoque__especie_id',
+            'estoque__az',
+            'estoque__embalagem',
+        )
+        .annotate(
+            soma=Sum('quantidade'),
+            total=Count('id'),
+        )
+    )
+
+    resumo = {}
+
+    for linha in linhas:
+        if linha['dia'] is None:
+            continue
+
+        campos = _campos_resumo(
+            linha['dia'],
+            linha['tipo'],
+            linha['estoque__cultivar_id'],
+            linha['estoque__peneira_id'],
+            linha['estoque__especie_id'],
+            linha['estoque__az'],
+            linha['estoque__embalagem'],
+        )
+
+        atual = resumo.setdefault(
+            campos['chave'],
+            {**campos, 'quantidade': 0, 'eventos': 0},
+        )
+        atual['quantidade'] += linha['soma'] or 0
+        atual['eventos'] += linha['total'] or 0
+
+    return resumo.values()
+
+
+def recalcular_resumo_dias(dias):
+    """Apaga e refaz as linhas do resumo dos dias informados."""
+    Historico, Resumo = _modelos()
+
+    dias = sorted(set(dias))
+
+    if not dias:
+        return 0
+
+    with transaction.atomic():
+        Resumo.objects.filter(dia__in=dias).delete()
+
+        novos = [
+            Resumo(**campos)
+            for campos in _linhas_agregadas(
+                Historico.objects.filter(q_dias(dias))
+            )
+        ]
+
+        Resumo.objects.bulk_create(novos)
+
+    return len(novos)
+
+
+def agendar_recalculo_resumo(dias):
+    """
+    Recalcula os dias após o commit da transação atual (ou na hora,
+    fora de transação). Dias pedidos na mesma transação são recalculados
+    juntos, uma única vez; em caso de rollback nada é feito.
+    """
+    dias = {dia for dia in dias if dia}
+
+    if not dias:
+        return
+
+    conexao = transaction.get_connection()
+
+    # run_on_commit guarda (savepoints, função, robust)
+    for _, funcao, *_ in conexao.run_on_commit:
+        pendentes = getattr(funcao, 'resumo_dias', None)
+        if pendentes is not None:
+            pendentes.update(dias)
+            return
+
+    def _executar():
+        # Depois de executada não recebe mais dias: um pedido posterior
+        # registra uma nova chamada
+        dias, _executar.resumo_dias = _executar.resumo_dias, None
+        recalcular_resumo_dias(dias)
+
+    _executar.resumo_dias = set(dias)
+    transaction.on_commit(_executar)
+
+
+def dias_com_movimentacao(movimentacoes):
+    """Dias (no fuso local) que possuem movimentações no queryset."""
+    return set(
+        movimentacoes
+        .order_by()
+        .annotate(dia=TruncDate('data_hora'))
+        .values_list('dia', flat=True)
+        .distinct()
+    )
+
+
+def reconstruir_resumo(data_inicio=None, data_fim=None,
+                       dias_por_lote=DIAS_POR_LOTE_RECONSTRUCAO, stdout=None):
+    """
+    Refaz o resumo a partir do HistoricoMovimentacao, em janelas de
+    dias_por_lote dias. Sem datas, cobre todo o histórico.
+
+    Retorna a quantidade de linhas gravadas.
+    """
+    Historico, Resumo = _modelos()
+
+    datas = Historico.objects.exclude(data_hora__isnull=True).dates('data_hora', 'day')
+
+    if data_inicio:
+        datas = datas.filter(data_hora__gte=inicio_do_dia(data_inicio))
+    if data_fim:
+        datas = datas.filter(data_hora__lt=inicio_do_dia(data_fim + timedelta(days=1)))
+
+    datas = list(datas)
+
+    if not datas:
+        if data_inicio is None and data_fim is None:
+            Resumo.objects.all().delete()
+        return 0
+
+    inicio = data_inicio or datas[0]
+    fim = data_fim or datas[-1]
+
+    # Sobras fora do período coberto pelo histórico
+    if data_inicio is None:
+        Resumo.objects.filter(dia__lt=inicio).delete()
+    if data_fim is None:
+        Resumo.objects.filter(dia__gt=fim).delete()
+    total = 0
+
+    while inicio <= fim:
+        fim_lote = min(inicio + timedelta(days=dias_por_lote - 1), fim)
+
+        with transaction.atomic():
+            Resumo.objects.filter(dia__gte=inicio, dia__lte=fim_lote).delete()
+
+            novos = [
+                Resumo(**campos)
+                for campos in _linhas_agregadas(
+                    Historico.objects.filter(q_periodo_dias(inicio, fim_lote))
+                )
+            ]
+
+            Resumo.objects.bulk_create(novos, batch_size=1000)
+
+        total += len(novos)
+
+        if stdout:
+            stdout.write(f'   {inicio:%d/%m/%Y} a {fim_lote:%d/%m/%Y}: {len(novos)} linhas')
+
+        inicio = fim_lote + timedelta(days=1)
+
+    return total
+
+
+# ============================================================
+# TENDÊNCIA DO DASHBOARD
+# ============================================================
+
+def tendencia_resumida(data_inicio, data_fim, *, tipos_semente=None,
+                       cultivares=None, peneiras=None, unidades=None,
+                       armazens=None):
+    """
+    Entradas, saídas e eventos por dia a partir do resumo diário.
+
+    Os filtros equivalem aos de _dashboard_aplicar_filtros_movimentacao,
+    exceto a busca textual (que depende do lote e fica no histórico).
+
+    Retorna [{'dia', 'entradas', 'saidas', 'eventos'}] ordenado por dia.
+    """
+    from .models import ResumoMovimentacaoDiaria
+
+    queryset = ResumoMovimentacaoDiaria.objects.filter(
+        dia__gte=data_inicio,
+        dia__lte=data_fim,
+    )
+
+    if tipos_semente:
+        queryset = queryset.filter(especie__nome__in=tipos_semente)
+
+    if cultivares:
+        queryset = queryset.filter(cultivar_id__in=cultivares)
+
+    if peneiras:
+        queryset = queryset.filter(peneira_id__in=peneiras)
+
+    if unidades:
+        queryset = queryset.filter(embalagem__in=unidades)
+
+    if armazens:
+        queryset = queryset.filter(az__in=armazens)
+
+    return list(
+        queryset
+        .order_by()
+        .values('dia')
+        .annotate(
+            entradas=Sum('quantidade', filter=Q(entrada=True)),
+            saidas=Sum('quantidade', filter=Q(saida=True)),
+            eventos=Sum('eventos'),
+        )
+        .order_by('dia')
+    )
+
+
+# ============================================================
+# CACHE DA RESPOSTA DO DASHBOARD
+# ============================================================
+#
+# A resposta do dashboard_data fica no cache, por conjunto de filtros
+# normalizado, junto com a geração em que foi calculada. A geração é o
+# contador CHAVE_VERSAO_DASHBOARD, incrementado pelos signals sempre que
+# Estoque ou HistoricoMovimentacao mudam.
+#
+# - mesma geração e dentro de TEMPO_FRESCO_DASHBOARD: HIT;
+# - geração antiga ou resposta velha: uma requisição recalcula e as
+#   demais recebem a resposta anterior (STALE) enquanto isso;
+# - sem nada no cache: MISS, calcula na hora.
+
+TEMPO_FRESCO_DASHBOARD = 120  # segundos
+TEMPO_CACHE_DASHBOARD = 15 * 60  # por quanto tempo uma resposta pode ser servida
+TEMPO_LIMITE_RECALCULO = 60  # trava do recálculo, caso a requisição morra
+
+SITUACAO_HIT = 'HIT'
+SITUACAO_STALE = 'STALE'
+SITUACAO_MISS = 'MISS'
+
+_METRICAS = {
+    SITUACAO_HIT: 'dashboard:metricas:acertos',
+    SITUACAO_STALE: 'dashboard:metricas:obsoletos',
+    SITUACAO_MISS: 'dashboard:metricas:falhas',
+}
+
+
+def chave_cache_dashboard(parametros):
+    """Chave do cache para os filtros já normalizados (dicionário)."""
+    texto = json.dumps(parametros, sort_keys=True, default=str)
+    return f'dashboard:resposta:{hashlib.sha1(texto.encode()).hexdigest()}'
+
+
+def _contar(situacao):
+    chave = _METRICAS[situacao]
+
+    try:
+        cache.incr(chave)
+    except ValueError:
+        if not cache.add(chave, 1, timeout=None):
+            cache.incr(chave)
+
+
+def metricas_cache_dashboard():
+    """Contadores de acertos/obsoletos/falhas do cache (desde o último reinício do cache)."""
+    valores = cache.get_many(_METRICAS.values())
+
+    metricas = {
+        situacao.lower(): valores.get(chave, 0)
+        for situacao, chave in _METRICAS.items()
+    }
+
+    total = sum(metricas.values())
+    servidos = metricas['hit'] + metricas['stale']
+
+    metricas['taxa_acerto'] = round(servidos / total, 4) if total else 0.0
+    return metricas
+
+
+def obter_dashboard_em_cache(parametros, calcular):
+    """
+    Retorna (dados, situacao) para os filtros informados.
+
+    calcular() monta os dados do zero; só é chamado em MISS ou quando
+    esta requisição ficou responsável por revalidar a resposta.
+    Respostas com success=False não são guardadas.
+    """
+    geracao = obter_versao(CHAVE_VERSAO_DASHBOARD)
+    chave = chave_cache_dashboard(parametros)
+    chave_trava = f'{chave}:recalculando'
+
+    entrada = cache.get(chave)
+    agora = time.time()
+    revalidando = False
+
+    if entrada is not None:
+        atual = (
+            entrada['geracao'] == geracao
+            and agora - entrada['criado_em'] < TEMPO_FRESCO_DASHBOARD
+        )
+
+        if atual:
+            _contar(SITUACAO_HIT)
+            return entrada['dados'], SITUACAO_HIT
+
+        if not cache.add(chave_trava, 1, TEMPO_LIMITE_RECALCULO):
+            _contar(SITUACAO_STALE)
+            return entrada['dados'], SITUACAO_STALE
+
+        revalidando = True
+
+    try:
+        dados = calcular()
+    finally:
+        if revalidando:
+            cache.delete(chave_trava)
+
+    if dados.get('success'):
+        cache.set(
+            chave,
+            {
+                'dados': dados,
+                'geracao': geracao,
+                'criado_em': agora,
+            },
+            TEMPO_CACHE_DASHBOARD,
+        )
+
+    _contar(SITUACAO_MISS)
+    return dados, SITUACAO_MISS
@@ -0,0 +1,437 @@
+# sapp/services_estoque.py
+
+import unicodedata
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db.models import CharField, Count, F, IntegerField, Max, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+
+# ============================================================
+# CONSTANTES
+# ============================================================
+
+# Regra utilizada no projeto: 1 BAG = 25 SC.
+SC_POR_BAG = 25
+
+# Lote sem movimentação há mais dias que isso é considerado parado.
+DIAS_LOTE_PARADO = 30
+
+
+# ============================================================
+# KPIs DO ESTOQUE
+# ============================================================
+
+def calcular_kpis_estoque(queryset, dias_parado=DIAS_LOTE_PARADO):
+    """
+    Calcula todos os indicadores do estoque em UMA única consulta.
+
+    Usa agregação condicional (Sum/Count com filter=Q(...)) sobre o
+    queryset recebido, que pode estar filtrado ou não. Os indicadores
+    de saldo consideram apenas registros com saldo > 0; os totais
+    gerais (total_lotes, esgotados, entrada, saída) consideram todos.
+
+    Retorna um dicionário com valores já tratados (sem None).
+    """
+
+    ativo = Q(saldo__gt=0)
+    limite_parado = timezone.now() - timedelta(days=dias_parado)
+
+    dados = queryset.order_by().aggregate(
+        total_lotes=Count('id'),
+        lotes_ativos=Count('id', filter=ativo),
+        lotes_esgotados=Count('id', filter=Q(saldo=0)),
+        lotes_parados=Count(
+            'id',
+            filter=ativo & (
+                Q(data_ultima_movimentacao__lt=limite_parado)
+                | Q(data_ultima_movimentacao__isnull=True)
+            ),
+        ),
+        saldo_bags=Sum('saldo', filter=ativo & Q(embalagem__iexact='BAG')),
+        saldo_sc=Sum('saldo', filter=ativo & Q(embalagem__iexact='SC')),
+        saldo_total=Sum('saldo', filter=ativo),
+        total_empenhado=Sum('empenhado', filter=ativo),
+        total_pme=Sum('peso_total', filter=ativo),
+        total_entrada=Sum('entrada'),
+        total_saida=Sum('saida'),
+        clientes_unicos=Count(
+            'cliente',
+            distinct=True,
+            filter=ativo & Q(cliente__isnull=False) & ~Q(cliente=''),
+        ),
+    )
+
+    kpis = {
+        chave: (valor or 0)
+        for chave, valor in dados.items()
+    }
+
+    kpis['total_pme'] = dados['total_pme'] or Decimal('0.00')
+    kpis['total_sc'] = (kpis['saldo_bags'] * SC_POR_BAG) + kpis['saldo_sc']
+    kpis['total_disponivel'] = kpis['saldo_total'] - kpis['total_empenhado']
+
+    return kpis
+
+
+# ============================================================
+# FACETAS (OPÇÕES DOS FILTROS DA TABELA)
+# ============================================================
+
+# Parâmetro do filtro -> lookup no Estoque
+CAMPOS_FACETA = {
+    'az': 'az',
+    'lote': 'lote',
+    'produto': 'produto',
+    'cultivar': 'cultivar__nome',
+    'peneira': 'peneira__nome',
+    'categoria': 'categoria__nome',
+    'endereco': 'endereco',
+    'especie': 'especie__nome',
+    'tratamento': 'tratamento__nome',
+    'embalagem': 'embalagem',
+    'cliente': 'cliente',
+    'empresa': 'empresa',
+    'conferente': 'conferente__username',
+}
+
+
+def _consulta_faceta(queryset, campo):
+    return (
+        queryset
+        .order_by()
+        .annotate(
+            faceta=Value(campo, output_field=CharField()),
+            valor=F(CAMPOS_FACETA[campo]),
+        )
+        .values('faceta', 'valor')
+        .annotate(total=Count('id'))
+    )
+
+
+def calcular_facetas_encadeadas(querysets_por_campo):
+    """
+    Calcula valores e contagens de várias facetas em UMA única consulta.
+
+    Recebe {campo: queryset}, permitindo que cada faceta use o seu próprio
+    queryset (ex.: todos os filtros atuais, exceto o da própria coluna).
+    Cada faceta vira um GROUP BY e todos são unidos com UNION ALL.
+
+    Retorna {campo: {'opcoes': [...], 'contagens': {...}, 'tem_null': bool}},
+    com as opções já ordenadas e sem valores vazios.
+    """
+
+    campos = [
+        campo
+        for campo in querysets_por_campo
+        if campo in CAMPOS_FACETA
+    ]
+
+    facetas = {
+        campo: {
+            'opcoes': [],
+            'contagens': {},
+            'tem_null': False,
+        }
+        for campo in campos
+    }
+
+    if not campos:
+        return facetas
+
+    consultas = [
+        _consulta_faceta(querysets_por_campo[campo], campo)
+        for campo in campos
+    ]
+
+    consulta = consultas[0]
+    if len(consultas) > 1:
+        consulta = consulta.union(*consultas[1:], all=True)
+
+    for linha in consulta:
+        faceta = facetas[linha['faceta']]
+        valor = linha['valor']
+
+        if valor is None or str(valor).strip() == '':
+            faceta['tem_null'] = True
+            continue
+
+        valor = str(valor)
+        faceta['contagens'][valor] = (
+            faceta['contagens'].get(valor, 0)
+            + linha['total']
+        )
+
+    for faceta in facetas.values():
+        faceta['opcoes'] = sorted(faceta['contagens'])
+
+    return facetas
+
+
+def calcular_facetas(queryset, campos=None):
+    """Facetas de um único queryset (todas as colunas por padrão)."""
+    campos = campos or CAMPOS_FACETA.keys()
+
+    return calcular_facetas_encadeadas({
+        campo: queryset
+        for campo in campos
+    })
+
+
+# ============================================================
+# BUSCA GLOBAL (COLUNA Estoque.busca_normalizada)
+# ============================================================
+
+# Campos copiados, já normalizados, para a coluna de busca do Estoque
+CAMPOS_BUSCA = (
+    'lote',
+    'produto',
+    'cultivar__nome',
+    'peneira__nome',
+    'categoria__nome',
+    'especie__nome',
+    'endereco',
+    'az',
+    'cliente',
+    'empresa',
+    'observacao',
+    'conferente__username',
+    'conferente__first_name',
+    'conferente__last_name',
+)
+
+
+def normalizar_busca(valor):
+    """Minúsculas, sem acentos e com espaços simples."""
+    texto = unicodedata.normalize('NFKD', str(valor or ''))
+    texto = ''.join(
+        caractere
+        for caractere in texto
+        if not unicodedata.combining(caractere)
+    )
+    return ' '.join(texto.lower().split())
+
+
+def montar_texto_busca(valores):
+    return normalizar_busca(
+        ' '.join(str(valor) for valor in valores if valor)
+    )
+
+
+def q_busca_estoque(busca, prefixo=''):
+    """
+    Filtro da busca global do estoque.
+
+    Cada termo precisa aparecer na coluna busca_normalizada (AND entre
+    termos). A comparação é feita sem UPPER(), sobre texto já normalizado,
+    o que permite ao PostgreSQL usar o índice trigram da coluna.
+
+    Use prefixo='estoque__' para filtrar modelos relacionados.
+    """
+    filtro = Q()
+
+    for termo in normalizar_busca(busca).split():
+        filtro &= Q(**{f'{prefixo}busca_normalizada__contains': termo})
+
+    return filtro
+
+
+def atualizar_busca_estoque(queryset, tamanho_lote=1000):
+    """
+    Recalcula busca_normalizada dos registros do queryset em lotes.
+    Retorna a quantidade de registros atualizados.
+    """
+    Modelo = queryset.model
+    total = 0
+    pendentes = []
+
+    linhas = (
+        queryset
+        .order_by()
+        .values('id', 'busca_normalizada', *CAMPOS_BUSCA)
+        .iterator(chunk_size=tamanho_lote)
+    )
+
+    for linha in linhas:
+        texto = montar_texto_busca(linha[campo] for campo in CAMPOS_BUSCA)
+
+        if texto == linha['busca_normalizada']:
+            continue
+
+        pendentes.append(Modelo(id=linha['id'], busca_normalizada=texto))
+
+        if len(pendentes) >= tamanho_lote:
+            Modelo.objects.bulk_update(pendentes, ['busca_normalizada'])
+            total += len(pendentes)
+            pendentes = []
+
+    if pendentes:
+        Modelo.objects.bulk_update(pendentes, ['busca_normalizada'])
+        total += len(pendentes)
+
+    return total
+
+
+# ============================================================
+# RESUMO POR LOTE (SALDO / EMPENHADO / DISPONÍVEL)
+# ============================================================
+#
+# ResumoLote guarda os totais de cada lote somando todos os endereços.
+# O Estoque.save() refaz os totais do lote com um UPDATE agregado
+# (atualizar_resumo_lotes) na mesma transação; o ItemEmpenho grava o
+# empenhado pelo save do Estoque, então também passa por ali. Caminhos que não chamam save()
+# (queryset.update, bulk_create) refazem os lotes afetados com
+# recalcular_resumo_lotes. Conferência: comando verificar_resumo_lotes.
+
+CAMPOS_RESUMO_LOTE = (
+    'saldo',
+    'empenhado',
+    'disponivel',
+    'lote_busca',
+    'estoque_recente',
+    'atualizado_em',
+)
+
+
+def atualizar_resumo_lotes(lotes):
+    """
+    Regrava saldo, empenhado, disponível e o registro mais recente dos
+    lotes num único UPDATE com as somas calculadas no banco (subconsulta
+    por lote no Estoque), sem ler nada antes. Lotes ainda sem resumo
+    passam por recalcular_resumo_lotes.
+    """
+    from .models import Estoque, ResumoLote
+
+    lotes = {lote for lote in lotes if lote}
+    if not lotes:
+        return
+
+    do_lote = Estoque.objects.filter(lote=OuterRef('pk')).order_by().values('lote')
+
+    def soma(campo):
+        return Coalesce(
+            Subquery(do_lote.annotate(total=Sum(campo)).values('total')[:1], output_field=IntegerField()),
+            Value(0),
+        )
+
+    atualizados = ResumoLote.objects.filter(pk__in=lotes).update(
+        saldo=soma('saldo'),
+        empenhado=soma('empenhado'),
+        disponivel=soma('saldo') - soma('empenhado'),
+        estoque_recente_id=Subquery(do_lote.annotate(recente=Max('id')).values('recente')[:1]),
+        atualizado_em=timezone.now(),
+    )
+
+    if atualizados < len(lotes):
+        recalcular_resumo_lotes(lotes)
+
+
+def _totais_por_lote(estoque):
+    """{lote: (saldo, empenhado, disponivel, id do registro mais recente)}"""
+    totais = {}
+
+    for linha in (
+        estoque
+        .order_by()
+        .values('lote')
+        .annotate(saldo=Sum('saldo'), empenhado=Sum('empenhado'), recente=Max('id'))
+    ):
+        saldo, empenhado = linha['saldo'] or 0, linha['empenhado'] or 0
+        totais[linha['lote']] = (saldo, empenhado, saldo - empenhado, linha['recente'])
+
+    return totais
+
+
+def recalcular_resumo_lotes(lotes=None, tamanho_lote=1000):
+    """
+    Refaz o resumo a partir do Estoque: só os lotes informados, ou
+    todos (lotes=None). Lotes que não existem mais no Estoque saem do
+    resumo. Retorna quantos lotes foram gravados.
+    """
+    from .models import Estoque, ResumoLote
+
+    estoque = Estoque.objects.all()
+    resumos = ResumoLote.objects.all()
+
+    if lotes is not None:
+        lotes = {lote for lote in lotes if lote}
+        if not lotes:
+            return 0
+        estoque = estoque.filter(lote__in=lotes)
+        resumos = resumos.filter(pk__in=lotes)
+
+    agora = timezone.now()
+    totais = _totais_por_lote(estoque)
+
+    ResumoLote.objects.bulk_create(
+        [
+            ResumoLote(
+                lote=lote,
+                saldo=saldo,
+                empenhado=empenhado,
+                disponivel=disponivel,
+                lote_busca=normalizar_busca(lote)[:50],
+                estoque_recente_id=recente,
+                atualizado_em=agora,
+            )
+            for lote, (saldo, empenhado, disponivel, recente) in totais.items()
+        ],
+        batch_size=tamanho_lote,
+        update_conflicts=True,
+        unique_fields=['lote'],
+        update_fields=list(CAMPOS_RESUMO_LOTE),
+    )
+
+    if lotes is None:
+        resumos.exclude(pk__in=Estoque.objects.values('lote')).delete()
+    else:
+        resumos.exclude(pk__in=list(totais)).delete()
+
+    return len(totais)
+
+
+def divergencias_resumo_lotes():
+    """
+    Lotes cujo ResumoLote difere do Estoque. Retorna
+    [{'lote', 'esperado', 'gravado'}], com (saldo, empenhado,
+    disponivel, estoque_recente_id) em cada lado (gravado None se faltar).
+    """
+    from .models import Estoque, ResumoLote
+
+    esperados = _totais_por_lote(Estoque.objects.all())
+    gravados = {
+        lote: tuple(valores)
+        for lote, *valores in ResumoLote.objects.values_list(
+            'lote', 'saldo', 'empenhado', 'disponivel', 'estoque_recente_id'
+        ).iterator(chunk_size=2000)
+    }
+
+    return [
+        {
+            'lote': lote,
+            'esperado': esperados.get(lote),
+            'gravado': gravados.get(lote),
+        }
+        for lote in sorted(set(esperados) | set(gravados))
+        if esperados.get(lote) != gravados.get(lote)
+    ]
+
+
+def resumo_do_lote(lote):
+    """ResumoLote do lote pela chave (zerado se o lote não tiver resumo)"""
+    from .models import ResumoLote
+
+    return ResumoLote.objects.filter(pk=lote).first() or ResumoLote(lote=lote)
+
+
+def empenhado_por_lote(lotes):
+    """{lote: empenhado} dos lotes informados, direto do ResumoLote"""
+    from .models import ResumoLote
+
+    return dict(
+        ResumoLote.objects
+        .filter(pk__in=list(lotes))
+        .values_list('lote', 'empenhado')
+    )
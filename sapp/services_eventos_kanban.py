@@ -0,0 +1,138 @@
+# sapp/services_eventos_kanban.py
+
+import asyncio
+import json
+import time
+
+from asgiref.sync import sync_to_async
+
+from .services_versao import CHAVE_VERSAO_KANBAN, versao_sinalizada
+
+
+# ============================================================
+# CANAL DE ATUALIZAÇÕES DO QUADRO (SSE / LONG-POLL)
+# ============================================================
+#
+# Em vez de cada aba consultar api_versao_cards a cada 5s, o cliente
+# abre api_eventos_kanban e fica esperando. A espera só lê a chave de
+# sinal do contador de versão (services_versao.versao_sinalizada), que
+# os signals de Solicitacao/HistoricoCard/... atualizam após o commit.
+# Com o quadro parado nenhuma consulta é feita; quando a versão muda,
+# o evento leva a versão nova e as entradas do HistoricoCard desde a
+# última que o cliente viu (com os ids dos cards afetados).
+#
+# Sob ASGI (sementes.asgi:application, uvicorn no dockerfile) a espera é
+# assíncrona e o endpoint também fala SSE. Sob WSGI a espera ocupa um
+# worker, por isso lá só o long-poll é atendido.
+
+ESPERA_LONG_POLL = 25  # segundos até responder "nada mudou"
+INTERVALO_VERIFICACAO = 1  # segundos entre leituras do sinal
+INTERVALO_HEARTBEAT = 15  # segundos entre comentários ":ping" no SSE
+DURACAO_SSE = 5 * 60  # segundos; o EventSource reconecta sozinho
+RECONEXAO_SSE_MS = 3000
+LIMITE_ATUALIZACOES = 50
+
+
+def serializar_atualizacao(atualizacao):
+    """Entrada do HistoricoCard no formato do feed"""
+    return {
+        'id': atualizacao.id,
+        'usuario': atualizacao.usuario.get_full_name() or atualizacao.usuario.username,
+        'acao': atualizacao.get_acao_display(),
+        'descricao': atualizacao.descricao_completa(),
+        'lote': atualizacao.lote,
+        'quantidade': float(atualizacao.quantidade) if atualizacao.quantidade else None,
+        'unidade': atualizacao.unidade,
+        'card_id': atualizacao.solicitacao.id,
+        'card_titulo': atualizacao.solicitacao.titulo,
+        'data': atualizacao.data.strftime('%d/%m/%Y %H:%M:%S'),
+        'data_iso': atualizacao.data.isoformat(),
+    }
+
+
+def montar_evento_kanban(versao, desde=None):
+    """
+    Delta de uma mudança de versão: entradas do HistoricoCard com id
+    maior que `desde` (mais antigas primeiro) e os cards afetados.
+    Sem `desde` (primeira conexão) só marca a posição atual do feed.
+    """
+    from .models import HistoricoCard
+
+    if desde is None:
+        ultimo_id = (
+            HistoricoCard.objects
+            .order_by('-id')
+            .values_list('id', flat=True)
+            .first()
+        ) or 0
+
+        return {'version': str(versao), 'ultimo_id': ultimo_id, 'atualizacoes': [], 'cards': []}
+
+    atualizacoes = [
+        serializar_atualizacao(atualizacao)
+        for atualizacao in (
+            HistoricoCard.objects
+            .select_related('usuario', 'solicitacao')
+            .filter(id__gt=desde)
+            .order_by('id')[:LIMITE_ATUALIZACOES]
+        )
+    ]
+
+    return {
+        'version': str(versao),
+        'ultimo_id': atualizacoes[-1]['id'] if atualizacoes else desde,
+        'atualizacoes': atualizacoes,
+        'cards': sorted({atualizacao['card_id'] for atualizacao in atualizacoes}),
+    }
+
+
+async def aguardar_versao(versao_cliente, espera=None, intervalo=None):
+    """
+    Espera a versão do quadro ficar diferente de `versao_cliente`.
+    Retorna a versão nova, ou None se o tempo de espera acabar.
+    Sem versão do cliente, retorna a atual na hora.
+    """
+    espera = ESPERA_LONG_POLL if espera is None else espera
+    intervalo = INTERVALO_VERIFICACAO if intervalo is None else intervalo
+    limite = time.monotonic() + espera
+
+    while True:
+        versao = await sync_to_async(versao_sinalizada)(CHAVE_VERSAO_KANBAN)
+
+        if versao_cliente in (None, '') or str(versao) != str(versao_cliente):
+            return versao
+
+        restante = limite - time.monotonic()
+        if restante <= 0:
+            return None
+
+        await asyncio.sleep(min(intervalo, restante))
+
+
+def ler_id_evento(valor):
+    """Last-Event-ID do SSE ('versao:ultimo_id') -> (versao, ultimo_id)"""
+    versao, _, ultimo_id = str(valor or '').partition(':')
+    return versao or None, int(ultimo_id) if ultimo_id.isdigit() else None
+
+
+def _formatar_evento(evento):
+    dados = json.dumps(evento)
+    return f"id: {evento['version']}:{evento['ultimo_id']}\nevent: kanban\ndata: {dados}\n\n"
+
+
+async def fluxo_eventos_kanban(versao, desde):
+    """Gerador do SSE: um evento por mudança de versão e heartbeats no meio"""
+    yield f'retry: {RECONEXAO_SSE_MS}\n\n'
+
+    limite = time.monotonic() + DURACAO_SSE
+
+    while time.monotonic() < limite:
+        nova = await aguardar_versao(versao, espera=INTERVALO_HEARTBEAT)
+
+        if nova is None:
+            yield ': ping\n\n'
+            continue
+
+        evento = await sync_to_async(montar_evento_kanban)(nova, desde)
+        versao, desde = nova, evento['ultimo_id']
+        yield _formatar_evento(evento)
@@ -0,0 +1,613 @@
+# sapp/services_exportacao.py
+
+import csv
+import logging
+import tempfile
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.apps import apps
+from django.core.files import File
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Border, Font, NamedStyle, PatternFill, Side
+from openpyxl.utils import get_column_letter
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.platypus import Paragraph, SimpleDocTemplate, Table, TableStyle
+
+from .services_estoque import q_busca_estoque
+
+logger = logging.getLogger(__name__)
+
+# ============================================================
+# CONSTANTES
+# ============================================================
+
+# Linhas lidas do banco por vez (queryset.iterator)
+TAMANHO_LOTE_EXPORTACAO = 2000
+
+# Arquivo temporário fica em memória até esse tamanho, depois vai para disco
+LIMITE_MEMORIA_XLSX = 5 * 1024 * 1024
+
+CONTENT_TYPE_XLSX = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+CONTENT_TYPE_CSV = 'text/csv; charset=utf-8'
+
+# Tarefa que não chegou ao broker fica na fila (pendente, sem
+# celery_task_id) e é reenviada pelo comando reenviar_exportacoes.
+# Só reenvia depois de TEMPO_MINIMO_REENVIO (o envio normal roda no
+# on_commit) e desiste, marcando erro, após TEMPO_LIMITE_FILA_EXPORTACAO.
+TEMPO_MINIMO_REENVIO = timedelta(minutes=1)
+TEMPO_LIMITE_FILA_EXPORTACAO = timedelta(hours=1)
+
+# Enviada ao broker (com celery_task_id) e não iniciada depois desse
+# tempo: a mensagem se perdeu e a tarefa é reenviada. Uma entrega
+# duplicada não faz mal, executar_tarefa_exportacao só roda pendentes.
+TEMPO_REENVIO_SEM_INICIO = timedelta(minutes=10)
+
+# Processando há mais que o limite do Celery (CELERY_TASK_TIME_LIMIT,
+# 30 min) com folga: o worker caiu no meio e a tarefa vira erro.
+TEMPO_LIMITE_PROCESSAMENTO_EXPORTACAO = timedelta(minutes=45)
+
+# Tarefas finalizadas (e seus arquivos) são apagadas depois desse prazo
+RETENCAO_EXPORTACOES = timedelta(days=7)
+
+
+# ============================================================
+# COLUNAS
+# ============================================================
+
+def _nome(relacionado):
+    return relacionado.nome if relacionado else ''
+
+
+def _nome_conferente(item):
+    if not item.conferente:
+        return ''
+
+    nome = item.conferente.get_full_name().strip()
+    if not nome:
+        nome = item.conferente.first_name.strip()
+    if not nome:
+        nome = item.conferente.username
+    return nome
+
+
+def _float(valor):
+    return float(valor) if valor else 0.0
+
+
+# (cabeçalho, largura, valor)
+COLUNAS_ESTOQUE_FILTRADO = [
+    ('Status', 15, lambda item: item.status_sistemico.nome if item.status_sistemico else 'Indefinido'),
+    ('AZ', 8, lambda item: item.az or ''),
+    ('Lote', 20, lambda item: item.lote or ''),
+    ('Produto', 30, lambda item: item.produto or ''),
+    ('Cultivar', 15, lambda item: _nome(item.cultivar)),
+    ('Peneira', 10, lambda item: _nome(item.peneira)),
+    ('Categoria', 12, lambda item: _nome(item.categoria)),
+    ('Endereço', 18, lambda item: item.endereco or ''),
+    ('Saldo', 10, lambda item: item.saldo if item.saldo is not None else 0),
+    ('Peso Unit.', 12, lambda item: _float(item.peso_unitario)),
+    ('Peso Total', 12, lambda item: _float(item.peso_total)),
+    ('Espécie', 12, lambda item: _nome(item.especie)),
+    ('Tratamento', 15, lambda item: _nome(item.tratamento)),
+    ('Embalagem', 12, lambda item: item.get_embalagem_display() if item.embalagem else ''),
+    ('Cliente', 25, lambda item: item.cliente or ''),
+    ('Empresa', 25, lambda item: item.empresa or ''),
+    ('Conferente', 25, _nome_conferente),
+    ('Observação', 30, lambda item: item.observacao or ''),
+]
+
+COLUNAS_ESTOQUE_SIMPLES = [
+    ('Lote', 20, lambda item: item.lote),
+    ('Produto', 30, lambda item: item.produto or ''),
+    ('Cultivar', 15, lambda item: _nome(item.cultivar)),
+    ('Peneira', 10, lambda item: _nome(item.peneira)),
+    ('Categoria', 12, lambda item: _nome(item.categoria)),
+    ('Endereço', 18, lambda item: item.endereco),
+    ('Saldo', 10, lambda item: item.saldo),
+    ('Peso Unitário (kg)', 18, lambda item: _float(item.peso_unitario)),
+    ('Peso Total (kg)', 16, lambda item: _float(item.peso_total)),
+    ('Tratamento', 15, lambda item: _nome(item.tratamento)),
+    ('Embalagem', 12, lambda item: item.get_embalagem_display()),
+    ('Conferente', 20, lambda item: item.conferente.first_name if item.conferente else ''),
+    ('Data Entrada', 14, lambda item: item.data_entrada.strftime('%d/%m/%Y') if item.data_entrada else ''),
+    ('AZ', 8, lambda item: item.az or ''),
+    ('Origem/Destino', 20, lambda item: item.origem_destino or ''),
+    ('Empresa', 25, lambda item: item.empresa or ''),
+    ('Espécie', 12, lambda item: _nome(item.especie)),
+    ('Observação', 30, lambda item: item.observacao or ''),
+]
+
+RELACIONADOS_EXPORTACAO = (
+    'cultivar',
+    'peneira',
+    'categoria',
+    'tratamento',
+    'especie',
+    'status_sistemico',
+    'conferente',
+)
+
+
+# ============================================================
+# FILTROS DA EXPORTAÇÃO
+# ============================================================
+
+CAMPOS_RELACIONADOS_FILTRO = {
+    'cultivar': 'cultivar__nome',
+    'peneira': 'peneira__nome',
+    'categoria': 'categoria__nome',
+    'tratamento': 'tratamento__nome',
+    'especie': 'especie__nome',
+    'status_sistemico': 'status_sistemico__nome',
+    'conferente': 'conferente__username',
+}
+
+PARAMETROS_IGNORADOS = ('page', 'page_size', 'busca', 'export', 'formato', 'cursor', 'paginacao', 'contagem')
+
+
+def filtrar_estoque_exportacao(queryset, parametros):
+    """
+    Aplica a busca e os filtros de coluna da tela de gestão.
+
+    parametros: {chave: [valores]} (ex.: dict(request.GET.lists())),
+    o que permite montar o mesmo filtro fora da requisição.
+    """
+    busca = (parametros.get('busca') or [''])[0]
+    if busca:
+        queryset = queryset.filter(q_busca_estoque(busca))
+
+    for key, values in parametros.items():
+        if key in PARAMETROS_IGNORADOS:
+            continue
+
+        # Filtros numéricos
+        if key.startswith('min_') or key.startswith('max_'):
+            campo = key[4:]
+            lookup = 'gte' if key.startswith('min_') else 'lte'
+            for val in values:
+                if val:
+                    try:
+                        queryset = queryset.filter(**{f"{campo}__{lookup}": float(val)})
+                    except (ValueError, TypeError):
+                        pass
+            continue
+
+        # Filtros de seleção múltipla
+        if values and values != ['']:
+            filtro_q = Q()
+            for valor in values:
+                if valor == '__null__':
+                    # Filtra por valores vazios/nulos
+                    if key in CAMPOS_RELACIONADOS_FILTRO and key != 'conferente':
+                        filtro_q |= Q(**{f"{key}__isnull": True})
+                    else:
+                        filtro_q |= Q(**{f"{key}__exact": ''}) | Q(**{f"{key}__isnull": True})
+                else:
+                    filtro_q |= Q(**{CAMPOS_RELACIONADOS_FILTRO.get(key, key): valor})
+
+            queryset = queryset.filter(filtro_q)
+
+    return queryset
+
+
+# ============================================================
+# GERAÇÃO DOS ARQUIVOS
+# ============================================================
+
+def _linhas(queryset, colunas):
+    for item in queryset.iterator(chunk_size=TAMANHO_LOTE_EXPORTACAO):
+        yield [valor(item) for _, _, valor in colunas]
+
+
+def _estilos_planilha():
+    borda = Side(style='thin', color='D3D3D3')
+    borda_fina = Border(left=borda, right=borda, top=borda, bottom=borda)
+
+    cabecalho = NamedStyle(name='exportacao_cabecalho')
+    cabecalho.font = Font(name='Arial', size=11, bold=True, color='FFFFFF')
+    cabecalho.fill = PatternFill(start_color='2F8F4E', end_color='2F8F4E', fill_type='solid')
+    cabecalho.alignment = Alignment(horizontal='center', vertical='center', wrap_text=True)
+    cabecalho.border = borda_fina
+
+    celula = NamedStyle(name='exportacao_celula')
+    celula.font = Font(name='Arial', size=10)
+    celula.alignment = Alignment(vertical='center')
+    celula.border = borda_fina
+
+    return cabecalho, celula
+
+
+def escrever_xlsx(queryset, colunas, destino, titulo='Estoque'):
+    """
+    Grava o queryset em XLSX no arquivo destino, linha a linha.
+
+    Usa o modo write_only do openpyxl (as linhas não ficam em memória)
+    e estilos nomeados (o estilo é registrado uma vez, e não por célula).
+    Retorna a quantidade de linhas gravadas.
+    """
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(titulo)
+
+    cabecalho, celula = _estilos_planilha()
+    wb.add_named_style(cabecalho)
+    wb.add_named_style(celula)
+
+    # Larguras e cabeçalho fixo precisam ser definidos antes das linhas
+    for indice, (_, largura, _) in enumerate(colunas, 1):
+        ws.column_dimensions[get_column_letter(indice)].width = largura
+    ws.freeze_panes = 'A2'
+    ws.row_dimensions[1].height = 30
+
+    def _linha_estilizada(valores, estilo):
+        linha = []
+        for valor in valores:
+            cell = WriteOnlyCell(ws, value=valor)
+            cell.style = estilo
+            linha.append(cell)
+        return linha
+
+    ws.append(_linha_estilizada([titulo_col for titulo_col, _, _ in colunas], cabecalho.name))
+
+    total = 0
+    for valores in _linhas(queryset, colunas):
+        ws.append(_linha_estilizada(valores, celula.name))
+        total += 1
+
+    if total:
+        ws.auto_filter.ref = f"A1:{get_column_letter(len(colunas))}{total + 1}"
+
+    wb.save(destino)
+    return total
+
+
+def gerar_xlsx_temporario(queryset, colunas, titulo='Estoque'):
+    """
+    Gera o XLSX em arquivo temporário (memória até LIMITE_MEMORIA_XLSX,
+    depois disco) e devolve (arquivo posicionado no início, total de linhas).
+    """
+    arquivo = tempfile.SpooledTemporaryFile(max_size=LIMITE_MEMORIA_XLSX)
+    total = escrever_xlsx(queryset, colunas, arquivo, titulo=titulo)
+    arquivo.seek(0)
+    return arquivo, total
+
+
+class _Eco:
+    """Pseudo-buffer para o csv.writer: devolve a linha em vez de gravar."""
+
+    def write(self, valor):
+        return valor
+
+
+def _valor_csv(valor):
+    # Excel em português espera vírgula decimal
+    if isinstance(valor, (float, Decimal)):
+        return f'{valor:.3f}'.rstrip('0').rstrip('.').replace('.', ',')
+    return valor
+
+
+def linhas_csv(queryset, colunas):
+    """
+    Gera o CSV linha a linha (separador ';' e BOM para o Excel).
+    Nada é acumulado: cada linha é enviada assim que lida do banco.
+    """
+    escritor = csv.writer(_Eco(), delimiter=';')
+
+    yield '\ufeff' + escritor.writerow([titulo for titulo, _, _ in colunas])
+
+    for valores in _linhas(queryset, colunas):
+        yield escritor.writerow([_valor_csv(valor) for valor in valores])
+
+
+# ============================================================
+# RELATÓRIO PDF
+# ============================================================
+
+def escrever_pdf_estoque(queryset, destino, limite=None):
+    """
+    Relatório de estoque em PDF. A exportação síncrona limita as linhas;
+    a exportação em segundo plano pode gerar o relatório completo.
+    Retorna a quantidade de linhas.
+    """
+    doc = SimpleDocTemplate(destino, pagesize=A4, topMargin=30)
+    elements = []
+    styles = getSampleStyleSheet()
+    elements.append(Paragraph("RELATÓRIO DE ESTOQUE - SEMENTES", styles['Title']))
+    elements.append(Paragraph(f"Data: {timezone.now().strftime('%d/%m/%Y %H:%M')}", styles['Normal']))
+    elements.append(Paragraph("<br/>", styles['Normal']))
+
+    data = [['Lote', 'Produto', 'Cultivar', 'Peneira', 'Endereço', 'Saldo', 'Peso Total']]
+
+    if limite:
+        queryset = queryset[:limite]
+
+    for item in queryset.iterator(chunk_size=TAMANHO_LOTE_EXPORTACAO):
+        data.append([
+            item.lote,
+            item.produto or '',
+            _nome(item.cultivar),
+            _nome(item.peneira),
+            item.endereco,
+            str(item.saldo),
+            f"{item.peso_total:.2f} kg"
+        ])
+
+    # repeatRows: cabeçalho repetido em cada página do relatório completo
+    table = Table(data, repeatRows=1)
+    table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#2f8f4e')),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 10),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+        ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
+        ('FONTSIZE', (0, 1), (-1, -1), 8),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black)
+    ]))
+
+    elements.append(table)
+    elements.append(Paragraph(f"<br/>Total de itens: {len(data) - 1}", styles['Normal']))
+
+    doc.build(elements)
+    return len(data) - 1
+
+
+# ============================================================
+# EXPORTAÇÕES EM SEGUNDO PLANO (TarefaExportacao)
+# ============================================================
+
+def _queryset_estoque_exportacao(tipo, parametros):
+    Estoque = apps.get_model('sapp', 'Estoque')
+
+    queryset = Estoque.objects.filter(saldo__gt=0).select_related(*RELACIONADOS_EXPORTACAO)
+
+    if tipo == 'estoque_filtrado':
+        queryset = filtrar_estoque_exportacao(queryset, parametros).order_by('lote')
+
+    return queryset
+
+
+def gerar_arquivo_tarefa(tarefa):
+    """Gera o arquivo da tarefa. Retorna (arquivo temporário, nome, total de linhas)."""
+    queryset = _queryset_estoque_exportacao(tarefa.tipo, tarefa.parametros or {})
+    carimbo = timezone.localtime(tarefa.criado_em).strftime('%Y%m%d_%H%M%S')
+
+    if tarefa.tipo == 'estoque_pdf':
+        arquivo = tempfile.SpooledTemporaryFile(max_size=LIMITE_MEMORIA_XLSX)
+        total = escrever_pdf_estoque(queryset, arquivo)
+        arquivo.seek(0)
+        return arquivo, f'estoque_sementes_{carimbo}.pdf', total
+
+    colunas = (
+        COLUNAS_ESTOQUE_FILTRADO
+        if tarefa.tipo == 'estoque_filtrado'
+        else COLUNAS_ESTOQUE_SIMPLES
+    )
+
+    if tarefa.formato == 'csv':
+        arquivo = tempfile.SpooledTemporaryFile(max_size=LIMITE_MEMORIA_XLSX)
+        total = -1  # cabeçalho
+        for linha in linhas_csv(queryset, colunas):
+            arquivo.write(linha.encode('utf-8'))
+            total += 1
+        arquivo.seek(0)
+        return arquivo, f'estoque_{carimbo}.csv', total
+
+    arquivo, total = gerar_xlsx_temporario(queryset, colunas)
+    return arquivo, f'estoque_{carimbo}.xlsx', total
+
+
+def executar_tarefa_exportacao(tarefa_id):
+    """
+    Executa a tarefa (chamado pelo Celery).
+
+    A tarefa só é processada se ainda estiver na fila, o que evita
+    execução dupla caso a mensagem seja entregue duas vezes.
+    Erros ficam registrados na tarefa e não são propagados.
+    """
+    TarefaExportacao = apps.get_model('sapp', 'TarefaExportacao')
+
+    iniciou = TarefaExportacao.objects.filter(
+        pk=tarefa_id,
+        status=TarefaExportacao.STATUS_PENDENTE,
+    ).update(
+        status=TarefaExportacao.STATUS_PROCESSANDO,
+        iniciado_em=timezone.now(),
+    )
+    if not iniciou:
+        return None
+
+    tarefa = TarefaExportacao.objects.get(pk=tarefa_id)
+    inicio = time.perf_counter()
+
+    try:
+        arquivo, nome, total = gerar_arquivo_tarefa(tarefa)
+
+        with arquivo:
+            tarefa.arquivo.save(nome, File(arquivo, name=nome), save=False)
+
+        tarefa.nome_arquivo = nome
+        tarefa.total_linhas = total
+        tarefa.tamanho_bytes = tarefa.arquivo.size
+        tarefa.status = TarefaExportacao.STATUS_CONCLUIDA
+    except Exception as e:
+        logger.exception("Erro na exportação #%s", tarefa_id)
+        tarefa.status = TarefaExportacao.STATUS_ERRO
+        tarefa.erro = str(e)[:2000]
+
+    tarefa.concluido_em = timezone.now()
+    tarefa.save(update_fields=[
+        'arquivo',
+        'nome_arquivo',
+        'total_linhas',
+        'tamanho_bytes',
+        'status',
+        'erro',
+        'concluido_em',
+    ])
+
+    logger.info(
+        "Exportação #%s (%s/%s) %s: fila %ss, geração %.2fs, %s linhas, %s bytes",
+        tarefa.pk,
+        tarefa.tipo,
+        tarefa.formato,
+        tarefa.status,
+        tarefa.segundos_na_fila,
+        time.perf_counter() - inicio,
+        tarefa.total_linhas or 0,
+        tarefa.tamanho_bytes or 0,
+    )
+    return tarefa
+
+
+def _enviar_ao_celery(tarefa_id):
+    """
+    Envia a tarefa ao Celery e grava o id recebido. Se o broker estiver
+    fora do ar, a tarefa continua na fila (nada é executado aqui) e o
+    retorno é False.
+    """
+    from .tasks import processar_tarefa_exportacao
+
+    TarefaExportacao = apps.get_model('sapp', 'TarefaExportacao')
+
+    try:
+        if processar_tarefa_exportacao.app.conf.task_always_eager:
+            # apply() executa no próprio processo, sem abrir conexão com o broker
+            resultado = processar_tarefa_exportacao.apply(args=(tarefa_id,))
+        else:
+            resultado = processar_tarefa_exportacao.delay(tarefa_id)
+    except Exception as e:
+        logger.warning(
+            "Broker indisponível, exportação #%s continua na fila para nova tentativa: %s",
+            tarefa_id,
+            e,
+        )
+        return False
+
+    TarefaExportacao.objects.filter(pk=tarefa_id).update(celery_task_id=resultado.id or '')
+    return True
+
+
+def enfileirar_tarefa_exportacao(tarefa):
+    """
+    Envia a tarefa ao Celery depois do commit.
+
+    Com CELERY_TASK_ALWAYS_EAGER (padrão local) o Celery já executa na hora.
+    Se o broker estiver fora do ar a exportação NÃO roda no processo web:
+    a tarefa fica pendente e o comando reenviar_exportacoes tenta de novo.
+    """
+    transaction.on_commit(lambda: _enviar_ao_celery(tarefa.pk))
+
+
+def reenviar_exportacoes_pendentes(agora=None):
+    """
+    Reenvia as tarefas que não chegaram ao broker ou cuja mensagem se
+    perdeu (TEMPO_REENVIO_SEM_INICIO) e marca como erro as que passaram
+    de TEMPO_LIMITE_FILA_EXPORTACAO na fila ou de
+    TEMPO_LIMITE_PROCESSAMENTO_EXPORTACAO processando.
+
+    Retorna (reenviadas, expiradas).
+    """
+    TarefaExportacao = apps.get_model('sapp', 'TarefaExportacao')
+
+    agora = agora or timezone.now()
+    na_fila = TarefaExportacao.objects.filter(status=TarefaExportacao.STATUS_PENDENTE)
+
+    expiradas = na_fila.filter(
+        criado_em__lt=agora - TEMPO_LIMITE_FILA_EXPORTACAO,
+    ).update(
+        status=TarefaExportacao.STATUS_ERRO,
+        erro='Fila de exportações indisponível. Solicite a exportação novamente.',
+        concluido_em=agora,
+    )
+
+    expiradas += TarefaExportacao.objects.filter(
+        status=TarefaExportacao.STATUS_PROCESSANDO,
+        iniciado_em__lt=agora - TEMPO_LIMITE_PROCESSAMENTO_EXPORTACAO,
+    ).update(
+        status=TarefaExportacao.STATUS_ERRO,
+        erro='A exportação foi interrompida. Solicite a exportação novamente.',
+        concluido_em=agora,
+    )
+
+    reenviadas = 0
+    pendentes = (
+        na_fila
+        .filter(
+            Q(celery_task_id='', criado_em__lte=agora - TEMPO_MINIMO_REENVIO)
+            | Q(criado_em__lte=agora - TEMPO_REENVIO_SEM_INICIO)
+        )
+        .order_by('criado_em')
+        .values_list('pk', flat=True)
+    )
+
+    for tarefa_id in pendentes:
+        if not _enviar_ao_celery(tarefa_id):
+            # Broker continua fora: as demais ficam para a próxima execução
+            break
+        reenviadas += 1
+
+    return reenviadas, expiradas
+
+
+def limpar_exportacoes_antigas(agora=None):
+    """
+    Apaga as tarefas finalizadas há mais de RETENCAO_EXPORTACOES,
+    junto com os arquivos gerados. Retorna quantas foram apagadas.
+    """
+    TarefaExportacao = apps.get_model('sapp', 'TarefaExportacao')
+
+    agora = agora or timezone.now()
+    antigas = TarefaExportacao.objects.filter(
+        status__in=[TarefaExportacao.STATUS_CONCLUIDA, TarefaExportacao.STATUS_ERRO],
+        criado_em__lt=agora - RETENCAO_EXPORTACOES,
+    )
+
+    apagadas = 0
+    while ids := list(antigas.values_list('pk', flat=True)[:TAMANHO_LOTE_EXPORTACAO]):
+        for tarefa in TarefaExportacao.objects.filter(pk__in=ids).exclude(arquivo='').only('pk', 'arquivo'):
+            try:
+                tarefa.arquivo.delete(save=False)
+            except OSError as e:
+                # Storage fora do ar: a linha some mesmo assim, o arquivo fica órfão
+                logger.warning("Arquivo da exportação #%s não foi apagado: %s", tarefa.pk, e)
+
+        TarefaExportacao.objects.filter(pk__in=ids).delete()
+        apagadas += len(ids)
+
+    return apagadas
+
+
+def dados_tarefa_exportacao(tarefa):
+    """Representação JSON usada pelo polling da tela."""
+    from django.urls import reverse
+
+    concluida = tarefa.status == tarefa.STATUS_CONCLUIDA
+
+    return {
+        'id': tarefa.pk,
+        'tipo': tarefa.tipo,
+        'formato': tarefa.formato,
+        'status': tarefa.status,
+        'status_display': tarefa.get_status_display(),
+        'finalizada': tarefa.finalizada,
+        'erro': tarefa.erro,
+        'nome_arquivo': tarefa.nome_arquivo,
+        'total_linhas': tarefa.total_linhas,
+        'tamanho_bytes': tarefa.tamanho_bytes,
+        'criado_em': tarefa.criado_em.isoformat() if tarefa.criado_em else None,
+        'segundos_na_fila': tarefa.segundos_na_fila,
+        'segundos_execucao': tarefa.segundos_execucao,
+        'status_url': reverse('sapp:status_exportacao', args=[tarefa.pk]),
+        'download_url': reverse('sapp:baixar_exportacao', args=[tarefa.pk]) if concluida else None,
+    }
+
@@ -0,0 +1,458 @@
+# sapp/services_historico.py
+
+import heapq
+from itertools import islice
+
+from django.apps import apps as django_apps
+from django.core.cache import cache
+from django.db.models import F
+
+from .services_estoque import montar_texto_busca
+from .services_versao import CHAVE_VERSAO_DASHBOARD, CHAVE_VERSAO_KANBAN, obter_versao
+
+
+# ============================================================
+# TIPOS E NOMES
+# ============================================================
+
+def nome_usuario_historico(usuario):
+    """Nome completo do usuário ou username; 'Sistema' se nulo."""
+    if not usuario:
+        return 'Sistema'
+    nome = f'{usuario.first_name or ""} {usuario.last_name or ""}'.strip()
+    return nome or usuario.username or 'Sistema'
+
+
+def normalizar_tipo_historico(tipo):
+    """
+    Retorna o tipo normalizado (sem acentos, sem espaços extras, minúsculo).
+    Mapeia variações comuns para uma chave única.
+    """
+    tipo_original = str(tipo or '').strip()
+    tipo_lower = tipo_original.lower()
+
+    mapa = {
+        'entrada': 'entrada',
+        'nova entrada': 'entrada',
+        'saida': 'saida',
+        'saída': 'saida',
+        'baixa': 'saida',
+        'transferencia': 'transferencia',
+        'transferência': 'transferencia',
+        'expedicao': 'expedicao',
+        'expedição': 'expedicao',
+        'edicao': 'edicao',
+        'edição': 'edicao',
+        'exclusao': 'exclusao',
+        'exclusão': 'exclusao',
+    }
+    return mapa.get(tipo_lower, tipo_lower.replace(' ', '_'))
+
+
+def nome_tipo_historico(tipo):
+    """Nome amigável para exibição."""
+    nomes = {
+        'entrada': 'Entrada',
+        'saida': 'Saída',
+        'transferencia': 'Transferência',
+        'expedicao': 'Expedição',
+        'edicao': 'Edição',
+        'exclusao': 'Exclusão',
+    }
+    return nomes.get(tipo, str(tipo or 'Não informado').replace('_', ' ').title())
+
+
+# Grafias gravadas no banco para cada tipo normalizado (filtro da tela)
+VARIANTES_TIPO_HISTORICO = {
+    'entrada': ['entrada', 'nova entrada'],
+    'saida': ['saida', 'saída', 'baixa'],
+    'transferencia': ['transferencia', 'transferência'],
+    'expedicao': ['expedicao', 'expedição'],
+    'edicao': ['edicao', 'edição'],
+    'exclusao': ['exclusao', 'exclusão'],
+}
+
+
+def obter_enderecos_historico_antigo(movimentacao, tipo):
+    """
+    No histórico antigo não há endereços separados.
+    Utiliza o endereço do estoque quando disponível.
+    """
+    endereco = movimentacao.estoque.endereco if movimentacao.estoque else ''
+
+    if tipo == 'entrada':
+        return '', endereco
+    if tipo in ('saida', 'expedicao'):
+        return endereco, ''
+    if tipo == 'transferencia':
+        return endereco, ''  # origem; destino normalmente na descrição
+    return endereco, ''
+
+
+def chave_dedup_historico(lote, tipo, quantidade, data_hora, numero_carga):
+    """
+    Mesmo lote, tipo, quantidade, minuto e carga = mesmo evento.
+
+    Uma movimentação pelo card grava nas duas tabelas de histórico;
+    a chave permite exibir o evento apenas uma vez (a tela descarta,
+    entre as linhas filtradas, as que repetem a chave de uma anterior).
+    """
+    return '|'.join([
+        str(lote or '').strip().upper(),
+        tipo or '',
+        str(int(quantidade or 0)),
+        data_hora.strftime('%Y-%m-%d %H:%M') if data_hora else '',
+        str(numero_carga or '').strip().upper(),
+    ])[:255]
+
+
+# ============================================================
+# LIVRO DE MOVIMENTAÇÕES (HISTÓRICO UNIFICADO)
+# ============================================================
+
+# Tabela de origem de cada lançamento do livro
+ORIGEM_HISTORICO = 'HISTORICO'
+ORIGEM_EMPENHO = 'EMPENHO'
+
+ORIGEM_CHOICES = [
+    (ORIGEM_HISTORICO, 'Histórico geral'),
+    (ORIGEM_EMPENHO, 'Cards e empenhos'),
+]
+
+def _nome(relacionado):
+    return relacionado.nome if relacionado else ''
+
+
+def _modelo_livro():
+    return django_apps.get_model('sapp', 'LivroMovimentacao')
+
+
+def montar_lancamento_movimentacao(mov):
+    """Converte um HistoricoMovimentacao em lançamento do livro (não salvo)."""
+    Livro = _modelo_livro()
+
+    estoque = mov.estoque
+    tipo = normalizar_tipo_historico(mov.tipo)
+    end_orig, end_dest = obter_enderecos_historico_antigo(mov, tipo)
+    cliente_estoque = (estoque.cliente if estoque else '') or ''
+
+    lancamento = Livro(
+        origem=ORIGEM_HISTORICO,
+        origem_id=mov.pk,
+        data_hora=mov.data_hora,
+        lote=(mov.lote_ref or (estoque.lote if estoque else '') or 'Sem lote').strip()[:100],
+        tipo=tipo,
+        tipo_original=(mov.tipo or '')[:50],
+        quantidade=mov.quantidade or 0,
+        produto=(estoque.produto if estoque else '') or '',
+        cliente=mov.cliente or cliente_estoque,
+        empresa=(estoque.empresa if estoque else '') or '',
+        cultivar=_nome(estoque.cultivar) if estoque else '',
+        peneira=_nome(estoque.peneira) if estoque else '',
+        categoria=_nome(estoque.categoria) if estoque else '',
+        tratamento=_nome(estoque.tratamento) if estoque else '',
+        especie=_nome(estoque.especie) if estoque else '',
+        embalagem=(estoque.embalagem if estoque else '') or '',
+        endereco_origem=end_orig or '',
+        endereco_destino=end_dest or '',
+        usuario_id=mov.usuario_id,
+        usuario_nome=nome_usuario_historico(mov.usuario),
+        observacao=mov.descricao or '',
+        numero_carga=mov.numero_carga or '',
+        motorista=mov.motorista or '',
+        placa=mov.placa or '',
+        ordem_entrega=mov.ordem_entrega or '',
+    )
+    lancamento.busca_normalizada = _texto_busca_lancamento(
+        lancamento,
+        mov.usuario,
+        extras=[cliente_estoque],
+    )
+    return lancamento
+
+
+def montar_lancamento_item_empenho(item):
+    """Converte um HistoricoItemEmpenho em lançamento do livro (não salvo)."""
+    Livro = _modelo_livro()
+
+    tipo = normalizar_tipo_historico(item.tipo)
+
+    lancamento = Livro(
+        origem=ORIGEM_EMPENHO,
+        origem_id=item.pk,
+        data_hora=item.processado_em,
+        lote=(item.lote or 'Sem lote').strip()[:100],
+        tipo=tipo,
+        tipo_original=(item.tipo or '')[:50],
+        quantidade=item.quantidade or 0,
+        produto=item.produto or '',
+        cliente=item.cliente or '',
+        empresa=item.empresa or '',
+        cultivar=item.cultivar or '',
+        peneira=item.peneira or '',
+        categoria=item.categoria or '',
+        tratamento=item.tratamento or '',
+        especie=item.especie or '',
+        embalagem=item.embalagem or '',
+        endereco_origem=item.endereco_origem or '',
+        endereco_destino=item.endereco_destino or '',
+        usuario_id=item.processado_por_id,
+        usuario_nome=nome_usuario_historico(item.processado_por),
+        observacao=item.observacao or '',
+        numero_carga=item.numero_carga or '',
+        motorista=(item.empenho.motorista if item.empenho else '') or '',
+        placa=item.placa or '',
+        ordem_entrega='',
+    )
+    lancamento.busca_normalizada = _texto_busca_lancamento(
+        lancamento,
+        item.processado_por,
+    )
+    return lancamento
+
+
+def _texto_busca_lancamento(lancamento, usuario, extras=()):
+    return montar_texto_busca([
+        lancamento.lote,
+        lancamento.produto,
+        lancamento.cultivar,
+        lancamento.cliente,
+        lancamento.empresa,
+        lancamento.tipo_original,
+        lancamento.observacao,
+        lancamento.numero_carga,
+        lancamento.motorista,
+        lancamento.placa,
+        lancamento.ordem_entrega,
+        lancamento.endereco_origem,
+        lancamento.endereco_destino,
+        usuario.username if usuario else '',
+        usuario.first_name if usuario else '',
+        usuario.last_name if usuario else '',
+        *extras,
+    ])
+
+
+def _preencher_chave_dedup(lancamento):
+    lancamento.chave_dedup = chave_dedup_historico(
+        lancamento.lote,
+        lancamento.tipo,
+        lancamento.quantidade,
+        lancamento.data_hora,
+        lancamento.numero_carga,
+    )
+    return lancamento
+
+
+def registrar_no_livro(lancamentos):
+    """
+    Grava lançamentos no livro com a chave_dedup preenchida.
+    Lançamentos já registrados para a mesma origem são ignorados.
+    """
+    Livro = _modelo_livro()
+    lancamentos = [_preencher_chave_dedup(lancamento) for lancamento in lancamentos]
+
+    if not lancamentos:
+        return []
+
+    return Livro.objects.bulk_create(lancamentos, ignore_conflicts=True)
+
+
+def _movimentacoes_para_livro(ids):
+    HistoricoMovimentacao = django_apps.get_model('sapp', 'HistoricoMovimentacao')
+
+    return (
+        HistoricoMovimentacao.objects
+        .filter(pk__in=ids)
+        .select_related(
+            'estoque__cultivar',
+            'estoque__peneira',
+            'estoque__categoria',
+            'estoque__tratamento',
+            'estoque__especie',
+            'usuario',
+        )
+        .order_by(F('data_hora').asc(nulls_last=True), 'id')
+    )
+
+
+def _itens_empenho_para_livro(ids):
+    HistoricoItemEmpenho = django_apps.get_model('sapp', 'HistoricoItemEmpenho')
+
+    return (
+        HistoricoItemEmpenho.objects
+        .filter(pk__in=ids)
+        .select_related('empenho', 'processado_por')
+        .order_by(F('processado_em').asc(nulls_last=True), 'id')
+    )
+
+
+def lancamentos_de_movimentacoes(ids):
+    return [
+        montar_lancamento_movimentacao(mov)
+        for mov in _movimentacoes_para_livro(ids)
+    ]
+
+
+def lancamentos_de_itens_empenho(ids):
+    return [
+        montar_lancamento_item_empenho(item)
+        for item in _itens_empenho_para_livro(ids)
+    ]
+
+
+def sincronizar_no_livro(lancamentos):
+    """
+    Atualiza lançamentos já existentes (origem editada) e registra os
+    que ainda não estão no livro. Se a edição mudar a chave_dedup, a
+    tela passa a agrupar o lançamento pela chave nova.
+    """
+    Livro = _modelo_livro()
+    campos = [
+        campo.attname
+        for campo in Livro._meta.concrete_fields
+        if campo.attname not in ('id', 'origem', 'origem_id')
+    ]
+    novos = []
+
+    for lancamento in lancamentos:
+        _preencher_chave_dedup(lancamento)
+
+        atualizados = Livro.objects.filter(
+            origem=lancamento.origem,
+            origem_id=lancamento.origem_id,
+        ).update(**{
+            campo: getattr(lancamento, campo)
+            for campo in campos
+        })
+
+        if not atualizados:
+            novos.append(lancamento)
+
+    return registrar_no_livro(novos)
+
+
+def remover_do_livro(origem, origem_id):
+    """
+    Remove o lançamento de uma origem apagada. Se havia outra ocorrência
+    do mesmo evento, a tela passa a exibi-la.
+    """
+    _modelo_livro().objects.filter(origem=origem, origem_id=origem_id).delete()
+
+
+def _ordem_no_livro(lancamento):
+    # Cronológica, sem data no fim; no mesmo instante o histórico antigo primeiro
+    return (
+        lancamento.data_hora is None,
+        lancamento.data_hora,
+        lancamento.origem != ORIGEM_HISTORICO,
+    )
+
+
+def reconstruir_livro(tamanho_lote=1000, stdout=None):
+    """
+    Apaga e regrava o livro inteiro a partir das duas tabelas de histórico,
+    em ordem cronológica (ids crescentes acompanham a data, e a tela
+    exibe a primeira ocorrência de cada evento).
+
+    As duas origens são lidas em streaming, já ordenadas pelo banco, e
+    intercaladas com heapq.merge: só um lote fica em memória por vez.
+    """
+    Livro = _modelo_livro()
+    HistoricoMovimentacao = django_apps.get_model('sapp', 'HistoricoMovimentacao')
+    HistoricoItemEmpenho = django_apps.get_model('sapp', 'HistoricoItemEmpenho')
+
+    Livro.objects.all().delete()
+
+    antigos = _movimentacoes_para_livro(
+        HistoricoMovimentacao.objects.values('id'),
+    )
+    novos = _itens_empenho_para_livro(
+        HistoricoItemEmpenho.objects.values('id'),
+    )
+    esperado = antigos.count() + novos.count()
+
+    lancamentos = heapq.merge(
+        (
+            montar_lancamento_movimentacao(mov)
+            for mov in antigos.iterator(chunk_size=tamanho_lote)
+        ),
+        (
+            montar_lancamento_item_empenho(item)
+            for item in novos.iterator(chunk_size=tamanho_lote)
+        ),
+        key=_ordem_no_livro,
+    )
+
+    total = 0
+    while bloco := list(islice(lancamentos, tamanho_lote)):
+        registrar_no_livro(bloco)
+        total += len(bloco)
+
+        if stdout:
+            stdout.write(f'   {total}/{esperado} lançamentos gravados')
+
+    return total
+
+
+# ============================================================
+# OPÇÕES DOS FILTROS DO HISTÓRICO GERAL
+# ============================================================
+#
+# Os selects de lote, produto, cliente e usuário saem de DISTINCTs
+# sobre o livro inteiro. As listas ficam no cache junto com as versões
+# que mudam quando o livro muda: HistoricoMovimentacao incrementa a do
+# dashboard e HistoricoItemEmpenho a do quadro. O que não passa por
+# elas (nome de usuário editado, reconstruir_livro) aparece depois de
+# TEMPO_CACHE_OPCOES_HISTORICO.
+
+CHAVE_CACHE_OPCOES_HISTORICO = 'historico:opcoes_filtro'
+TEMPO_CACHE_OPCOES_HISTORICO = 30 * 60  # segundos
+
+
+def _calcular_opcoes_filtro_historico():
+    livro = _modelo_livro().objects.order_by()
+
+    def _lista_distinta(campo):
+        valores = livro.exclude(**{campo: ''}).values_list(campo, flat=True).distinct()
+        return sorted({v.strip() for v in valores if v and v.strip()}, key=str.lower)
+
+    # Usuários (dicionário username -> nome)
+    usuarios = {}
+    for u in livro.exclude(usuario__isnull=True).values('usuario__username', 'usuario__first_name', 'usuario__last_name').distinct():
+        username = u['usuario__username']
+        nome = f"{u['usuario__first_name']} {u['usuario__last_name']}".strip() or username
+        usuarios[username] = nome
+
+    return {
+        'lotes': _lista_distinta('lote'),
+        'produtos': _lista_distinta('produto'),
+        'clientes': _lista_distinta('cliente'),
+        'usuarios': [
+            {'valor': k, 'nome': v}
+            for k, v in sorted(usuarios.items(), key=lambda item: item[1].lower())
+        ],
+    }
+
+
+def opcoes_filtro_historico():
+    """
+    Listas dos selects do historico_geral ({'lotes', 'produtos',
+    'clientes', 'usuarios'}), recalculadas só quando o livro muda.
+    """
+    versoes = [
+        obter_versao(CHAVE_VERSAO_DASHBOARD),
+        obter_versao(CHAVE_VERSAO_KANBAN),
+    ]
+
+    entrada = cache.get(CHAVE_CACHE_OPCOES_HISTORICO)
+    if entrada is not None and entrada['versoes'] == versoes:
+        return entrada['opcoes']
+
+    opcoes = _calcular_opcoes_filtro_historico()
+    cache.set(
+        CHAVE_CACHE_OPCOES_HISTORICO,
+        {'versoes': versoes, 'opcoes': opcoes},
+        TEMPO_CACHE_OPCOES_HISTORICO,
+    )
+    return opcoes
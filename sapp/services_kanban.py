@@ -0,0 +1,322 @@
+# sapp/services_kanban.py
+
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import DecimalField, F, IntegerField, Max, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .services_versao import (
+    CHAVE_VERSAO_KANBAN,
+    incrementar_no_banco,
+    obter_versao,
+    publicar_versao,
+)
+
+
+# ============================================================
+# TOTAIS EMPENHADOS (KG / EMBALAGENS)
+# ============================================================
+#
+# Solicitacao.total_kg_empenhado e total_embalagens_empenhadas guardam
+# a soma dos itens pendentes (ItemEmpenho) dos empenhos do card. Os
+# signals do ItemEmpenho (e do Estoque, quando o peso unitário muda)
+# chamam atualizar_totais_empenho dentro da mesma transação: um UPDATE
+# com as somas calculadas no banco, sem carregar os itens. Caminhos
+# que mexem nos itens por queryset.update/bulk_create chamam a função
+# diretamente. Correção geral: comando recalcular_totais_empenho.
+
+CAMPO_KG = DecimalField(max_digits=18, decimal_places=2)
+
+
+def _itens_da_solicitacao(ItemEmpenho):
+    return (
+        ItemEmpenho.objects
+        .filter(empenho__solicitacao_id=OuterRef('pk'))
+        .order_by()
+        .values('empenho__solicitacao_id')
+    )
+
+
+def _subquery_kg_empenhado(ItemEmpenho):
+    """Soma de quantidade × peso unitário do estoque dos itens pendentes"""
+    return Subquery(
+        _itens_da_solicitacao(ItemEmpenho)
+        .filter(estoque__isnull=False)
+        .annotate(total=Sum(F('quantidade') * F('estoque__peso_unitario'), output_field=CAMPO_KG))
+        .values('total')[:1],
+        output_field=CAMPO_KG,
+    )
+
+
+def _subquery_embalagens_empenhadas(ItemEmpenho):
+    return Subquery(
+        _itens_da_solicitacao(ItemEmpenho)
+        .annotate(total=Sum('quantidade'))
+        .values('total')[:1],
+        output_field=IntegerField(),
+    )
+
+
+def atualizar_totais_empenho(solicitacoes=None):
+    """
+    Regrava os totais empenhados das solicitações informadas (ids ou
+    queryset de ids; None = todas) num único UPDATE. Retorna quantas
+    solicitações foram atualizadas.
+    """
+    from .models import ItemEmpenho, Solicitacao
+
+    alvo = Solicitacao.objects.all()
+    if solicitacoes is not None:
+        alvo = alvo.filter(pk__in=solicitacoes)
+
+    return alvo.update(
+        total_kg_empenhado=Coalesce(_subquery_kg_empenhado(ItemEmpenho), Value(Decimal('0.00')), output_field=CAMPO_KG),
+        total_embalagens_empenhadas=Coalesce(_subquery_embalagens_empenhadas(ItemEmpenho), Value(0)),
+    )
+
+
+def solicitacoes_dos_empenhos(empenho_ids):
+    """Queryset com os ids das solicitações dos empenhos (para usar como subconsulta)"""
+    from .models import Empenho
+
+    return (
+        Empenho.objects
+        .filter(pk__in=empenho_ids, solicitacao_id__isnull=False)
+        .values('solicitacao_id')
+    )
+
+
+def kg_empenhado(solicitacao):
+    """
+    Kg empenhado da solicitação (total gravado, sem consulta).
+    Só faz sentido para solicitações controladas em QUILOGRAMA.
+    """
+    return solicitacao.quantidade_empenhada_kg
+
+
+# ============================================================
+# LOTES E EMBALAGENS DOS CARDS
+# ============================================================
+
+def lotes_e_embalagens(solicitacao_ids):
+    """
+    Lotes e embalagens (pendentes e já processados) de várias
+    solicitações em UMA única consulta.
+
+    Itens pendentes (ItemEmpenho) e processados (HistoricoItemEmpenho)
+    são unidos com UNION, já sem repetições de
+    (solicitação, lote, embalagem).
+
+    Retorna {solicitacao_id: {'lotes': [...], 'embalagens': [...]}},
+    com listas ordenadas; solicitações sem itens ficam com listas vazias.
+    """
+    from .models import HistoricoItemEmpenho, ItemEmpenho
+
+    solicitacao_ids = list(solicitacao_ids)
+
+    if not solicitacao_ids:
+        return {}
+
+    resultado = {
+        solicitacao_id: {
+            'lotes': set(),
+            'embalagens': set(),
+        }
+        for solicitacao_id in solicitacao_ids
+    }
+
+    pendentes = (
+        ItemEmpenho.objects
+        .filter(empenho__solicitacao_id__in=solicitacao_ids)
+        .order_by()
+        .values_list(
+            'empenho__solicitacao_id',
+            'lote',
+            'embalagem_snapshot',
+        )
+    )
+
+    processados = (
+        HistoricoItemEmpenho.objects
+        .filter(empenho__solicitacao_id__in=solicitacao_ids)
+        .order_by()
+        .values_list(
+            'empenho__solicitacao_id',
+            'lote',
+            'embalagem',
+        )
+    )
+
+    for solicitacao_id, lote, embalagem in pendentes.union(processados):
+        dados = resultado.get(solicitacao_id)
+
+        if dados is None:
+            continue
+
+        lote = str(lote or '').strip()
+        if lote:
+            dados['lotes'].add(lote)
+
+        embalagem = str(embalagem or '').strip().upper()
+        if embalagem:
+            dados['embalagens'].add(embalagem)
+
+    return {
+        solicitacao_id: {
+            'lotes': sorted(dados['lotes']),
+            'embalagens': sorted(dados['embalagens']),
+        }
+        for solicitacao_id, dados in resultado.items()
+    }
+
+
+# ============================================================
+# VERSÃO POR CARD (DELTA DO QUADRO)
+# ============================================================
+#
+# Os signals do quadro chamam marcar_cards_alterados com os cards
+# afetados. Após o commit, numa transação só, a versão do quadro é
+# incrementada e os cards recebem essa versão em versao_kanban; cards
+# excluídos viram CardKanbanRemovido. Assim api_kanban_dados?since=V
+# devolve só os cards com versao_kanban > V e os removidos depois de V.
+#
+# Mudanças de estrutura (colunas, tags) e a limpeza dos removidos
+# antigos sobem a versão de corte: deltas pedidos a partir de uma
+# versão abaixo do corte recebem o quadro completo.
+
+CHAVE_CORTE_KANBAN = 'kanban_corte'
+RETENCAO_REMOVIDOS = timedelta(days=30)
+
+
+def marcar_cards_alterados(solicitacao_ids=(), empenho_ids=(), removidos=(), estrutura=False):
+    """
+    Junta os cards alterados na transação atual em um único incremento
+    da versão do quadro, feito após o commit (mesmo esquema de
+    incrementar_versao, que continua reconhecendo o agendamento).
+
+    empenho_ids: resolvidos para a solicitação só no commit (evita uma
+    consulta por ItemEmpenho salvo).
+    """
+    conexao = transaction.get_connection()
+
+    for _, funcao, *_ in conexao.run_on_commit:
+        pendentes = getattr(funcao, 'cards_kanban', None)
+        # Já executado (captureOnCommitCallbacks nos testes) não recebe mais cards
+        if pendentes is not None and not pendentes['gravado']:
+            break
+    else:
+        pendentes = {
+            'solicitacoes': set(),
+            'empenhos': set(),
+            'removidos': set(),
+            'estrutura': False,
+            'gravado': False,
+        }
+
+        def _executar():
+            pendentes['gravado'] = True
+            _gravar_versao_dos_cards(pendentes)
+
+        _executar.cards_kanban = pendentes
+        _executar.versao_chave = CHAVE_VERSAO_KANBAN
+        transaction.on_commit(_executar)
+
+    pendentes['solicitacoes'].update(pk for pk in solicitacao_ids if pk)
+    pendentes['empenhos'].update(pk for pk in empenho_ids if pk)
+    pendentes['removidos'].update(pk for pk in removidos if pk)
+    pendentes['estrutura'] = pendentes['estrutura'] or estrutura
+
+
+def _subir_corte(versao):
+    """A versão de corte só aumenta."""
+    from .models import ContadorVersao
+
+    contador, criado = ContadorVersao.objects.get_or_create(
+        chave=CHAVE_CORTE_KANBAN,
+        defaults={'valor': versao},
+    )
+    if not criado:
+        ContadorVersao.objects.filter(pk=contador.pk, valor__lt=versao).update(valor=versao)
+
+
+def _limpar_removidos_antigos():
+    from .models import CardKanbanRemovido
+
+    antigos = CardKanbanRemovido.objects.filter(
+        removido_em__lt=timezone.now() - RETENCAO_REMOVIDOS
+    )
+    maior = antigos.aggregate(maior=Max('versao'))['maior']
+
+    if maior:
+        antigos.delete()
+        _subir_corte(maior)
+
+    return maior
+
+
+def _gravar_versao_dos_cards(pendentes):
+    from .models import CardKanbanRemovido, Empenho, Solicitacao
+
+    removidos = pendentes['removidos']
+    corte_alterado = False
+
+    with transaction.atomic():
+        versao = incrementar_no_banco(CHAVE_VERSAO_KANBAN)
+
+        ids = set(pendentes['solicitacoes'])
+        if pendentes['empenhos']:
+            ids.update(
+                Empenho.objects
+                .filter(pk__in=pendentes['empenhos'], solicitacao__isnull=False)
+                .values_list('solicitacao_id', flat=True)
+            )
+
+        # update() não dispara signals nem mexe em data_atualizacao
+        Solicitacao.objects.filter(pk__in=ids - removidos).update(versao_kanban=versao)
+
+        if removidos:
+            CardKanbanRemovido.objects.bulk_create([
+                CardKanbanRemovido(card_id=pk, versao=versao)
+                for pk in sorted(removidos)
+            ])
+            corte_alterado = bool(_limpar_removidos_antigos())
+
+        if pendentes['estrutura']:
+            _subir_corte(versao)
+            corte_alterado = True
+
+    # Só depois do commit: quem acordar com a versão nova já vê os carimbos
+    if corte_alterado:
+        publicar_versao(CHAVE_CORTE_KANBAN)
+    publicar_versao(CHAVE_VERSAO_KANBAN, versao)
+
+
+def alteracoes_desde(versao_cliente):
+    """
+    Cards alterados e removidos depois de `versao_cliente`.
+
+    Retorna (queryset de Solicitacao, [ids removidos]) ou None quando
+    o delta não é confiável (versão abaixo do corte ou acima da atual)
+    e o cliente deve recarregar o quadro completo.
+    """
+    from .models import CardKanbanRemovido, Solicitacao
+
+    if versao_cliente < obter_versao(CHAVE_CORTE_KANBAN):
+        return None
+
+    if versao_cliente > obter_versao(CHAVE_VERSAO_KANBAN):
+        return None
+
+    alterados = Solicitacao.objects.filter(versao_kanban__gt=versao_cliente)
+
+    removidos = sorted(set(
+        CardKanbanRemovido.objects
+        .filter(versao__gt=versao_cliente)
+        .values_list('card_id', flat=True)
+    ))
+
+    return alterados, removidos
+
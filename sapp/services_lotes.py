@@ -0,0 +1,141 @@
+# sapp/services_lotes.py
+
+import threading
+from collections import OrderedDict
+
+from .services_estoque import normalizar_busca
+from .services_versao import CHAVE_VERSAO_DASHBOARD, obter_versao
+
+
+# ============================================================
+# BUSCA DE LOTES (AUTOCOMPLETE)
+# ============================================================
+#
+# Os autocompletes de lote (nova entrada, modal do estoque) consultam
+# o ResumoLote, que tem uma linha por lote: o código normalizado
+# (lote_busca, indexado) e o registro mais recente do lote no
+# Estoque, de onde vêm os atributos para preencher o formulário.
+#
+# 1. Primeiro os lotes que COMEÇAM com o termo (LIKE 'termo%' pelo
+#    índice, em ordem alfabética);
+# 2. se faltar, os que apenas contêm o termo.
+# Os dois passos têm LIMIT no SQL. O resultado fica num LRU pequeno
+# do processo, com a versão do dashboard na chave: qualquer alteração
+# no Estoque troca a versão e as entradas antigas deixam de ser usadas.
+
+LIMITE_SUGESTOES = 10
+TAMANHO_MINIMO_TERMO = 2
+TAMANHO_CACHE_LOCAL = 256
+
+
+class CacheLRU:
+    """LRU em memória do processo, seguro entre threads"""
+
+    def __init__(self, tamanho):
+        self.tamanho = tamanho
+        self._itens = OrderedDict()
+        self._trava = threading.Lock()
+
+    def get(self, chave):
+        with self._trava:
+            if chave not in self._itens:
+                return None
+            self._itens.move_to_end(chave)
+            return self._itens[chave]
+
+    def set(self, chave, valor):
+        with self._trava:
+            self._itens[chave] = valor
+            self._itens.move_to_end(chave)
+            while len(self._itens) > self.tamanho:
+                self._itens.popitem(last=False)
+
+    def clear(self):
+        with self._trava:
+            self._itens.clear()
+
+
+cache_sugestoes = CacheLRU(TAMANHO_CACHE_LOCAL)
+
+
+def serializar_lote(resumo):
+    """Dados do lote (registro mais recente) para preencher os formulários"""
+    estoque = resumo.estoque_recente
+
+    return {
+        'lote': resumo.lote,
+        'estoque_id': estoque.id,
+        'produto': estoque.produto or '',
+        'cultivar': estoque.cultivar.nome if estoque.cultivar_id else '',
+        'cultivar_id': estoque.cultivar_id,
+        'peneira_id': estoque.peneira_id,
+        'categoria_id': estoque.categoria_id,
+        'tratamento_id': estoque.tratamento_id,
+        'especie_id': estoque.especie_id,
+        'empresa': estoque.empresa or '',
+        'cliente': estoque.cliente or '',
+        'origem_destino': estoque.origem_destino or '',
+        'peso_unitario': str(estoque.peso_unitario),
+        'embalagem': estoque.embalagem,
+        'az': estoque.az or '',
+        'observacao': estoque.observacao or '',
+        'endereco': estoque.endereco,
+        # Totais do lote (todos os endereços)
+        'saldo': resumo.saldo,
+        'disponivel': resumo.disponivel,
+    }
+
+
+def _lotes_com_registro():
+    from .models import ResumoLote
+
+    return (
+        ResumoLote.objects
+        .filter(estoque_recente__isnull=False)
+        .select_related('estoque_recente__cultivar')
+    )
+
+
+def _buscar_no_banco(termo, limite):
+    lotes = list(
+        _lotes_com_registro()
+        .filter(lote_busca__startswith=termo)
+        .order_by('lote_busca')[:limite]
+    )
+
+    if len(lotes) < limite:
+        lotes += list(
+            _lotes_com_registro()
+            .filter(lote_busca__contains=termo)
+            .exclude(lote_busca__startswith=termo)
+            .order_by('lote_busca')[:limite - len(lotes)]
+        )
+
+    return [serializar_lote(resumo) for resumo in lotes]
+
+
+def buscar_lotes(termo, limite=LIMITE_SUGESTOES):
+    """
+    Até `limite` lotes distintos para o termo digitado (prefixo
+    primeiro). Lista de dicionários de serializar_lote.
+    """
+    termo = normalizar_busca(termo)[:50]
+
+    if len(termo) < TAMANHO_MINIMO_TERMO:
+        return []
+
+    chave = (obter_versao(CHAVE_VERSAO_DASHBOARD), termo, limite)
+    lotes = cache_sugestoes.get(chave)
+
+    if lotes is None:
+        lotes = _buscar_no_banco(termo, limite)
+        cache_sugestoes.set(chave, lotes)
+
+    # Cópias: quem chama pode alterar os dicionários
+    return [dict(lote) for lote in lotes]
+
+
+def dados_do_lote(lote):
+    """Dados do registro mais recente do lote (leitura pela chave) ou None"""
+    resumo = _lotes_com_registro().filter(pk=lote).first()
+    return serializar_lote(resumo) if resumo else None
@@ -0,0 +1,207 @@
+# sapp/services_mapa.py
+
+import re
+
+from django.db.models import Count, Q, Sum
+
+
+# ============================================================
+# ENDEREÇO NORMALIZADO
+# ============================================================
+#
+# Estoque.endereco é digitado à mão (" r-a  ln01 p01 ") e o
+# identificador dos retângulos do mapa nem sempre segue o mesmo
+# padrão. Os dois lados passam por normalizar_endereco; no Estoque o
+# resultado fica gravado em endereco_normalizado (mantido pelo save()
+# e indexado para os lotes com saldo), então a ocupação do mapa é
+# uma consulta agrupada por endereço, sem normalizar linha a linha.
+
+def normalizar_endereco(endereco):
+    """Maiúsculo, sem espaços nas pontas e com espaços internos simples"""
+    return ' '.join(str(endereco or '').split()).upper()
+
+
+# ============================================================
+# RUA / LINHA / POSIÇÃO
+# ============================================================
+#
+# Endereços seguem R-A LN10 P02 (ou só R-A LN10, R-A GERAL, R-A).
+# Estoque, Endereco e ElementoMapa guardam rua/linha/posição já
+# separadas (preenchidas no save() e pelo comando
+# preencher_enderecos_estruturados), e consultas por linha viram uma
+# faixa no índice (rua, linha, posicao) em vez de regex por registro.
+
+PADRAO_ENDERECO = re.compile(r'^(R-[A-Z]+)(?:\s+(LN\d+|GERAL)(?:\s+P(\d+))?)?$')
+
+CAMPOS_ENDERECO_ESTRUTURADO = ('rua', 'linha', 'posicao')
+
+
+def decompor_endereco(endereco):
+    """
+    {'rua', 'linha', 'posicao'} de um endereço; campos ausentes ficam
+    '' (rua/linha) ou None (posição). Fora do padrão: tudo vazio.
+
+    "R-A LN10 P02" -> {'rua': 'R-A', 'linha': 'LN10', 'posicao': 2}
+    "R-A GERAL"    -> {'rua': 'R-A', 'linha': 'GERAL', 'posicao': None}
+    """
+    match = PADRAO_ENDERECO.match(normalizar_endereco(endereco))
+
+    if not match:
+        return {'rua': '', 'linha': '', 'posicao': None}
+
+    rua, linha, posicao = match.groups()
+
+    return {
+        'rua': rua,
+        'linha': linha or '',
+        'posicao': int(posicao) if posicao else None,
+    }
+
+
+def preencher_endereco_estruturado(instancia, endereco):
+    """Copia rua/linha/posição do endereço para a instância (sem salvar)"""
+    for campo, valor in decompor_endereco(endereco).items():
+        setattr(instancia, campo, valor)
+
+
+def q_posicoes_apos(rua, linha, posicao):
+    """Posições da mesma rua+linha depois da posição informada"""
+    return Q(rua=rua, linha=linha, posicao__gt=posicao)
+
+
+def enderecos_do_armazem(elementos):
+    """Endereços normalizados dos retângulos de um armazém"""
+    return sorted({
+        normalizar_endereco(elemento.identificador)
+        for elemento in elementos
+        if elemento.tipo == 'RETANGULO' and normalizar_endereco(elemento.identificador)
+    })
+
+
+# ============================================================
+# OCUPAÇÃO POR ENDEREÇO
+# ============================================================
+
+def _estoque_ocupado(enderecos):
+    from .models import Estoque
+
+    return Estoque.objects.filter(
+        endereco_normalizado__in=list(enderecos),
+        saldo__gt=0,
+    )
+
+
+def ocupacao_por_endereco(enderecos):
+    """
+    Totais por endereço em UMA consulta agrupada, restrita aos
+    endereços informados (os do armazém).
+
+    Retorna {endereco: {'lotes', 'saldo', 'clientes'}}; endereços
+    vazios não aparecem.
+    """
+    if not enderecos:
+        return {}
+
+    linhas = (
+        _estoque_ocupado(enderecos)
+        .order_by()
+        .values('endereco_normalizado')
+        .annotate(
+            lotes=Count('id'),
+            saldo=Sum('saldo'),
+            clientes=Count('cliente', distinct=True, filter=~Q(cliente='')),
+        )
+    )
+
+    return {
+        linha['endereco_normalizado']: {
+            'lotes': linha['lotes'],
+            'saldo': linha['saldo'] or 0,
+            'clientes': linha['clientes'],
+        }
+        for linha in linhas
+    }
+
+
+def lotes_por_endereco(enderecos):
+    """
+    Lotes de cada endereço (para o tooltip do mapa) em UMA consulta,
+    só com as colunas usadas e restrita aos endereços informados.
+
+    Retorna {endereco: [{'lote', 'produto', 'qtd', 'embalagem', 'cliente'}]}.
+    """
+    if not enderecos:
+        return {}
+
+    linhas = (
+        _estoque_ocupado(enderecos)
+        .order_by('endereco_normalizado', 'lote', 'id')
+        .values_list('endereco_normalizado', 'lote', 'produto', 'saldo', 'embalagem', 'cliente')
+    )
+
+    ocupacao = {}
+
+    for endereco, lote, produto, saldo, embalagem, cliente in linhas:
+        ocupacao.setdefault(endereco, []).append({
+            'lote': lote,
+            'produto': str(produto or 'S/ Produto'),
+            'qtd': float(saldo),
+            'embalagem': str(embalagem),
+            'cliente': str(cliente or '-'),
+        })
+
+    return ocupacao
+
+
+# ============================================================
+# CARGA / CORREÇÃO DOS CAMPOS DERIVADOS
+# ============================================================
+
+def atualizar_enderecos_estruturados(queryset, campo_origem, campos_extras=None, tamanho_lote=1000):
+    """
+    Recalcula rua/linha/posição (e os campos extras, calculados a
+    partir do endereço) dos registros do queryset. Retorna quantos mudaram.
+
+    campos_extras: {campo: função(endereco)}, ex. endereco_normalizado.
+    """
+    Modelo = queryset.model
+    campos_extras = campos_extras or {}
+    campos = list(CAMPOS_ENDERECO_ESTRUTURADO) + list(campos_extras)
+
+    alterados = []
+    total = 0
+
+    linhas = (
+        queryset
+        .order_by('pk')
+        .values_list('pk', campo_origem, *campos)
+        .iterator(chunk_size=tamanho_lote)
+    )
+
+    for pk, endereco, *atuais in linhas:
+        novos = decompor_endereco(endereco)
+        for campo, funcao in campos_extras.items():
+            novos[campo] = funcao(endereco)
+
+        if [novos[campo] for campo in campos] != atuais:
+            alterados.append(Modelo(pk=pk, **novos))
+
+        if len(alterados) >= tamanho_lote:
+            Modelo.objects.bulk_update(alterados, campos)
+            total += len(alterados)
+            alterados = []
+
+    if alterados:
+        Modelo.objects.bulk_update(alterados, campos)
+        total += len(alterados)
+
+    return total
+
+
+def atualizar_enderecos_do_estoque(queryset, tamanho_lote=1000):
+    return atualizar_enderecos_estruturados(
+        queryset,
+        'endereco',
+        campos_extras={'endereco_normalizado': lambda endereco: normalizar_endereco(endereco)[:50]},
+        tamanho_lote=tamanho_lote,
+    )
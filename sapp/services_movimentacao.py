@@ -0,0 +1,529 @@
+# sapp/services_movimentacao.py
+
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, DecimalField, ExpressionWrapper, F, IntegerField, Value, When
+from django.utils import timezone
+
+from .services_dashboard import agendar_recalculo_resumo, dia_local
+from .services_estoque import recalcular_resumo_lotes
+from .services_historico import lancamentos_de_movimentacoes, registrar_no_livro
+from .services_mapa import normalizar_endereco, preencher_endereco_estruturado
+from .services_versao import CHAVE_VERSAO_DASHBOARD, incrementar_versao
+
+
+# ============================================================
+# MOVIMENTAÇÃO EM LOTE (EXPEDIÇÃO / TRANSFERÊNCIA)
+# ============================================================
+#
+# Carregamento de caminhão: várias linhas (estoque, quantidade,
+# destino) numa única transação.
+#
+# 1. Uma leitura com SELECT ... FOR UPDATE trava todas as origens e
+#    TODAS as linhas são validadas antes de gravar qualquer coisa.
+#    Uma linha inválida cancela o lote inteiro.
+# 2. Origens e destinos existentes são atualizados com um UPDATE cada
+#    (F() + CASE por id); destinos novos e históricos vão por
+#    bulk_create.
+# 3. bulk_create/update não disparam signals: livro de movimentações,
+#    resumo diário do dashboard, resumo dos lotes (ResumoLote) e versão
+#    do dashboard são atualizados aqui mesmo.
+#
+# Só movimenta o disponível (saldo - empenhado). A parte empenhada
+# continua saindo pelo card, e a transferência avulsa de um lote com
+# reserva continua sendo feita pela tela de transferência.
+
+TIPO_EXPEDICAO = 'EXPEDICAO'
+TIPO_TRANSFERENCIA = 'TRANSFERENCIA'
+TIPOS_LINHA = (TIPO_EXPEDICAO, TIPO_TRANSFERENCIA)
+
+LIMITE_LINHAS = 200
+
+CAMPOS_CARGA = ('numero_carga', 'motorista', 'placa', 'cliente', 'observacao')
+
+
+class MovimentacaoEmLoteInvalida(Exception):
+    """Alguma linha (ou a carga) não passou na validação; nada foi gravado"""
+
+    def __init__(self, resultados, erros_gerais=None):
+        self.resultados = resultados
+        self.erros_gerais = erros_gerais or []
+        super().__init__('Movimentação em lote inválida')
+
+
+def _inteiro(valor):
+    try:
+        return int(str(valor).strip())
+    except (TypeError, ValueError):
+        return None
+
+
+def _normalizar_linha(numero, dados):
+    if not isinstance(dados, dict):
+        dados = {}
+
+    return {
+        'linha': numero,
+        'estoque_id': _inteiro(dados.get('estoque_id')),
+        'quantidade': _inteiro(dados.get('quantidade')),
+        'tipo': str(dados.get('tipo') or TIPO_EXPEDICAO).strip().upper(),
+        'endereco': str(dados.get('endereco') or '').strip().upper(),
+    }
+
+
+# ============================================================
+# VALIDAÇÃO
+# ============================================================
+
+def _validar_carga(linhas, carga, fotos):
+    erros = []
+
+    if not linhas:
+        erros.append('Nenhuma linha informada.')
+
+    if len(linhas) > LIMITE_LINHAS:
+        erros.append(f'Máximo de {LIMITE_LINHAS} linhas por lote.')
+
+    if any(linha['tipo'] == TIPO_EXPEDICAO for linha in linhas):
+        if not carga['numero_carga']:
+            erros.append('Número da Carga é obrigatório.')
+        if not carga['motorista']:
+            erros.append('Motorista é obrigatório.')
+        if not carga['placa']:
+            erros.append('Placa é obrigatória.')
+        if not fotos:
+            erros.append('Pelo menos uma foto é obrigatória na expedição.')
+
+    return erros
+
+
+def _validar_linha(linha, origem, usado):
+    """Mensagem de erro da linha (None se válida); acumula o usado por origem"""
+    if linha['tipo'] not in TIPOS_LINHA:
+        return f'Tipo inválido: {linha["tipo"]}.'
+
+    if origem is None:
+        return 'Registro de estoque não encontrado.'
+
+    quantidade = linha['quantidade']
+
+    if not quantidade or quantidade <= 0:
+        return 'Quantidade inválida.'
+
+    if linha['tipo'] == TIPO_TRANSFERENCIA:
+        if not linha['endereco']:
+            return 'Novo endereço é obrigatório para transferência.'
+        if linha['endereco'] == (origem.endereco or '').strip().upper():
+            return 'O destino é o próprio endereço de origem.'
+
+    disponivel = max(0, int(origem.saldo or 0) - int(origem.empenhado or 0)) - usado[origem.pk]
+
+    if quantidade > disponivel:
+        if origem.empenhado:
+            return (
+                f'O registro possui {origem.empenhado} unidade(s) empenhada(s); '
+                f'em lote só é permitido movimentar o disponível ({max(0, disponivel)}).'
+            )
+        return f'Quantidade acima do disponível ({max(0, disponivel)}).'
+
+    usado[origem.pk] += quantidade
+    return None
+
+
+# ============================================================
+# EXPRESSÕES (UPDATE ÚNICO POR CONJUNTO DE LINHAS)
+# ============================================================
+
+def _quantidade_por_id(quantidades):
+    return Case(
+        *[When(pk=pk, then=Value(quantidade)) for pk, quantidade in quantidades.items()],
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+
+
+def _peso_total(saldo):
+    return ExpressionWrapper(
+        saldo * F('peso_unitario'),
+        output_field=DecimalField(max_digits=10, decimal_places=2),
+    )
+
+
+def _baixar_origens(baixas, expedidos, agora):
+    """saida += quantidade, com saldo/peso/status recalculados como no save()"""
+    from .models import Estoque
+
+    Estoque.objects.filter(pk__in=baixas).update(
+        saida=F('saida') + _quantidade_por_id(baixas),
+        saldo=F('entrada') - F('saida') - _quantidade_por_id(baixas),
+        peso_total=_peso_total(F('entrada') - F('saida') - _quantidade_por_id(baixas)),
+        status=Case(
+            When(entrada__gt=F('saida') + _quantidade_por_id(baixas), then=Value('ATIVO')),
+            default=Value('ESGOTADO'),
+        ),
+        data_ultima_saida=Case(
+            When(pk__in=expedidos, then=Value(agora)),
+            default=F('data_ultima_saida'),
+        ),
+        data_ultima_movimentacao=agora,
+    )
+
+
+def _creditar_destinos(creditos, agora):
+    """entrada += quantidade nos destinos que já existiam"""
+    from .models import Estoque
+
+    if not creditos:
+        return
+
+    Estoque.objects.filter(pk__in=creditos).update(
+        entrada=F('entrada') + _quantidade_por_id(creditos),
+        saldo=F('entrada') + _quantidade_por_id(creditos) - F('saida'),
+        peso_total=_peso_total(F('entrada') + _quantidade_por_id(creditos) - F('saida')),
+        status=Case(
+            When(saida__lt=F('entrada') + _quantidade_por_id(creditos), then=Value('ATIVO')),
+            default=Value('ESGOTADO'),
+        ),
+        data_ultima_movimentacao=agora,
+    )
+
+
+# ============================================================
+# DESTINOS DAS TRANSFERÊNCIAS
+# ============================================================
+
+def _chave_destino(estoque, endereco):
+    """Mesmos critérios da transferência avulsa para somar num registro existente"""
+    return (
+        estoque.lote,
+        estoque.cultivar_id,
+        estoque.especie_id,
+        estoque.peneira_id,
+        estoque.categoria_id,
+        estoque.tratamento_id,
+        estoque.embalagem,
+        estoque.empresa or '',
+        estoque.cliente or '',
+        endereco,
+        estoque.peso_unitario,
+    )
+
+
+def _novo_destino(origem, endereco, quantidade, usuario, status_inicial_id):
+    """Registro de destino montado como o save() montaria (bulk_create não chama save)"""
+    from .models import Estoque
+
+    destino = Estoque(
+        lote=origem.lote,
+        endereco=endereco,
+        endereco_normalizado=normalizar_endereco(endereco),
+        entrada=quantidade,
+        saida=0,
+        saldo=quantidade,
+        status='ATIVO',
+        conferente=usuario,
+        origem_destino=f'Transferência de {origem.endereco}',
+        produto=origem.produto or '',
+        cliente=origem.cliente or '',
+        empresa=origem.empresa or '',
+        az=origem.az or '',
+        peso_unitario=origem.peso_unitario,
+        peso_total=(
+            Decimal(quantidade) * (origem.peso_unitario or Decimal('0.00'))
+        ).quantize(Decimal('0.01')),
+        embalagem=origem.embalagem,
+        observacao=origem.observacao or '',
+        especie=origem.especie,
+        cultivar=origem.cultivar,
+        peneira=origem.peneira,
+        categoria=origem.categoria,
+        tratamento=origem.tratamento,
+        status_sistemico_id=status_inicial_id,
+    )
+    preencher_endereco_estruturado(destino, endereco)
+    destino.busca_normalizada = destino.montar_busca_normalizada()
+    return destino
+
+
+def _resolver_destinos(transferencias, origens, usuario, agora):
+    """
+    Agrupa as transferências por destino, soma nos registros existentes
+    e cria os que faltam. Retorna {chave: (destino, saldo_antes, criado)}.
+    """
+    from .models import Estoque, StatusSistemico
+
+    creditos = defaultdict(int)
+    origem_da_chave = {}
+
+    for linha in transferencias:
+        origem = origens[linha['estoque_id']]
+        chave = _chave_destino(origem, linha['endereco'])
+        creditos[chave] += linha['quantidade']
+        origem_da_chave.setdefault(chave, origem)
+
+    if not creditos:
+        return {}
+
+    existentes = {}
+    candidatos = (
+        Estoque.objects
+        .select_for_update(of=('self',))
+        .filter(
+            lote__in={chave[0] for chave in creditos},
+            endereco__in={chave[9] for chave in creditos},
+            saldo__gt=0,
+        )
+        .order_by('pk')
+    )
+    for estoque in candidatos:
+        existentes.setdefault(_chave_destino(estoque, estoque.endereco), estoque)
+
+    destinos = {}
+    novos = []
+    status_inicial_id = StatusSistemico.obter_id_status_inicial()
+
+    for chave, quantidade in creditos.items():
+        destino = existentes.get(chave)
+
+        if destino is not None:
+            destinos[chave] = (destino, int(destino.saldo or 0), False)
+            continue
+
+        destino = _novo_destino(
+            origem_da_chave[chave],
+            chave[9],
+            quantidade,
+            usuario,
+            status_inicial_id,
+        )
+        novos.append(destino)
+        destinos[chave] = (destino, 0, True)
+
+    _creditar_destinos(
+        {
+            destino.pk: creditos[chave]
+            for chave, (destino, _, criado) in destinos.items()
+            if not criado
+        },
+        agora,
+    )
+    Estoque.objects.bulk_create(novos)
+
+    return destinos
+
+
+# ============================================================
+# HISTÓRICO E FOTOS
+# ============================================================
+
+def _descricao_expedicao(quantidade, saldo, carga, usuario, agora):
+    responsavel = usuario.get_full_name() or usuario.username
+    data = timezone.localtime(agora).strftime('%d/%m/%Y %H:%M')
+    obs = carga['observacao']
+
+    return f"""
+        <div class="d-flex flex-column gap-1">
+            <div class="d-flex justify-content-between border-bottom pb-1">
+                <span><strong>Qtd Expedida:</strong> <span class="text-danger">-{quantidade}</span></span>
+                <span><strong>Saldo Restante:</strong> {saldo}</span>
+            </div>
+            <div class="small text-muted mt-1">
+                <i class="fas fa-truck"></i> <strong>Carga:</strong> {carga['numero_carga']} | <strong>Placa:</strong> {carga['placa']}<br>
+                <i class="fas fa-id-card"></i> <strong>Motorista:</strong> {carga['motorista']}<br>
+                <i class="fas fa-building"></i> <strong>Cliente:</strong> {carga['cliente'] or 'N/A'}<br>
+                <i class="fas fa-user"></i> <strong>Responsável:</strong> {responsavel}<br>
+                <i class="fas fa-clock"></i> <strong>Data/Hora:</strong> {data}
+            </div>
+            {f'<div class="mt-1 p-1 bg-light rounded small"><strong>Obs:</strong> {obs}</div>' if obs else ''}
+        </div>
+    """
+
+
+def _salvar_fotos(fotos, historicos):
+    """Grava cada arquivo uma vez e vincula a todos os históricos de saída"""
+    from .models import FotoMovimentacao
+
+    if not fotos or not historicos:
+        return 0
+
+    campo = FotoMovimentacao._meta.get_field('arquivo')
+    nomes = [
+        campo.storage.save(
+            campo.generate_filename(None, foto.name),
+            foto,
+            max_length=campo.max_length,
+        )
+        for foto in fotos
+    ]
+
+    FotoMovimentacao.objects.bulk_create([
+        FotoMovimentacao(historico=historico, arquivo=nome)
+        for historico in historicos
+        for nome in nomes
+    ])
+
+    return len(nomes)
+
+
+# ============================================================
+# API DO SERVIÇO
+# ============================================================
+
+def movimentar_em_lote(linhas, usuario, carga=None, fotos=()):
+    """
+    Aplica expedições/transferências em uma única transação.
+
+    linhas: [{'estoque_id', 'quantidade', 'tipo' (EXPEDICAO|TRANSFERENCIA),
+              'endereco' (destino da transferência)}, ...]
+    carga:  {'numero_carga', 'motorista', 'placa', 'cliente', 'observacao'}
+            (obrigatório quando há expedição, junto com as fotos)
+
+    Retorna o resultado por linha. Se alguma linha for inválida, levanta
+    MovimentacaoEmLoteInvalida com o resultado de cada linha e nada é gravado.
+    """
+    from .models import Estoque, HistoricoMovimentacao
+
+    carga = {
+        campo: str((carga or {}).get(campo) or '').strip()
+        for campo in CAMPOS_CARGA
+    }
+    linhas = [
+        _normalizar_linha(numero, dados)
+        for numero, dados in enumerate(linhas or [], start=1)
+    ]
+    fotos = list(fotos or [])
+
+    erros_gerais = _validar_carga(linhas, carga, fotos)
+
+    with transaction.atomic():
+        ids = {linha['estoque_id'] for linha in linhas if linha['estoque_id']}
+
+        # Uma leitura trava todas as origens (ordem por pk evita deadlock)
+        origens = {
+            estoque.pk: estoque
+            for estoque in (
+                Estoque.objects
+                .select_for_update(of=('self',))
+                .select_related('cultivar', 'peneira', 'categoria', 'tratamento', 'especie')
+                .filter(pk__in=ids)
+                .order_by('pk')
+            )
+        }
+
+        usado = defaultdict(int)
+        resultados = []
+
+        for linha in linhas:
+            erro = _validar_linha(linha, origens.get(linha['estoque_id']), usado)
+            resultados.append({
+                'linha': linha['linha'],
+                'estoque_id': linha['estoque_id'],
+                'tipo': linha['tipo'],
+                'quantidade': linha['quantidade'],
+                'ok': erro is None,
+                'erro': erro,
+            })
+
+        if erros_gerais or any(not resultado['ok'] for resultado in resultados):
+            raise MovimentacaoEmLoteInvalida(resultados, erros_gerais)
+
+        agora = timezone.now()
+
+        baixas = defaultdict(int)
+        for linha in linhas:
+            baixas[linha['estoque_id']] += linha['quantidade']
+
+        _baixar_origens(
+            baixas,
+            {linha['estoque_id'] for linha in linhas if linha['tipo'] == TIPO_EXPEDICAO},
+            agora,
+        )
+
+        destinos = _resolver_destinos(
+            [linha for linha in linhas if linha['tipo'] == TIPO_TRANSFERENCIA],
+            origens,
+            usuario,
+            agora,
+        )
+
+        # Saldos linha a linha (as origens estão travadas: o valor lido é o do banco)
+        saldos = {pk: int(origem.saldo or 0) for pk, origem in origens.items()}
+        for destino, saldo_antes, _ in destinos.values():
+            saldos.setdefault(destino.pk, saldo_antes)
+
+        historicos = []
+        saidas = []
+
+        for linha, resultado in zip(linhas, resultados):
+            origem = origens[linha['estoque_id']]
+            quantidade = linha['quantidade']
+            saldos[origem.pk] -= quantidade
+
+            if linha['tipo'] == TIPO_EXPEDICAO:
+                historico = HistoricoMovimentacao(
+                    estoque=origem,
+                    lote_ref=origem.lote,
+                    usuario=usuario,
+                    tipo='Expedição',
+                    descricao=_descricao_expedicao(quantidade, saldos[origem.pk], carga, usuario, agora),
+                    quantidade=quantidade,
+                    numero_carga=carga['numero_carga'],
+                    motorista=carga['motorista'],
+                    placa=carga['placa'],
+                    cliente=carga['cliente'],
+                )
+                historicos.append(historico)
+                saidas.append(historico)
+                resultado['historicos'] = [historico]
+                resultado['saldo_origem'] = saldos[origem.pk]
+                continue
+
+            destino, _, criado = destinos[_chave_destino(origem, linha['endereco'])]
+            saldos[destino.pk] += quantidade
+            mensagem_tipo = 'criado no novo endereço' if criado else 'somado ao registro existente'
+
+            saida = HistoricoMovimentacao(
+                estoque=origem,
+                lote_ref=origem.lote,
+                usuario=usuario,
+                tipo='Transferência (Saída)',
+                descricao=(
+                    f'Transferido para {linha["endereco"]} ({destino.lote}) - '
+                    f'Quantidade: {quantidade} {origem.embalagem} | {mensagem_tipo}'
+                ),
+                quantidade=quantidade,
+            )
+            entrada = HistoricoMovimentacao(
+                estoque=destino,
+                lote_ref=destino.lote,
+                usuario=usuario,
+                tipo='Transferência (Entrada)',
+                descricao=(
+                    f'Recebido de {origem.endereco} ({origem.lote}) - '
+                    f'Quantidade: {quantidade} {origem.embalagem} | '
+                    f'Peso: {destino.peso_unitario} kg | Novo saldo: {saldos[destino.pk]}'
+                ),
+                quantidade=quantidade,
+            )
+            historicos.extend([saida, entrada])
+            saidas.append(saida)
+            resultado['historicos'] = [saida, entrada]
+            resultado['saldo_origem'] = saldos[origem.pk]
+            resultado['destino_id'] = destino.pk
+            resultado['saldo_destino'] = saldos[destino.pk]
+
+        HistoricoMovimentacao.objects.bulk_create(historicos)
+        _salvar_fotos(fotos, saidas)
+
+        # O que os signals de post_save fariam
+        registrar_no_livro(lancamentos_de_movimentacoes([historico.pk for historico in historicos]))
+        agendar_recalculo_resumo({dia_local(historico.data_hora) for historico in historicos})
+        recalcular_resumo_lotes({origem.lote for origem in origens.values()})
+        incrementar_versao(CHAVE_VERSAO_DASHBOARD)
+
+    for resultado in resultados:
+        resultado['historico_ids'] = [historico.pk for historico in resultado.pop('historicos')]
+
+    return resultados
@@ -0,0 +1,162 @@
+# sapp/services_versao.py
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+
+
+# ============================================================
+# CONTADORES DE VERSÃO (CACHE + BANCO)
+# ============================================================
+#
+# Em vez de recalcular um hash dos dados a cada consulta, cada
+# alteração relevante incrementa um contador (ContadorVersao). A
+# leitura é uma única consulta ao cache; o banco só é lido quando a
+# chave expira ou o cache foi limpo.
+#
+# O incremento acontece após o commit e apaga a chave do cache, de
+# modo que a próxima leitura já traz o valor novo do banco. Com cache
+# local por processo (LocMemCache) o tempo de expiração limita o
+# atraso entre processos; com Redis a mudança é vista na hora.
+
+CHAVE_VERSAO_KANBAN = 'kanban'
+CHAVE_VERSAO_DASHBOARD = 'dashboard'
+
+TEMPO_CACHE_VERSAO = 5  # segundos
+TEMPO_SINAL_VERSAO = 60  # segundos, com cache compartilhado (Redis)
+TEMPO_SINAL_VERSAO_LOCAL = 3  # segundos, com cache por processo
+
+
+def _chave_cache(chave):
+    return f'versao:{chave}'
+
+
+def _chave_sinal(chave):
+    return f'versao:{chave}:sinal'
+
+
+def obter_versao(chave):
+    """Versão atual do contador (0 se ainda não existir)."""
+    versao = cache.get(_chave_cache(chave))
+
+    if versao is not None:
+        return versao
+
+    versao = _ler_versao_do_banco(chave)
+    cache.set(_chave_cache(chave), versao, TEMPO_CACHE_VERSAO)
+    return versao
+
+
+def _ler_versao_do_banco(chave):
+    from .models import ContadorVersao
+
+    return (
+        ContadorVersao.objects
+        .filter(chave=chave)
+        .values_list('valor', flat=True)
+        .first()
+    ) or 0
+
+
+def incrementar_no_banco(chave):
+    """Incrementa o contador no banco e devolve o valor novo (sem mexer no cache)."""
+    from .models import ContadorVersao
+
+    atualizados = (
+        ContadorVersao.objects
+        .filter(chave=chave)
+        .update(valor=F('valor') + 1)
+    )
+
+    if not atualizados:
+        contador, criado = ContadorVersao.objects.get_or_create(
+            chave=chave,
+            defaults={'valor': 1},
+        )
+        if not criado:
+            ContadorVersao.objects.filter(pk=contador.pk).update(
+                valor=F('valor') + 1
+            )
+
+    return (
+        ContadorVersao.objects
+        .filter(chave=chave)
+        .values_list('valor', flat=True)
+        .first()
+    )
+
+
+def publicar_versao(chave, versao=None):
+    """
+    Depois do commit do incremento: descarta a versão em cache e,
+    com a versão nova, avisa quem espera mudanças (chave de sinal).
+    """
+    cache.delete(_chave_cache(chave))
+
+    if versao is not None:
+        cache.set(_chave_sinal(chave), versao, tempo_sinal_versao())
+
+
+def _incrementar_agora(chave):
+    publicar_versao(chave, incrementar_no_banco(chave))
+
+
+def incrementar_versao(chave):
+    """
+    Incrementa o contador depois do commit da transação atual
+    (ou na hora, fora de transação). Se houver rollback, nada muda.
+
+    Várias alterações na mesma transação geram um único incremento.
+    """
+    conexao = transaction.get_connection()
+
+    # run_on_commit guarda (savepoints, função, robust); o Django
+    # descarta as entradas sozinho em caso de rollback.
+    for _, funcao, *_ in conexao.run_on_commit:
+        if getattr(funcao, 'versao_chave', None) == chave:
+            return
+
+    def _executar():
+        _incrementar_agora(chave)
+
+    _executar.versao_chave = chave
+    transaction.on_commit(_executar)
+
+
+# ============================================================
+# SINAL PARA QUEM ESPERA MUDANÇAS (SSE / LONG-POLL)
+# ============================================================
+#
+# Quem fica esperando uma versão nova (api_eventos_kanban) lê só a
+# chave de sinal, gravada pelo próprio incremento. Enquanto nada muda
+# a espera não consulta o banco; a chave só é recarregada do banco
+# quando expira, uma vez por processo e não por cliente.
+#
+# O aviso imediato entre processos (workers do uvicorn, Celery) exige
+# cache compartilhado: com Redis (REDIS_URL) todos veem o sinal na hora
+# e a chave dura TEMPO_SINAL_VERSAO. Com LocMemCache cada processo tem
+# o seu sinal, por isso ele expira em TEMPO_SINAL_VERSAO_LOCAL segundos:
+# uma mudança feita em outro processo aparece nesse prazo, ao custo de
+# uma consulta por processo a cada expiração.
+
+def cache_compartilhado():
+    """True se o cache padrão é visto por todos os processos (não é locmem)"""
+    return 'locmem' not in settings.CACHES['default']['BACKEND'].lower()
+
+
+def tempo_sinal_versao():
+    return TEMPO_SINAL_VERSAO if cache_compartilhado() else TEMPO_SINAL_VERSAO_LOCAL
+
+
+def versao_sinalizada(chave):
+    """Versão do contador vista pela chave de sinal."""
+    versao = cache.get(_chave_sinal(chave))
+
+    if versao is None:
+        # Direto do banco: a versão em cache (TEMPO_CACHE_VERSAO) somaria
+        # mais atraso quando o sinal é local ao processo
+        versao = _ler_versao_do_banco(chave)
+        cache.set(_chave_sinal(chave), versao, tempo_sinal_versao())
+
+    return versao
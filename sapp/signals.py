@@ -1,8 +1,51 @@
 # sapp/signals.py
-from django.db.models.signals import post_migrate
+from django.db.models.signals import m2m_changed, post_delete, post_migrate, post_save, pre_delete
 from django.dispatch import receiver
 from django.contrib.auth.models import Group, Permission
 from django.contrib.contenttypes.models import ContentType
+from django.contrib.auth.signals import user_logged_in
+
+from .models import (
+    Categoria,
+    ColunaKanban,
+    Cultivar,
+    Empenho,
+    Especie,
+    Estoque,
+    HistoricoCard,
+    HistoricoItemEmpenho,
+    HistoricoMovimentacao,
+    ItemEmpenho,
+    Peneira,
+    Solicitacao,
+    StatusSistemico,
+    TagKanban,
+)
+from .services_dashboard import (
+    agendar_recalculo_resumo,
+    dia_local,
+    dias_com_movimentacao,
+    somar_movimentacao_no_resumo,
+)
+from .services_estoque import atualizar_busca_estoque, recalcular_resumo_lotes
+from .services_historico import (
+    ORIGEM_EMPENHO,
+    ORIGEM_HISTORICO,
+    lancamentos_de_itens_empenho,
+    lancamentos_de_movimentacoes,
+    registrar_no_livro,
+    remover_do_livro,
+    sincronizar_no_livro,
+)
+from .services_kanban import (
+    atualizar_totais_empenho,
+    marcar_cards_alterados,
+    solicitacoes_dos_empenhos,
+)
+from .services_versao import (
+    CHAVE_VERSAO_DASHBOARD,
+    incrementar_versao,
+)
 
 @receiver(post_migrate)
 def criar_grupos_padrao(sender, **kwargs):
@@ -46,4 +89,223 @@ def criar_grupos_padrao(sender, **kwargs):
         print("   ✅ Grupos configurados! Permissões serão gerenciadas individualmente.")
         
     except Exception as e:
-        print(f"   ❌ Erro ao configurar grupos: {e}")
\ No newline at end of file
+        print(f"   ❌ Erro ao configurar grupos: {e}")
+
+
+@receiver(user_logged_in)
+def marcar_troca_senha_no_login(sender, request, user, **kwargs):
+    """Calcula uma única vez, no login, se o usuário ainda usa a senha padrão"""
+    if request is None or not hasattr(request, 'session'):
+        return
+
+    from .middleware import atualizar_marcador_troca_senha
+    atualizar_marcador_troca_senha(request, user)
+
+
+# ============================================================
+# BUSCA GLOBAL DO ESTOQUE
+# ============================================================
+
+@receiver(post_save, sender=Cultivar)
+@receiver(post_save, sender=Peneira)
+@receiver(post_save, sender=Categoria)
+@receiver(post_save, sender=Especie)
+def atualizar_busca_ao_renomear(sender, instance, created, **kwargs):
+    """Renomear um cadastro básico reflete na busca dos lotes vinculados"""
+    if created or kwargs.get('raw'):
+        return
+
+    campo = sender._meta.model_name
+    atualizar_busca_estoque(Estoque.objects.filter(**{campo: instance}))
+
+
+# ============================================================
+# LIVRO DE MOVIMENTAÇÕES (HISTÓRICO UNIFICADO)
+# ============================================================
+
+@receiver(post_save, sender=HistoricoMovimentacao)
+def espelhar_movimentacao_no_livro(sender, instance, created, **kwargs):
+    if kwargs.get('raw'):
+        return
+
+    lancamentos = lancamentos_de_movimentacoes([instance.pk])
+
+    if created:
+        registrar_no_livro(lancamentos)
+    else:
+        sincronizar_no_livro(lancamentos)
+
+
+@receiver(post_save, sender=HistoricoItemEmpenho)
+def espelhar_item_empenho_no_livro(sender, instance, created, **kwargs):
+    if kwargs.get('raw'):
+        return
+
+    lancamentos = lancamentos_de_itens_empenho([instance.pk])
+
+    if created:
+        registrar_no_livro(lancamentos)
+    else:
+        sincronizar_no_livro(lancamentos)
+
+
+@receiver(post_delete, sender=HistoricoMovimentacao)
+def remover_movimentacao_do_livro(sender, instance, **kwargs):
+    remover_do_livro(ORIGEM_HISTORICO, instance.pk)
+
+
+@receiver(post_delete, sender=HistoricoItemEmpenho)
+def remover_item_empenho_do_livro(sender, instance, **kwargs):
+    remover_do_livro(ORIGEM_EMPENHO, instance.pk)
+
+
+# ============================================================
+# RESUMO DIÁRIO DE MOVIMENTAÇÕES (DASHBOARD)
+# ============================================================
+
+@receiver(post_save, sender=HistoricoMovimentacao)
+def atualizar_resumo_movimentacao(sender, instance, created, **kwargs):
+    if kwargs.get('raw'):
+        return
+
+    if created:
+        somar_movimentacao_no_resumo(instance)
+    else:
+        # data_hora é auto_now_add: a edição não muda o dia da movimentação
+        agendar_recalculo_resumo([dia_local(instance.data_hora)])
+
+
+@receiver(post_delete, sender=HistoricoMovimentacao)
+def remover_movimentacao_do_resumo(sender, instance, **kwargs):
+    agendar_recalculo_resumo([dia_local(instance.data_hora)])
+
+
+@receiver(post_save, sender=Estoque)
+def recalcular_resumo_do_lote(sender, instance, created, **kwargs):
+    """Cultivar/peneira/espécie/AZ/embalagem do lote fazem parte da chave do resumo"""
+    if created or kwargs.get('raw'):
+        return
+
+    if getattr(instance, '_resumo_dimensoes_alteradas', False):
+        agendar_recalculo_resumo(dias_com_movimentacao(instance.historico.all()))
+
+
+@receiver(pre_delete, sender=Estoque)
+def recalcular_resumo_ao_excluir_lote(sender, instance, **kwargs):
+    # As movimentações ficam sem lote (SET_NULL); o recálculo roda após o commit
+    agendar_recalculo_resumo(dias_com_movimentacao(instance.historico.all()))
+
+
+@receiver(post_delete, sender=Estoque)
+def remover_do_resumo_lote(sender, instance, **kwargs):
+    # Refaz o lote a partir do que sobrou (não depende da instância estar atualizada)
+    recalcular_resumo_lotes([instance.lote])
+
+
+@receiver(post_save, sender=ItemEmpenho)
+@receiver(post_delete, sender=ItemEmpenho)
+def atualizar_totais_da_solicitacao(sender, instance, **kwargs):
+    """Kg/embalagens empenhados do card, na mesma transação do item"""
+    if kwargs.get('raw'):
+        return
+
+    empenhos = {instance.empenho_id}
+    if not kwargs.get('created', True) and instance.pk:
+        # Item trocado de empenho: o card anterior também muda
+        empenhos.add(instance.valor_original('empenho'))
+
+    atualizar_totais_empenho(solicitacoes_dos_empenhos(empenhos - {None}))
+
+
+@receiver(post_save, sender=Estoque)
+def atualizar_totais_ao_mudar_peso(sender, instance, created, **kwargs):
+    if created or kwargs.get('raw') or not instance.campo_alterado('peso_unitario'):
+        return
+
+    atualizar_totais_empenho(
+        solicitacoes_dos_empenhos(
+            ItemEmpenho.objects.filter(estoque=instance).values('empenho_id')
+        )
+    )
+
+
+@receiver(post_save, sender=Estoque)
+@receiver(post_save, sender=HistoricoMovimentacao)
+@receiver(post_save, sender=Cultivar)
+@receiver(post_save, sender=Peneira)
+@receiver(post_save, sender=Especie)
+@receiver(post_delete, sender=Estoque)
+@receiver(post_delete, sender=HistoricoMovimentacao)
+def incrementar_geracao_dashboard(sender, **kwargs):
+    """Invalida as respostas do dashboard_data guardadas no cache"""
+    if kwargs.get('raw'):
+        return
+
+    incrementar_versao(CHAVE_VERSAO_DASHBOARD)
+
+
+# ============================================================
+# VERSÃO DO QUADRO KANBAN
+# ============================================================
+
+@receiver(post_save, sender=Solicitacao)
+@receiver(post_save, sender=Empenho)
+@receiver(post_save, sender=ItemEmpenho)
+@receiver(post_save, sender=HistoricoItemEmpenho)
+@receiver(post_save, sender=HistoricoCard)
+@receiver(post_save, sender=TagKanban)
+@receiver(post_save, sender=ColunaKanban)
+@receiver(post_delete, sender=Solicitacao)
+@receiver(post_delete, sender=Empenho)
+@receiver(post_delete, sender=ItemEmpenho)
+@receiver(post_delete, sender=HistoricoItemEmpenho)
+@receiver(post_delete, sender=HistoricoCard)
+@receiver(post_delete, sender=TagKanban)
+@receiver(post_delete, sender=ColunaKanban)
+@receiver(m2m_changed, sender=Solicitacao.tags_kanban.through)
+def incrementar_versao_kanban(sender, instance, signal, **kwargs):
+    """
+    Qualquer alteração que aparece no quadro muda a versão dos cards;
+    os cards afetados recebem essa versão (delta do api_kanban_dados).
+    """
+    if kwargs.get('raw'):
+        return
+
+    if kwargs.get('action', 'post_').startswith('pre_'):
+        return
+
+    if sender is Solicitacao:
+        if signal is post_delete:
+            marcar_cards_alterados(removidos=[instance.pk])
+        else:
+            marcar_cards_alterados(solicitacao_ids=[instance.pk])
+
+    elif sender in (Empenho, HistoricoCard):
+        marcar_cards_alterados(solicitacao_ids=[instance.solicitacao_id])
+
+    elif sender in (ItemEmpenho, HistoricoItemEmpenho):
+        marcar_cards_alterados(empenho_ids=[instance.empenho_id])
+
+    elif sender is Solicitacao.tags_kanban.through:
+        if isinstance(instance, Solicitacao):
+            marcar_cards_alterados(solicitacao_ids=[instance.pk])
+        elif kwargs.get('pk_set'):
+            marcar_cards_alterados(solicitacao_ids=kwargs['pk_set'])
+        else:
+            # tag.solicitacoes.clear(): não se sabe quais cards tinham a tag
+            marcar_cards_alterados(estrutura=True)
+
+    else:
+        # Colunas e tags: o cliente recarrega o quadro completo
+        marcar_cards_alterados(estrutura=True)
+
+
+# ============================================================
+# STATUS SISTÊMICO INICIAL (CACHE)
+# ============================================================
+
+@receiver(post_save, sender=StatusSistemico)
+@receiver(post_delete, sender=StatusSistemico)
+def limpar_cache_status_inicial(sender, **kwargs):
+    """Renomear/excluir status muda o id usado pelos lotes novos"""
+    StatusSistemico.limpar_cache_status_inicial()
@@ -0,0 +1,11 @@
+# sapp/tasks.py
+
+from celery import shared_task
+
+from .services_exportacao import executar_tarefa_exportacao
+
+
+@shared_task(name='sapp.processar_tarefa_exportacao')
+def processar_tarefa_exportacao(tarefa_id):
+    tarefa = executar_tarefa_exportacao(tarefa_id)
+    return tarefa.status if tarefa else None
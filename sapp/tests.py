@@ -0,0 +1,1646 @@
+# sapp/tests.py
+
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import time
+from dataclasses import dataclass
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+
+import environ
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from almoxarifado.models import Item
+from .models import (
+    ArmazemLayout,
+    Categoria,
+    ColunaKanban,
+    Cultivar,
+    ElementoMapa,
+    Empenho,
+    EmpenhoStatus,
+    Especie,
+    Estoque,
+    HistoricoItemEmpenho,
+    FotoMovimentacao,
+    HistoricoMovimentacao,
+    ItemEmpenho,
+    LivroMovimentacao,
+    Peneira,
+    ResumoLote,
+    ResumoMovimentacaoDiaria,
+    Solicitacao,
+    StatusSistemico,
+    TarefaExportacao,
+)
+
+
+# ============================================================
+# ORÇAMENTO DE CONSULTAS E TEMPO POR ENDPOINT
+# ============================================================
+#
+# Cada endpoint importante tem um orçamento de consultas SQL e de tempo.
+# O teste falha se:
+# - o endpoint passar do orçamento declarado; ou
+# - a quantidade de consultas crescer quando a massa de dados cresce
+#   (sinal de N+1).
+#
+# Rodar:  python manage.py test sapp
+#
+# - ORCAMENTO_RELATORIO=1 imprime ao final um relatório com consultas,
+#   tempo de SQL e tempo total de cada endpoint;
+# - ORCAMENTO_FATOR_TEMPO multiplica os orçamentos de tempo (ex.: 3 numa
+#   máquina de CI mais lenta). Os orçamentos de consultas não mudam.
+
+env = environ.Env()
+
+RELATORIO_ORCAMENTO = env.bool('ORCAMENTO_RELATORIO', default=False)
+FATOR_TEMPO_ORCAMENTO = max(env.float('ORCAMENTO_FATOR_TEMPO', default=1.0), 0.1)
+
+LOTES_POR_ESCALA = 30
+SOLICITACOES_POR_ESCALA = 4
+ITENS_ALMOXARIFADO_POR_ESCALA = 15
+
+
+@dataclass
+class Orcamento:
+    nome: str
+    url: str
+    consultas: int
+    milissegundos: int
+    parametros: str = ''
+
+    @property
+    def limite_ms(self):
+        return self.milissegundos * FATOR_TEMPO_ORCAMENTO
+
+    def caminho(self, contexto):
+        return reverse(self.url, kwargs=contexto.get(self.nome)) + self.parametros
+
+
+# Orçamentos medidos no SQLite com folga; consultas de sessão/usuário inclusas
+ORCAMENTOS = [
+    Orcamento('lista_estoque', 'sapp:lista_estoque', consultas=25, milissegundos=3000),
+    Orcamento('gestao_estoque', 'sapp:gestao_estoque', consultas=40, milissegundos=3000),
+    Orcamento('historico_geral', 'sapp:historico_geral', consultas=20, milissegundos=3000),
+    Orcamento('dashboard_data', 'sapp:dashboard_data', consultas=20, milissegundos=3000, parametros='?periodo=30'),
+    Orcamento('api_kanban_dados', 'sapp:api_kanban_dados', consultas=12, milissegundos=2000),
+    Orcamento('api_html_cards_atualizados', 'sapp:api_html_cards', consultas=8, milissegundos=2000),
+    Orcamento(
+        'api_lotes_disponiveis_para_solicitacao',
+        'sapp:api_lotes_disponiveis_solicitacao',
+        consultas=15,
+        milissegundos=2000,
+    ),
+    Orcamento('mapa_ocupacao_canvas', 'sapp:mapa_canvas', consultas=15, milissegundos=2000),
+    Orcamento('api_mapa_dados', 'sapp:api_mapa_dados', consultas=12, milissegundos=2000),
+    Orcamento('lista_itens', 'almoxarifado:lista_itens', consultas=15, milissegundos=2000),
+]
+
+
+def semear_dados(usuario, escala, inicio=0):
+    """
+    Cria uma massa de dados proporcional à escala: lotes com histórico,
+    solicitações com empenhos (pendentes e processados), elementos do
+    mapa e itens do almoxarifado. inicio evita colisão entre chamadas.
+    """
+    cultivares = [Cultivar.objects.get_or_create(nome=f'CULTIVAR {i}')[0] for i in range(4)]
+    peneiras = [Peneira.objects.get_or_create(nome=f'P{i}')[0] for i in range(3)]
+    categoria = Categoria.objects.get_or_create(nome='C1')[0]
+    especie = Especie.objects.get_or_create(nome='Soja')[0]
+    status_empenho = EmpenhoStatus.objects.get_or_create(nome='Rascunho')[0]
+    coluna = ColunaKanban.objects.filter(ativa=True).order_by('ordem').first()
+    armazem = ArmazemLayout.objects.get_or_create(numero=1, defaults={'nome': 'Armazém 1'})[0]
+
+    lotes = []
+    for i in range(inicio, inicio + LOTES_POR_ESCALA * escala):
+        endereco = f'R-A LN{i % 6 + 1:02d} P{i % 10 + 1:02d}'
+        estoque = Estoque.objects.create(
+            lote=f'L{i:04d}',
+            produto=f'Produto {i % 5}',
+            cultivar=cultivares[i % 4],
+            peneira=peneiras[i % 3],
+            categoria=categoria,
+            especie=especie,
+            endereco=endereco,
+            entrada=100 + i,
+            saida=(i % 7 == 0) * (100 + i),
+            conferente=usuario,
+            embalagem='BAG' if i % 2 else 'SC',
+            peso_unitario=Decimal('1000' if i % 2 else '40'),
+            az=f'AZ{i % 3 + 1}',
+            cliente=f'Cliente {i % 6}',
+        )
+        lotes.append(estoque)
+
+        HistoricoMovimentacao.objects.create(
+            estoque=estoque,
+            usuario=usuario,
+            tipo='Entrada',
+            descricao='Entrada de teste',
+            quantidade=estoque.entrada,
+        )
+        if estoque.saida:
+            HistoricoMovimentacao.objects.create(
+                estoque=estoque,
+                usuario=usuario,
+                tipo='Saída',
+                descricao='Saída de teste',
+                quantidade=estoque.saida,
+            )
+
+        ElementoMapa.objects.create(
+            armazem=armazem,
+            tipo='RETANGULO',
+            identificador=endereco,
+            pos_x=(i % 10) * 110,
+            pos_y=(i % 6) * 70,
+        )
+
+    disponiveis = [estoque for estoque in lotes if estoque.saldo > 5]
+
+    for j in range(SOLICITACOES_POR_ESCALA * escala):
+        solicitacao = Solicitacao.objects.create(
+            titulo=f'Card {inicio}-{j}',
+            criador=usuario,
+            quantidade_solicitada=Decimal('5000'),
+            unidade_controle='QUILOGRAMA' if j % 2 else 'EMBALAGEM',
+            coluna_kanban=coluna,
+            especie=especie,
+        )
+        empenho = Empenho.objects.create(
+            solicitacao=solicitacao,
+            usuario=usuario,
+            status=status_empenho,
+            observacao=solicitacao.titulo,
+        )
+
+        for k, estoque in enumerate(disponiveis[j * 3:j * 3 + 3]):
+            ItemEmpenho.objects.create(empenho=empenho, estoque=estoque, quantidade=1)
+
+            if k == 0:
+                HistoricoItemEmpenho.objects.create(
+                    empenho=empenho,
+                    estoque_origem=estoque,
+                    lote=estoque.lote,
+                    embalagem=estoque.embalagem,
+                    quantidade=1,
+                    tipo='TRANSFERENCIA',
+                    processado_por=usuario,
+                    processado_em=timezone.now(),
+                )
+
+    for i in range(inicio, inicio + ITENS_ALMOXARIFADO_POR_ESCALA * escala):
+        Item.objects.create(
+            codigo=f'IT{i:04d}',
+            nome=f'Item {i}',
+            quantidade=Decimal(i % 9 + 1),
+            lote=f'LA{i:04d}',
+        )
+
+    return lotes
+
+
+class OrcamentoEndpointsTests(TestCase):
+    """Regressão de desempenho: consultas SQL e tempo dos endpoints principais"""
+
+    relatorio = []
+
+    @classmethod
+    def setUpTestData(cls):
+        StatusSistemico.get_status_padrao()
+        ColunaKanban.criar_colunas_padrao()
+
+        cls.usuario = User.objects.create_superuser(
+            'orcamento',
+            'orcamento@example.com',
+            'Orcamento-12345!',
+        )
+        semear_dados(cls.usuario, escala=1)
+
+    def setUp(self):
+        self.client.force_login(self.usuario)
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+
+        if not (RELATORIO_ORCAMENTO and cls.relatorio):
+            return
+
+        print('\n📊 Orçamento por endpoint (consultas | SQL ms | total ms)')
+        for nome, escala, medida in cls.relatorio:
+            print(
+                f'   {nome:<42} escala {escala}: '
+                f'{medida["consultas"]:>4} | '
+                f'{medida["sql_ms"]:>8.1f} | '
+                f'{medida["total_ms"]:>8.1f}'
+            )
+
+    def _contexto(self):
+        solicitacao = Solicitacao.objects.order_by('id').first()
+        return {
+            'api_lotes_disponiveis_para_solicitacao': {'solicitacao_id': solicitacao.id},
+            'mapa_ocupacao_canvas': {'armazem_numero': 1},
+            'api_mapa_dados': {'armazem_numero': 1},
+        }
+
+    def medir(self, caminho):
+        """Consultas, tempo de SQL e tempo total de um GET (sem cache)"""
+        cache.clear()
+
+        with CaptureQueriesContext(connection) as consultas:
+            inicio = time.perf_counter()
+            resposta = self.client.get(caminho)
+            if resposta.streaming:
+                b''.join(resposta.streaming_content)
+            total = time.perf_counter() - inicio
+
+        self.assertEqual(resposta.status_code, 200, caminho)
+
+        return {
+            'consultas': len(consultas),
+            'sql_ms': sum(float(consulta['time']) for consulta in consultas) * 1000,
+            'total_ms': total * 1000,
+        }
+
+    def medir_todos(self, escala):
+        contexto = self._contexto()
+        medidas = {}
+
+        for orcamento in ORCAMENTOS:
+            caminho = orcamento.caminho(contexto)
+            self.medir(caminho)  # aquecimento (ContentType, status padrão, ...)
+            medidas[orcamento.nome] = self.medir(caminho)
+            self.relatorio.append((orcamento.nome, escala, medidas[orcamento.nome]))
+
+        return medidas
+
+    def test_endpoints_dentro_do_orcamento(self):
+        medidas = self.medir_todos(escala=1)
+
+        for orcamento in ORCAMENTOS:
+            medida = medidas[orcamento.nome]
+
+            with self.subTest(endpoint=orcamento.nome):
+                self.assertLessEqual(
+                    medida['consultas'],
+                    orcamento.consultas,
+                    f'{orcamento.nome}: {medida["consultas"]} consultas '
+                    f'(orçamento {orcamento.consultas})',
+                )
+                self.assertLessEqual(
+                    medida['total_ms'],
+                    orcamento.limite_ms,
+                    f'{orcamento.nome}: {medida["total_ms"]:.0f} ms '
+                    f'(orçamento {orcamento.limite_ms:.0f} ms)',
+                )
+
+    def test_consultas_nao_crescem_com_os_dados(self):
+        pequena = self.medir_todos(escala=1)
+
+        semear_dados(self.usuario, escala=3, inicio=LOTES_POR_ESCALA)
+
+        # Mais histórico por lote: pega N+1 nas linhas do tempo da tabela
+        for estoque in Estoque.objects.all():
+            for _ in range(3):
+                HistoricoMovimentacao.objects.create(
+                    estoque=estoque,
+                    usuario=self.usuario,
+                    tipo='Transferência (Entrada)',
+                    descricao='Movimentação extra',
+                    quantidade=1,
+                )
+
+        grande = self.medir_todos(escala=4)
+
+        for orcamento in ORCAMENTOS:
+            with self.subTest(endpoint=orcamento.nome):
+                self.assertEqual(
+                    grande[orcamento.nome]['consultas'],
+                    pequena[orcamento.nome]['consultas'],
+                    f'{orcamento.nome}: consultas passaram de '
+                    f'{pequena[orcamento.nome]["consultas"]} para '
+                    f'{grande[orcamento.nome]["consultas"]} com 4x mais dados',
+                )
+
+
+# ============================================================
+# CAMPOS ALTERADOS (RastreiaAlteracoesMixin)
+# ============================================================
+
+class RastreiaAlteracoesTests(TestCase):
+    """O save dos lotes/solicitações não relê o registro do banco"""
+
+    @classmethod
+    def setUpTestData(cls):
+        StatusSistemico.get_status_padrao()
+
+        cls.usuario = User.objects.create_user('rastreio', password='Rastreio-12345!')
+        cls.estoque = semear_dados(cls.usuario, escala=1)[0]
+
+    def setUp(self):
+        cache.clear()
+
+    def test_save_do_estoque_e_um_unico_update(self):
+        estoque = Estoque.objects.get(pk=self.estoque.pk)
+        StatusSistemico.obter_id_status_inicial()
+
+        with CaptureQueriesContext(connection) as consultas:
+            estoque.empenhado += 1
+            estoque.save(update_fields=['empenhado'])
+
+        comandos = [consulta['sql'].split()[0] for consulta in consultas]
+        # Estoque e ResumoLote (totais somados no próprio UPDATE); a versão
+        # do dashboard é incrementada após o commit
+        self.assertEqual(comandos, ['UPDATE', 'UPDATE'])
+
+    def test_busca_normalizada_le_as_relacoes_numa_consulta(self):
+        estoque = Estoque.objects.get(pk=self.estoque.pk)
+
+        with CaptureQueriesContext(connection) as consultas:
+            texto = estoque.montar_busca_normalizada()
+
+        self.assertEqual(len(consultas), 1)
+        self.assertEqual(texto, estoque.busca_normalizada)
+
+        # Relações já carregadas não voltam ao banco
+        estoque = Estoque.objects.select_related(
+            'cultivar', 'peneira', 'categoria', 'especie', 'conferente',
+        ).get(pk=self.estoque.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(estoque.montar_busca_normalizada(), texto)
+
+    def test_campos_alterados_e_valor_original(self):
+        estoque = Estoque.objects.get(pk=self.estoque.pk)
+        endereco = estoque.endereco
+
+        self.assertEqual(estoque.campos_alterados, set())
+
+        estoque.endereco = 'R-B LN01 P01'
+        estoque.cultivar = Cultivar.objects.exclude(pk=estoque.cultivar_id).first()
+
+        self.assertEqual(estoque.campos_alterados, {'endereco', 'cultivar_id'})
+        self.assertEqual(estoque.valor_original('endereco'), endereco)
+
+        estoque.save()
+
+        self.assertTrue(estoque._resumo_dimensoes_alteradas)
+        self.assertEqual(estoque.campos_alterados, set())
+        self.assertEqual(estoque.valor_original('endereco'), 'R-B LN01 P01')
+
+    def test_mudar_endereco_desmarca_ultimo_lote_da_linha(self):
+        Estoque.objects.filter(pk=self.estoque.pk).update(ultimo_lote_linha=True)
+
+        estoque = Estoque.objects.get(pk=self.estoque.pk)
+        estoque.endereco = 'R-C LN01 P01'
+        estoque.save()
+
+        self.assertFalse(Estoque.objects.get(pk=self.estoque.pk).ultimo_lote_linha)
+
+    def test_status_inicial_vem_do_cache(self):
+        self.assertEqual(
+            StatusSistemico.obter_id_status_inicial(),
+            StatusSistemico.objects.get(nome='Crítico').id,
+        )
+
+        with self.assertNumQueries(0):
+            StatusSistemico.obter_id_status_inicial()
+
+        StatusSistemico.objects.filter(nome='Crítico').get().save()
+        self.assertIsNone(cache.get(StatusSistemico.CHAVE_CACHE_STATUS_INICIAL))
+
+    def test_solicitacao_concluida_sem_reler_status(self):
+        solicitacao = Solicitacao.objects.first()
+        solicitacao = Solicitacao.objects.get(pk=solicitacao.pk)
+
+        with CaptureQueriesContext(connection) as consultas:
+            solicitacao.status = 'CONCLUIDO'
+            solicitacao.save(update_fields=['status'])
+
+        self.assertFalse(any(consulta['sql'].startswith('SELECT') for consulta in consultas))
+
+        solicitacao.refresh_from_db()
+        self.assertIsNotNone(solicitacao.data_finalizacao)
+
+
+class ResumoLoteTests(TestCase):
+    """ResumoLote acompanha o Estoque (todos os endereços do lote)"""
+
+    @classmethod
+    def setUpTestData(cls):
+        StatusSistemico.get_status_padrao()
+
+        cls.usuario = User.objects.create_user('resumo', password='Resumo-12345!')
+        semear_dados(cls.usuario, escala=1)
+        cls.estoque = Estoque.objects.filter(empenhado=0, saldo__gt=10).order_by('pk').first()
+
+    def _resumo(self, lote):
+        from .services_estoque import resumo_do_lote
+
+        resumo = resumo_do_lote(lote)
+        return resumo.saldo, resumo.empenhado, resumo.disponivel
+
+    def test_save_empenho_e_exclusao_atualizam_o_resumo(self):
+        from .services_estoque import divergencias_resumo_lotes
+
+        lote, saldo = self.estoque.lote, self.estoque.saldo
+
+        outro = Estoque.objects.create(
+            lote=lote,
+            produto=self.estoque.produto,
+            cultivar=self.estoque.cultivar,
+            peneira=self.estoque.peneira,
+            categoria=self.estoque.categoria,
+            especie=self.estoque.especie,
+            endereco='R-Z LN01 P01',
+            entrada=20,
+            conferente=self.usuario,
+        )
+        self.assertEqual(self._resumo(lote), (saldo + 20, 0, saldo + 20))
+
+        empenho = Empenho.objects.filter(itens__isnull=False).first()
+        item = ItemEmpenho.objects.create(empenho=empenho, estoque=outro, quantidade=7)
+        self.assertEqual(self._resumo(lote), (saldo + 20, 7, saldo + 13))
+
+        item.quantidade = 5
+        item.save()
+        self.assertEqual(self._resumo(lote), (saldo + 20, 5, saldo + 15))
+
+        item.delete()
+        outro = Estoque.objects.get(pk=outro.pk)
+        outro.lote = 'L-NOVO'
+        outro.save()
+        self.assertEqual(self._resumo(lote), (saldo, 0, saldo))
+        self.assertEqual(self._resumo('L-NOVO'), (20, 0, 20))
+
+        outro.delete()
+        self.assertFalse(ResumoLote.objects.filter(pk='L-NOVO').exists())
+        self.assertEqual(divergencias_resumo_lotes(), [])
+
+    def test_saves_com_copias_desatualizadas_nao_desviam_o_resumo(self):
+        from .services_estoque import divergencias_resumo_lotes
+
+        # Duas requisições carregaram o mesmo registro antes de salvar
+        primeira = Estoque.objects.get(pk=self.estoque.pk)
+        segunda = Estoque.objects.get(pk=self.estoque.pk)
+
+        primeira.entrada += 5
+        primeira.save()
+        segunda.entrada += 2
+        segunda.save()
+
+        self.assertEqual(divergencias_resumo_lotes(), [])
+
+    def test_verificacao_encontra_e_corrige_divergencia(self):
+        from .services_estoque import divergencias_resumo_lotes, resumo_do_lote
+
+        # queryset.update não passa pelo save()
+        Estoque.objects.filter(pk=self.estoque.pk).update(empenhado=3)
+
+        saida = StringIO()
+        call_command('verificar_resumo_lotes', stdout=saida)
+        self.assertIn(self.estoque.lote, saida.getvalue())
+
+        call_command('verificar_resumo_lotes', '--corrigir', stdout=StringIO())
+
+        self.assertEqual(divergencias_resumo_lotes(), [])
+        self.assertEqual(resumo_do_lote(self.estoque.lote).empenhado, 3)
+
+    def test_autocomplete_de_lotes_distintos_com_prefixo_primeiro(self):
+        from .services_lotes import buscar_lotes, cache_sugestoes
+
+        cache_sugestoes.clear()
+
+        # Mesmo lote em outro endereço (mais recente) e um lote que só contém o termo
+        recente = Estoque.objects.create(
+            lote='L0003',
+            produto='Produto novo',
+            cultivar=self.estoque.cultivar,
+            peneira=self.estoque.peneira,
+            categoria=self.estoque.categoria,
+            especie=self.estoque.especie,
+            endereco='R-Z LN01 P01',
+            entrada=5,
+            conferente=self.usuario,
+        )
+        Estoque.objects.create(
+            lote='XL0003',
+            produto='Outro',
+            cultivar=self.estoque.cultivar,
+            peneira=self.estoque.peneira,
+            categoria=self.estoque.categoria,
+            especie=self.estoque.especie,
+            endereco='R-Z LN01 P02',
+            entrada=5,
+            conferente=self.usuario,
+        )
+
+        lotes = buscar_lotes('l0003')
+        self.assertEqual([lote['lote'] for lote in lotes], ['L0003', 'XL0003'])
+        self.assertEqual(lotes[0]['estoque_id'], recente.pk)
+        self.assertEqual(lotes[0]['produto'], 'Produto novo')
+
+        # Termo repetido sai do LRU do processo, sem consulta ao banco
+        with self.assertNumQueries(0):
+            buscar_lotes('L0003')
+
+        self.client.force_login(User.objects.create_superuser('auto', 'auto@example.com', 'Auto-12345!'))
+        resposta = self.client.get(reverse('sapp:api_autocomplete_entrada'), {'term': 'L00'})
+        rotulos = [sugestao['label'] for sugestao in resposta.json()]
+        self.assertEqual(len(rotulos), len(set(rotulos)))
+        self.assertEqual(rotulos, sorted(rotulos))
+
+
+class MigracaoResumoLoteTests(TransactionTestCase):
+    """Backfills das migrations (cópias congeladas) sobre tabelas com dados"""
+
+    antes = [('sapp', '0045_kanban_delta')]
+    antes_da_busca = [('sapp', '0037_historicoitemempenho_az_origem_and_more')]
+
+    def _migrar(self, alvo):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(alvo)
+        return executor.loader.project_state(alvo).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+        super().tearDown()
+
+    def test_migrations_preenchem_resumo_com_dados(self):
+        apps = self._migrar(self.antes)
+
+        usuario = apps.get_model('auth', 'User').objects.create(username='migracao')
+        cultivar = apps.get_model('sapp', 'Cultivar').objects.create(nome='CULT MIG')
+        peneira = apps.get_model('sapp', 'Peneira').objects.create(nome='P MIG')
+        categoria = apps.get_model('sapp', 'Categoria').objects.create(nome='C MIG')
+        Estoque = apps.get_model('sapp', 'Estoque')
+
+        registros = [
+            Estoque.objects.create(
+                lote='LT-MIG 01', cultivar=cultivar, peneira=peneira, categoria=categoria,
+                endereco=endereco, entrada=saldo, saldo=saldo, empenhado=empenhado,
+                conferente=usuario,
+            )
+            for endereco, saldo, empenhado in (('R-A LN01 P01', 30, 5), ('R-B LN02 P03', 12, 0))
+        ]
+
+        apps = self._migrar(MigrationExecutor(connection).loader.graph.leaf_nodes())
+        resumo = apps.get_model('sapp', 'ResumoLote').objects.get(lote='LT-MIG 01')
+
+        self.assertEqual((resumo.saldo, resumo.empenhado, resumo.disponivel), (42, 5, 37))
+        self.assertEqual(resumo.lote_busca, 'lt-mig 01')
+        self.assertEqual(resumo.estoque_recente_id, registros[-1].pk)
+
+    def _lote_antes_da_busca(self):
+        """Migra até a 0037 e cria um lote com três movimentações. Retorna (estoque_id, cultivar_id)"""
+        apps = self._migrar(self.antes_da_busca)
+
+        usuario = apps.get_model('auth', 'User').objects.create(username='migracao', first_name='José')
+        cultivar = apps.get_model('sapp', 'Cultivar').objects.create(nome='CULTIVAR ÁGIL')
+        peneira = apps.get_model('sapp', 'Peneira').objects.create(nome='P MIG')
+        categoria = apps.get_model('sapp', 'Categoria').objects.create(nome='C MIG')
+        estoque = apps.get_model('sapp', 'Estoque').objects.create(
+            lote='LT-MIG 02', cultivar=cultivar, peneira=peneira, categoria=categoria,
+            endereco='r-a  ln03 p02', entrada=20, saldo=20, az='AZ1', embalagem='BAG',
+            conferente=usuario,
+        )
+        Historico = apps.get_model('sapp', 'HistoricoMovimentacao')
+        for tipo, quantidade in (('Entrada', 20), ('Saída', 5), ('Saida', 3)):
+            Historico.objects.create(
+                estoque=estoque, lote_ref=estoque.lote, usuario=usuario,
+                tipo=tipo, quantidade=quantidade, descricao=tipo,
+            )
+
+        return estoque.pk, cultivar.pk
+
+    def _migrar_ate_o_fim(self):
+        return self._migrar(MigrationExecutor(connection).loader.graph.leaf_nodes())
+
+    def test_migration_preenche_busca_normalizada(self):
+        estoque_id, _ = self._lote_antes_da_busca()
+        estoque = self._migrar_ate_o_fim().get_model('sapp', 'Estoque').objects.get(pk=estoque_id)
+
+        self.assertIn('cultivar agil', estoque.busca_normalizada)
+        self.assertIn('jose', estoque.busca_normalizada)
+
+    def test_migration_preenche_livro(self):
+        self._lote_antes_da_busca()
+        Livro = self._migrar_ate_o_fim().get_model('sapp', 'LivroMovimentacao')
+
+        livro = Livro.objects.filter(lote='LT-MIG 02')
+        self.assertEqual(sorted(livro.values_list('tipo', flat=True)), ['entrada', 'saida', 'saida'])
+
+    def test_migration_preenche_resumo_diario(self):
+        _, cultivar_id = self._lote_antes_da_busca()
+        Resumo = self._migrar_ate_o_fim().get_model('sapp', 'ResumoMovimentacaoDiaria')
+
+        resumo = Resumo.objects.filter(cultivar_id=cultivar_id)
+        self.assertEqual(
+            sorted(resumo.values_list('tipo', 'quantidade', 'eventos')),
+            [('entrada', 20, 1), ('saida', 8, 2)],
+        )
+
+    def test_migration_preenche_endereco_normalizado(self):
+        estoque_id, _ = self._lote_antes_da_busca()
+        estoque = self._migrar_ate_o_fim().get_model('sapp', 'Estoque').objects.get(pk=estoque_id)
+
+        self.assertEqual(estoque.endereco_normalizado, 'R-A LN03 P02')
+
+    def test_migration_preenche_rua_linha_posicao(self):
+        estoque_id, _ = self._lote_antes_da_busca()
+        estoque = self._migrar_ate_o_fim().get_model('sapp', 'Estoque').objects.get(pk=estoque_id)
+
+        self.assertEqual((estoque.rua, estoque.linha, estoque.posicao), ('R-A', 'LN03', 2))
+
+
+# ============================================================
+# HISTÓRICO GERAL E DASHBOARD
+# ============================================================
+
+class LivroMovimentacaoTests(TestCase):
+    """Histórico geral: livro reconstruído em ordem e eventos repetidos só após os filtros"""
+
+    @classmethod
+    def setUpTestData(cls):
+        StatusSistemico.get_status_padrao()
+
+        cls.usuario = User.objects.create_superuser('livro', 'livro@example.com', 'Livro-12345!')
+        cls.outro = User.objects.create_user('livro2', password='Livro-12345!')
+        semear_dados(cls.usuario, escala=1)
+
+    def setUp(self):
+        self.client.force_login(self.usuario)
+
+    def _grupos(self, **filtros):
+        resposta = self.client.get(reverse('sapp:historico_geral'), filtros)
+        return {grupo['lote_ref']: grupo['total_mov'] for grupo in resposta.context['lotes']}
+
+    def test_evento_repetido_some_so_entre_as_linhas_filtradas(self):
+        from .services_historico import ORIGEM_EMPENHO, ORIGEM_HISTORICO, registrar_no_livro
+
+        quando = timezone.now().replace(second=0, microsecond=0)
+        registrar_no_livro([
+            LivroMovimentacao(
+                origem=origem, origem_id=990001, data_hora=quando, lote='LT-DUP',
+                tipo='saida', quantidade=5, usuario=usuario, usuario_nome=usuario.username,
+            )
+            for origem, usuario in ((ORIGEM_HISTORICO, self.usuario), (ORIGEM_EMPENHO, self.outro))
+        ])
+
+        self.assertEqual(self._grupos(lote='LT-DUP'), {'LT-DUP': 1})
+        # A segunda ocorrência aparece quando a primeira não passa no filtro
+        self.assertEqual(self._grupos(lote='LT-DUP', usuario='livro2'), {'LT-DUP': 1})
+
+    def test_reconstrucao_intercala_as_origens_em_ordem_cronologica(self):
+        from .services_historico import reconstruir_livro
+
+        total = reconstruir_livro(tamanho_lote=7)
+        datas = list(LivroMovimentacao.objects.order_by('id').values_list('data_hora', flat=True))
+
+        self.assertEqual(total, HistoricoMovimentacao.objects.count() + HistoricoItemEmpenho.objects.count())
+        self.assertEqual(len(datas), total)
+        self.assertEqual(datas, sorted(datas, key=lambda data: (data is None, data)))
+
+    def test_opcoes_dos_filtros_ficam_em_cache_ate_o_livro_mudar(self):
+        from .services_historico import ORIGEM_HISTORICO, opcoes_filtro_historico, registrar_no_livro
+        from .services_versao import CHAVE_VERSAO_DASHBOARD, incrementar_no_banco, publicar_versao
+
+        cache.clear()
+        opcoes = opcoes_filtro_historico()
+
+        with self.assertNumQueries(0):
+            self.assertEqual(opcoes_filtro_historico(), opcoes)
+
+        registrar_no_livro([
+            LivroMovimentacao(
+                origem=ORIGEM_HISTORICO, origem_id=990002, data_hora=timezone.now(), lote='LT-NOVO',
+                tipo='entrada', quantidade=1, usuario=self.outro, usuario_nome=self.outro.username,
+            )
+        ])
+        self.assertNotIn('LT-NOVO', opcoes_filtro_historico()['lotes'])
+
+        # O signal do histórico incrementa a versão do dashboard após o commit
+        publicar_versao(CHAVE_VERSAO_DASHBOARD, incrementar_no_banco(CHAVE_VERSAO_DASHBOARD))
+        opcoes = opcoes_filtro_historico()
+
+        self.assertIn('LT-NOVO', opcoes['lotes'])
+        self.assertIn({'valor': 'livro2', 'nome': 'livro2'}, opcoes['usuarios'])
+
+
+class ResumoMovimentacaoDiariaTests(TestCase):
+    """O resumo diário do dashboard bate com a agregação direta do histórico"""
+
+    @classmethod
+    def setUpTestData(cls):
+        StatusSistemico.get_status_padrao()
+
+        cls.usuario = User.objects.create_user('rollup', password='Rollup-12345!')
+        semear_dados(cls.usuario, escala=1)
+        cls.estoque = Estoque.objects.order_by('pk').first()
+        cls.outra_cultivar = Cultivar.objects.create(nome='CULTIVAR ROLLUP')
+
+    def _agregado_direto(self):
+        """Mesma chave do resumo, calculada direto no HistoricoMovimentacao"""
+        from django.db.models import Count, Sum
+        from django.db.models.functions import TruncDate
+        from .services_historico import normalizar_tipo_historico
+
+        esperado = {}
+        linhas = (
+            HistoricoMovimentacao.objects
+            .order_by()
+            .annotate(dia=TruncDate('data_hora'))
+            .values(
+                'dia', 'tipo', 'estoque__cultivar_id', 'estoque__peneira_id',
+                'estoque__especie_id', 'estoque__az', 'estoque__embalagem',
+            )
+            .annotate(soma=Sum('quantidade'), total=Count('id'))
+        )
+        for linha in linhas:
+            chave = (
+                linha['dia'],
+                normalizar_tipo_historico(linha['tipo']),
+                linha['estoque__cultivar_id'],
+                linha['estoque__peneira_id'],
+                linha['estoque__especie_id'],
+                linha['estoque__az'] or '',
+                linha['estoque__embalagem'] or '',
+            )
+            quantidade, eventos = esperado.get(chave, (0, 0))
+            esperado[chave] = (quantidade + linha['soma'], eventos + linha['total'])
+
+        return esperado
+
+    def _resumo(self):
+        return {
+            (dia, tipo, cultivar, peneira, especie, az, embalagem): (quantidade, eventos)
+            for dia, tipo, cultivar, peneira, especie, az, embalagem, quantidade, eventos
+            in ResumoMovimentacaoDiaria.objects.values_list(
+                'dia', 'tipo', 'cultivar_id', 'peneira_id', 'especie_id',
+                'az', 'embalagem', 'quantidade', 'eventos',
+            )
+        }
+
+    def _movimentar(self, estoque, tipo, quantidade):
+        with self.captureOnCommitCallbacks(execute=True):
+            return HistoricoMovimentacao.objects.create(
+                estoque=estoque, usuario=self.usuario, tipo=tipo,
+                quantidade=quantidade, descricao=tipo,
+            )
+
+    def test_criacao_soma_na_linha_do_dia(self):
+        from .services_dashboard import reconstruir_resumo
+
+        reconstruir_resumo()
+        self.assertEqual(self._resumo(), self._agregado_direto())
+
+        for tipo, quantidade in (('Entrada', 10), ('Saída', 4), ('Saida', 2), ('Expedição', 1)):
+            self._movimentar(self.estoque, tipo, quantidade)
+
+        self.assertEqual(self._resumo(), self._agregado_direto())
+
+    def test_edicao_e_exclusao_recalculam_o_dia(self):
+        movimentacao = self._movimentar(self.estoque, 'Saída', 6)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            movimentacao.quantidade = 9
+            movimentacao.tipo = 'Transferência'
+            movimentacao.save()
+        self.assertEqual(self._resumo(), self._agregado_direto())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            movimentacao.delete()
+        self.assertEqual(self._resumo(), self._agregado_direto())
+
+    def test_mudanca_de_atributo_e_exclusao_do_lote(self):
+        estoque = Estoque.objects.create(
+            lote='LT-ROLLUP', cultivar=self.estoque.cultivar, peneira=self.estoque.peneira,
+            categoria=self.estoque.categoria, endereco='R-Z LN09 P01', entrada=40,
+            embalagem='BAG', conferente=self.usuario,
+        )
+        self._movimentar(estoque, 'Entrada', 40)
+        self._movimentar(estoque, 'Saída', 15)
+
+        estoque = Estoque.objects.get(pk=estoque.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            estoque.cultivar = self.outra_cultivar
+            estoque.az = 'AZ-9'
+            estoque.save()
+
+        self.assertEqual(self._resumo(), self._agregado_direto())
+        self.assertEqual(
+            ResumoMovimentacaoDiaria.objects.filter(cultivar_id=self.outra_cultivar.pk, az='AZ-9').count(),
+            2,
+        )
+
+        # Movimentações ficam sem lote (SET_NULL) e saem da linha da cultivar
+        with self.captureOnCommitCallbacks(execute=True):
+            estoque.delete()
+
+        self.assertEqual(self._resumo(), self._agregado_direto())
+        self.assertFalse(ResumoMovimentacaoDiaria.objects.filter(cultivar_id=self.outra_cultivar.pk).exists())
+
+    def test_recalculo_filtra_data_hora_por_faixa_local(self):
+        from .services_dashboard import inicio_do_dia, q_dias, recalcular_resumo_dias
+
+        dia = timezone.localdate() - timedelta(days=10)
+        meia_noite = inicio_do_dia(dia + timedelta(days=1))
+
+        ultima = self._movimentar(self.estoque, 'Entrada', 7)
+        seguinte = self._movimentar(self.estoque, 'Entrada', 11)
+        HistoricoMovimentacao.objects.filter(pk=ultima.pk).update(data_hora=meia_noite - timedelta(seconds=1))
+        HistoricoMovimentacao.objects.filter(pk=seguinte.pk).update(data_hora=meia_noite)
+
+        recalcular_resumo_dias([dia])
+        self.assertEqual(
+            list(ResumoMovimentacaoDiaria.objects.filter(dia=dia).values_list('quantidade', 'eventos')),
+            [(7, 1)],
+        )
+
+        # Comparação direta com a coluna (índice), dias seguidos numa faixa só
+        sql = str(HistoricoMovimentacao.objects.filter(q_dias([dia, dia + timedelta(days=1), dia + timedelta(days=5)])).query)
+        self.assertNotIn('cast_date', sql.lower())
+        self.assertEqual(sql.count('"data_hora" >='), 2)
+
+    def test_recalcular_dias_corrige_linha_divergente(self):
+        from .services_dashboard import dia_local, recalcular_resumo_dias
+
+        movimentacao = self._movimentar(self.estoque, 'Entrada', 12)
+        dia = dia_local(movimentacao.data_hora)
+
+        ResumoMovimentacaoDiaria.objects.filter(dia=dia).update(quantidade=999, eventos=99)
+        ResumoMovimentacaoDiaria.objects.create(chave='orfa', dia=dia, tipo='saida', quantidade=5, eventos=1)
+
+        recalcular_resumo_dias([dia])
+        self.assertEqual(self._resumo(), self._agregado_direto())
+
+
+class CacheDashboardTests(TestCase):
+    """Resposta do dashboard no cache: HIT, STALE após mudança de versão e MISS"""
+
+    @classmethod
+    def setUpTestData(cls):
+        StatusSistemico.get_status_padrao()
+
+        cls.usuario = User.objects.create_superuser('painel', 'painel@example.com', 'Painel-12345!')
+        semear_dados(cls.usuario, escala=1)
+
+    def setUp(self):
+        cache.clear()
+
+    def _nova_versao(self):
+        """O que incrementar_versao faz após o commit (o TestCase não faz commit)"""
+        from .services_versao import CHAVE_VERSAO_DASHBOARD, incrementar_no_banco, publicar_versao
+
+        publicar_versao(CHAVE_VERSAO_DASHBOARD, incrementar_no_banco(CHAVE_VERSAO_DASHBOARD))
+
+    def test_servico_hit_stale_e_revalidacao(self):
+        from .services_dashboard import (
+            TEMPO_FRESCO_DASHBOARD,
+            chave_cache_dashboard,
+            metricas_cache_dashboard,
+            obter_dashboard_em_cache,
+        )
+
+        parametros = {'periodo': 30}
+        calculos = []
+
+        def calcular():
+            calculos.append(1)
+            return {'success': True, 'calculo': len(calculos)}
+
+        self.assertEqual(obter_dashboard_em_cache(parametros, calcular), ({'success': True, 'calculo': 1}, 'MISS'))
+        self.assertEqual(obter_dashboard_em_cache(parametros, calcular), ({'success': True, 'calculo': 1}, 'HIT'))
+
+        # Versão nova enquanto outra requisição recalcula: resposta anterior
+        self._nova_versao()
+        trava = f'{chave_cache_dashboard(parametros)}:recalculando'
+        cache.add(trava, 1)
+        self.assertEqual(obter_dashboard_em_cache(parametros, calcular), ({'success': True, 'calculo': 1}, 'STALE'))
+        self.assertEqual(len(calculos), 1)
+
+        # Sem a trava, esta requisição recalcula e grava na versão nova
+        cache.delete(trava)
+        self.assertEqual(obter_dashboard_em_cache(parametros, calcular), ({'success': True, 'calculo': 2}, 'MISS'))
+        self.assertIsNone(cache.get(trava))
+        self.assertEqual(obter_dashboard_em_cache(parametros, calcular)[1], 'HIT')
+
+        # Mesma versão, mas a resposta passou do tempo fresco
+        depois = time.time() + TEMPO_FRESCO_DASHBOARD + 1
+        with mock.patch('sapp.services_dashboard.time.time', return_value=depois):
+            self.assertEqual(obter_dashboard_em_cache(parametros, calcular)[0]['calculo'], 3)
+
+        metricas = metricas_cache_dashboard()
+        self.assertEqual((metricas['hit'], metricas['stale'], metricas['miss']), (2, 1, 3))
+
+    def test_resposta_com_erro_nao_fica_no_cache(self):
+        from .services_dashboard import obter_dashboard_em_cache
+
+        falha = {'success': False, 'error': 'falhou'}
+        self.assertEqual(obter_dashboard_em_cache({}, lambda: falha), (falha, 'MISS'))
+        self.assertEqual(obter_dashboard_em_cache({}, lambda: falha), (falha, 'MISS'))
+
+    def test_cabecalho_x_dashboard_cache(self):
+        from django.http import QueryDict
+        from .services_dashboard import chave_cache_dashboard
+        from .views import _dashboard_parametros
+
+        self.client.force_login(self.usuario)
+        url = reverse('sapp:dashboard_data')
+        filtros = {'periodo': '30'}
+
+        def situacao():
+            resposta = self.client.get(url, filtros)
+            self.assertEqual(resposta.status_code, 200)
+            return resposta['X-Dashboard-Cache']
+
+        self.assertEqual(situacao(), 'MISS')
+        self.assertEqual(situacao(), 'HIT')
+
+        # Versão nova com outra requisição recalculando: resposta anterior
+        self._nova_versao()
+        trava = f'{chave_cache_dashboard(_dashboard_parametros(QueryDict("periodo=30")))}:recalculando'
+        cache.add(trava, 1)
+        self.assertEqual(situacao(), 'STALE')
+
+        cache.delete(trava)
+        self.assertEqual(situacao(), 'MISS')
+        self.assertEqual(situacao(), 'HIT')
+
+
+# ============================================================
+# MOVIMENTAÇÃO EM LOTE
+# ============================================================
+
+# GIF 1x1 (as fotos da expedição são ImageField)
+FOTO_TESTE = (
+    b'GIF89a\x01\x00\x01\x00\x80\x00\x00\x00\x00\x00\xff\xff\xff!'
+    b'\xf9\x04\x01\x00\x00\x00\x00,\x00\x00\x00\x00\x01\x00\x01\x00'
+    b'\x00\x02\x02D\x01\x00;'
+)
+
+CARGA_TESTE = {'numero_carga': 'C-1', 'motorista': 'João', 'placa': 'ABC1D23'}
+
+MEDIA_TESTE = tempfile.mkdtemp(prefix='sapp-testes-')
+
+
+@override_settings(MEDIA_ROOT=MEDIA_TESTE)
+class MovimentacaoEmLoteTests(TestCase):
+    """api_movimentar_em_lote: valida tudo antes e grava tudo ou nada"""
+
+    @classmethod
+    def setUpTestData(cls):
+        StatusSistemico.get_status_padrao()
+
+        cls.usuario = User.objects.create_superuser(
+            'lote',
+            'lote@example.com',
+            'Lote-12345!',
+        )
+        cls.lotes = semear_dados(cls.usuario, escala=1)
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_TESTE, ignore_errors=True)
+
+    def setUp(self):
+        self.client.force_login(self.usuario)
+
+    def _lote_livre(self, indice=0):
+        livres = [
+            estoque for estoque in Estoque.objects.filter(empenhado=0, saldo__gt=10).order_by('pk')
+        ]
+        return livres[indice]
+
+    def _enviar(self, linhas, carga=None, fotos=True):
+        dados = json.dumps({'linhas': linhas, 'carga': carga or {}})
+        arquivos = [SimpleUploadedFile('carga.gif', FOTO_TESTE, 'image/gif')] if fotos else []
+
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(
+                reverse('sapp:api_movimentar_em_lote'),
+                {'dados': dados, 'fotos': arquivos},
+            )
+
+    def test_expedicao_e_transferencias_numa_transacao(self):
+        expedido = self._lote_livre(0)
+        transferido = self._lote_livre(1)
+
+        resposta = self._enviar(
+            [
+                {'estoque_id': expedido.pk, 'quantidade': 4, 'tipo': 'EXPEDICAO'},
+                {'estoque_id': expedido.pk, 'quantidade': 1, 'tipo': 'EXPEDICAO'},
+                {'estoque_id': transferido.pk, 'quantidade': 3, 'tipo': 'TRANSFERENCIA', 'endereco': 'r-z ln01 p01'},
+                {'estoque_id': transferido.pk, 'quantidade': 2, 'tipo': 'TRANSFERENCIA', 'endereco': 'R-Z LN01 P01'},
+            ],
+            carga=CARGA_TESTE,
+        )
+
+        self.assertEqual(resposta.status_code, 200, resposta.content)
+        linhas = resposta.json()['linhas']
+        self.assertEqual([linha['saldo_origem'] for linha in linhas[:2]], [expedido.saldo - 4, expedido.saldo - 5])
+
+        saida_antes = expedido.saida
+        expedido.refresh_from_db()
+        self.assertEqual(expedido.saida, saida_antes + 5)
+        self.assertEqual(expedido.saldo, expedido.entrada - expedido.saida)
+        self.assertEqual(expedido.peso_total, Decimal(expedido.saldo) * expedido.peso_unitario)
+        self.assertIsNotNone(expedido.data_ultima_saida)
+
+        # As duas linhas para o mesmo endereço viram um único destino novo
+        destino = Estoque.objects.get(pk=linhas[2]['destino_id'])
+        self.assertEqual(linhas[3]['destino_id'], destino.pk)
+        self.assertEqual((destino.endereco, destino.entrada, destino.saldo), ('R-Z LN01 P01', 5, 5))
+        self.assertEqual(destino.cultivar_id, transferido.cultivar_id)
+        self.assertEqual(destino.status_sistemico_id, StatusSistemico.obter_id_status_inicial())
+        self.assertIn('r-z ln01 p01', destino.busca_normalizada)
+
+        historico_ids = [pk for linha in linhas for pk in linha['historico_ids']]
+        self.assertEqual(len(historico_ids), 6)
+        self.assertEqual(
+            LivroMovimentacao.objects.filter(origem_id__in=historico_ids).count(),
+            6,
+        )
+        # Fotos vão para os históricos de saída (2 expedições + 2 transferências)
+        self.assertEqual(FotoMovimentacao.objects.filter(historico_id__in=historico_ids).count(), 4)
+
+    def test_soma_no_destino_existente(self):
+        origem = self._lote_livre(0)
+        destino = Estoque.objects.create(
+            lote=origem.lote,
+            cultivar=origem.cultivar,
+            peneira=origem.peneira,
+            categoria=origem.categoria,
+            especie=origem.especie,
+            endereco='R-Y LN01 P01',
+            entrada=10,
+            conferente=self.usuario,
+            embalagem=origem.embalagem,
+            peso_unitario=origem.peso_unitario,
+            cliente=origem.cliente,
+        )
+
+        resposta = self._enviar(
+            [{'estoque_id': origem.pk, 'quantidade': 3, 'tipo': 'TRANSFERENCIA', 'endereco': 'R-Y LN01 P01'}],
+            fotos=False,
+        )
+
+        self.assertEqual(resposta.status_code, 200, resposta.content)
+        self.assertEqual(resposta.json()['linhas'][0]['destino_id'], destino.pk)
+
+        destino.refresh_from_db()
+        self.assertEqual((destino.entrada, destino.saldo), (13, 13))
+        self.assertEqual(destino.peso_total, 13 * destino.peso_unitario)
+
+    def test_linha_invalida_cancela_o_lote(self):
+        origem = self._lote_livre(0)
+        saldo = origem.saldo
+
+        resposta = self._enviar(
+            [
+                {'estoque_id': origem.pk, 'quantidade': 1, 'tipo': 'EXPEDICAO'},
+                {'estoque_id': origem.pk, 'quantidade': saldo, 'tipo': 'EXPEDICAO'},
+                {'estoque_id': 999999, 'quantidade': 1, 'tipo': 'EXPEDICAO'},
+            ],
+            carga=CARGA_TESTE,
+        )
+
+        self.assertEqual(resposta.status_code, 400)
+        linhas = resposta.json()['linhas']
+        self.assertEqual([linha['ok'] for linha in linhas], [True, False, False])
+        self.assertIn('disponível', linhas[1]['erro'])
+
+        origem.refresh_from_db()
+        self.assertEqual(origem.saldo, saldo)
+        self.assertFalse(HistoricoMovimentacao.objects.filter(tipo='Expedição').exists())
+
+    def test_expedicao_exige_carga_e_fotos(self):
+        origem = self._lote_livre(0)
+
+        resposta = self._enviar(
+            [{'estoque_id': origem.pk, 'quantidade': 1, 'tipo': 'EXPEDICAO'}],
+            fotos=False,
+        )
+
+        self.assertEqual(resposta.status_code, 400)
+        self.assertEqual(len(resposta.json()['erros']), 4)
+
+    def test_consultas_nao_crescem_com_as_linhas(self):
+        livres = list(Estoque.objects.filter(empenhado=0, saldo__gt=10).order_by('pk'))
+
+        def consultas(quantidade):
+            linhas = [
+                {'estoque_id': estoque.pk, 'quantidade': 1, 'tipo': 'TRANSFERENCIA', 'endereco': f'R-X LN01 P{i:02d}'}
+                for i, estoque in enumerate(livres[:quantidade])
+            ]
+            with CaptureQueriesContext(connection) as capturadas:
+                resposta = self._enviar(linhas, fotos=False)
+            self.assertEqual(resposta.status_code, 200, resposta.content)
+            return len(capturadas)
+
+        consultas(1)  # aquecimento (sessão, status inicial em cache)
+        self.assertEqual(consultas(2), consultas(8))
+
+
+# ============================================================
+# OCUPAÇÃO DO MAPA
+# ============================================================
+
+class OcupacaoMapaTests(TestCase):
+    """Ocupação por endereço normalizado, restrita aos endereços do armazém"""
+
+    @classmethod
+    def setUpTestData(cls):
+        StatusSistemico.get_status_padrao()
+
+        cls.usuario = User.objects.create_user('mapa', password='Mapa-12345!')
+        cls.lotes = semear_dados(cls.usuario, escala=1)
+
+    def test_endereco_normalizado_mantido_pelo_save(self):
+        estoque = Estoque.objects.get(pk=self.lotes[0].pk)
+        estoque.endereco = '  r-b   ln02 p03 '
+        estoque.save(update_fields=['endereco'])
+
+        estoque.refresh_from_db()
+        self.assertEqual(estoque.endereco_normalizado, 'R-B LN02 P03')
+
+    def test_totais_por_endereco_em_uma_consulta(self):
+        from .services_mapa import ocupacao_por_endereco
+
+        endereco = self.lotes[1].endereco
+        esperado = Estoque.objects.filter(endereco=endereco, saldo__gt=0)
+
+        with self.assertNumQueries(1):
+            totais = ocupacao_por_endereco([endereco, 'R-Z LN99 P99'])
+
+        self.assertEqual(list(totais), [endereco])
+        self.assertEqual(totais[endereco]['lotes'], esperado.count())
+        self.assertEqual(totais[endereco]['saldo'], sum(estoque.saldo for estoque in esperado))
+
+
+class EnderecoEstruturadoTests(TestCase):
+    """Rua/linha/posição gravadas no save() e usadas nas consultas por linha"""
+
+    @classmethod
+    def setUpTestData(cls):
+        StatusSistemico.get_status_padrao()
+
+        cls.usuario = User.objects.create_superuser(
+            'enderecos',
+            'enderecos@example.com',
+            'Enderecos-12345!',
+        )
+        cls.lotes = semear_dados(cls.usuario, escala=1)
+
+    def setUp(self):
+        self.client.force_login(self.usuario)
+
+    def test_decompor_endereco(self):
+        from .services_mapa import decompor_endereco
+
+        self.assertEqual(decompor_endereco(' r-a  ln10 p02 '), {'rua': 'R-A', 'linha': 'LN10', 'posicao': 2})
+        self.assertEqual(decompor_endereco('R-B GERAL'), {'rua': 'R-B', 'linha': 'GERAL', 'posicao': None})
+        self.assertEqual(decompor_endereco('R-C'), {'rua': 'R-C', 'linha': '', 'posicao': None})
+        self.assertEqual(decompor_endereco('DOCA 3'), {'rua': '', 'linha': '', 'posicao': None})
+
+    def test_campos_mantidos_pelo_save(self):
+        estoque = Estoque.objects.get(pk=self.lotes[0].pk)
+        estoque.endereco = 'r-b ln07 p05'
+        estoque.save(update_fields=['endereco'])
+
+        estoque.refresh_from_db()
+        self.assertEqual((estoque.rua, estoque.linha, estoque.posicao), ('R-B', 'LN07', 5))
+
+        elemento = ElementoMapa.objects.filter(identificador=self.lotes[1].endereco).first()
+        self.assertEqual(elemento.rua, 'R-A')
+        self.assertIsNotNone(elemento.posicao)
+
+    def test_marcacoes_sao_as_posicoes_posteriores_da_linha(self):
+        lote = Estoque.objects.filter(saldo__gt=0, linha='LN01').order_by('posicao').first()
+        lote.ultimo_lote_linha = True
+        lote.save(update_fields=['ultimo_lote_linha'])
+
+        esperado = {
+            identificador
+            for identificador in ElementoMapa.objects.values_list('identificador', flat=True)
+            if identificador.startswith('R-A LN01 P') and int(identificador[-2:]) > lote.posicao
+        }
+
+        resposta = self.client.get(reverse('sapp:api_marcacoes_ultimo_lote'))
+
+        self.assertEqual(resposta.status_code, 200)
+        self.assertTrue(esperado)
+        self.assertEqual(set(resposta.json()['marcacoes']), esperado)
+
+
+class EventosKanbanTests(TestCase):
+    """Canal de atualizações do quadro: espera sem consultas, delta quando muda"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_user('kanban', password='Kanban-12345!')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.usuario)
+
+    def test_espera_sem_mudanca_nao_consulta_o_banco(self):
+        from asgiref.sync import async_to_sync
+
+        from .services_eventos_kanban import aguardar_versao
+        from .services_versao import CHAVE_VERSAO_KANBAN, versao_sinalizada
+
+        versao = versao_sinalizada(CHAVE_VERSAO_KANBAN)
+
+        with self.assertNumQueries(0):
+            nova = async_to_sync(aguardar_versao)(versao, espera=0.05, intervalo=0.01)
+
+        self.assertIsNone(nova)
+
+    def test_long_poll_devolve_delta_do_feed(self):
+        from .models import HistoricoCard
+
+        inicial = self.client.get(reverse('sapp:api_eventos_kanban')).json()
+
+        # Os signals incrementam a versão uma vez, após o commit
+        with self.captureOnCommitCallbacks(execute=True):
+            solicitacao = Solicitacao.objects.create(
+                titulo='Card ao vivo',
+                criador=self.usuario,
+                quantidade_solicitada=Decimal('100'),
+                unidade_controle='EMBALAGEM',
+            )
+            HistoricoCard.objects.create(
+                solicitacao=solicitacao,
+                usuario=self.usuario,
+                acao='MOVIMENTACAO_KANBAN',
+            )
+
+        with mock.patch('sapp.services_eventos_kanban.ESPERA_LONG_POLL', 0.1):
+            resposta = self.client.get(
+                reverse('sapp:api_eventos_kanban'),
+                {'versao': inicial['version'], 'desde': inicial['ultimo_id']},
+            ).json()
+
+        self.assertTrue(resposta['mudou'])
+        self.assertNotEqual(resposta['version'], inicial['version'])
+        self.assertEqual(resposta['cards'], [solicitacao.pk])
+        self.assertEqual(len(resposta['atualizacoes']), 1)
+
+    def test_sse_fora_do_asgi_cai_para_long_poll(self):
+        resposta = self.client.get(reverse('sapp:api_eventos_kanban'), HTTP_ACCEPT='text/event-stream')
+
+        self.assertEqual(resposta.status_code, 204)
+
+    def test_sinal_local_expira_rapido_e_rele_o_banco(self):
+        from .services_versao import (
+            CHAVE_VERSAO_KANBAN, TEMPO_SINAL_VERSAO_LOCAL, incrementar_no_banco,
+            obter_versao, tempo_sinal_versao, versao_sinalizada,
+        )
+
+        self.assertEqual(tempo_sinal_versao(), TEMPO_SINAL_VERSAO_LOCAL)
+
+        versao = versao_sinalizada(CHAVE_VERSAO_KANBAN)
+        obter_versao(CHAVE_VERSAO_KANBAN)
+
+        # Incremento feito por outro processo: o cache deste não é avisado
+        nova = incrementar_no_banco(CHAVE_VERSAO_KANBAN)
+        self.assertEqual(versao_sinalizada(CHAVE_VERSAO_KANBAN), versao)
+
+        # Sinal expirado: vem do banco, sem passar pela versão em cache
+        cache.delete(f'versao:{CHAVE_VERSAO_KANBAN}:sinal')
+        self.assertEqual(versao_sinalizada(CHAVE_VERSAO_KANBAN), nova)
+
+
+class KanbanDeltaTests(TestCase):
+    """api_kanban_dados?since=<versão>: só cards alterados e removidos"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_user('quadro', password='Quadro-12345!')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.usuario)
+
+        # Dentro do capture: callbacks de on_commit que nunca rodam no
+        # TestCase absorveriam as marcações seguintes
+        with self.captureOnCommitCallbacks(execute=True):
+            ColunaKanban.criar_colunas_padrao()
+
+        self.coluna = ColunaKanban.objects.filter(ativa=True).order_by('ordem').first()
+
+    def _card(self, titulo):
+        return Solicitacao.objects.create(
+            titulo=titulo,
+            criador=self.usuario,
+            quantidade_solicitada=Decimal('10'),
+            unidade_controle='EMBALAGEM',
+            coluna_kanban=self.coluna,
+        )
+
+    def _dados(self, **params):
+        return self.client.get(reverse('sapp:api_kanban_dados'), params).json()
+
+    def test_delta_traz_alterados_e_removidos(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            alterado = self._card('Alterado')
+            removido = self._card('Removido')
+            self._card('Parado')
+
+        versao = self._dados()['versao']
+        removido_id = removido.pk
+
+        with self.captureOnCommitCallbacks(execute=True):
+            alterado.titulo = 'Alterado de novo'
+            alterado.save()
+            removido.delete()
+
+        delta = self._dados(since=versao)
+
+        self.assertTrue(delta['delta'])
+        self.assertEqual([card['id'] for card in delta['cards']], [alterado.pk])
+        self.assertEqual(delta['cards'][0]['titulo'], 'Alterado de novo')
+        self.assertEqual(delta['removidos'], [removido_id])
+        self.assertGreater(delta['versao'], versao)
+
+        # Já em dia: delta vazio
+        vazio = self._dados(since=delta['versao'])
+        self.assertEqual((vazio['cards'], vazio['removidos']), ([], []))
+
+    def test_mudanca_de_coluna_devolve_quadro_completo(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self._card('Card')
+
+        versao = self._dados()['versao']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.coluna.cor = '#123456'
+            self.coluna.save()
+
+        resposta = self._dados(since=versao)
+
+        self.assertNotIn('delta', resposta)
+        self.assertIn('colunas', resposta)
+
+
+class TotaisEmpenhoTests(TestCase):
+    """Kg/embalagens empenhados gravados na solicitação acompanham os itens"""
+
+    @classmethod
+    def setUpTestData(cls):
+        StatusSistemico.get_status_padrao()
+
+        cls.usuario = User.objects.create_user('totais', password='Totais-12345!')
+        semear_dados(cls.usuario, escala=1)
+        cls.estoque = Estoque.objects.filter(empenhado=0, saldo__gt=10, peso_unitario=40).first()
+
+    def test_itens_e_peso_atualizam_os_totais(self):
+        solicitacao = Solicitacao.objects.create(
+            titulo='Card em kg',
+            criador=self.usuario,
+            quantidade_solicitada=Decimal('1000'),
+            unidade_controle='QUILOGRAMA',
+        )
+        empenho = Empenho.objects.create(solicitacao=solicitacao, usuario=self.usuario)
+        carregada = Solicitacao.objects.get(pk=solicitacao.pk)
+
+        item = ItemEmpenho.objects.create(empenho=empenho, estoque=self.estoque, quantidade=5)
+        solicitacao.refresh_from_db()
+        self.assertEqual(solicitacao.total_kg_empenhado, Decimal('200.00'))
+        self.assertEqual(solicitacao.total_embalagens_empenhadas, 5)
+
+        estoque = Estoque.objects.get(pk=self.estoque.pk)
+        estoque.peso_unitario = Decimal('50')
+        estoque.save()
+        solicitacao.refresh_from_db()
+        self.assertEqual(solicitacao.quantidade_empenhada_kg, Decimal('250.00'))
+
+        # save() completo de uma instância antiga não volta os totais
+        carregada.titulo = 'Renomeado'
+        carregada.save()
+        solicitacao.refresh_from_db()
+        self.assertEqual(solicitacao.total_embalagens_empenhadas, 5)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(solicitacao.percentual_empenhado, Decimal('25'))
+
+        item.delete()
+        solicitacao.refresh_from_db()
+        self.assertEqual(solicitacao.total_kg_empenhado, Decimal('0.00'))
+        self.assertEqual(solicitacao.total_embalagens_empenhadas, 0)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_TESTE)
+class TarefaExportacaoTests(TestCase):
+    """Broker fora do ar: a exportação fica na fila, não roda no processo web"""
+
+    @classmethod
+    def setUpTestData(cls):
+        StatusSistemico.get_status_padrao()
+
+        cls.usuario = User.objects.create_user('exporta', password='Exporta-12345!')
+        semear_dados(cls.usuario, escala=1)
+
+    def _nova_tarefa(self):
+        return TarefaExportacao.objects.create(
+            usuario=self.usuario,
+            tipo=TarefaExportacao.TIPO_ESTOQUE_SIMPLES,
+            formato='csv',
+        )
+
+    def test_broker_indisponivel_deixa_na_fila_e_reenvia(self):
+        from .services_exportacao import enfileirar_tarefa_exportacao, reenviar_exportacoes_pendentes
+        from .tasks import processar_tarefa_exportacao
+
+        tarefa = self._nova_tarefa()
+
+        with mock.patch.object(processar_tarefa_exportacao, 'apply', side_effect=ConnectionError('sem broker')), \
+                self.assertLogs('sapp.services_exportacao', 'WARNING'), \
+                self.captureOnCommitCallbacks(execute=True):
+            enfileirar_tarefa_exportacao(tarefa)
+
+        tarefa.refresh_from_db()
+        self.assertEqual((tarefa.status, tarefa.celery_task_id, tarefa.arquivo.name), ('pendente', '', ''))
+
+        # Recém-criada: o envio normal ainda pode estar a caminho
+        self.assertEqual(reenviar_exportacoes_pendentes(), (0, 0))
+
+        reenviadas = reenviar_exportacoes_pendentes(agora=timezone.now() + timedelta(minutes=2))
+        self.assertEqual(reenviadas, (1, 0))
+
+        tarefa.refresh_from_db()
+        self.assertEqual(tarefa.status, TarefaExportacao.STATUS_CONCLUIDA)
+        self.assertTrue(tarefa.celery_task_id)
+
+    def test_tarefa_parada_na_fila_vira_erro(self):
+        from .services_exportacao import reenviar_exportacoes_pendentes
+
+        tarefa = self._nova_tarefa()
+
+        self.assertEqual(reenviar_exportacoes_pendentes(agora=timezone.now() + timedelta(hours=2)), (0, 1))
+
+        tarefa.refresh_from_db()
+        self.assertEqual(tarefa.status, TarefaExportacao.STATUS_ERRO)
+        self.assertTrue(tarefa.erro)
+
+    def test_mensagem_perdida_no_broker_e_reenviada(self):
+        from .services_exportacao import reenviar_exportacoes_pendentes
+
+        tarefa = self._nova_tarefa()
+        TarefaExportacao.objects.filter(pk=tarefa.pk).update(celery_task_id='perdida')
+
+        # Enviada há pouco: o worker ainda pode estar com a fila cheia
+        self.assertEqual(reenviar_exportacoes_pendentes(agora=timezone.now() + timedelta(minutes=5)), (0, 0))
+        self.assertEqual(reenviar_exportacoes_pendentes(agora=timezone.now() + timedelta(minutes=11)), (1, 0))
+
+        tarefa.refresh_from_db()
+        self.assertEqual(tarefa.status, TarefaExportacao.STATUS_CONCLUIDA)
+        self.assertNotEqual(tarefa.celery_task_id, 'perdida')
+
+    def test_tarefa_presa_processando_vira_erro(self):
+        from .services_exportacao import executar_tarefa_exportacao, reenviar_exportacoes_pendentes
+
+        tarefa = self._nova_tarefa()
+        TarefaExportacao.objects.filter(pk=tarefa.pk).update(
+            status=TarefaExportacao.STATUS_PROCESSANDO,
+            iniciado_em=timezone.now(),
+            celery_task_id='worker-caiu',
+        )
+
+        self.assertEqual(reenviar_exportacoes_pendentes(agora=timezone.now() + timedelta(minutes=20)), (0, 0))
+        self.assertEqual(reenviar_exportacoes_pendentes(agora=timezone.now() + timedelta(minutes=50)), (0, 1))
+
+        tarefa.refresh_from_db()
+        self.assertEqual(tarefa.status, TarefaExportacao.STATUS_ERRO)
+        self.assertTrue(tarefa.erro)
+
+        # Uma entrega atrasada da mesma mensagem não roda a tarefa de novo
+        self.assertIsNone(executar_tarefa_exportacao(tarefa.pk))
+
+    @override_settings(MEDIA_ROOT=MEDIA_TESTE)
+    def test_limpeza_apaga_tarefas_antigas_e_arquivos(self):
+        from .services_exportacao import executar_tarefa_exportacao, limpar_exportacoes_antigas
+
+        concluida = executar_tarefa_exportacao(self._nova_tarefa().pk)
+        caminho = concluida.arquivo.path
+        pendente = self._nova_tarefa()
+
+        self.assertTrue(os.path.exists(caminho))
+        self.assertEqual(limpar_exportacoes_antigas(), 0)
+        self.assertEqual(limpar_exportacoes_antigas(agora=timezone.now() + timedelta(days=8)), 1)
+
+        self.assertFalse(os.path.exists(caminho))
+        self.assertEqual(list(TarefaExportacao.objects.values_list('pk', flat=True)), [pendente.pk])
+
+
+class ExportacaoAsgiTests(TestCase):
+    """Sob ASGI a exportação sai em blocos, sem materializar o corpo"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_user('asgi', password='Asgi-12345!')
+
+    def _get_asgi(self, caminho, query_string, ao_enviar):
+        """Atende a requisição pelo ASGIHandler, como o UvicornWorker faz"""
+        from asgiref.sync import async_to_sync
+        from django.conf import settings
+        from django.core import signals
+        from django.core.handlers.asgi import ASGIHandler
+        from django.db import close_old_connections
+
+        # Como o Client do Django: a conexão do TestCase não pode ser fechada
+        signals.request_started.disconnect(close_old_connections)
+        signals.request_finished.disconnect(close_old_connections)
+        self.addCleanup(signals.request_started.connect, close_old_connections)
+        self.addCleanup(signals.request_finished.connect, close_old_connections)
+
+        self.client.force_login(self.usuario)
+        cookie = f'{settings.SESSION_COOKIE_NAME}={self.client.cookies[settings.SESSION_COOKIE_NAME].value}'
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': 'GET',
+            'scheme': 'http',
+            'path': caminho,
+            'raw_path': caminho.encode(),
+            'query_string': query_string.encode(),
+            'headers': [(b'host', b'testserver'), (b'cookie', cookie.encode())],
+            'server': ('testserver', 80),
+            'client': ('127.0.0.1', 50000),
+        }
+        mensagens = []
+
+        async def receive():
+            if not mensagens:
+                mensagens.append({'type': 'http.request'})
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+            # Cliente conectado até o fim da resposta
+            await asyncio.Event().wait()
+
+        async def send(mensagem):
+            if mensagem['type'] == 'http.response.start':
+                mensagens.append(mensagem)
+            elif mensagem.get('body'):
+                mensagens.append(mensagem)
+                ao_enviar()
+
+        async_to_sync(ASGIHandler())(scope, receive, send)
+        return mensagens[1], mensagens[2:]
+
+    def test_csv_sai_antes_de_terminar_de_gerar(self):
+        geradas = []
+        geradas_no_primeiro_envio = []
+
+        def linhas_csv(queryset, colunas):
+            for numero in range(1000):
+                geradas.append(numero)
+                yield f'{numero};{"x" * 1000}\n'
+
+        with mock.patch('sapp.views.linhas_csv', linhas_csv):
+            inicio, corpo = self._get_asgi(
+                reverse('sapp:exportar_estoque_excel'),
+                'formato=csv',
+                lambda: geradas_no_primeiro_envio.append(len(geradas)),
+            )
+
+        self.assertEqual(inicio['status'], 200)
+        self.assertLess(geradas_no_primeiro_envio[0], 1000)
+        self.assertEqual(b''.join(mensagem['body'] for mensagem in corpo).count(b'\n'), 1000)
+
+    def test_xlsx_sai_antes_de_ler_o_arquivo_todo(self):
+        from io import BytesIO
+
+        conteudo = b'x' * (4 * 1024 * 1024)
+        arquivo = BytesIO(conteudo)
+        lidos_no_primeiro_envio = []
+
+        with mock.patch('sapp.views.gerar_xlsx_temporario', return_value=(arquivo, 0)):
+            inicio, corpo = self._get_asgi(
+                reverse('sapp:exportar_estoque_excel'),
+                '',
+                lambda: lidos_no_primeiro_envio.append(arquivo.tell()),
+            )
+
+        self.assertEqual(inicio['status'], 200)
+        self.assertLess(lidos_no_primeiro_envio[0], len(conteudo))
+        self.assertEqual(b''.join(mensagem['body'] for mensagem in corpo), conteudo)
@@ -31,6 +31,7 @@ urlpatterns = [
     path('estoque/excluir/<int:id>/', views.excluir_lote, name='excluir_lote'),
     path('estoque/registrar-saida/<int:id>/', views.registrar_saida, name='registrar_saida'),
     path('estoque/nova-saida/', views.nova_saida, name='nova_saida'),
+    path('api/estoque/movimentar-lote/', views.api_movimentar_em_lote, name='api_movimentar_em_lote'),
     path('relatorio-saidas/', views.relatorio_saidas, name='relatorio_saidas'),
     path('api/estoque/estatisticas/', views.api_estoque_estatisticas, name='api_estoque_estatisticas'),
     path('api/estoque/opcoes-filtro/', views.api_opcoes_filtro, name='api_opcoes_filtro'),
@@ -40,6 +41,9 @@ urlpatterns = [
     path('pagina-rascunho/', views.pagina_rascunho, name='pagina_rascunho'),
     path('exportar-excel/', views.exportar_excel, name='exportar_estoque_excel'),
     path('exportar-pdf/', views.exportar_pdf, name='exportar_estoque_pdf'),
+    path('exportacoes/iniciar/', views.iniciar_exportacao, name='iniciar_exportacao'),
+    path('exportacoes/<int:tarefa_id>/status/', views.status_exportacao, name='status_exportacao'),
+    path('exportacoes/<int:tarefa_id>/baixar/', views.baixar_exportacao, name='baixar_exportacao'),
     path('salvar-config-dashboard/', views.salvar_config_dashboard, name='salvar_config_dashboard'),
     path('debug-estoque/', views.debug_estoque_completo, name='debug_estoque'),
     path('api/buscar-dados-lote/', views.api_buscar_dados_lote, name='api_buscar_dados_lote'),
@@ -114,6 +118,7 @@ urlpatterns = [
 
     # FASE 4 - Atualização ao vivo, feed e som
     path('api/cards/versao/', views.api_versao_cards, name='api_versao_cards'),
+    path('api/cards/eventos/', views.api_eventos_kanban, name='api_eventos_kanban'),
     path('api/cards/atualizacoes/', views.api_atualizacoes_recentes, name='api_atualizacoes_recentes'),
     path('api/cards/html/', views.api_html_cards_atualizados, name='api_html_cards'),
     path('api/configuracao-atualizacao/', views.api_configuracao_atualizacao, name='api_config_atualizacao'),
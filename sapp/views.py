@@ -13,7 +13,7 @@ from django.core.serializers.json import DjangoJSONEncoder
 from .models import HistoricoMovimentacao
 from .models import OrigemDestino
 from .models import Estoque, Cultivar, Peneira, Categoria, StatusSistemico
-from django.db.models import Q, Sum, Prefetch, F
+from django.db.models import Q, Sum, Prefetch, F, prefetch_related_objects
 # Adicione no topo com os outros imports
 import datetime
 from django import forms  #
@@ -92,7 +92,65 @@ import tempfile
 import os
 
 from django.db import transaction
+from django.http import Http404, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
+from django.views.decorators.http import require_GET, require_POST
+from django.core.handlers.asgi import ASGIRequest
+from asgiref.sync import sync_to_async
 from .models import FotoMovimentacao # e os outros models   
+from .models import TarefaExportacao
+from .paginacao import paginar_por_cursor, usar_paginacao_cursor
+from .respostas import RespostaArquivo, RespostaStreaming
+from .services_exportacao import (
+    COLUNAS_ESTOQUE_FILTRADO,
+    COLUNAS_ESTOQUE_SIMPLES,
+    CONTENT_TYPE_CSV,
+    CONTENT_TYPE_XLSX,
+    RELACIONADOS_EXPORTACAO,
+    dados_tarefa_exportacao,
+    enfileirar_tarefa_exportacao,
+    escrever_pdf_estoque,
+    filtrar_estoque_exportacao,
+    gerar_xlsx_temporario,
+    linhas_csv,
+)
+from .services_estoque import (
+    CAMPOS_FACETA,
+    calcular_facetas,
+    calcular_facetas_encadeadas,
+    calcular_kpis_estoque,
+    empenhado_por_lote,
+    q_busca_estoque,
+    resumo_do_lote,
+)
+from .services_dashboard import obter_dashboard_em_cache, tendencia_resumida
+from .services_mapa import (
+    decompor_endereco,
+    enderecos_do_armazem,
+    lotes_por_endereco,
+    normalizar_endereco,
+    ocupacao_por_endereco,
+    preencher_endereco_estruturado,
+    q_posicoes_apos,
+)
+from .services_movimentacao import MovimentacaoEmLoteInvalida, movimentar_em_lote
+from .services_lotes import buscar_lotes, dados_do_lote
+from .services_kanban import (
+    alteracoes_desde,
+    atualizar_totais_empenho,
+    kg_empenhado,
+    lotes_e_embalagens,
+    solicitacoes_dos_empenhos,
+)
+from .services_versao import CHAVE_VERSAO_KANBAN, obter_versao
+from .services_eventos_kanban import (
+    aguardar_versao,
+    fluxo_eventos_kanban,
+    ler_id_evento,
+    montar_evento_kanban,
+    serializar_atualizacao,
+)
     
 
 # No início de views.py, com os outros imports de models
@@ -239,172 +297,6 @@ from .models import Estoque, HistoricoMovimentacao, Especie, Cultivar, Peneira
 
 
 
-@login_required
-@permission_required('sapp.pode_ver_estoque', raise_exception=True)
-def dashboard_data(request):
-    """Endpoint AJAX para dados do dashboard"""
-    try:
-        # Receber filtros (listas)
-        tipos_semente = request.GET.getlist('tipo_semente[]')
-        cultivares = request.GET.getlist('cultivar[]')
-        peneiras = request.GET.getlist('peneira[]')
-        unidades = request.GET.getlist('unidade[]')
-        armazens = request.GET.getlist('armazem[]')
-        data_inicio = request.GET.get('data_inicio', '').strip()
-        data_fim = request.GET.get('data_fim', '').strip()
-        tipo_mov = request.GET.get('tipo_mov', '').strip()
-        search = request.GET.get('search', '').strip()
-        
-        # Base queries
-        est_qs = Estoque.objects.filter(saldo__gt=0)
-        mov_qs = HistoricoMovimentacao.objects.select_related('estoque', 'usuario')
-        
-        # Aplicar filtros de estoque
-        if tipos_semente:
-            est_qs = est_qs.filter(especie__nome__in=tipos_semente)
-        
-        if cultivares:
-            est_qs = est_qs.filter(cultivar_id__in=cultivares)
-        
-        if peneiras:
-            est_qs = est_qs.filter(peneira_id__in=peneiras)
-        
-        if unidades:
-            est_qs = est_qs.filter(embalagem__in=unidades)
-        
-        if armazens:
-            est_qs = est_qs.filter(az__in=armazens)
-        
-        if search:
-            est_qs = est_qs.filter(
-                Q(lote__icontains=search) | 
-                Q(cultivar__nome__icontains=search) |
-                Q(especie__nome__icontains=search)
-            )
-        
-        # Aplicar filtros de movimentação
-        mov_qs = mov_qs.filter(estoque__in=est_qs)
-        
-        # Filtros de data
-        if data_inicio:
-            try:
-                data_inicio_obj = datetime.strptime(data_inicio, '%Y-%m-%d').date()
-                mov_qs = mov_qs.filter(data_hora__date__gte=data_inicio_obj)
-            except:
-                pass
-        
-        if data_fim:
-            try:
-                data_fim_obj = datetime.strptime(data_fim, '%Y-%m-%d').date()
-                mov_qs = mov_qs.filter(data_hora__date__lte=data_fim_obj)
-            except:
-                pass
-        
-        if tipo_mov:
-            mov_qs = mov_qs.filter(tipo__iexact=tipo_mov)
-        
-        # Calcular KPIs
-        bags = est_qs.filter(embalagem='BAG').aggregate(s=Sum('saldo'))['s'] or 0
-        scs = est_qs.filter(embalagem='SC').aggregate(s=Sum('saldo'))['s'] or 0
-        total_sc = (bags * 25) + scs
-        
-        kpis = {
-            'total_sc': int(total_sc),
-            'bags': int(bags),
-            'scs': int(scs),
-            'peso': float(est_qs.aggregate(s=Sum('peso_total'))['s'] or 0),
-            'ativos': est_qs.count(),
-            'parados': est_qs.filter(data_ultima_movimentacao__lt=timezone.now() - timedelta(days=30)).count()
-        }
-        
-        # Dados dos gráficos
-        cores_padrao = ['#10b981', '#3b82f6', '#f59e0b', '#ef4444', '#8b5cf6', '#ec4899', '#06b6d4', '#84cc16', '#f97316', '#6366f1']
-        
-        cultivares_data = list(est_qs.filter(cultivar__isnull=False)
-                               .values('cultivar__nome')
-                               .annotate(volume=Sum('saldo'))
-                               .filter(volume__gt=0)
-                               .order_by('-volume')[:10])
-        
-        peneiras_data = list(est_qs.filter(peneira__isnull=False)
-                             .values('peneira__nome')
-                             .annotate(volume=Sum('saldo'))
-                             .filter(volume__gt=0)
-                             .order_by('-volume'))
-        
-        armazens_data = list(est_qs.exclude(az__isnull=True).exclude(az='')
-                             .values('az')
-                             .annotate(volume=Sum('saldo'))
-                             .filter(volume__gt=0)
-                             .order_by('az'))
-        
-        # Tendência
-        data_limite = timezone.now() - timedelta(days=15)
-        tendencia_data = list(mov_qs.filter(data_hora__date__gte=data_limite.date())
-                              .annotate(dia=TruncDate('data_hora'))
-                              .values('dia')
-                              .annotate(
-                                  entradas=Count('id', filter=Q(tipo__iexact='Entrada')),
-                                  saidas=Count('id', filter=Q(tipo__iexact='Saída'))
-                              )
-                              .order_by('dia'))
-        
-        graficos = {
-            'cultivar': {
-                'labels': [d['cultivar__nome'] for d in cultivares_data],
-                'values': [int(d['volume']) for d in cultivares_data],
-                'colors': cores_padrao[:len(cultivares_data)]
-            },
-            'peneira': {
-                'labels': [d['peneira__nome'] for d in peneiras_data],
-                'values': [int(d['volume']) for d in peneiras_data],
-                'colors': cores_padrao[:len(peneiras_data)]
-            },
-            'armazem': {
-                'labels': [d['az'] for d in armazens_data],
-                'values': [int(d['volume']) for d in armazens_data],
-                'colors': cores_padrao[:len(armazens_data)]
-            },
-            'tendencia': {
-                'labels': [d['dia'].strftime('%d/%m') for d in tendencia_data],
-                'entradas': [d['entradas'] for d in tendencia_data],
-                'saidas': [d['saidas'] for d in tendencia_data]
-            }
-        }
-        
-        # Opções de filtros (encadeamento)
-        opcoes_filtros = {
-            'tipos_semente': list(est_qs.values_list('especie__nome', flat=True).distinct().order_by('especie__nome')),
-            'cultivares': list(est_qs.filter(cultivar__isnull=False).values('cultivar_id', 'cultivar__nome').distinct().order_by('cultivar__nome')),
-            'peneiras': list(est_qs.filter(peneira__isnull=False).values('peneira_id', 'peneira__nome').distinct().order_by('peneira__nome')),
-            'armazens': list(est_qs.exclude(az__isnull=True).exclude(az='').values_list('az', flat=True).distinct().order_by('az'))
-        }
-        
-        # Movimentações recentes
-        movimentacoes = []
-        for mov in mov_qs.order_by('-data_hora')[:10]:
-            movimentacoes.append({
-                'dt': mov.data_hora.strftime('%d/%m/%Y %H:%M') if mov.data_hora else '--',
-                'tp': mov.tipo or '--',
-                'lt': mov.lote_ref or (mov.estoque.lote if mov.estoque else '--'),
-                'unidade': mov.estoque.embalagem if mov.estoque else '--',
-                'qtd': getattr(mov, 'quantidade', 0),
-                'us': mov.usuario.username if mov.usuario else 'Sistema'
-            })
-        
-        return JsonResponse({
-            'success': True,
-            'kpis': kpis,
-            'graficos': graficos,
-            'recentes': movimentacoes,
-            'opcoes_filtros': opcoes_filtros
-        })
-        
-    except Exception as e:
-        print(f"[ERROR] {str(e)}")
-        import traceback
-        traceback.print_exc()
-        return JsonResponse({'success': False, 'error': str(e)}, status=500)
 # ================================================================
 # LISTA DE ESTOQUE (TABELA PRINCIPAL)
 # ================================================================
@@ -435,16 +327,7 @@ def lista_estoque(request, template_name='sapp/tabela_estoque.html'):
     # Busca Global
     busca = request.GET.get('busca', '').strip()
     if busca:
-        for termo in busca.split():
-            qs = qs.filter(
-                Q(lote__icontains=termo) | 
-                Q(produto__icontains=termo) |
-                Q(cultivar__nome__icontains=termo) | 
-                Q(especie__nome__icontains=termo) |
-                Q(endereco__icontains=termo) | 
-                Q(cliente__icontains=termo) |
-                Q(empresa__icontains=termo)
-            )
+        qs = qs.filter(q_busca_estoque(busca))
 
     # Aplicar filtros sequenciais - COM SUPORTE A VALORES VAZIOS (__null__)
     filter_map = {
@@ -494,66 +377,15 @@ def lista_estoque(request, template_name='sapp/tabela_estoque.html'):
             qs = qs.filter(**{f'{field}__lte': max_val})
 
     # MÉTRICAS PARA OS CARDS - Usando o queryset NÃO FILTRADO (qs_metrics)
-    # CARD 1: Lotes Ativos (APENAS saldo > 0)
-    total_itens_ativos = qs_metrics.filter(saldo__gt=0).count()
-    
-    # CARD 2: SC Equivalente (somente saldo > 0)
-    saldo_bags = qs_metrics.filter(embalagem='BAG', saldo__gt=0).aggregate(s=Sum('saldo'))['s'] or 0
-    saldo_sc = qs_metrics.filter(embalagem='SC', saldo__gt=0).aggregate(s=Sum('saldo'))['s'] or 0
-    saldo_total_sc = (saldo_bags * 25) + saldo_sc
+    # Uma única consulta agregada; os cards consideram apenas saldo > 0
+    kpis = calcular_kpis_estoque(qs_metrics)
     origens = OrigemDestino.objects.all().order_by('nome')
-    # CARD 3: Unidades BAG (somente saldo > 0)
-    saldo_bags_total = qs_metrics.filter(embalagem='BAG', saldo__gt=0).aggregate(s=Sum('saldo'))['s'] or 0
-    
-    # CARD 4: PME Total (KG)
-    pme_total = qs_metrics.filter(saldo__gt=0).aggregate(s=Sum('peso_total'))['s'] or Decimal('0.00')
-    
-    # CARD 5: Clientes Únicos (somente saldo > 0)
-    clientes_unicos = qs_metrics.filter(
-        saldo__gt=0
-    ).exclude(
-        cliente__isnull=True
-    ).exclude(
-        cliente=''
-    ).values('cliente').distinct().count()
 
     # Opções de Filtro (baseadas no queryset filtrado qs, NÃO no qs_metrics)
-    def get_options_list(field_lookup, param_name):
-        vals = qs.values_list(field_lookup, flat=True).distinct().order_by(field_lookup)
-        options = [str(v) for v in vals if v is not None and str(v).strip() != '']
-        # Ordenar e retornar
-        return sorted(options)
-
+    # Todas as colunas em uma única consulta agrupada
     filter_options = {
-        'az': get_options_list('az', 'az'),
-        'lote': get_options_list('lote', 'lote'),
-        'produto': get_options_list('produto', 'produto'),
-        'cultivar': get_options_list('cultivar__nome', 'cultivar'),
-        'peneira': get_options_list('peneira__nome', 'peneira'),
-        'categoria': get_options_list('categoria__nome', 'categoria'),
-        'endereco': get_options_list('endereco', 'endereco'),
-        'especie': get_options_list('especie__nome', 'especie'),
-        'tratamento': get_options_list('tratamento__nome', 'tratamento'),
-        'embalagem': get_options_list('embalagem', 'embalagem'),
-        'cliente': get_options_list('cliente', 'cliente'),
-        'empresa': get_options_list('empresa', 'empresa'),
-        'conferente': get_options_list('conferente__username', 'conferente')
-    }
-
-    # ================================================================
-    # RESERVAS / EMPENHOS POR LOTE
-    # ================================================================
-    # O estoque físico continua separado por endereço, mas o usuário precisa
-    # enxergar quando o LOTE possui reserva em qualquer endereço.
-    lotes_visiveis = list(qs.values_list('lote', flat=True).distinct())
-    empenhos_por_lote = {
-        row['lote']: int(row['total'] or 0)
-        for row in (
-            Estoque.objects
-            .filter(lote__in=lotes_visiveis)
-            .values('lote')
-            .annotate(total=Sum('empenhado'))
-        )
+        campo: faceta['opcoes']
+        for campo, faceta in calcular_facetas(qs).items()
     }
 
     # Paginação
@@ -563,20 +395,40 @@ def lista_estoque(request, template_name='sapp/tabela_estoque.html'):
     except (ValueError, TypeError):
         page_size = 25
     
-    paginator = Paginator(qs, page_size)
-    page_number = request.GET.get('page', 1)
-    
-    try:
-        page_obj = paginator.page(page_number)
-    except PageNotAnInteger:
-        page_obj = paginator.page(1)
-    except EmptyPage:
-        page_obj = paginator.page(paginator.num_pages)
+    if usar_paginacao_cursor(request):
+        # Paginação por cursor: páginas profundas custam o mesmo que a primeira
+        page_obj = paginar_por_cursor(
+            qs,
+            ('-data_ultima_movimentacao', '-id'),
+            page_size,
+            cursor=request.GET.get('cursor'),
+            contagem=request.GET.get('contagem'),
+        )
+    else:
+        paginator = Paginator(qs, page_size)
+        page_number = request.GET.get('page', 1)
+
+        try:
+            page_obj = paginator.page(page_number)
+        except PageNotAnInteger:
+            page_obj = paginator.page(1)
+        except EmptyPage:
+            page_obj = paginator.page(paginator.num_pages)
 
     query_params = request.GET.copy()
     if 'page' in query_params:
         del query_params['page']
+    query_params.pop('cursor', None)
     
+    # ================================================================
+    # RESERVAS / EMPENHOS POR LOTE
+    # ================================================================
+    # O estoque físico continua separado por endereço, mas o usuário precisa
+    # enxergar quando o LOTE possui reserva em qualquer endereço.
+    # Só os lotes da página atual são lidos, direto do ResumoLote.
+    lotes_visiveis = {item.lote for item in page_obj.object_list}
+    empenhos_por_lote = empenhado_por_lote(lotes_visiveis)
+
     # Atributos transitórios usados apenas pelo template.
     # disponivel = saldo físico deste endereço - reserva atribuída a este registro.
     # empenhado_lote = reserva total do lote, independentemente do endereço.
@@ -584,16 +436,29 @@ def lista_estoque(request, template_name='sapp/tabela_estoque.html'):
         item.disponivel_ui = max(0, int(item.disponivel or 0))
         item.empenhado_lote_ui = empenhos_por_lote.get(item.lote, 0)
 
+    # Linha do tempo de cada lote (usuário e fotos) em três consultas para a página
+    prefetch_related_objects(
+        list(page_obj.object_list),
+        Prefetch(
+            'historico',
+            queryset=(
+                HistoricoMovimentacao.objects
+                .select_related('usuario')
+                .prefetch_related('fotos')
+            ),
+        ),
+    )
+
     context = {
         'estoque': page_obj,
         'itens': page_obj,
         'status': status,
         'busca': busca,
-        'total_itens': total_itens_ativos,  # CARD 1: APENAS saldo > 0
-        'total_sc': saldo_total_sc,          # CARD 2: APENAS saldo > 0
-        'total_bags': saldo_bags_total,      # CARD 3: APENAS saldo > 0
-        'total_pme': pme_total,              # CARD 4: NOVO CARD
-        'clientes_unicos': clientes_unicos,  # CARD 5: APENAS saldo > 0
+        'total_itens': kpis['lotes_ativos'],         # CARD 1: APENAS saldo > 0
+        'total_sc': kpis['total_sc'],                # CARD 2: APENAS saldo > 0
+        'total_bags': kpis['saldo_bags'],            # CARD 3: APENAS saldo > 0
+        'total_pme': kpis['total_pme'],              # CARD 4: NOVO CARD
+        'clientes_unicos': kpis['clientes_unicos'],  # CARD 5: APENAS saldo > 0
         'filter_options': filter_options,
         'url_params': query_params.urlencode(),
         'page_sizes': [10, 25, 50, 100, 200],
@@ -645,15 +510,7 @@ def gestao_estoque(request, template_name='sapp/gestao_estoque.html'):
     # Busca Global
     busca = request.GET.get('busca', '').strip()
     if busca:
-        for termo in busca.split():
-            qs = qs.filter(
-                Q(lote__icontains=termo) | 
-                Q(produto__icontains=termo) |
-                Q(cultivar__nome__icontains=termo) | 
-                Q(especie__nome__icontains=termo) |
-                Q(endereco__icontains=termo) | 
-                Q(cliente__icontains=termo)
-            )
+        qs = qs.filter(q_busca_estoque(busca))
 
     # Aplicar filtros sequenciais
     filter_map = {
@@ -704,24 +561,13 @@ def gestao_estoque(request, template_name='sapp/gestao_estoque.html'):
             except ValueError:
                 pass
 
-    # MÉTRICAS - usando o mesmo queryset filtrado
-    saldo_bags = qs.filter(embalagem='BAG').aggregate(s=Sum('saldo'))['s'] or 0
-    saldo_sc = qs.filter(embalagem='SC').aggregate(s=Sum('saldo'))['s'] or 0
-    saldo_total_sc = (saldo_bags * 25) + saldo_sc
-    
-    total_pme = qs.aggregate(s=Sum('peso_total'))['s'] or 0
+    # MÉTRICAS - usando o mesmo queryset filtrado (uma única consulta)
+    kpis = calcular_kpis_estoque(qs)
     
     
     # Opções de Filtro - baseadas no queryset COMPLETO (com saldo > 0)
     base_options_qs = Estoque.objects.filter(saldo__gt=0)
-    
-    def get_options_list(field_lookup):
-        vals = base_options_qs.values_list(field_lookup, flat=True).distinct().order_by(field_lookup)
-        options = []
-        for v in vals:
-            if v is not None and str(v).strip() != '':
-                options.append(str(v))
-        return options
+    facetas = calcular_facetas(base_options_qs)
     status_ids_em_uso = qs.exclude(
         status_sistemico__isnull=True
     ).values_list(
@@ -744,20 +590,11 @@ def gestao_estoque(request, template_name='sapp/gestao_estoque.html'):
     
     filter_options = {
         'status_sistemico': status_options,
-        'az': get_options_list('az'),
-        'lote': get_options_list('lote'),
-        'produto': get_options_list('produto'),
-        'cultivar': get_options_list('cultivar__nome'),
-        'peneira': get_options_list('peneira__nome'),
-        'categoria': get_options_list('categoria__nome'),
-        'endereco': get_options_list('endereco'),
-        'especie': get_options_list('especie__nome'),
-        'tratamento': get_options_list('tratamento__nome'),
-        'embalagem': get_options_list('embalagem'),
-        'cliente': get_options_list('cliente'),
-        'empresa': get_options_list('empresa'),
-        'conferente': get_options_list('conferente__username')
     }
+    filter_options.update({
+        campo: faceta['opcoes']
+        for campo, faceta in facetas.items()
+    })
 
     # Paginação
     page_size = request.GET.get('page_size', 25)
@@ -766,42 +603,47 @@ def gestao_estoque(request, template_name='sapp/gestao_estoque.html'):
     except (ValueError, TypeError):
         page_size = 25
     
-    paginator = Paginator(qs, page_size)
-    page_number = request.GET.get('page', 1)
-    
-    try:
-        page_obj = paginator.page(page_number)
-    except PageNotAnInteger:
-        page_obj = paginator.page(1)
-    except EmptyPage:
-        page_obj = paginator.page(paginator.num_pages)
+    if usar_paginacao_cursor(request):
+        # Paginação por cursor: páginas profundas custam o mesmo que a primeira
+        page_obj = paginar_por_cursor(
+            qs,
+            ('-data_ultima_movimentacao', '-id'),
+            page_size,
+            cursor=request.GET.get('cursor'),
+            contagem=request.GET.get('contagem'),
+        )
+    else:
+        paginator = Paginator(qs, page_size)
+        page_number = request.GET.get('page', 1)
+
+        try:
+            page_obj = paginator.page(page_number)
+        except PageNotAnInteger:
+            page_obj = paginator.page(1)
+        except EmptyPage:
+            page_obj = paginator.page(paginator.num_pages)
 
     query_params = request.GET.copy()
     if 'page' in query_params:
         del query_params['page']
+    query_params.pop('cursor', None)
     
-    total_itens = qs.count()
-    clientes_unicos = qs.exclude(cliente__isnull=True).exclude(cliente='').values('cliente').distinct().count()
-
-    total_empenhado = qs.aggregate(e=Sum('empenhado'))['e'] or 0
-    total_disponivel = (qs.aggregate(s=Sum('saldo'))['s'] or 0) - total_empenhado
-
     context = {
         'estoque': page_obj,
         'itens': page_obj,
         'busca': busca,
-        'total_itens': total_itens,
-        'total_sc': saldo_total_sc,
-        'total_bags': saldo_bags,
-        'total_sc_fisico': saldo_sc,
-        'total_pme': total_pme,
-        'clientes_unicos': clientes_unicos,
+        'total_itens': kpis['lotes_ativos'],
+        'total_sc': kpis['total_sc'],
+        'total_bags': kpis['saldo_bags'],
+        'total_sc_fisico': kpis['saldo_sc'],
+        'total_pme': kpis['total_pme'],
+        'clientes_unicos': kpis['clientes_unicos'],
         'filter_options': filter_options,
         'url_params': query_params.urlencode(),
         'page_sizes': [10, 25, 50, 100, 200],
         'page_size': page_size,
-        'total_empenhado': total_empenhado,
-        'total_disponivel': total_disponivel,
+        'total_empenhado': kpis['total_empenhado'],
+        'total_disponivel': kpis['total_disponivel'],
     }
     
     return render(request, template_name, context)
@@ -818,20 +660,6 @@ def opcoes_filtro_api(request):
             'error': 'Coluna não especificada'
         })
 
-    qs = Estoque.objects.filter(saldo__gt=0)
-
-    busca = request.GET.get('busca', '').strip()
-    if busca:
-        for termo in busca.split():
-            qs = qs.filter(
-                Q(lote__icontains=termo) |
-                Q(produto__icontains=termo) |
-                Q(cultivar__nome__icontains=termo) |
-                Q(especie__nome__icontains=termo) |
-                Q(endereco__icontains=termo) |
-                Q(cliente__icontains=termo)
-            )
-
     field_map = {
         'az': 'az',
         'lote': 'lote',
@@ -851,79 +679,112 @@ def opcoes_filtro_api(request):
         'conferente': 'conferente__username',
     }
 
-    filter_map = {
-        'az': 'az__in',
-        'lote': 'lote__in',
-        'produto': 'produto__in',
-        'cultivar': 'cultivar__nome__in',
-        'peneira': 'peneira__nome__in',
-        'categoria': 'categoria__nome__in',
-        'endereco': 'endereco__in',
-        'especie': 'especie__nome__in',
-        'tratamento': 'tratamento__nome__in',
-        'embalagem': 'embalagem__in',
-        'cliente': 'cliente__in',
-        'empresa': 'empresa__in',
-        'conferente': 'conferente__username__in',
-    }
+    def filtrar_exceto(coluna):
+        """Aplica todos os filtros atuais, exceto o da coluna informada"""
+        qs = Estoque.objects.filter(saldo__gt=0)
 
-    for param, lookup in filter_map.items():
-        if param == coluna:
-            continue
+        busca = request.GET.get('busca', '').strip()
+        if busca:
+            qs = qs.filter(q_busca_estoque(busca))
+
+        filter_map = {
+            'az': 'az__in',
+            'lote': 'lote__in',
+            'produto': 'produto__in',
+            'cultivar': 'cultivar__nome__in',
+            'peneira': 'peneira__nome__in',
+            'categoria': 'categoria__nome__in',
+            'endereco': 'endereco__in',
+            'especie': 'especie__nome__in',
+            'tratamento': 'tratamento__nome__in',
+            'embalagem': 'embalagem__in',
+            'cliente': 'cliente__in',
+            'empresa': 'empresa__in',
+            'conferente': 'conferente__username__in',
+        }
 
-        values = request.GET.getlist(param)
-        values = [v for v in values if v and v.strip()]
+        for param, lookup in filter_map.items():
+            if param == coluna:
+                continue
 
-        if values:
-            if '__null__' in values:
-                specific_values = [v for v in values if v != '__null__']
-                null_lookup = lookup.replace('__in', '__isnull')
+            values = request.GET.getlist(param)
+            values = [v for v in values if v and v.strip()]
 
-                if specific_values:
-                    qs = qs.filter(
-                        Q(**{lookup: specific_values}) |
-                        Q(**{null_lookup: True})
-                    )
+            if values:
+                if '__null__' in values:
+                    specific_values = [v for v in values if v != '__null__']
+                    null_lookup = lookup.replace('__in', '__isnull')
+
+                    if specific_values:
+                        qs = qs.filter(
+                            Q(**{lookup: specific_values}) |
+                            Q(**{null_lookup: True})
+                        )
+                    else:
+                        qs = qs.filter(**{null_lookup: True})
                 else:
-                    qs = qs.filter(**{null_lookup: True})
-            else:
-                qs = qs.filter(**{lookup: values})
+                    qs = qs.filter(**{lookup: values})
 
-    for field in ['saldo', 'peso_unitario', 'peso_total']:
-        if field == coluna:
-            continue
+        for field in ['saldo', 'peso_unitario', 'peso_total']:
+            if field == coluna:
+                continue
 
-        min_val = request.GET.get(f'min_{field}')
-        max_val = request.GET.get(f'max_{field}')
+            min_val = request.GET.get(f'min_{field}')
+            max_val = request.GET.get(f'max_{field}')
 
-        if min_val:
-            try:
-                qs = qs.filter(**{f'{field}__gte': float(min_val)})
-            except ValueError:
-                pass
+            if min_val:
+                try:
+                    qs = qs.filter(**{f'{field}__gte': float(min_val)})
+                except ValueError:
+                    pass
 
-        if max_val:
-            try:
-                qs = qs.filter(**{f'{field}__lte': float(max_val)})
-            except ValueError:
-                pass
+            if max_val:
+                try:
+                    qs = qs.filter(**{f'{field}__lte': float(max_val)})
+                except ValueError:
+                    pass
 
-    status_filter = request.GET.getlist('status_sistemico')
-    if status_filter and coluna != 'status_sistemico':
-        status_ids = []
+        status_filter = request.GET.getlist('status_sistemico')
+        if status_filter and coluna != 'status_sistemico':
+            status_ids = []
 
-        for status_value in status_filter:
-            try:
-                if str(status_value).isdigit():
-                    status_ids.append(int(status_value))
-                else:
-                    status_obj = StatusSistemico.objects.get(nome=status_value)
-                    status_ids.append(status_obj.id)
-            except StatusSistemico.DoesNotExist:
-                pass
+            for status_value in status_filter:
+                try:
+                    if str(status_value).isdigit():
+                        status_ids.append(int(status_value))
+                    else:
+                        status_obj = StatusSistemico.objects.get(nome=status_value)
+                        status_ids.append(status_obj.id)
+                except StatusSistemico.DoesNotExist:
+                    pass
 
-        if status_ids:
-            qs = qs.filter(status_sistemico__in=status_ids)
+            if status_ids:
+                qs = qs.filter(status_sistemico__in=status_ids)
+
+        return qs
+
+    # Todas as colunas de uma vez (uma única consulta agrupada)
+    if coluna == 'todas':
+        facetas = calcular_facetas_encadeadas({
+            campo: filtrar_exceto(campo)
+            for campo in CAMPOS_FACETA
+        })
+
+        return JsonResponse({
+            'success': True,
+            'facetas': {
+                campo: {
+                    'opcoes': [
+                        {'value': v, 'label': v, 'total': faceta['contagens'][v]}
+                        for v in faceta['opcoes']
+                    ],
+                    'tem_null': faceta['tem_null'],
+                }
+                for campo, faceta in facetas.items()
+            }
+        })
+
+    qs = filtrar_exceto(coluna)
 
     if coluna == 'status_sistemico':
         status_ids_em_uso = qs.exclude(
@@ -952,6 +813,18 @@ def opcoes_filtro_api(request):
             'tem_null': qs.filter(status_sistemico__isnull=True).exists()
         })
 
+    if coluna in CAMPOS_FACETA:
+        faceta = calcular_facetas(qs, [coluna])[coluna]
+
+        return JsonResponse({
+            'success': True,
+            'opcoes': [
+                {'value': v, 'label': v, 'total': faceta['contagens'][v]}
+                for v in faceta['opcoes']
+            ],
+            'tem_null': faceta['tem_null']
+        })
+
     if coluna not in field_map:
         return JsonResponse({
             'success': False,
@@ -1253,6 +1126,7 @@ def _realocar_empenho_apos_transferencia_avulsa(origem, destino):
         movido += qtd_mover
 
     if movido:
+        # Origem e destino são do mesmo lote: o ResumoLote não muda
         Estoque.objects.filter(pk=origem.pk).update(
             empenhado=F('empenhado') - movido
         )
@@ -1262,6 +1136,12 @@ def _realocar_empenho_apos_transferencia_avulsa(origem, destino):
         origem.refresh_from_db(fields=['saldo', 'empenhado'])
         destino.refresh_from_db(fields=['saldo', 'empenhado'])
 
+        # Itens alterados por queryset/bulk_create: os signals não rodaram
+        # (o peso do destino pode ser outro, então o kg do card muda)
+        atualizar_totais_empenho(
+            solicitacoes_dos_empenhos({item.empenho_id for item in itens})
+        )
+
     return movido
 
 
@@ -1290,12 +1170,7 @@ def transferir(request, id):
                     )
                     return redirect('sapp:lista_estoque')
 
-                empenhado_lote = int(
-                    Estoque.objects
-                    .filter(lote=origem.lote)
-                    .aggregate(total=Sum('empenhado'))['total']
-                    or 0
-                )
+                empenhado_lote = resumo_do_lote(origem.lote).empenhado
 
                 # Beneficiamento é uma saída definitiva. Não pode consumir a
                 # parcela empenhada fora do card.
@@ -1577,6 +1452,50 @@ def transferir(request, id):
     return redirect('sapp:lista_estoque')
 
 
+@login_required
+@permission_required('sapp.pode_movimentar_estoque', raise_exception=True)
+@require_POST
+def api_movimentar_em_lote(request):
+    """
+    Expedição/transferência de várias linhas numa única transação
+    (carregamento de caminhão).
+
+    JSON: {"carga": {"numero_carga", "motorista", "placa", "cliente", "observacao"},
+           "linhas": [{"estoque_id", "quantidade", "tipo": "EXPEDICAO"|"TRANSFERENCIA",
+                       "endereco"}]}
+    Com fotos, envie multipart: campo "dados" com o mesmo JSON + arquivos "fotos".
+    """
+    try:
+        if request.content_type == 'application/json':
+            dados = json.loads(request.body or b'{}')
+        else:
+            dados = json.loads(request.POST.get('dados') or '{}')
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'JSON inválido.'}, status=400)
+
+    if not isinstance(dados, dict):
+        return JsonResponse({'success': False, 'error': 'JSON inválido.'}, status=400)
+
+    try:
+        linhas = movimentar_em_lote(
+            dados.get('linhas'),
+            request.user,
+            carga=dados.get('carga'),
+            fotos=request.FILES.getlist('fotos'),
+        )
+    except MovimentacaoEmLoteInvalida as erro:
+        return JsonResponse({
+            'success': False,
+            'error': 'Nenhuma movimentação foi gravada: corrija as linhas com erro.',
+            'erros': erro.erros_gerais,
+            'linhas': erro.resultados,
+        }, status=400)
+
+    print(f"🚚 [MOVIMENTAÇÃO EM LOTE] {len(linhas)} linha(s) por {request.user.username}")
+
+    return JsonResponse({'success': True, 'linhas': linhas})
+
+
 
 # No seu views.py
 from django.http import JsonResponse
@@ -1670,7 +1589,9 @@ def nova_entrada(request):
                         dados_end = extrair_ln_p(endereco)
                         if dados_end:
                             outro_ultimo = Estoque.objects.filter(
-                                endereco__startswith=f"{dados_end['rua']} {dados_end['ln']} P",
+                                rua=dados_end['rua'],
+                                linha=dados_end['ln'],
+                                posicao__isnull=False,
                                 ultimo_lote_linha=True
                             ).exclude(id=item.id).first()
                             
@@ -1711,7 +1632,9 @@ def nova_entrada(request):
                         dados_end = extrair_ln_p(endereco)
                         if dados_end:
                             outro_ultimo = Estoque.objects.filter(
-                                endereco__startswith=f"{dados_end['rua']} {dados_end['ln']} P",
+                                rua=dados_end['rua'],
+                                linha=dados_end['ln'],
+                                posicao__isnull=False,
                                 ultimo_lote_linha=True
                             ).first()
                             
@@ -1910,14 +1833,7 @@ def api_estoque_estatisticas(request):
     # Busca
     busca = request.GET.get('busca', '').strip()
     if busca:
-        for termo in busca.split():
-            qs = qs.filter(
-                Q(lote__icontains=termo) | 
-                Q(produto__icontains=termo) |
-                Q(cultivar__nome__icontains=termo) | 
-                Q(endereco__icontains=termo) | 
-                Q(cliente__icontains=termo)
-            )
+        qs = qs.filter(q_busca_estoque(busca))
     
     # Filtros de seleção
     filter_map = {
@@ -1967,24 +1883,16 @@ def api_estoque_estatisticas(request):
             except ValueError:
                 pass
     
-    # Calcular estatísticas
-    total_itens = qs.count()
-    
-    saldo_bags = qs.filter(embalagem='BAG').aggregate(s=Sum('saldo'))['s'] or 0
-    saldo_sc = qs.filter(embalagem='SC').aggregate(s=Sum('saldo'))['s'] or 0
-    total_sc = (saldo_bags * 25) + saldo_sc
-    
-    total_pme = qs.aggregate(s=Sum('peso_total'))['s'] or 0
-    
-    clientes_unicos = qs.exclude(cliente__isnull=True).exclude(cliente='').values('cliente').distinct().count()
+    # Calcular estatísticas (uma única consulta)
+    kpis = calcular_kpis_estoque(qs)
     
     return JsonResponse({
         'success': True,
-        'total_itens': total_itens,
-        'total_sc': total_sc,
-        'total_bags': saldo_bags,
-        'total_pme': total_pme,
-        'clientes_unicos': clientes_unicos
+        'total_itens': kpis['lotes_ativos'],
+        'total_sc': kpis['total_sc'],
+        'total_bags': kpis['saldo_bags'],
+        'total_pme': kpis['total_pme'],
+        'clientes_unicos': kpis['clientes_unicos']
     })
 
 
@@ -1998,114 +1906,106 @@ def api_opcoes_filtro(request):
     if not coluna:
         return JsonResponse({'success': False, 'error': 'Coluna não especificada'})
 
-    # Query base - APENAS saldo > 0
-    qs = Estoque.objects.filter(saldo__gt=0)
+    def filtrar_exceto(coluna):
+        """Aplica TODOS os filtros atuais, exceto o da coluna informada"""
+        # Query base - APENAS saldo > 0
+        qs = Estoque.objects.filter(saldo__gt=0)
 
-    # Aplicar TODOS os filtros atuais, exceto a coluna que estamos abrindo
-    # Status sistêmico
-    status_filter = request.GET.getlist('status_sistemico')
-    if status_filter and coluna != 'status_sistemico':
-        if '__null__' in status_filter:
-            qs = qs.filter(
-                Q(status_sistemico__in=[s for s in status_filter if s != '__null__']) | 
-                Q(status_sistemico__isnull=True)
-            )
-        else:
-            qs = qs.filter(status_sistemico__in=status_filter)
+        # Aplicar TODOS os filtros atuais, exceto a coluna que estamos abrindo
+        # Status sistêmico
+        status_filter = request.GET.getlist('status_sistemico')
+        if status_filter and coluna != 'status_sistemico':
+            if '__null__' in status_filter:
+                qs = qs.filter(
+                    Q(status_sistemico__in=[s for s in status_filter if s != '__null__']) | 
+                    Q(status_sistemico__isnull=True)
+                )
+            else:
+                qs = qs.filter(status_sistemico__in=status_filter)
 
-    # Busca
-    busca = request.GET.get('busca', '').strip()
-    if busca:
-        for termo in busca.split():
-            qs = qs.filter(
-                Q(lote__icontains=termo) | 
-                Q(produto__icontains=termo) |
-                Q(cultivar__nome__icontains=termo) | 
-                Q(endereco__icontains=termo) | 
-                Q(cliente__icontains=termo)
-            )
+        # Busca
+        busca = request.GET.get('busca', '').strip()
+        if busca:
+            qs = qs.filter(q_busca_estoque(busca))
+
+        # Mapeamento de filtros
+        filter_map = {
+            'az': 'az__in',
+            'lote': 'lote__in',
+            'produto': 'produto__in',
+            'cultivar': 'cultivar__nome__in',
+            'peneira': 'peneira__nome__in',
+            'categoria': 'categoria__nome__in',
+            'endereco': 'endereco__in',
+            'especie': 'especie__nome__in',
+            'tratamento': 'tratamento__nome__in',
+            'embalagem': 'embalagem__in',
+            'cliente': 'cliente__in',
+            'empresa': 'empresa__in',
+            'conferente': 'conferente__username__in'
+        }
 
-    # Mapeamento de filtros
-    filter_map = {
-        'az': 'az__in',
-        'lote': 'lote__in',
-        'produto': 'produto__in',
-        'cultivar': 'cultivar__nome__in',
-        'peneira': 'peneira__nome__in',
-        'categoria': 'categoria__nome__in',
-        'endereco': 'endereco__in',
-        'especie': 'especie__nome__in',
-        'tratamento': 'tratamento__nome__in',
-        'embalagem': 'embalagem__in',
-        'cliente': 'cliente__in',
-        'empresa': 'empresa__in',
-        'conferente': 'conferente__username__in'
-    }
-
-    # Aplicar outros filtros (exceto a coluna atual)
-    for param, lookup in filter_map.items():
-        if param == coluna:
-            continue
+        # Aplicar outros filtros (exceto a coluna atual)
+        for param, lookup in filter_map.items():
+            if param == coluna:
+                continue
 
-        values = request.GET.getlist(param)
-        values = [v for v in values if v and v.strip()]
-        if values:
-            if '__null__' in values:
-                specific_values = [v for v in values if v != '__null__']
-                if specific_values:
-                    qs = qs.filter(
-                        Q(**{lookup: specific_values}) | 
-                        Q(**{lookup.replace('__in', '__isnull'): True})
-                    )
+            values = request.GET.getlist(param)
+            values = [v for v in values if v and v.strip()]
+            if values:
+                if '__null__' in values:
+                    specific_values = [v for v in values if v != '__null__']
+                    if specific_values:
+                        qs = qs.filter(
+                            Q(**{lookup: specific_values}) | 
+                            Q(**{lookup.replace('__in', '__isnull'): True})
+                        )
+                    else:
+                        qs = qs.filter(**{lookup.replace('__in', '__isnull'): True})
                 else:
-                    qs = qs.filter(**{lookup.replace('__in', '__isnull'): True})
-            else:
-                qs = qs.filter(**{lookup: values})
+                    qs = qs.filter(**{lookup: values})
 
-    # Filtros numéricos (exceto a coluna atual)
-    for field in ['saldo', 'peso_unitario', 'peso_total']:
-        if field == coluna:
-            continue
-        min_val = request.GET.get(f'min_{field}')
-        max_val = request.GET.get(f'max_{field}')
-        if min_val:
-            try:
-                qs = qs.filter(**{f'{field}__gte': float(min_val)})
-            except ValueError:
-                pass
-        if max_val:
-            try:
-                qs = qs.filter(**{f'{field}__lte': float(max_val)})
-            except ValueError:
-                pass
+        # Filtros numéricos (exceto a coluna atual)
+        for field in ['saldo', 'peso_unitario', 'peso_total']:
+            if field == coluna:
+                continue
+            min_val = request.GET.get(f'min_{field}')
+            max_val = request.GET.get(f'max_{field}')
+            if min_val:
+                try:
+                    qs = qs.filter(**{f'{field}__gte': float(min_val)})
+                except ValueError:
+                    pass
+            if max_val:
+                try:
+                    qs = qs.filter(**{f'{field}__lte': float(max_val)})
+                except ValueError:
+                    pass
 
-    # Mapeamento para buscar os valores distintos
-    field_lookup_map = {
-        'az': 'az',
-        'lote': 'lote',
-        'produto': 'produto',
-        'cultivar': 'cultivar__nome',
-        'peneira': 'peneira__nome',
-        'categoria': 'categoria__nome',
-        'endereco': 'endereco',
-        'especie': 'especie__nome',
-        'tratamento': 'tratamento__nome',
-        'embalagem': 'embalagem',
-        'cliente': 'cliente',
-        'empresa': 'empresa',
-        'conferente': 'conferente__username'
-    }
+        return qs
 
-    if coluna in field_lookup_map:
-        lookup = field_lookup_map[coluna]
-        tem_null = qs.filter(**{lookup + '__isnull': True}).exists() or qs.filter(**{lookup: ''}).exists()
-        valores = qs.exclude(**{lookup: None}).exclude(**{lookup: ''}).values_list(lookup, flat=True).distinct().order_by(lookup)
-        opcoes = [str(v) for v in valores if v is not None and str(v).strip() != '']
+    # Todas as colunas de uma vez (uma única consulta agrupada)
+    if coluna == 'todas':
+        facetas = calcular_facetas_encadeadas({
+            campo: filtrar_exceto(campo)
+            for campo in CAMPOS_FACETA
+        })
 
         return JsonResponse({
             'success': True,
-            'opcoes': opcoes,
-            'tem_null': tem_null
+            'facetas': facetas
+        })
+
+    qs = filtrar_exceto(coluna)
+
+    if coluna in CAMPOS_FACETA:
+        faceta = calcular_facetas(qs, [coluna])[coluna]
+
+        return JsonResponse({
+            'success': True,
+            'opcoes': faceta['opcoes'],
+            'contagens': faceta['contagens'],
+            'tem_null': faceta['tem_null']
         })
 
     return JsonResponse({'success': False, 'error': 'Coluna inválida'})
@@ -3000,79 +2900,27 @@ def obter_nome_usuario(usuario):
 
 
 from collections import defaultdict
-from types import SimpleNamespace
+from datetime import datetime, time, timedelta
 
 from django.contrib.auth.decorators import login_required, permission_required
 from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
-from django.db.models import Q
+from django.db.models import Count, Exists, F, Max, OuterRef, Q, Sum
 from django.shortcuts import render
 from django.utils import timezone
 from django.utils.dateparse import parse_date
 
-from .models import HistoricoMovimentacao, HistoricoItemEmpenho
-
-
-def nome_usuario_historico(usuario):
-    """Nome completo do usuário ou username; 'Sistema' se nulo."""
-    if not usuario:
-        return 'Sistema'
-    nome = usuario.get_full_name().strip()
-    return nome or usuario.username or 'Sistema'
-
-
-def normalizar_tipo_historico(tipo):
-    """
-    Retorna o tipo normalizado (sem acentos, sem espaços extras, minúsculo).
-    Mapeia variações comuns para uma chave única.
-    """
-    tipo_original = str(tipo or '').strip()
-    tipo_lower = tipo_original.lower()
-
-    mapa = {
-        'entrada': 'entrada',
-        'nova entrada': 'entrada',
-        'saida': 'saida',
-        'saída': 'saida',
-        'baixa': 'saida',
-        'transferencia': 'transferencia',
-        'transferência': 'transferencia',
-        'expedicao': 'expedicao',
-        'expedição': 'expedicao',
-        'edicao': 'edicao',
-        'edição': 'edicao',
-        'exclusao': 'exclusao',
-        'exclusão': 'exclusao',
-    }
-    return mapa.get(tipo_lower, tipo_lower.replace(' ', '_'))
-
-
-def nome_tipo_historico(tipo):
-    """Nome amigável para exibição."""
-    nomes = {
-        'entrada': 'Entrada',
-        'saida': 'Saída',
-        'transferencia': 'Transferência',
-        'expedicao': 'Expedição',
-        'edicao': 'Edição',
-        'exclusao': 'Exclusão',
-    }
-    return nomes.get(tipo, str(tipo or 'Não informado').replace('_', ' ').title())
-
+from .models import LivroMovimentacao
+from .services_estoque import normalizar_busca
+from .services_historico import (
+    VARIANTES_TIPO_HISTORICO,
+    nome_tipo_historico,
+    normalizar_tipo_historico,
+    opcoes_filtro_historico,
+)
 
-def obter_enderecos_historico_antigo(movimentacao, tipo):
-    """
-    No histórico antigo não há endereços separados.
-    Utiliza o endereço do estoque quando disponível.
-    """
-    endereco = movimentacao.estoque.endereco if movimentacao.estoque else ''
 
-    if tipo == 'entrada':
-        return '', endereco
-    if tipo in ('saida', 'expedicao'):
-        return endereco, ''
-    if tipo == 'transferencia':
-        return endereco, ''  # origem; destino normalmente na descrição
-    return endereco, ''
+def _inicio_do_dia(data):
+    return timezone.make_aware(datetime.combine(data, time.min))
 
 
 @login_required
@@ -3094,213 +2942,118 @@ def historico_geral(request):
     data_final = parse_date(data_final_txt)
 
     # ----------------------------------------------------------
-    # 2. Querysets base
+    # 2. Queryset base: livro unificado
     # ----------------------------------------------------------
-    qs_antigo = HistoricoMovimentacao.objects.select_related(
-        'estoque', 'usuario'
-    ).all()
-
-    qs_novo = HistoricoItemEmpenho.objects.select_related(
-        'estoque_origem', 'estoque_destino', 'processado_por', 'empenho'
-    ).all()
+    # O livro já traz o histórico antigo e o de cards/empenhos
+    # normalizados (ver services_historico).
+    movimentacoes = LivroMovimentacao.objects.all()
 
     # ----------------------------------------------------------
     # 3. Busca textual (múltiplos termos → AND)
     # ----------------------------------------------------------
-    if busca:
-        termos = [t for t in busca.split() if t]
-        for termo in termos:
-            qs_antigo = qs_antigo.filter(
-                Q(lote_ref__icontains=termo) |
-                Q(estoque__lote__icontains=termo) |
-                Q(estoque__produto__icontains=termo) |
-                Q(estoque__cultivar__nome__icontains=termo) |
-                Q(estoque__cliente__icontains=termo) |
-                Q(estoque__empresa__icontains=termo) |
-                Q(cliente__icontains=termo) |
-                Q(tipo__icontains=termo) |
-                Q(descricao__icontains=termo) |
-                Q(numero_carga__icontains=termo) |
-                Q(motorista__icontains=termo) |
-                Q(placa__icontains=termo) |
-                Q(ordem_entrega__icontains=termo) |
-                Q(usuario__username__icontains=termo) |
-                Q(usuario__first_name__icontains=termo) |
-                Q(usuario__last_name__icontains=termo)
-            )
-            qs_novo = qs_novo.filter(
-                Q(lote__icontains=termo) |
-                Q(produto__icontains=termo) |
-                Q(cultivar__icontains=termo) |
-                Q(cliente__icontains=termo) |
-                Q(empresa__icontains=termo) |
-                Q(tipo__icontains=termo) |
-                Q(observacao__icontains=termo) |
-                Q(numero_carga__icontains=termo) |
-                Q(placa__icontains=termo) |
-                Q(endereco_origem__icontains=termo) |
-                Q(endereco_destino__icontains=termo) |
-                Q(processado_por__username__icontains=termo) |
-                Q(processado_por__first_name__icontains=termo) |
-                Q(processado_por__last_name__icontains=termo)
-            )
+    for termo in normalizar_busca(busca).split():
+        movimentacoes = movimentacoes.filter(busca_normalizada__contains=termo)
 
     # ----------------------------------------------------------
     # 4. Filtros exatos
     # ----------------------------------------------------------
     if filtro_lote:
-        qs_antigo = qs_antigo.filter(
-            Q(lote_ref=filtro_lote) | Q(estoque__lote=filtro_lote)
-        )
-        qs_novo = qs_novo.filter(lote=filtro_lote)
+        movimentacoes = movimentacoes.filter(lote=filtro_lote)
 
     if filtro_produto:
-        qs_antigo = qs_antigo.filter(estoque__produto=filtro_produto)
-        qs_novo = qs_novo.filter(produto=filtro_produto)
+        movimentacoes = movimentacoes.filter(produto=filtro_produto)
 
     if filtro_cliente:
-        qs_antigo = qs_antigo.filter(
-            Q(cliente=filtro_cliente) | Q(estoque__cliente=filtro_cliente)
-        )
-        qs_novo = qs_novo.filter(cliente=filtro_cliente)
+        movimentacoes = movimentacoes.filter(cliente=filtro_cliente)
 
     if filtro_usuario:
-        qs_antigo = qs_antigo.filter(usuario__username=filtro_usuario)
-        qs_novo = qs_novo.filter(processado_por__username=filtro_usuario)
+        movimentacoes = movimentacoes.filter(usuario__username=filtro_usuario)
 
-    # Filtro por tipo – agora 100% flexível: usamos icontains com a string normalizada,
-    # o que casa com qualquer variação de maiúsculas/minúsculas e acentos.
+    # Tipo: casa o tipo normalizado e qualquer grafia gravada na origem
+    # (ex.: "Transferência (Saída)" aparece no filtro de transferência).
     if filtro_tipo:
         tipo_normalizado = normalizar_tipo_historico(filtro_tipo)
-        # Mapeamos as grafias mais comuns que podem estar no banco para o termo normalizado
-        mapa_busca = {
-            'entrada': ['entrada', 'nova entrada'],
-            'saida': ['saida', 'saída', 'baixa'],
-            'transferencia': ['transferencia', 'transferência'],
-            'expedicao': ['expedicao', 'expedição'],
-            'edicao': ['edicao', 'edição'],
-            'exclusao': ['exclusao', 'exclusão'],
-        }
-        variantes = mapa_busca.get(tipo_normalizado, [filtro_tipo])
-        tipo_q = Q()
+        variantes = VARIANTES_TIPO_HISTORICO.get(tipo_normalizado, [filtro_tipo])
+        tipo_q = Q(tipo=tipo_normalizado)
         for v in variantes:
-            tipo_q |= Q(tipo__icontains=v)  # icontains ignora case e acentos parcialmente
-        qs_antigo = qs_antigo.filter(tipo_q)
-        qs_novo = qs_novo.filter(tipo_q)
+            tipo_q |= Q(tipo_original__icontains=v)
+        movimentacoes = movimentacoes.filter(tipo_q)
 
-    # Datas
+    # Datas como intervalo, para aproveitar o índice de data_hora
     if data_inicial:
-        qs_antigo = qs_antigo.filter(data_hora__date__gte=data_inicial)
-        qs_novo = qs_novo.filter(processado_em__date__gte=data_inicial)
+        movimentacoes = movimentacoes.filter(data_hora__gte=_inicio_do_dia(data_inicial))
     if data_final:
-        qs_antigo = qs_antigo.filter(data_hora__date__lte=data_final)
-        qs_novo = qs_novo.filter(processado_em__date__lte=data_final)
-
-    # ----------------------------------------------------------
-    # 5. Normalização dos registros (histórico antigo + novo)
-    # ----------------------------------------------------------
-    movimentacoes = []
+        movimentacoes = movimentacoes.filter(
+            data_hora__lt=_inicio_do_dia(data_final + timedelta(days=1))
+        )
 
-    for m in qs_antigo.iterator(chunk_size=1000):
-        estoque = m.estoque
-        lote = m.lote_ref or (estoque.lote if estoque else '') or 'Sem lote'
-        produto = estoque.produto if estoque else ''
-        cliente = m.cliente or (estoque.cliente if estoque else '') or ''
-        empresa = estoque.empresa if estoque else ''
-        tipo = normalizar_tipo_historico(m.tipo)
-        end_orig, end_dest = obter_enderecos_historico_antigo(m, tipo)
-
-        movimentacoes.append(SimpleNamespace(
-            chave=f'antigo-{m.pk}',
-            origem_historico='Histórico geral',
-            lote=lote,
-            produto=produto,
-            cliente_exibicao=cliente,
-            empresa=empresa,
-            cultivar=estoque.cultivar.nome if estoque and estoque.cultivar else '',
-            peneira=estoque.peneira.nome if estoque and estoque.peneira else '',
-            categoria=estoque.categoria.nome if estoque and estoque.categoria else '',
-            tratamento=estoque.tratamento.nome if estoque and estoque.tratamento else '',
-            especie=estoque.especie.nome if estoque and estoque.especie else '',
-            embalagem=estoque.embalagem if estoque else '',
-            quantidade=m.quantidade or 0,
-            tipo=tipo,
-            tipo_exibicao=nome_tipo_historico(tipo),
-            endereco_origem=end_orig,
-            endereco_destino=end_dest,
-            usuario_exibicao=nome_usuario_historico(m.usuario),
-            processado_em=m.data_hora,
-            observacao=m.descricao or '',
-            numero_carga=m.numero_carga or '',
-            motorista=m.motorista or '',
-            placa=m.placa or '',
-            ordem_entrega=m.ordem_entrega or '',
-        ))
-
-    for m in qs_novo.iterator(chunk_size=1000):
-        tipo = normalizar_tipo_historico(m.tipo)
-        movimentacoes.append(SimpleNamespace(
-            chave=f'novo-{m.pk}',
-            origem_historico='Cards e empenhos',
-            lote=m.lote or 'Sem lote',
-            produto=m.produto or '',
-            cliente_exibicao=m.cliente or '',
-            empresa=m.empresa or '',
-            cultivar=m.cultivar or '',
-            peneira=m.peneira or '',
-            categoria=m.categoria or '',
-            tratamento=m.tratamento or '',
-            especie=m.especie or '',
-            embalagem=m.embalagem or '',
-            quantidade=m.quantidade or 0,
-            tipo=tipo,
-            tipo_exibicao=nome_tipo_historico(tipo),
-            endereco_origem=m.endereco_origem or '',
-            endereco_destino=m.endereco_destino or '',
-            usuario_exibicao=nome_usuario_historico(m.processado_por),
-            processado_em=m.processado_em,
-            observacao=m.observacao or '',
-            numero_carga=m.numero_carga or '',
-            motorista=m.empenho.motorista if m.empenho else '',
-            placa=m.placa or '',
-            ordem_entrega='',
-        ))
+    # Mesmo evento gravado nas duas origens (mesma chave_dedup): só a
+    # primeira ocorrência ENTRE AS LINHAS FILTRADAS é exibida. Se a
+    # outra ocorrência não passou nos filtros, esta continua visível.
+    movimentacoes = movimentacoes.exclude(
+        Exists(
+            movimentacoes.filter(
+                chave_dedup=OuterRef('chave_dedup'),
+                id__lt=OuterRef('id'),
+            )
+        )
+    )
 
     # ----------------------------------------------------------
-    # 6. Ordenação e deduplicação leve
+    # 5. Agrupamento por lote (no banco) e paginação dos grupos
     # ----------------------------------------------------------
-    data_minima = timezone.make_aware(timezone.datetime.min)
-    movimentacoes.sort(key=lambda x: x.processado_em or data_minima, reverse=True)
+    grupos = (
+        movimentacoes
+        .order_by()
+        .values('lote')
+        .annotate(
+            ultima_data=Max('data_hora'),
+            total_mov=Count('id'),
+            quantidade_total=Sum('quantidade'),
+        )
+        # Lotes sem data no fim, como na paginação por cursor
+        .order_by(F('ultima_data').desc(nulls_last=True), 'lote')
+    )
 
-    # Remove eventos duplicados (mesmo lote, tipo, qtd, data/minuto e carga)
-    vistos = set()
-    unicos = []
-    for mov in movimentacoes:
-        data_chave = mov.processado_em.strftime('%Y-%m-%d %H:%M') if mov.processado_em else ''
-        chave = (
-            str(mov.lote).strip().upper(),
-            mov.tipo,
-            int(mov.quantidade or 0),
-            data_chave,
-            str(mov.numero_carga or '').strip().upper(),
-        )
-        if chave not in vistos:
-            vistos.add(chave)
-            unicos.append(mov)
-    movimentacoes = unicos
+    try:
+        page_size = int(request.GET.get('page_size', 25))
+    except (ValueError, TypeError):
+        page_size = 25
+    if page_size not in (10, 25, 50, 100, 200):
+        page_size = 25
+
+    if usar_paginacao_cursor(request):
+        # Cursor sobre (ultima_data, lote): sem COUNT e sem OFFSET
+        pagina = paginar_por_cursor(
+            grupos,
+            ('-ultima_data', 'lote'),
+            page_size,
+            cursor=request.GET.get('cursor'),
+            contagem=request.GET.get('contagem'),
+        )
+    else:
+        paginator = Paginator(grupos, page_size)
+        page_number = request.GET.get('page', 1)
+        try:
+            pagina = paginator.page(page_number)
+        except PageNotAnInteger:
+            pagina = paginator.page(1)
+        except EmptyPage:
+            pagina = paginator.page(paginator.num_pages)
 
     # ----------------------------------------------------------
-    # 7. Agrupamento por lote
+    # 6. Movimentações apenas dos lotes da página
     # ----------------------------------------------------------
+    grupos_pagina = list(pagina.object_list)
+
     por_lote = defaultdict(list)
-    for mov in movimentacoes:
-        por_lote[str(mov.lote or 'Sem lote').strip()].append(mov)
+    for mov in movimentacoes.filter(lote__in=[g['lote'] for g in grupos_pagina]).order_by('-data_hora', '-id'):
+        por_lote[mov.lote].append(mov)
 
     lotes_agrupados = []
-    for idx, (lote_ref, movs) in enumerate(por_lote.items(), start=1):
-        movs.sort(key=lambda x: x.processado_em or data_minima, reverse=True)
-        ultima = movs[0]
-        quantidade_total = sum(int(m.quantidade or 0) for m in movs)
+    for i, grupo in enumerate(grupos_pagina, start=1):
+        movs = por_lote.get(grupo['lote'], [])
+        ultima = movs[0] if movs else None
 
         # Clientes e produtos únicos (resumo)
         clientes_unicos = list(dict.fromkeys(m.cliente_exibicao for m in movs if m.cliente_exibicao))
@@ -3314,107 +3067,54 @@ def historico_geral(request):
             produto_resumo += f' +{len(produtos_unicos)-2}'
 
         lotes_agrupados.append({
-            'grupo_id': f'grupo-{idx}',
-            'lote_ref': lote_ref,
+            'grupo_id': f'grupo-{getattr(pagina, "number", 0)}-{i}',
+            'lote_ref': grupo['lote'],
             'produto': produto_resumo,
             'cliente': cliente_resumo,
-            'total_mov': len(movs),
-            'quantidade_total': quantidade_total,
-            'ultima_data': ultima.processado_em,
-            'ultimo_end_origem': ultima.endereco_origem,
-            'ultimo_end_destino': ultima.endereco_destino,
-            'ultimo_usuario': ultima.usuario_exibicao,
-            'ultimo_tipo': ultima.tipo,
-            'ultimo_tipo_exibicao': ultima.tipo_exibicao,
+            'total_mov': grupo['total_mov'],
+            'quantidade_total': grupo['quantidade_total'] or 0,
+            'ultima_data': grupo['ultima_data'],
+            'ultimo_end_origem': ultima.endereco_origem if ultima else '',
+            'ultimo_end_destino': ultima.endereco_destino if ultima else '',
+            'ultimo_usuario': ultima.usuario_exibicao if ultima else '',
+            'ultimo_tipo': ultima.tipo if ultima else '',
+            'ultimo_tipo_exibicao': ultima.tipo_exibicao if ultima else '',
             'movimentacoes': movs,
         })
 
-    lotes_agrupados.sort(key=lambda g: g['ultima_data'] or data_minima, reverse=True)
+    pagina.object_list = lotes_agrupados
 
     # ----------------------------------------------------------
-    # 8. Cards informativos
+    # 7. Cards informativos (uma única consulta)
     # ----------------------------------------------------------
-    hoje = timezone.localdate()
-    total_mov = len(movimentacoes)
-    total_lotes = len(lotes_agrupados)
-    total_exp = sum(1 for m in movimentacoes if m.tipo == 'expedicao')
-    mov_hoje = sum(
-        1 for m in movimentacoes
-        if m.processado_em and timezone.localtime(m.processado_em).date() == hoje
+    inicio_hoje = _inicio_do_dia(timezone.localdate())
+
+    cards = movimentacoes.order_by().aggregate(
+        total_mov=Count('id'),
+        total_lotes=Count('lote', distinct=True),
+        total_exp=Count('id', filter=Q(tipo='expedicao')),
+        mov_hoje=Count(
+            'id',
+            filter=Q(
+                data_hora__gte=inicio_hoje,
+                data_hora__lt=inicio_hoje + timedelta(days=1),
+            ),
+        ),
     )
 
     # ----------------------------------------------------------
-    # 9. Opções para os selects (sempre completas, sem filtro)
+    # 8. Opções para os selects (sempre completas, sem filtro; em cache)
     # ----------------------------------------------------------
-    def _lista_distinta(qs, campo, modelo_rel=None):
-        """Extrai valores distintos de um campo, aceitando relacionamento."""
-        if modelo_rel:
-            return set(
-                qs.exclude(**{f'{modelo_rel}__isnull': True})
-                .values_list(f'{modelo_rel}__{campo}', flat=True)
-            )
-        return set(qs.exclude(**{campo: ''}).values_list(campo, flat=True))
-
-    lotes_ant = _lista_distinta(HistoricoMovimentacao.objects, 'lote_ref')
-    lotes_ant_est = _lista_distinta(HistoricoMovimentacao.objects, 'lote', modelo_rel='estoque')
-    lotes_nov = _lista_distinta(HistoricoItemEmpenho.objects, 'lote')
-    opcoes_lotes = sorted({x.strip() for x in (lotes_ant | lotes_ant_est | lotes_nov) if x and x.strip()}, key=str.lower)
-
-    prod_ant = _lista_distinta(HistoricoMovimentacao.objects, 'produto', modelo_rel='estoque')
-    prod_nov = _lista_distinta(HistoricoItemEmpenho.objects, 'produto')
-    opcoes_produtos = sorted({x.strip() for x in (prod_ant | prod_nov) if x and x.strip()}, key=str.lower)
-
-    cli_ant = _lista_distinta(HistoricoMovimentacao.objects, 'cliente')
-    cli_ant_est = _lista_distinta(HistoricoMovimentacao.objects, 'cliente', modelo_rel='estoque')
-    cli_nov = _lista_distinta(HistoricoItemEmpenho.objects, 'cliente')
-    opcoes_clientes = sorted({x.strip() for x in (cli_ant | cli_ant_est | cli_nov) if x and x.strip()}, key=str.lower)
-
-    # Usuários (dicionário username -> nome)
-    usuarios_dict = {}
-    for u in HistoricoMovimentacao.objects.select_related('usuario').exclude(usuario__isnull=True).values('usuario__username', 'usuario__first_name', 'usuario__last_name').distinct():
-        username = u['usuario__username']
-        nome = f"{u['usuario__first_name']} {u['usuario__last_name']}".strip() or username
-        usuarios_dict[username] = nome
-    for u in HistoricoItemEmpenho.objects.select_related('processado_por').exclude(processado_por__isnull=True).values('processado_por__username', 'processado_por__first_name', 'processado_por__last_name').distinct():
-        username = u['processado_por__username']
-        nome = f"{u['processado_por__first_name']} {u['processado_por__last_name']}".strip() or username
-        usuarios_dict[username] = nome
-    opcoes_usuarios = [{'valor': k, 'nome': v} for k, v in sorted(usuarios_dict.items(), key=lambda item: item[1].lower())]
+    opcoes = opcoes_filtro_historico()
 
     choices_tipo = [
-        ('entrada', 'Entrada'),
-        ('saida', 'Saída'),
-        ('transferencia', 'Transferência'),
-        ('expedicao', 'Expedição'),
-        ('edicao', 'Edição'),
-        ('exclusao', 'Exclusão'),
+        (tipo, nome_tipo_historico(tipo))
+        for tipo in VARIANTES_TIPO_HISTORICO
     ]
 
-    # ----------------------------------------------------------
-    # 10. Paginação dos lotes agrupados
-    # ----------------------------------------------------------
-    try:
-        page_size = int(request.GET.get('page_size', 25))
-    except (ValueError, TypeError):
-        page_size = 25
-    if page_size not in (10, 25, 50, 100, 200):
-        page_size = 25
-
-    paginator = Paginator(lotes_agrupados, page_size)
-    page_number = request.GET.get('page', 1)
-    try:
-        pagina = paginator.page(page_number)
-    except PageNotAnInteger:
-        pagina = paginator.page(1)
-    except EmptyPage:
-        pagina = paginator.page(paginator.num_pages)
-
-    # Ajusta IDs dos grupos por página
-    for i, grupo in enumerate(pagina.object_list, start=1):
-        grupo['grupo_id'] = f'grupo-{pagina.number}-{i}'
-
     query_params = request.GET.copy()
     query_params.pop('page', None)
+    query_params.pop('cursor', None)
     url_params = query_params.urlencode()
 
     context = {
@@ -3427,15 +3127,15 @@ def historico_geral(request):
         'filtro_usuario': filtro_usuario,
         'data_inicial': data_inicial_txt,
         'data_final': data_final_txt,
-        'opcoes_lotes': opcoes_lotes,
-        'opcoes_produtos': opcoes_produtos,
-        'opcoes_clientes': opcoes_clientes,
-        'opcoes_usuarios': opcoes_usuarios,
+        'opcoes_lotes': opcoes['lotes'],
+        'opcoes_produtos': opcoes['produtos'],
+        'opcoes_clientes': opcoes['clientes'],
+        'opcoes_usuarios': opcoes['usuarios'],
         'choices_tipo': choices_tipo,
-        'total_movimentacoes': total_mov,
-        'total_lotes': total_lotes,
-        'total_expedicoes': total_exp,
-        'movimentacoes_hoje': mov_hoje,
+        'total_movimentacoes': cards['total_mov'],
+        'total_lotes': cards['total_lotes'],
+        'total_expedicoes': cards['total_exp'],
+        'movimentacoes_hoje': cards['mov_hoje'],
         'page_size': page_size,
         'page_sizes': [10, 25, 50, 100, 200],
         'url_params': url_params,
@@ -3448,6 +3148,7 @@ from django.contrib import messages
 from django.shortcuts import render, redirect
 from django.contrib.auth.decorators import login_required
 from .forms import MudarSenhaForm
+from .middleware import atualizar_marcador_troca_senha
 
 @login_required
 def mudar_senha(request):
@@ -3472,6 +3173,8 @@ def mudar_senha(request):
                 pass
             
             update_session_auth_hash(request, request.user)
+            # A nova senha nunca é a padrão (validado acima)
+            atualizar_marcador_troca_senha(request, request.user, deve_trocar=False)
             messages.success(request, "✅ Senha atualizada com sucesso!")
             return redirect('sapp:redirecionar')
     else:
@@ -3482,112 +3185,52 @@ def mudar_senha(request):
 
 
 def exportar_excel(request):
+    """Exportação simples do estoque com saldo (XLSX, ou CSV com ?formato=csv)"""
     estoque = Estoque.objects.filter(saldo__gt=0).select_related(
-        'cultivar', 'peneira', 'categoria', 'tratamento', 'conferente'
+        *RELACIONADOS_EXPORTACAO
+    )
+
+    return _resposta_exportacao(
+        request,
+        estoque,
+        COLUNAS_ESTOQUE_SIMPLES,
+        'estoque_sementes',
+    )
+
+
+def _resposta_exportacao(request, queryset, colunas, nome_arquivo):
+    """
+    CSV: resposta em streaming, cada linha sai assim que é lida do banco.
+    XLSX: planilha write_only gravada em arquivo temporário e enviada em
+    blocos (o formato zip só pode ser transmitido depois de fechado).
+    As duas continuam em streaming sob ASGI (sapp/respostas.py).
+    """
+    if request.GET.get('formato') == 'csv':
+        response = RespostaStreaming(
+            linhas_csv(queryset, colunas),
+            content_type=CONTENT_TYPE_CSV,
+        )
+        response['Content-Disposition'] = f'attachment; filename="{nome_arquivo}.csv"'
+        return response
+
+    arquivo, total = gerar_xlsx_temporario(queryset, colunas)
+    print(f"✅ Arquivo Excel gerado: {nome_arquivo}.xlsx com {total} registros")
+
+    return RespostaArquivo(
+        arquivo,
+        as_attachment=True,
+        filename=f'{nome_arquivo}.xlsx',
+        content_type=CONTENT_TYPE_XLSX,
     )
-    
-    # Criar DataFrame
-    data = []
-    for item in estoque:
-        data.append({
-            'Lote': item.lote,
-            'Produto': item.produto or '',  # 🔥 NOVO CAMPO
-            'Cultivar': item.cultivar.nome,
-            'Peneira': item.peneira.nome,
-            'Categoria': item.categoria.nome,
-            'Endereço': item.endereco,
-            'Saldo': item.saldo,
-            'Peso Unitário (kg)': float(item.peso_unitario),
-            'Peso Total (kg)': float(item.peso_total),
-            'Tratamento': item.tratamento.nome if item.tratamento else '',
-            'Embalagem': item.get_embalagem_display(),
-            'Conferente': item.conferente.first_name,
-            'Data Entrada': item.data_entrada.strftime('%d/%m/%Y'),
-            'AZ': item.az or '',
-            'Origem/Destino': item.origem_destino,
-            'Empresa': item.empresa,
-            'Espécie': item.especie,
-            'Observação': item.observacao or ''
-        })
-    
-    df = pd.DataFrame(data)
-    
-    # Criar resposta HTTP
-    response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-    response['Content-Disposition'] = 'attachment; filename="estoque_sementes.xlsx"'
-    
-    # Exportar para Excel
-    with pd.ExcelWriter(response, engine='openpyxl') as writer:
-        df.to_excel(writer, sheet_name='Estoque', index=False)
-        
-        # Formatar a planilha
-        workbook = writer.book
-        worksheet = writer.sheets['Estoque']
-        
-        # Ajustar largura das colunas
-        for column in worksheet.columns:
-            max_length = 0
-            column_letter = column[0].column_letter
-            for cell in column:
-                try:
-                    if len(str(cell.value)) > max_length:
-                        max_length = len(str(cell.value))
-                except:
-                    pass
-            adjusted_width = (max_length + 2)
-            worksheet.column_dimensions[column_letter].width = adjusted_width
-    
-    return response
 
 def exportar_pdf(request):
     estoque = Estoque.objects.filter(saldo__gt=0).select_related(
         'cultivar', 'peneira', 'categoria', 'tratamento', 'conferente'
-    )[:100]  # Limitar para não sobrecarregar o PDF
+    )
     buffer = io.BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4, topMargin=30)
-    elements = []
-    styles = getSampleStyleSheet()
-    title = Paragraph("RELATÓRIO DE ESTOQUE - SEMENTES", styles['Title'])
-    elements.append(title)
-    elements.append(Paragraph(f"Data: {timezone.now().strftime('%d/%m/%Y %H:%M')}", styles['Normal']))
-    elements.append(Paragraph("<br/>", styles['Normal']))
-    
-    # Dados da tabela ATUALIZADOS
-    data = [['Lote', 'Produto', 'Cultivar', 'Peneira', 'Endereço', 'Saldo', 'Peso Total']]  # 🔥 ADICIONADO PRODUTO
-    
-    for item in estoque:
-        data.append([
-            item.lote,
-            item.produto or '',  # 🔥 NOVO CAMPO
-            item.cultivar.nome,
-            item.peneira.nome,
-            item.endereco,
-            str(item.saldo),
-            f"{item.peso_total:.2f} kg"
-        ])
-    
-    # Criar tabela
-    table = Table(data)
-    table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#2f8f4e')),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, 0), 10),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-        ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
-        ('FONTSIZE', (0, 1), (-1, -1), 8),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black)
-    ]))
-    
-    elements.append(table)
-    
-    # Rodapé
-    elements.append(Paragraph(f"<br/>Total de itens: {estoque.count()}", styles['Normal']))
-    
-    # Gerar PDF
-    doc.build(elements)
+    # Limitar para não sobrecarregar o PDF (o relatório completo é gerado
+    # em segundo plano pela TarefaExportacao)
+    escrever_pdf_estoque(estoque, buffer, limite=100)
     
     buffer.seek(0)
     response = HttpResponse(buffer, content_type='application/pdf')
@@ -3595,6 +3238,84 @@ def exportar_pdf(request):
     
     return response
 
+
+# ============================================================================
+# EXPORTAÇÕES EM SEGUNDO PLANO
+# ============================================================================
+
+@login_required
+@require_POST
+def iniciar_exportacao(request):
+    """
+    Cria a tarefa de exportação e envia ao Celery.
+
+    POST tipo/formato; os filtros da tela vão na query string,
+    no mesmo formato usado por exportar_estoque_excel.
+    """
+    tipo = request.POST.get('tipo', TarefaExportacao.TIPO_ESTOQUE_FILTRADO)
+    formato = request.POST.get('formato', 'xlsx')
+
+    if tipo not in dict(TarefaExportacao.TIPO_CHOICES):
+        return JsonResponse({'success': False, 'error': 'Tipo de exportação inválido'}, status=400)
+
+    if tipo == TarefaExportacao.TIPO_ESTOQUE_PDF:
+        formato = 'pdf'
+    elif formato not in ('xlsx', 'csv'):
+        return JsonResponse({'success': False, 'error': 'Formato inválido'}, status=400)
+
+    tarefa = TarefaExportacao.objects.create(
+        usuario=request.user,
+        tipo=tipo,
+        formato=formato,
+        parametros=dict(request.GET.lists()),
+    )
+    enfileirar_tarefa_exportacao(tarefa)
+
+    # No modo eager a tarefa já terminou aqui; o front baixa sem precisar consultar
+    tarefa.refresh_from_db()
+
+    return JsonResponse({
+        'success': True,
+        'tarefa': dados_tarefa_exportacao(tarefa),
+    }, status=202)
+
+
+def _tarefa_do_usuario(request, tarefa_id):
+    tarefas = TarefaExportacao.objects.all()
+    if not request.user.is_superuser:
+        tarefas = tarefas.filter(usuario=request.user)
+    return get_object_or_404(tarefas, pk=tarefa_id)
+
+
+@login_required
+def status_exportacao(request, tarefa_id):
+    tarefa = _tarefa_do_usuario(request, tarefa_id)
+    return JsonResponse({
+        'success': True,
+        'tarefa': dados_tarefa_exportacao(tarefa),
+    })
+
+
+@login_required
+def baixar_exportacao(request, tarefa_id):
+    tarefa = _tarefa_do_usuario(request, tarefa_id)
+
+    if tarefa.status != TarefaExportacao.STATUS_CONCLUIDA or not tarefa.arquivo:
+        raise Http404("Arquivo ainda não disponível")
+
+    content_types = {
+        'xlsx': CONTENT_TYPE_XLSX,
+        'csv': CONTENT_TYPE_CSV,
+        'pdf': 'application/pdf',
+    }
+
+    return RespostaArquivo(
+        tarefa.arquivo.open('rb'),
+        as_attachment=True,
+        filename=tarefa.nome_arquivo or None,
+        content_type=content_types.get(tarefa.formato),
+    )
+
 ################ DEBUG #####################
 @login_required
 @permission_required('sapp.pode_configuracoes', raise_exception=True)
@@ -3670,46 +3391,32 @@ def api_saldo_lote(request, id):
 @login_required
 @permission_required('sapp.pode_ver_estoque', raise_exception=True)
 def api_buscar_lotes(request):
-
-    query = request.GET.get('q', '')
-
-    if not query:
-        return JsonResponse({'results': []})
-
-    lotes = (
-        Estoque.objects
-        .filter(Q(lote__icontains=query))
-        .select_related(
-            'cultivar',
-            'peneira',
-            'categoria',
-            'tratamento',
-            'especie'
-        )
-        .order_by('-data_ultima_movimentacao')[:10]
-    )
-
-    results = []
-
-    for item in lotes:
-        results.append({
-            "id": item.id,
-            "lote": item.lote,
-            "produto": item.produto,
-            "cultivar": item.cultivar.nome if item.cultivar else "",
-            "cultivar_id": item.cultivar.id if item.cultivar else None,
-            "especie_id": item.especie.id if item.especie else None,
-            "peneira_id": item.peneira.id if item.peneira else None,
-            "categoria_id": item.categoria.id if item.categoria else None,
-            "tratamento_id": item.tratamento.id if item.tratamento else None,
-            "empresa": item.empresa,
-            "cliente": item.cliente,
-            "peso_unitario": float(item.peso_unitario) if item.peso_unitario else "",
-            "embalagem": item.embalagem,
-            "az": item.az,
-            "endereco": item.endereco,
-            "saldo": float(item.saldo)
-        })
+    """
+    Autocomplete do modal do estoque: um resultado por lote
+    (services_lotes). endereco/id são do registro mais recente do lote
+    e saldo é o total do lote em todos os endereços.
+    """
+    results = [
+        {
+            "id": dados['estoque_id'],
+            "lote": dados['lote'],
+            "produto": dados['produto'],
+            "cultivar": dados['cultivar'],
+            "cultivar_id": dados['cultivar_id'],
+            "especie_id": dados['especie_id'],
+            "peneira_id": dados['peneira_id'],
+            "categoria_id": dados['categoria_id'],
+            "tratamento_id": dados['tratamento_id'],
+            "empresa": dados['empresa'],
+            "cliente": dados['cliente'],
+            "peso_unitario": float(dados['peso_unitario']) or "",
+            "embalagem": dados['embalagem'],
+            "az": dados['az'],
+            "endereco": dados['endereco'],
+            "saldo": float(dados['saldo']),
+        }
+        for dados in buscar_lotes(request.GET.get('q', ''))
+    ]
 
     return JsonResponse({"results": results})
 
@@ -3722,26 +3429,29 @@ def api_buscar_lote_completo(request):
     
     if not lote:
         return JsonResponse({'encontrado': False, 'error': 'Lote não especificado'})
-    item = Estoque.objects.filter(lote=lote).order_by('-id').first()
-    
-    if item:
-        data = {
+
+    # Registro mais recente do lote, pela chave do ResumoLote
+    dados = dados_do_lote(lote)
+
+    if dados:
+        # Mesmas chaves de antes: endereço/cliente do lote antigo não
+        # são copiados para a nova entrada
+        return JsonResponse({
             'encontrado': True,
-            'lote': item.lote,
-            'produto': item.produto or '',
-            'cultivar_id': item.cultivar.id if item.cultivar else None,
-            'peneira_id': item.peneira.id if item.peneira else None,
-            'categoria_id': item.categoria.id if item.categoria else None,
-            'tratamento_id': item.tratamento.id if item.tratamento else None,
-            'empresa': item.empresa or '',
-            'origem_destino': item.origem_destino or '',
-            'especie_id': item.especie.id if item.especie else None,
-            'peso_unitario': str(item.peso_unitario),
-            'embalagem': item.embalagem or 'BAG',
-            'az': item.az or '',
-            'observacao': item.observacao or ''
-        }
-        return JsonResponse(data)
+            'lote': dados['lote'],
+            'produto': dados['produto'],
+            'cultivar_id': dados['cultivar_id'],
+            'peneira_id': dados['peneira_id'],
+            'categoria_id': dados['categoria_id'],
+            'tratamento_id': dados['tratamento_id'],
+            'empresa': dados['empresa'],
+            'origem_destino': dados['origem_destino'],
+            'especie_id': dados['especie_id'],
+            'peso_unitario': dados['peso_unitario'],
+            'embalagem': dados['embalagem'] or 'BAG',
+            'az': dados['az'],
+            'observacao': dados['observacao'],
+        })
     
     return JsonResponse({'encontrado': False})
 
@@ -3762,11 +3472,7 @@ def api_verificar_lote(request):
 @permission_required('sapp.pode_ver_estoque', raise_exception=True)
 def api_estoque_resumo(request):
     """API para resumo do estoque (usado no dashboard)"""
-    total_lotes = Estoque.objects.count()
-    lotes_ativos = Estoque.objects.filter(saldo__gt=0).count()
-    lotes_esgotados = Estoque.objects.filter(saldo=0).count()
-    total_entrada = Estoque.objects.aggregate(total=Sum('entrada'))['total'] or 0
-    total_saida = Estoque.objects.aggregate(total=Sum('saida'))['total'] or 0
+    kpis = calcular_kpis_estoque(Estoque.objects.all())
     
     # Top 5 cultivares
     top_cultivares = Estoque.objects.filter(saldo__gt=0).values(
@@ -3778,11 +3484,11 @@ def api_estoque_resumo(request):
     
     return JsonResponse({
         'success': True,
-        'total_lotes': total_lotes,
-        'lotes_ativos': lotes_ativos,
-        'lotes_esgotados': lotes_esgotados,
-        'total_entrada': total_entrada,
-        'total_saida': total_saida,
+        'total_lotes': kpis['total_lotes'],
+        'lotes_ativos': kpis['lotes_ativos'],
+        'lotes_esgotados': kpis['lotes_esgotados'],
+        'total_entrada': kpis['total_entrada'],
+        'total_saida': kpis['total_saida'],
         'top_cultivares': list(top_cultivares)
     })
 
@@ -4553,85 +4259,33 @@ def api_itens_empenhos(request):
 @login_required
 @permission_required('sapp.pode_movimentar_estoque', raise_exception=True)
 def api_autocomplete_nova_entrada(request):
-    
-    # No views.py, dentro de nova_entrada ou editar:
-
-    endereco_raw = request.POST.get('endereco', '').strip().upper() # R-A LN01 P01
-    # Regex para separar: (Rua) (Linha) (Posição)
-    import re
-    match = re.match(r'^(R-[A-Z]+)\s+(LN\d+)\s+(P\d+)$', endereco_raw)
-
-    if not match:
-        messages.error(request, "Formato de endereço inválido! Use: R-A LN01 P01")
-        return redirect('sapp:lista_estoque')
-
-    rua_nome, linha_nome, posicao_str = match.groups()
-
-    # 1. Validar Posição (01 a 06)
-    posicao_num = int(re.search(r'\d+', posicao_str).group())
-    if posicao_num < 1 or posicao_num > 6:
-        messages.error(request, f"Posição {posicao_str} inválida! Use de 01 a 06.")
-        return redirect('sapp:lista_estoque')
-
-    # 2. Verificar se Rua e Linha existem no cadastro
-    rua_obj = Rua.objects.filter(nome=rua_nome).first()
-    if not rua_obj:
-        messages.error(request, f"Rua {rua_nome} não cadastrada!")
-        return redirect('sapp:lista_estoque')
-
-    if not Linha.objects.filter(nome=linha_nome).exists():
-        messages.error(request, f"Linha {linha_nome} não cadastrada!")
-        return redirect('sapp:lista_estoque')
-
-    # 3. SETAR ARMAZÉM AUTOMÁTICO (Puxa da Rua)
-    item.az = rua_obj.armazem.nome
-    item.endereco = endereco_raw
-    termo = request.GET.get('term', '').strip()
-    
-    if len(termo) < 2:
-        return JsonResponse([], safe=False)
-    
-    # Busca lotes que contenham o texto digitado
-    qs = Estoque.objects.filter(lote__icontains=termo).select_related(
-        'especie', 'cultivar', 'peneira', 'categoria', 'tratamento'
-    ).order_by('-id')
-    
-    resultados = []
-    lotes_vistos = set()
-    
-    for item in qs:
-        if item.lote not in lotes_vistos:
-            dados_item = {
-                'lote': item.lote,
-                'produto': item.produto or '',
-                'cultivar__id': item.cultivar.id if item.cultivar else None,
-                'peneira__id': item.peneira.id if item.peneira else None,
-                'categoria__id': item.categoria.id if item.categoria else None,
-                'tratamento__id': item.tratamento.id if item.tratamento else None,
-                'especie__id': item.especie.id if item.especie else None,
-                
-                'empresa': item.empresa or '',
-                'origem_destino': item.origem_destino or '',
-                'cliente': item.cliente or '',
-                'peso_unitario': str(item.peso_unitario),
-                'embalagem': item.embalagem,
-                'az': item.az or '',
-                'observacao': item.observacao or ''
-            }
+    # Um resultado por lote, prefixo primeiro, pelo índice do ResumoLote
+    resultados = [
+        {
+            'label': dados['lote'],
+            'dados': {
+                'lote': dados['lote'],
+                'produto': dados['produto'],
+                'cultivar__id': dados['cultivar_id'],
+                'peneira__id': dados['peneira_id'],
+                'categoria__id': dados['categoria_id'],
+                'tratamento__id': dados['tratamento_id'],
+                'especie__id': dados['especie_id'],
+
+                'empresa': dados['empresa'],
+                'origem_destino': dados['origem_destino'],
+                'cliente': dados['cliente'],
+                'peso_unitario': dados['peso_unitario'],
+                'embalagem': dados['embalagem'],
+                'az': dados['az'],
+                'observacao': dados['observacao'],
+            },
+        }
+        for dados in buscar_lotes(request.GET.get('term', '').strip())
+    ]
 
-            resultados.append({
-                'label': item.lote,
-                'dados': dados_item
-            })
-            lotes_vistos.add(item.lote)
-        
-        if len(resultados) >= 10: 
-            break
-            
     return JsonResponse(resultados, safe=False)
 
-    
-
 
 @staff_member_required
 def api_status_enderecos(request):
@@ -4851,30 +4505,12 @@ def editar_config_armazem(request, armazem_id):
 def mapa_ocupacao_canvas(request, armazem_numero=1):
     # 1. Busca Armazém e Elementos
     armazem = get_object_or_404(ArmazemLayout, numero=armazem_numero, ativo=True)
-    elementos_db = armazem.elementos.all().order_by('ordem_z')
+    elementos_db = list(armazem.elementos.all().order_by('ordem_z'))
     armazens_disponiveis = ArmazemLayout.objects.filter(ativo=True).order_by('numero')
     
-    # 2. Busca Estoque com Saldo > 0
-    itens_estoque = Estoque.objects.filter(saldo__gt=0)
-
-    # 3. Mapeia Estoque (Normalizando Endereço: Tira espaços e põe Maiúsculo)
-    dados_ocupacao = {}
-    
-    for item in itens_estoque:
-        if item.endereco:
-            # A MÁGICA: .strip().upper() garante que " a-01" seja igual a "A-01"
-            chave = item.endereco.strip().upper()
-            
-            if chave not in dados_ocupacao:
-                dados_ocupacao[chave] = []
-            
-            dados_ocupacao[chave].append({
-                'lote': item.lote,
-                'produto': str(item.produto or 'S/ Produto'),
-                'qtd': float(item.saldo),
-                'embalagem': str(item.embalagem),
-                'cliente': str(item.cliente or '-')
-            })
+    # 2/3. Lotes com saldo apenas dos endereços deste armazém, numa única
+    # consulta pelo endereco_normalizado (indexado)
+    dados_ocupacao = lotes_por_endereco(enderecos_do_armazem(elementos_db))
 
     # 4. Prepara Elementos para o Mapa (Já definindo a cor aqui)
     elementos_render = []
@@ -4885,12 +4521,13 @@ def mapa_ocupacao_canvas(request, armazem_numero=1):
             'tipo': el.tipo,
             'x': el.pos_x, 'y': el.pos_y, 'w': el.largura, 'h': el.altura, 'rot': el.rotacao,
             'texto': el.conteudo_texto,
-            'id': el.identificador
+            # Retângulos usam o mesmo endereço normalizado das chaves de ocupação
+            'id': normalizar_endereco(el.identificador) if el.tipo == 'RETANGULO' else el.identificador
         }
 
         # SE FOR RETÂNGULO: Verifica se deve pintar
         if el.tipo == 'RETANGULO' and el.identificador:
-            chave_mapa = el.identificador.strip().upper() # Normaliza também
+            chave_mapa = normalizar_endereco(el.identificador) # Normaliza também
             
             if chave_mapa in dados_ocupacao:
                 # TEM ESTOQUE -> VERDE
@@ -4954,6 +4591,8 @@ def salvar_todos_elementos(request):
                     # O MAIS IMPORTANTE: O ENDEREÇO
                     identificador=item.get('identificador', '').strip().upper() 
                 )
+                # bulk_create não chama save(): preenche rua/linha/posição aqui
+                preencher_endereco_estruturado(novo, novo.identificador)
                 novos_objetos.append(novo)
             
             # Bulk create é muito mais rápido
@@ -5768,33 +5407,8 @@ def _dashboard_aplicar_filtros_estoque(
 
     if search:
         queryset = queryset.filter(
-            Q(
-                lote__icontains=
-                    search
-            )
-            | Q(
-                produto__icontains=
-                    search
-            )
-            | Q(
-                cultivar__nome__icontains=
-                    search
-            )
-            | Q(
-                especie__nome__icontains=
-                    search
-            )
-            | Q(
-                cliente__icontains=
-                    search
-            )
-            | Q(
-                endereco__icontains=
-                    search
-            )
-            | Q(
-                az__icontains=
-                    search
+            q_busca_estoque(
+                search
             )
         )
 
@@ -6048,14 +5662,64 @@ def _dashboard_data_segura(
 # API DO DASHBOARD
 # ================================================================
 
-@login_required
-@permission_required(
-    'sapp.pode_ver_estoque',
-    raise_exception=True,
-)
-def dashboard_data(request):
+def _dashboard_parametros(query):
     """
-    Endpoint AJAX do Dashboard Analítico.
+    Lê e normaliza os filtros da tela.
+
+    Listas sem vazios/repetições e ordenadas, datas já convertidas e
+    período limitado a 7–90 dias: filtros equivalentes geram o mesmo
+    dicionário e, portanto, a mesma chave de cache.
+    """
+
+    def lista(nome):
+        return sorted({
+            valor.strip()
+            for valor in query.getlist(nome)
+            if valor and valor.strip()
+        })
+
+    try:
+        periodo_dias = int(
+            query.get(
+                'periodo',
+                15,
+            )
+        )
+    except (
+        TypeError,
+        ValueError,
+    ):
+        periodo_dias = 15
+
+    return {
+        'tipos_semente': lista('tipo_semente[]'),
+        'cultivares': lista('cultivar[]'),
+        'peneiras': lista('peneira[]'),
+        'unidades': lista('unidade[]'),
+        'armazens': lista('armazem[]'),
+        'data_inicio': _dashboard_data_segura(
+            query.get('data_inicio', '').strip()
+        ),
+        'data_fim': _dashboard_data_segura(
+            query.get('data_fim', '').strip()
+        ),
+        'tipo_mov': query.get('tipo_mov', '').strip().lower(),
+        'search': query.get('search', '').strip(),
+        'periodo_dias': max(
+            7,
+            min(
+                periodo_dias,
+                90,
+            ),
+        ),
+        # A tendência termina hoje: a virada do dia muda a resposta
+        'hoje': timezone.localdate(),
+    }
+
+
+def _dashboard_calcular(parametros):
+    """
+    Monta os dados do Dashboard Analítico.
 
     Principais regras:
     - estoque atual usa saldo > 0;
@@ -6065,145 +5729,184 @@ def dashboard_data(request):
     - dias sem movimento aparecem como zero;
     - filtros disponíveis são encadeados.
     """
-
-    try:
-        # --------------------------------------------------------
-        # PARÂMETROS
-        # --------------------------------------------------------
-        tipos_semente = (
-            request.GET.getlist(
-                'tipo_semente[]'
-            )
+    tipos_semente = parametros['tipos_semente']
+    cultivares = parametros['cultivares']
+    peneiras = parametros['peneiras']
+    unidades = parametros['unidades']
+    armazens = parametros['armazens']
+    data_inicio = parametros['data_inicio']
+    data_fim = parametros['data_fim']
+    tipo_mov = parametros['tipo_mov']
+    search = parametros['search']
+    periodo_dias = parametros['periodo_dias']
+
+    # --------------------------------------------------------
+    # ESTOQUE ATUAL
+    # --------------------------------------------------------
+    est_qs = (
+        Estoque.objects
+        .select_related(
+            'cultivar',
+            'peneira',
+            'especie',
         )
-
-        cultivares = (
-            request.GET.getlist(
-                'cultivar[]'
-            )
+        .filter(
+            saldo__gt=0
         )
+    )
 
-        peneiras = (
-            request.GET.getlist(
-                'peneira[]'
-            )
+    est_qs = (
+        _dashboard_aplicar_filtros_estoque(
+            est_qs,
+            tipos_semente=
+                tipos_semente,
+            cultivares=
+                cultivares,
+            peneiras=
+                peneiras,
+            unidades=
+                unidades,
+            armazens=
+                armazens,
+            search=
+                search,
         )
+    )
 
-        unidades = (
-            request.GET.getlist(
-                'unidade[]'
-            )
+    # --------------------------------------------------------
+    # HISTÓRICO
+    # --------------------------------------------------------
+    mov_qs = (
+        HistoricoMovimentacao.objects
+        .select_related(
+            'estoque',
+            'estoque__cultivar',
+            'estoque__peneira',
+            'estoque__especie',
+            'usuario',
         )
+        .all()
+    )
 
-        armazens = (
-            request.GET.getlist(
-                'armazem[]'
-            )
+    mov_qs = (
+        _dashboard_aplicar_filtros_movimentacao(
+            mov_qs,
+            tipos_semente=
+                tipos_semente,
+            cultivares=
+                cultivares,
+            peneiras=
+                peneiras,
+            unidades=
+                unidades,
+            armazens=
+                armazens,
+            search=
+                search,
         )
+    )
 
-        data_inicio = (
-            _dashboard_data_segura(
-                request.GET.get(
-                    'data_inicio',
-                    ''
-                ).strip()
-            )
+    if data_inicio:
+        mov_qs = mov_qs.filter(
+            data_hora__date__gte=
+                data_inicio
         )
 
-        data_fim = (
-            _dashboard_data_segura(
-                request.GET.get(
-                    'data_fim',
-                    ''
-                ).strip()
-            )
+    if data_fim:
+        mov_qs = mov_qs.filter(
+            data_hora__date__lte=
+                data_fim
         )
 
-        tipo_mov = (
-            request.GET.get(
-                'tipo_mov',
-                ''
-            ).strip()
+    mov_qs_filtrado_tipo = (
+        _dashboard_filtro_tipo_movimentacao(
+            mov_qs,
+            tipo_mov,
         )
+    )
 
-        search = (
-            request.GET.get(
-                'search',
-                ''
-            ).strip()
+    # --------------------------------------------------------
+    # KPIs
+    # --------------------------------------------------------
+    kpis_estoque = (
+        calcular_kpis_estoque(
+            est_qs
         )
+    )
 
-        try:
-            periodo_dias = int(
-                request.GET.get(
-                    'periodo',
-                    15,
-                )
-            )
-        except (
-            TypeError,
-            ValueError,
-        ):
-            periodo_dias = 15
+    hoje = parametros['hoje']
 
-        periodo_dias = max(
-            7,
-            min(
-                periodo_dias,
-                90,
-            ),
+    data_limite = (
+        hoje
+        - timedelta(
+            days=
+                periodo_dias - 1
         )
+    )
 
-        # --------------------------------------------------------
-        # ESTOQUE ATUAL
-        # --------------------------------------------------------
-        est_qs = (
-            Estoque.objects
-            .select_related(
-                'cultivar',
-                'peneira',
-                'especie',
-            )
+    q_entrada = (
+        _dashboard_q_entrada()
+    )
+
+    q_saida = (
+        _dashboard_q_saida()
+    )
+
+    # --------------------------------------------------------
+    # TENDÊNCIA POR DIA (e totais do período)
+    # --------------------------------------------------------
+    if search:
+        # A busca textual usa lote/descrição da movimentação:
+        # só o histórico completo consegue atender
+        tendencia_agregada = list(
+            mov_qs
             .filter(
-                saldo__gt=0
+                data_hora__date__gte=
+                    data_limite,
+                data_hora__date__lte=
+                    hoje,
             )
-        )
-
-        est_qs = (
-            _dashboard_aplicar_filtros_estoque(
-                est_qs,
-                tipos_semente=
-                    tipos_semente,
-                cultivares=
-                    cultivares,
-                peneiras=
-                    peneiras,
-                unidades=
-                    unidades,
-                armazens=
-                    armazens,
-                search=
-                    search,
+            .annotate(
+                dia=TruncDate(
+                    'data_hora'
+                )
             )
-        )
-
-        # --------------------------------------------------------
-        # HISTÓRICO
-        # --------------------------------------------------------
-        mov_qs = (
-            HistoricoMovimentacao.objects
-            .select_related(
-                'estoque',
-                'estoque__cultivar',
-                'estoque__peneira',
-                'estoque__especie',
-                'usuario',
+            .values(
+                'dia'
+            )
+            .annotate(
+                entradas=Sum(
+                    'quantidade',
+                    filter=
+                        q_entrada,
+                ),
+                saidas=Sum(
+                    'quantidade',
+                    filter=
+                        q_saida,
+                ),
+                eventos=Count(
+                    'id'
+                ),
+            )
+            .order_by(
+                'dia'
             )
-            .all()
         )
-
-        mov_qs = (
-            _dashboard_aplicar_filtros_movimentacao(
-                mov_qs,
+    else:
+        # Linhas já somadas por dia (ResumoMovimentacaoDiaria)
+        tendencia_agregada = (
+            tendencia_resumida(
+                max(
+                    data_limite,
+                    data_inicio
+                    or data_limite,
+                ),
+                min(
+                    hoje,
+                    data_fim
+                    or hoje,
+                ),
                 tipos_semente=
                     tipos_semente,
                 cultivares=
@@ -6214,733 +5917,601 @@ def dashboard_data(request):
                     unidades,
                 armazens=
                     armazens,
-                search=
-                    search,
             )
         )
 
-        if data_inicio:
-            mov_qs = mov_qs.filter(
-                data_hora__date__gte=
-                    data_inicio
-            )
+    entradas_periodo = sum(
+        item['entradas'] or 0
+        for item in tendencia_agregada
+    )
 
-        if data_fim:
-            mov_qs = mov_qs.filter(
-                data_hora__date__lte=
-                    data_fim
-            )
+    saidas_periodo = sum(
+        item['saidas'] or 0
+        for item in tendencia_agregada
+    )
 
-        mov_qs_filtrado_tipo = (
-            _dashboard_filtro_tipo_movimentacao(
-                mov_qs,
-                tipo_mov,
-            )
-        )
+    eventos_periodo = sum(
+        item['eventos'] or 0
+        for item in tendencia_agregada
+    )
 
-        # --------------------------------------------------------
-        # KPIs
-        # --------------------------------------------------------
-        bags = (
-            est_qs
-            .filter(
-                embalagem__iexact=
-                    'BAG'
+    kpis = {
+        'total_sc': int(
+            kpis_estoque['total_sc']
+        ),
+        'bags': int(
+            kpis_estoque['saldo_bags']
+        ),
+        'scs': int(
+            kpis_estoque['saldo_sc']
+        ),
+        'peso': (
+            _dashboard_numero(
+                kpis_estoque['total_pme']
             )
-            .aggregate(
-                total=Sum('saldo')
-            )['total']
-            or 0
-        )
-
-        scs = (
-            est_qs
-            .filter(
-                embalagem__iexact=
-                    'SC'
+        ),
+        'ativos': (
+            kpis_estoque['lotes_ativos']
+        ),
+        'parados': (
+            kpis_estoque['lotes_parados']
+        ),
+        'entradas_periodo': (
+            _dashboard_numero(
+                entradas_periodo
             )
-            .aggregate(
-                total=Sum('saldo')
-            )['total']
-            or 0
-        )
+        ),
+        'saidas_periodo': (
+            _dashboard_numero(
+                saidas_periodo
+            )
+        ),
+        'eventos_periodo': (
+            int(
+                eventos_periodo
+            )
+        ),
+        'periodo_dias': (
+            periodo_dias
+        ),
+    }
 
-        # Regra utilizada no seu projeto:
-        # 1 BAG = 25 SC.
-        total_sc = (
-            (bags * 25)
-            + scs
+    # --------------------------------------------------------
+    # GRÁFICO CULTIVAR
+    # --------------------------------------------------------
+    cultivares_data = list(
+        est_qs
+        .filter(
+            cultivar__isnull=False
         )
-
-        peso = (
-            est_qs
-            .aggregate(
-                total=Sum(
-                    'peso_total'
-                )
-            )['total']
-            or 0
+        .values(
+            'cultivar__nome'
         )
-
-        limite_parado = (
-            timezone.now()
-            - timedelta(
-                days=30
+        .annotate(
+            volume=Sum(
+                'saldo'
             )
         )
-
-        parados = (
-            est_qs
-            .filter(
-                Q(
-                    data_ultima_movimentacao__lt=
-                        limite_parado
-                )
-                | Q(
-                    data_ultima_movimentacao__isnull=
-                        True
-                )
-            )
-            .count()
+        .filter(
+            volume__gt=0
         )
+        .order_by(
+            '-volume'
+        )[:10]
+    )
 
-        hoje = (
-            timezone.localdate()
+    # --------------------------------------------------------
+    # GRÁFICO PENEIRA
+    # --------------------------------------------------------
+    peneiras_data = list(
+        est_qs
+        .filter(
+            peneira__isnull=False
         )
-
-        data_limite = (
-            hoje
-            - timedelta(
-                days=
-                    periodo_dias - 1
-            )
+        .values(
+            'peneira__nome'
         )
-
-        tendencia_qs = (
-            mov_qs
-            .filter(
-                data_hora__date__gte=
-                    data_limite,
-                data_hora__date__lte=
-                    hoje,
+        .annotate(
+            volume=Sum(
+                'saldo'
             )
         )
-
-        q_entrada = (
-            _dashboard_q_entrada()
+        .filter(
+            volume__gt=0
         )
-
-        q_saida = (
-            _dashboard_q_saida()
+        .order_by(
+            '-volume'
         )
+    )
 
-        entradas_periodo = (
-            tendencia_qs
-            .filter(
-                q_entrada
-            )
-            .aggregate(
-                total=Sum(
-                    'quantidade'
-                )
-            )['total']
-            or 0
+    # --------------------------------------------------------
+    # GRÁFICO ARMAZÉM
+    # --------------------------------------------------------
+    armazens_data = list(
+        est_qs
+        .exclude(
+            az__isnull=True
         )
-
-        saidas_periodo = (
-            tendencia_qs
-            .filter(
-                q_saida
+        .exclude(
+            az=''
+        )
+        .values(
+            'az'
+        )
+        .annotate(
+            volume=Sum(
+                'saldo'
             )
-            .aggregate(
-                total=Sum(
-                    'quantidade'
-                )
-            )['total']
-            or 0
         )
+        .filter(
+            volume__gt=0
+        )
+        .order_by(
+            'az'
+        )
+    )
 
-        kpis = {
-            'total_sc': int(
-                total_sc
-            ),
-            'bags': int(
-                bags
-            ),
-            'scs': int(
-                scs
-            ),
-            'peso': (
-                _dashboard_numero(
-                    peso
-                )
-            ),
-            'ativos': (
-                est_qs.count()
-            ),
-            'parados': (
-                parados
-            ),
-            'entradas_periodo': (
+    cores = [
+        '#2f8f4e',
+        '#3b82f6',
+        '#f59e0b',
+        '#ef4444',
+        '#8b5cf6',
+        '#06b6d4',
+        '#84cc16',
+        '#f97316',
+        '#ec4899',
+        '#6366f1',
+        '#14b8a6',
+        '#64748b',
+    ]
+
+    def cores_para(
+        quantidade,
+    ):
+        if quantidade <= 0:
+            return []
+
+        repeticoes = (
+            quantidade
+            // len(cores)
+            + 1
+        )
+
+        return (
+            cores
+            * repeticoes
+        )[:quantidade]
+
+    tendencia_por_dia = {
+        item['dia']: {
+            'entradas': (
                 _dashboard_numero(
-                    entradas_periodo
+                    item[
+                        'entradas'
+                    ]
                 )
             ),
-            'saidas_periodo': (
+            'saidas': (
                 _dashboard_numero(
-                    saidas_periodo
+                    item[
+                        'saidas'
+                    ]
                 )
             ),
-            'eventos_periodo': (
-                tendencia_qs.count()
-            ),
-            'periodo_dias': (
-                periodo_dias
+            'eventos': int(
+                item[
+                    'eventos'
+                ]
+                or 0
             ),
         }
+        for item
+        in tendencia_agregada
+    }
 
-        # --------------------------------------------------------
-        # GRÁFICO CULTIVAR
-        # --------------------------------------------------------
-        cultivares_data = list(
-            est_qs
-            .filter(
-                cultivar__isnull=False
-            )
-            .values(
-                'cultivar__nome'
-            )
-            .annotate(
-                volume=Sum(
-                    'saldo'
-                )
-            )
-            .filter(
-                volume__gt=0
+    labels_tendencia = []
+    entradas_tendencia = []
+    saidas_tendencia = []
+    eventos_tendencia = []
+
+    for indice in range(
+        periodo_dias
+    ):
+        dia = (
+            data_limite
+            + timedelta(
+                days=indice
             )
-            .order_by(
-                '-volume'
-            )[:10]
         )
 
-        # --------------------------------------------------------
-        # GRÁFICO PENEIRA
-        # --------------------------------------------------------
-        peneiras_data = list(
-            est_qs
-            .filter(
-                peneira__isnull=False
-            )
-            .values(
-                'peneira__nome'
-            )
-            .annotate(
-                volume=Sum(
-                    'saldo'
-                )
-            )
-            .filter(
-                volume__gt=0
-            )
-            .order_by(
-                '-volume'
+        valores = (
+            tendencia_por_dia.get(
+                dia,
+                {
+                    'entradas': 0,
+                    'saidas': 0,
+                    'eventos': 0,
+                },
             )
         )
 
-        # --------------------------------------------------------
-        # GRÁFICO ARMAZÉM
-        # --------------------------------------------------------
-        armazens_data = list(
-            est_qs
-            .exclude(
-                az__isnull=True
-            )
-            .exclude(
-                az=''
-            )
-            .values(
-                'az'
-            )
-            .annotate(
-                volume=Sum(
-                    'saldo'
-                )
-            )
-            .filter(
-                volume__gt=0
-            )
-            .order_by(
-                'az'
+        labels_tendencia.append(
+            dia.strftime(
+                '%d/%m'
             )
         )
 
-        cores = [
-            '#2f8f4e',
-            '#3b82f6',
-            '#f59e0b',
-            '#ef4444',
-            '#8b5cf6',
-            '#06b6d4',
-            '#84cc16',
-            '#f97316',
-            '#ec4899',
-            '#6366f1',
-            '#14b8a6',
-            '#64748b',
-        ]
-
-        def cores_para(
-            quantidade,
-        ):
-            if quantidade <= 0:
-                return []
-
-            repeticoes = (
-                quantidade
-                // len(cores)
-                + 1
-            )
+        entradas_tendencia.append(
+            valores[
+                'entradas'
+            ]
+        )
 
-            return (
-                cores
-                * repeticoes
-            )[:quantidade]
+        saidas_tendencia.append(
+            valores[
+                'saidas'
+            ]
+        )
 
-        # --------------------------------------------------------
-        # TENDÊNCIA POR DIA
-        # --------------------------------------------------------
-        tendencia_agregada = list(
-            tendencia_qs
-            .annotate(
-                dia=TruncDate(
-                    'data_hora'
-                )
-            )
-            .values(
-                'dia'
-            )
-            .annotate(
-                entradas=Sum(
-                    'quantidade',
-                    filter=
-                        q_entrada,
-                ),
-                saidas=Sum(
-                    'quantidade',
-                    filter=
-                        q_saida,
-                ),
-                eventos=Count(
-                    'id'
-                ),
-            )
-            .order_by(
-                'dia'
-            )
+        eventos_tendencia.append(
+            valores[
+                'eventos'
+            ]
         )
 
-        tendencia_por_dia = {
-            item['dia']: {
-                'entradas': (
-                    _dashboard_numero(
-                        item[
-                            'entradas'
-                        ]
-                    )
-                ),
-                'saidas': (
-                    _dashboard_numero(
-                        item[
-                            'saidas'
-                        ]
-                    )
-                ),
-                'eventos': int(
+    graficos = {
+        'cultivar': {
+            'labels': [
+                item[
+                    'cultivar__nome'
+                ]
+                for item
+                in cultivares_data
+            ],
+            'values': [
+                _dashboard_numero(
                     item[
-                        'eventos'
+                        'volume'
                     ]
-                    or 0
-                ),
-            }
-            for item
-            in tendencia_agregada
-        }
-
-        labels_tendencia = []
-        entradas_tendencia = []
-        saidas_tendencia = []
-        eventos_tendencia = []
-
-        for indice in range(
-            periodo_dias
-        ):
-            dia = (
-                data_limite
-                + timedelta(
-                    days=indice
                 )
-            )
-
-            valores = (
-                tendencia_por_dia.get(
-                    dia,
-                    {
-                        'entradas': 0,
-                        'saidas': 0,
-                        'eventos': 0,
-                    },
+                for item
+                in cultivares_data
+            ],
+            'colors': cores_para(
+                len(
+                    cultivares_data
                 )
-            )
-
-            labels_tendencia.append(
-                dia.strftime(
-                    '%d/%m'
-                )
-            )
-
-            entradas_tendencia.append(
-                valores[
-                    'entradas'
-                ]
-            )
-
-            saidas_tendencia.append(
-                valores[
-                    'saidas'
-                ]
-            )
+            ),
+        },
 
-            eventos_tendencia.append(
-                valores[
-                    'eventos'
+        'peneira': {
+            'labels': [
+                item[
+                    'peneira__nome'
                 ]
-            )
-
-        graficos = {
-            'cultivar': {
-                'labels': [
+                for item
+                in peneiras_data
+            ],
+            'values': [
+                _dashboard_numero(
                     item[
-                        'cultivar__nome'
+                        'volume'
                     ]
-                    for item
-                    in cultivares_data
-                ],
-                'values': [
-                    _dashboard_numero(
-                        item[
-                            'volume'
-                        ]
-                    )
-                    for item
-                    in cultivares_data
-                ],
-                'colors': cores_para(
-                    len(
-                        cultivares_data
-                    )
-                ),
-            },
+                )
+                for item
+                in peneiras_data
+            ],
+            'colors': cores_para(
+                len(
+                    peneiras_data
+                )
+            ),
+        },
 
-            'peneira': {
-                'labels': [
+        'armazem': {
+            'labels': [
+                item[
+                    'az'
+                ]
+                for item
+                in armazens_data
+            ],
+            'values': [
+                _dashboard_numero(
                     item[
-                        'peneira__nome'
+                        'volume'
                     ]
-                    for item
-                    in peneiras_data
-                ],
-                'values': [
-                    _dashboard_numero(
-                        item[
-                            'volume'
-                        ]
-                    )
-                    for item
-                    in peneiras_data
-                ],
-                'colors': cores_para(
-                    len(
-                        peneiras_data
-                    )
-                ),
-            },
+                )
+                for item
+                in armazens_data
+            ],
+            'colors': cores_para(
+                len(
+                    armazens_data
+                )
+            ),
+        },
 
-            'armazem': {
-                'labels': [
-                    item[
-                        'az'
-                    ]
-                    for item
-                    in armazens_data
-                ],
-                'values': [
-                    _dashboard_numero(
-                        item[
-                            'volume'
-                        ]
-                    )
-                    for item
-                    in armazens_data
-                ],
-                'colors': cores_para(
-                    len(
-                        armazens_data
-                    )
-                ),
-            },
+        'tendencia': {
+            'labels': (
+                labels_tendencia
+            ),
+            'entradas': (
+                entradas_tendencia
+            ),
+            'saidas': (
+                saidas_tendencia
+            ),
+            'eventos': (
+                eventos_tendencia
+            ),
+        },
+    }
 
-            'tendencia': {
-                'labels': (
-                    labels_tendencia
+    # --------------------------------------------------------
+    # OPÇÕES DE FILTROS ENCADEADOS
+    # --------------------------------------------------------
+    def estoque_para_opcao(
+        ignorar,
+    ):
+        return (
+            _dashboard_aplicar_filtros_estoque(
+                Estoque.objects
+                .filter(
+                    saldo__gt=0
                 ),
-                'entradas': (
-                    entradas_tendencia
+                tipos_semente=(
+                    []
+                    if ignorar == 'tipo'
+                    else tipos_semente
                 ),
-                'saidas': (
-                    saidas_tendencia
+                cultivares=(
+                    []
+                    if ignorar == 'cultivar'
+                    else cultivares
                 ),
-                'eventos': (
-                    eventos_tendencia
+                peneiras=(
+                    []
+                    if ignorar == 'peneira'
+                    else peneiras
                 ),
-            },
-        }
-
-        # --------------------------------------------------------
-        # OPÇÕES DE FILTROS ENCADEADOS
-        # --------------------------------------------------------
-        def estoque_para_opcao(
-            ignorar,
-        ):
-            return (
-                _dashboard_aplicar_filtros_estoque(
-                    Estoque.objects
-                    .filter(
-                        saldo__gt=0
-                    ),
-                    tipos_semente=(
-                        []
-                        if ignorar == 'tipo'
-                        else tipos_semente
-                    ),
-                    cultivares=(
-                        []
-                        if ignorar == 'cultivar'
-                        else cultivares
-                    ),
-                    peneiras=(
-                        []
-                        if ignorar == 'peneira'
-                        else peneiras
-                    ),
-                    unidades=(
-                        []
-                        if ignorar == 'unidade'
-                        else unidades
-                    ),
-                    armazens=(
-                        []
-                        if ignorar == 'armazem'
-                        else armazens
-                    ),
-                    search=search,
-                )
+                unidades=(
+                    []
+                    if ignorar == 'unidade'
+                    else unidades
+                ),
+                armazens=(
+                    []
+                    if ignorar == 'armazem'
+                    else armazens
+                ),
+                search=search,
             )
+        )
 
-        qs_tipo = (
-            estoque_para_opcao(
-                'tipo'
-            )
+    qs_tipo = (
+        estoque_para_opcao(
+            'tipo'
         )
+    )
 
-        qs_cultivar = (
-            estoque_para_opcao(
-                'cultivar'
-            )
+    qs_cultivar = (
+        estoque_para_opcao(
+            'cultivar'
         )
+    )
 
-        qs_peneira = (
-            estoque_para_opcao(
-                'peneira'
-            )
+    qs_peneira = (
+        estoque_para_opcao(
+            'peneira'
         )
+    )
 
-        qs_unidade = (
-            estoque_para_opcao(
-                'unidade'
-            )
+    qs_unidade = (
+        estoque_para_opcao(
+            'unidade'
         )
+    )
 
-        qs_armazem = (
-            estoque_para_opcao(
-                'armazem'
-            )
+    qs_armazem = (
+        estoque_para_opcao(
+            'armazem'
         )
+    )
 
-        opcoes_filtros = {
-            'tipos_semente': list(
-                qs_tipo
-                .exclude(
-                    especie__isnull=True
-                )
-                .exclude(
-                    especie__nome=''
-                )
-                .values_list(
-                    'especie__nome',
-                    flat=True,
-                )
-                .distinct()
-                .order_by(
-                    'especie__nome'
-                )
-            ),
+    opcoes_filtros = {
+        'tipos_semente': list(
+            qs_tipo
+            .exclude(
+                especie__isnull=True
+            )
+            .exclude(
+                especie__nome=''
+            )
+            .values_list(
+                'especie__nome',
+                flat=True,
+            )
+            .distinct()
+            .order_by(
+                'especie__nome'
+            )
+        ),
 
-            'cultivares': list(
-                qs_cultivar
-                .filter(
-                    cultivar__isnull=False
-                )
-                .values(
-                    'cultivar_id',
-                    'cultivar__nome',
-                )
-                .distinct()
-                .order_by(
-                    'cultivar__nome'
-                )
-            ),
+        'cultivares': list(
+            qs_cultivar
+            .filter(
+                cultivar__isnull=False
+            )
+            .values(
+                'cultivar_id',
+                'cultivar__nome',
+            )
+            .distinct()
+            .order_by(
+                'cultivar__nome'
+            )
+        ),
 
-            'peneiras': list(
-                qs_peneira
-                .filter(
-                    peneira__isnull=False
-                )
-                .values(
-                    'peneira_id',
-                    'peneira__nome',
-                )
-                .distinct()
-                .order_by(
-                    'peneira__nome'
-                )
-            ),
+        'peneiras': list(
+            qs_peneira
+            .filter(
+                peneira__isnull=False
+            )
+            .values(
+                'peneira_id',
+                'peneira__nome',
+            )
+            .distinct()
+            .order_by(
+                'peneira__nome'
+            )
+        ),
 
-            'unidades': list(
-                qs_unidade
-                .exclude(
-                    embalagem__isnull=True
-                )
-                .exclude(
-                    embalagem=''
-                )
-                .values_list(
-                    'embalagem',
-                    flat=True,
-                )
-                .distinct()
-                .order_by(
-                    'embalagem'
-                )
-            ),
+        'unidades': list(
+            qs_unidade
+            .exclude(
+                embalagem__isnull=True
+            )
+            .exclude(
+                embalagem=''
+            )
+            .values_list(
+                'embalagem',
+                flat=True,
+            )
+            .distinct()
+            .order_by(
+                'embalagem'
+            )
+        ),
 
-            'armazens': list(
-                qs_armazem
-                .exclude(
-                    az__isnull=True
-                )
-                .exclude(
-                    az=''
-                )
-                .values_list(
-                    'az',
-                    flat=True,
-                )
-                .distinct()
-                .order_by(
-                    'az'
-                )
-            ),
-        }
+        'armazens': list(
+            qs_armazem
+            .exclude(
+                az__isnull=True
+            )
+            .exclude(
+                az=''
+            )
+            .values_list(
+                'az',
+                flat=True,
+            )
+            .distinct()
+            .order_by(
+                'az'
+            )
+        ),
+    }
 
-        # --------------------------------------------------------
-        # MOVIMENTAÇÕES RECENTES
-        # --------------------------------------------------------
-        movimentacoes = []
+    # --------------------------------------------------------
+    # MOVIMENTAÇÕES RECENTES
+    # --------------------------------------------------------
+    movimentacoes = []
 
-        recentes_qs = (
-            mov_qs_filtrado_tipo
-            .order_by(
-                '-data_hora'
-            )[:12]
+    recentes_qs = (
+        mov_qs_filtrado_tipo
+        .order_by(
+            '-data_hora'
+        )[:12]
+    )
+
+    for mov in recentes_qs:
+        estoque = mov.estoque
+
+        lote = (
+            mov.lote_ref
+            or (
+                estoque.lote
+                if estoque
+                else ''
+            )
+            or '--'
+        )
+
+        unidade = (
+            (
+                estoque.embalagem
+                if estoque
+                else ''
+            )
+            or '--'
         )
 
-        for mov in recentes_qs:
-            estoque = mov.estoque
-
-            lote = (
-                mov.lote_ref
-                or (
-                    estoque.lote
-                    if estoque
-                    else ''
-                )
-                or '--'
+        if mov.usuario:
+            usuario = (
+                mov.usuario.get_full_name()
+                or mov.usuario.username
             )
+        else:
+            usuario = 'Sistema'
 
-            unidade = (
-                (
-                    estoque.embalagem
-                    if estoque
-                    else ''
+        movimentacoes.append({
+            'dt': (
+                timezone.localtime(
+                    mov.data_hora
+                ).strftime(
+                    '%d/%m/%Y %H:%M'
                 )
+                if mov.data_hora
+                else '--'
+            ),
+            'tp': (
+                mov.tipo
                 or '--'
-            )
-
-            if mov.usuario:
-                usuario = (
-                    mov.usuario.get_full_name()
-                    or mov.usuario.username
+            ),
+            'lt': lote,
+            'unidade': unidade,
+            'qtd': (
+                _dashboard_numero(
+                    getattr(
+                        mov,
+                        'quantidade',
+                        0,
+                    )
                 )
-            else:
-                usuario = 'Sistema'
+            ),
+            'us': usuario,
+        })
 
-            movimentacoes.append({
-                'dt': (
-                    timezone.localtime(
-                        mov.data_hora
-                    ).strftime(
-                        '%d/%m/%Y %H:%M'
-                    )
-                    if mov.data_hora
-                    else '--'
-                ),
-                'tp': (
-                    mov.tipo
-                    or '--'
-                ),
-                'lt': lote,
-                'unidade': unidade,
-                'qtd': (
-                    _dashboard_numero(
-                        getattr(
-                            mov,
-                            'quantidade',
-                            0,
-                        )
-                    )
-                ),
-                'us': usuario,
-            })
+    return {
+        'success': True,
+        'kpis': kpis,
+        'graficos': graficos,
+        'recentes': movimentacoes,
+        'opcoes_filtros': (
+            opcoes_filtros
+        ),
+    }
 
-        return JsonResponse({
-            'success': True,
-            'kpis': kpis,
-            'graficos': graficos,
-            'recentes': movimentacoes,
-            'opcoes_filtros': (
-                opcoes_filtros
+
+@login_required
+@permission_required(
+    'sapp.pode_ver_estoque',
+    raise_exception=True,
+)
+def dashboard_data(request):
+    """
+    Endpoint AJAX do Dashboard Analítico.
+
+    A resposta vem do cache por conjunto de filtros (ver
+    obter_dashboard_em_cache); o cabeçalho X-Dashboard-Cache informa
+    se foi HIT, STALE ou MISS.
+    """
+
+    try:
+        parametros = _dashboard_parametros(
+            request.GET
+        )
+
+        dados, situacao = obter_dashboard_em_cache(
+            parametros,
+            lambda: _dashboard_calcular(
+                parametros
             ),
-        })
+        )
 
     except Exception as erro:
         import traceback
@@ -6957,6 +6528,10 @@ def dashboard_data(request):
             status=500,
         )
 
+    response = JsonResponse(dados)
+    response['X-Dashboard-Cache'] = situacao
+    return response
+
 ################################################## fim dashbord ##################
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
@@ -7030,16 +6605,7 @@ def ficha_rastreabilidade(request):
     # Busca global
     busca = request.GET.get('busca', '')
     if busca and busca.strip():
-        for termo in busca.split():
-            filtros &= (
-                Q(lote__icontains=termo) | 
-                Q(produto__icontains=termo) |
-                Q(cultivar__nome__icontains=termo) | 
-                Q(especie__nome__icontains=termo) |
-                Q(endereco__icontains=termo) | 
-                Q(cliente__icontains=termo) |
-                Q(empresa__icontains=termo)
-            )
+        filtros &= q_busca_estoque(busca)
     
     # Filtros de seleção
     campos_selecao = [
@@ -7421,45 +6987,35 @@ def extrair_ln_p(endereco):
     Extrai LN e P de um endereço no formato R-X LN## P##
     Retorna (rua, ln, posicao) ou None se não seguir o padrão
     """
-    if not endereco:
+    dados = decompor_endereco(endereco)
+
+    if not dados['linha'].startswith('LN') or dados['posicao'] is None:
         return None
-    
-    # Padrão: R-X LN## P## (ex: R-A LN10 P03)
-    pattern = r'^(R-[A-Z])\s+(LN\d+)\s+(P\d+)$'
-    match = re.match(pattern, endereco.strip().upper())
-    
-    if match:
-        rua = match.group(1)  # R-A
-        ln = match.group(2)   # LN10
-        p = match.group(3)    # P03
-        posicao = int(re.search(r'\d+', p).group())  # 3
-        return {
-            'rua': rua,
-            'ln': ln,
-            'posicao': posicao,
-            'endereco_completo': endereco
-        }
-    return None
+
+    return {
+        'rua': dados['rua'],
+        'ln': dados['linha'],
+        'posicao': dados['posicao'],
+        'endereco_completo': endereco
+    }
 
 def get_posicoes_linha(rua, ln):
     """
     Retorna todas as posições existentes de uma rua+linha
+    (uma consulta no índice rua/linha/posição, já ordenada)
     """
-    enderecos = Estoque.objects.filter(
-        endereco__startswith=f"{rua} {ln} P"
-    ).values_list('endereco', flat=True).distinct()
-    
-    posicoes = []
-    for end in enderecos:
-        dados = extrair_ln_p(end)
-        if dados:
-            posicoes.append({
-                'endereco': end,
-                'posicao': dados['posicao']
-            })
-    
-    # Ordenar por posição numérica
-    return sorted(posicoes, key=lambda x: x['posicao'])
+    enderecos = (
+        Estoque.objects
+        .filter(rua=rua, linha=ln, posicao__isnull=False)
+        .order_by('posicao', 'endereco')
+        .values_list('endereco', 'posicao')
+        .distinct()
+    )
+
+    return [
+        {'endereco': end, 'posicao': posicao}
+        for end, posicao in enderecos
+    ]
 
 @login_required
 @permission_required('sapp.pode_movimentar_estoque', raise_exception=True)
@@ -7486,13 +7042,6 @@ def marcar_ultimo_lote_linha(request, estoque_id):
             lote.ultimo_lote_linha = False
             lote.save()
             
-            # Limpar marcações da linha
-            posicoes = get_posicoes_linha(dados_end['rua'], dados_end['ln'])
-            for pos in posicoes:
-                if pos['posicao'] >= dados_end['posicao']:
-                    # Aqui você pode limpar alguma flag visual se necessário
-                    pass
-            
             return JsonResponse({
                 'success': True,
                 'marcado': False,
@@ -7501,7 +7050,9 @@ def marcar_ultimo_lote_linha(request, estoque_id):
         
         # Verificar se já existe outro último na mesma linha
         outro_ultimo = Estoque.objects.filter(
-            endereco__startswith=f"{dados_end['rua']} {dados_end['ln']} P",
+            rua=dados_end['rua'],
+            linha=dados_end['ln'],
+            posicao__isnull=False,
             ultimo_lote_linha=True
         ).exclude(id=estoque_id).first()
         
@@ -7534,7 +7085,9 @@ def get_marcacoes_linha(request, rua, ln):
     try:
         # Encontrar o último lote marcado nesta linha
         ultimo = Estoque.objects.filter(
-            endereco__startswith=f"{rua} {ln} P",
+            rua=rua,
+            linha=ln,
+            posicao__isnull=False,
             ultimo_lote_linha=True
         ).first()
         
@@ -7545,28 +7098,20 @@ def get_marcacoes_linha(request, rua, ln):
                 'posicoes_afetadas': []
             })
         
-        dados_ultimo = extrair_ln_p(ultimo.endereco)
-        if not dados_ultimo:
-            return JsonResponse({
-                'success': True,
-                'tem_marcacao': False,
-                'posicoes_afetadas': []
-            })
-        
-        # Todas as posições da linha
-        posicoes = get_posicoes_linha(rua, ln)
-        
-        # Filtrar posições >= a posição marcada
-        posicoes_afetadas = [
-            p['endereco'] for p in posicoes 
-            if p['posicao'] >= dados_ultimo['posicao']
-        ]
+        # Posições >= a posição marcada, direto no índice
+        posicoes_afetadas = list(
+            Estoque.objects
+            .filter(rua=rua, linha=ln, posicao__gte=ultimo.posicao)
+            .order_by('posicao', 'endereco')
+            .values_list('endereco', flat=True)
+            .distinct()
+        )
         
         return JsonResponse({
             'success': True,
             'tem_marcacao': True,
             'lote_marcado': ultimo.lote,
-            'posicao_marcada': dados_ultimo['posicao'],
+            'posicao_marcada': ultimo.posicao,
             'posicoes_afetadas': posicoes_afetadas
         })
         
@@ -7581,18 +7126,19 @@ def api_mapa_dados(request, armazem_numero):
     """API para retornar dados do mapa em formato JSON"""
     try:
         armazem = get_object_or_404(ArmazemLayout, numero=armazem_numero)
-        elementos = armazem.elementos.all()
+        elementos = list(armazem.elementos.all())
         
-        # Buscar estoque
-        itens_estoque = Estoque.objects.filter(saldo__gt=0)
+        # Ocupação de todos os endereços do armazém numa consulta agrupada
+        totais = ocupacao_por_endereco(enderecos_do_armazem(elementos))
         ocupacao = {}
+        resumo_ocupacao = {}
         
         for el in elementos:
             if el.tipo == 'RETANGULO' and el.identificador:
-                chave = el.identificador.strip().upper()
-                tem_estoque = itens_estoque.filter(endereco__iexact=chave).exists()
-                if tem_estoque:
+                chave = normalizar_endereco(el.identificador)
+                if chave in totais:
                     ocupacao[el.id] = True
+                    resumo_ocupacao[el.id] = totais[chave]
         
         # Converter elementos para dicionário
         elementos_list = []
@@ -7622,7 +7168,8 @@ def api_mapa_dados(request, armazem_numero):
                 'altura_canvas': armazem.altura_canvas,
             },
             'elementos': elementos_list,
-            'ocupacao': ocupacao
+            'ocupacao': ocupacao,
+            'resumo_ocupacao': resumo_ocupacao,
         })
         
     except Exception as e:
@@ -7636,42 +7183,37 @@ def api_marcacoes_ultimo_lote(request):
     (posições posteriores à posição marcada como último lote)
     """
     try:
-        from .models import ArmazemLayout, ElementoMapa
+        from .models import ElementoMapa
         
-        # Buscar todos os lotes marcados como último
+        # Linhas com lote marcado como último (posição marcada por linha)
+        marcadas = {}
         lotes_marcados = Estoque.objects.filter(
             ultimo_lote_linha=True,
-            saldo__gt=0
-        )
+            saldo__gt=0,
+            posicao__isnull=False,
+        ).exclude(rua='').values_list('rua', 'linha', 'posicao')
+        
+        for rua, ln, posicao_marcada in lotes_marcados:
+            chave = (rua, ln)
+            marcadas[chave] = min(posicao_marcada, marcadas.get(chave, posicao_marcada))
         
         marcacoes = {}
         
-        for lote in lotes_marcados:
-            # Extrair informações do endereço usando regex
-            dados_end = extrair_info_endereco(lote.endereco)
-            if not dados_end:
-                continue
-            
-            rua = dados_end.get('rua')        # R-A
-            ln = dados_end.get('linha')       # LN01
-            posicao_marcada = dados_end.get('posicao')  # 4
-            
-            # Se não tiver posição, pula
-            if not posicao_marcada:
-                continue
+        if marcadas:
+            # Uma consulta no mapa: posições posteriores à marcada em cada linha
+            filtro = Q()
+            for (rua, ln), posicao_marcada in marcadas.items():
+                filtro |= q_posicoes_apos(rua, ln, posicao_marcada)
             
-            # Buscar no MAPA todos os endereços desta linha
-            padrao = f"{rua} {ln} P"
-            elementos = ElementoMapa.objects.filter(
-                tipo='RETANGULO',
-                identificador__startswith=padrao
-            ).values_list('identificador', flat=True).distinct()
+            elementos = (
+                ElementoMapa.objects
+                .filter(filtro, tipo='RETANGULO')
+                .values_list('identificador', flat=True)
+                .distinct()
+            )
             
-            # Para cada endereço do mapa, verificar se é posterior
             for endereco in elementos:
-                dados_pos = extrair_info_endereco(endereco)
-                if dados_pos and dados_pos.get('posicao', 0) > posicao_marcada:
-                    marcacoes[endereco.strip().upper()] = True
+                marcacoes[normalizar_endereco(endereco)] = True
         
         return JsonResponse({
             'success': True,
@@ -7704,16 +7246,13 @@ def api_get_armazem_by_rua(request):
         ).first()
         
         if endereco:
-            # Extrai informações adicionais do endereço (se possível)
-            dados = extrair_info_endereco(endereco.codigo)
-            
             return JsonResponse({
                 'sucesso': True, 
                 'az': endereco.armazem.nome,
                 'endereco': endereco.codigo,
-                'rua': dados.get('rua') if dados else None,
-                'linha': dados.get('linha') if dados else None,
-                'posicao': dados.get('posicao') if dados else None
+                'rua': endereco.rua or None,
+                'linha': endereco.linha or None,
+                'posicao': endereco.posicao
             })
         
         return JsonResponse({'sucesso': False, 'msg': 'Endereço não cadastrado'}, status=404)
@@ -7725,7 +7264,7 @@ def api_get_armazem_by_rua(request):
 def extrair_info_endereco(endereco_str):
     """
     Função auxiliar para extrair rua, linha e posição de um endereço
-    Usa regex para extrair informações mesmo sem campos no banco
+    (mesmo padrão dos campos rua/linha/posicao gravados no banco)
     
     Exemplos:
     - "R-A LN10 P02" -> {'rua': 'R-A', 'linha': 'LN10', 'posicao': 2}
@@ -7733,48 +7272,18 @@ def extrair_info_endereco(endereco_str):
     - "R-A GERAL" -> {'rua': 'R-A', 'linha': 'GERAL', 'posicao': None}
     - "R-A" -> {'rua': 'R-A', 'linha': None, 'posicao': None}
     """
-    import re
-    
     if not endereco_str:
         return None
     
-    endereco_str = endereco_str.strip().upper()
-    
-    # Padrão completo: R-A LN10 P02
-    match_completo = re.match(r'^(R-[A-Z])\s+LN(\d{2})\s+P(\d{2})$', endereco_str)
-    if match_completo:
-        return {
-            'rua': match_completo.group(1),
-            'linha': f"LN{match_completo.group(2)}",
-            'posicao': int(match_completo.group(3))
-        }
-    
-    # Padrão sem posição: R-A LN10
-    match_linha = re.match(r'^(R-[A-Z])\s+LN(\d{2})$', endereco_str)
-    if match_linha:
-        return {
-            'rua': match_linha.group(1),
-            'linha': f"LN{match_linha.group(2)}",
-            'posicao': None
-        }
-    
-    # Padrão geral: R-A GERAL
-    match_geral = re.match(r'^(R-[A-Z])\s+GERAL$', endereco_str)
-    if match_geral:
+    dados = decompor_endereco(endereco_str)
+    if dados['rua']:
         return {
-            'rua': match_geral.group(1),
-            'linha': 'GERAL',
-            'posicao': None
+            'rua': dados['rua'],
+            'linha': dados['linha'] or None,
+            'posicao': dados['posicao']
         }
     
-    # Apenas a rua: R-A
-    match_rua = re.match(r'^(R-[A-Z])$', endereco_str)
-    if match_rua:
-        return {
-            'rua': match_rua.group(1),
-            'linha': None,
-            'posicao': None
-        }
+    endereco_str = endereco_str.strip().upper()
     
     # Formato livre: tenta extrair o primeiro como rua
     partes = endereco_str.split()
@@ -8020,219 +7529,26 @@ def exportar_estoque_excel(request):
     """Exporta o estoque para Excel com os filtros aplicados (apenas saldo > 0)"""
     
     try:
-        # Cria o workbook
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "Estoque"
-        
-        # Estilos
-        header_font = Font(name='Arial', size=11, bold=True, color='FFFFFF')
-        header_fill = PatternFill(start_color='2F8F4E', end_color='2F8F4E', fill_type='solid')
-        header_alignment = Alignment(horizontal='center', vertical='center', wrap_text=True)
-        
-        cell_font = Font(name='Arial', size=10)
-        cell_alignment = Alignment(vertical='center')
-        
-        thin_border = Border(
-            left=Side(style='thin', color='D3D3D3'),
-            right=Side(style='thin', color='D3D3D3'),
-            top=Side(style='thin', color='D3D3D3'),
-            bottom=Side(style='thin', color='D3D3D3')
-        )
-        
-        # Cabeçalhos
-        headers = [
-            'Status', 'AZ', 'Lote', 'Produto', 'Cultivar', 'Peneira', 
-            'Categoria', 'Endereço', 'Saldo', 'Peso Unit.', 'Peso Total',
-            'Espécie', 'Tratamento', 'Embalagem', 'Cliente', 'Empresa', 
-            'Conferente', 'Observação'
-        ]
-        
-        # Aplica estilos nos cabeçalhos
-        for col, header in enumerate(headers, 1):
-            cell = ws.cell(row=1, column=col, value=header)
-            cell.font = header_font
-            cell.fill = header_fill
-            cell.alignment = header_alignment
-            cell.border = thin_border
-        
         # Query base - FILTRA APENAS SALDO > 0
         queryset = Estoque.objects.select_related(
-            'cultivar', 'peneira', 'categoria', 'tratamento', 
-            'especie', 'status_sistemico', 'conferente'
+            *RELACIONADOS_EXPORTACAO
         ).filter(saldo__gt=0)  # 🔥 AQUI: Apenas itens com saldo maior que 0
-        
-        # Aplica busca
-        busca = request.GET.get('busca', '')
-        if busca:
-            queryset = queryset.filter(
-                Q(lote__icontains=busca) |
-                Q(produto__icontains=busca) |
-                Q(endereco__icontains=busca) |
-                Q(cliente__icontains=busca) |
-                Q(empresa__icontains=busca) |
-                Q(az__icontains=busca) |
-                Q(observacao__icontains=busca) |
-                Q(conferente__username__icontains=busca) |
-                Q(conferente__first_name__icontains=busca) |
-                Q(conferente__last_name__icontains=busca)
-            )
-        
-        # Aplica filtros de coluna (exceto page, page_size, busca, export)
-        for key, values in request.GET.lists():
-            if key in ['page', 'page_size', 'busca', 'export']:
-                continue
-            
-            # Filtros numéricos
-            if key.startswith('min_'):
-                campo = key.replace('min_', '')
-                for val in values:
-                    if val:
-                        try:
-                            queryset = queryset.filter(**{f"{campo}__gte": float(val)})
-                        except (ValueError, TypeError):
-                            pass
-                continue
-            
-            if key.startswith('max_'):
-                campo = key.replace('max_', '')
-                for val in values:
-                    if val:
-                        try:
-                            queryset = queryset.filter(**{f"{campo}__lte": float(val)})
-                        except (ValueError, TypeError):
-                            pass
-                continue
-            
-            # Filtros de seleção múltipla
-            if values and values != ['']:
-                filtro_q = Q()
-                for valor in values:
-                    if valor == '__null__':
-                        # Filtra por valores vazios/nulos
-                        if key in ['cultivar', 'peneira', 'categoria', 'tratamento', 'especie', 'status_sistemico']:
-                            filtro_q |= Q(**{f"{key}__isnull": True})
-                        else:
-                            filtro_q |= Q(**{f"{key}__exact": ''}) | Q(**{f"{key}__isnull": True})
-                    else:
-                        # Mapeia campos relacionados
-                        if key == 'cultivar':
-                            filtro_q |= Q(cultivar__nome=valor)
-                        elif key == 'peneira':
-                            filtro_q |= Q(peneira__nome=valor)
-                        elif key == 'categoria':
-                            filtro_q |= Q(categoria__nome=valor)
-                        elif key == 'tratamento':
-                            filtro_q |= Q(tratamento__nome=valor)
-                        elif key == 'especie':
-                            filtro_q |= Q(especie__nome=valor)
-                        elif key == 'status_sistemico':
-                            filtro_q |= Q(status_sistemico__nome=valor)
-                        elif key == 'conferente':
-                            filtro_q |= Q(conferente__username=valor)
-                        else:
-                            filtro_q |= Q(**{key: valor})
-                
-                queryset = queryset.filter(filtro_q)
-        
+
+        # Aplica busca e filtros de coluna (exceto page, page_size, busca, export)
+        queryset = filtrar_estoque_exportacao(queryset, dict(request.GET.lists()))
+
         # Ordena
         queryset = queryset.order_by('lote')
-        
-        total_registros = queryset.count()
-        print(f"📊 Exportando {total_registros} registros (apenas saldo > 0)")
-        
-        # Preenche os dados
-        for row_idx, item in enumerate(queryset, 2):
-            # Nome do conferente
-            nome_conferente = ''
-            if item.conferente:
-                nome_conferente = item.conferente.get_full_name().strip()
-                if not nome_conferente:
-                    nome_conferente = item.conferente.first_name.strip()
-                if not nome_conferente:
-                    nome_conferente = item.conferente.username
-            
-            # Nome do status
-            nome_status = item.status_sistemico.nome if item.status_sistemico else 'Indefinido'
-            
-            data_row = [
-                nome_status,
-                item.az or '',
-                item.lote or '',
-                item.produto or '',
-                item.cultivar.nome if item.cultivar else '',
-                item.peneira.nome if item.peneira else '',
-                item.categoria.nome if item.categoria else '',
-                item.endereco or '',
-                item.saldo if item.saldo is not None else 0,
-                float(item.peso_unitario) if item.peso_unitario else 0.0,
-                float(item.peso_total) if item.peso_total else 0.0,
-                item.especie.nome if item.especie else '',
-                item.tratamento.nome if item.tratamento else '',
-                item.get_embalagem_display() if item.embalagem else '',
-                item.cliente or '',
-                item.empresa or '',
-                nome_conferente,
-                item.observacao or '',
-            ]
-            
-            for col, value in enumerate(data_row, 1):
-                cell = ws.cell(row=row_idx, column=col, value=value)
-                cell.font = cell_font
-                cell.alignment = cell_alignment
-                cell.border = thin_border
-        
-        # Ajusta largura das colunas
-        column_widths = {
-            1: 15,   # Status
-            2: 8,    # AZ
-            3: 20,   # Lote
-            4: 30,   # Produto
-            5: 15,   # Cultivar
-            6: 10,   # Peneira
-            7: 12,   # Categoria
-            8: 18,   # Endereço
-            9: 10,   # Saldo
-            10: 12,  # Peso Unit.
-            11: 12,  # Peso Total
-            12: 12,  # Espécie
-            13: 15,  # Tratamento
-            14: 12,  # Embalagem
-            15: 25,  # Cliente
-            16: 25,  # Empresa
-            17: 25,  # Conferente
-            18: 30,  # Observação
-        }
-        
-        for col, width in column_widths.items():
-            ws.column_dimensions[get_column_letter(col)].width = width
-        
-        # Congela o cabeçalho
-        ws.freeze_panes = 'A2'
-        
-        # Filtro automático
-        if total_registros > 0:
-            ultima_linha = total_registros + 1
-            ws.auto_filter.ref = f"A1:{get_column_letter(len(headers))}{ultima_linha}"
-        
-        # Altura das linhas
-        ws.row_dimensions[1].height = 30
-        
-        # Prepara resposta
+
+        # Linhas lidas em blocos (iterator) e gravadas sem montar a planilha em memória
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        filename = f'estoque_{timestamp}.xlsx'
-        
-        response = HttpResponse(
-            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+        return _resposta_exportacao(
+            request,
+            queryset,
+            COLUNAS_ESTOQUE_FILTRADO,
+            f'estoque_{timestamp}',
         )
-        response['Content-Disposition'] = f'attachment; filename="{filename}"'
-        response['Content-Type'] = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        
-        wb.save(response)
-        
-        print(f"✅ Arquivo Excel gerado: {filename} com {total_registros} registros")
-        
-        return response
         
     except Exception as e:
         import traceback
@@ -8255,30 +7571,78 @@ def exportar_estoque_excel(request):
 @login_required
 def api_versao_cards(request):
     """
-    Retorna um hash/versão dos cards para verificar se houve alteração.
-    Usado pelo polling de 30 segundos.
+    Retorna a versão atual do quadro de cards (contador incrementado
+    pelos signals a cada alteração). Usado pelo polling da página.
+
+    Responde com ETag; se o navegador enviar If-None-Match com a
+    mesma versão, devolve 304 sem corpo.
+    """
+    versao = obter_versao(CHAVE_VERSAO_KANBAN)
+    etag = quote_etag(f'kanban-{versao}')
+
+    response = get_conditional_response(request, etag=etag)
+
+    if response is None:
+        response = JsonResponse({
+            'success': True,
+            'version': str(versao),
+            'timestamp': timezone.now().isoformat(),
+        })
+
+    response['ETag'] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+@login_required
+@require_GET
+async def api_eventos_kanban(request):
     """
-    from django.core.cache import cache
-    from hashlib import md5
-    
-    cache_key = 'cards_version_hash'
-    version = cache.get(cache_key)
-    
-    if not version:
-        # Gerar hash baseado nos cards ativos
-        cards_data = Solicitacao.objects.exclude(
-            status='CONCLUIDO'
-        ).values_list('id', 'data_atualizacao', 'status', 'quantidade_empenhada')
-        
-        hash_input = str(list(cards_data)).encode('utf-8')
-        version = md5(hash_input).hexdigest()
-        cache.set(cache_key, version, 5)  # Cache por 30 segundos
-    
-    return JsonResponse({
-        'success': True,
-        'version': version,
-        'timestamp': timezone.now().isoformat(),
-    })
+    Canal de atualizações do quadro (substitui o polling de
+    api_versao_cards). Parâmetros: versao (última vista pelo cliente)
+    e desde (último id do feed).
+
+    - Accept: text/event-stream (só sob ASGI): SSE, um evento "kanban"
+      por mudança; o EventSource retoma pelo Last-Event-ID.
+    - Caso contrário: long-poll; responde quando a versão mudar ou,
+      sem mudança, após ESPERA_LONG_POLL segundos com mudou=false.
+
+    Enquanto nada muda, a espera não consulta o banco. O login_required
+    lê sessão e usuário (duas consultas pela chave) a cada conexão: uma
+    vez por long-poll (até ESPERA_LONG_POLL s) ou por SSE (DURACAO_SSE),
+    e não a cada verificação. Fica assim de propósito: com a sessão
+    guardada em cache um logout só valeria na próxima expiração.
+    """
+    versao_evento, desde_evento = ler_id_evento(request.headers.get('Last-Event-ID'))
+    # Na reconexão do EventSource o Last-Event-ID vale mais que a URL
+    versao = versao_evento or request.GET.get('versao')
+    desde = request.GET.get('desde', '')
+    desde = desde_evento if desde_evento is not None else (int(desde) if desde.isdigit() else None)
+
+    if 'text/event-stream' in request.headers.get('Accept', ''):
+        # Sob WSGI o stream prenderia um worker: 204 faz o EventSource
+        # desistir e o cliente cai para o long-poll
+        if not isinstance(request, ASGIRequest):
+            return HttpResponse(status=204)
+
+        response = StreamingHttpResponse(
+            fluxo_eventos_kanban(versao, desde),
+            content_type='text/event-stream',
+        )
+        response['X-Accel-Buffering'] = 'no'
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+    nova = await aguardar_versao(versao)
+
+    if nova is None:
+        response = JsonResponse({'success': True, 'mudou': False, 'version': versao})
+    else:
+        evento = await sync_to_async(montar_evento_kanban)(nova, desde)
+        response = JsonResponse({'success': True, 'mudou': True, **evento})
+
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
 
 
 
@@ -12974,25 +12338,18 @@ def _nome_usuario(usuario):
     return usuario.get_full_name() or usuario.username
 
 
-def _lotes_da_solicitacao(solicitacao):
-    """
-    Retorna lotes pendentes e já processados usando o vínculo
-    Empenho.solicitacao. Não depende do título do card.
-    """
-    lotes = set()
-
-    for empenho in solicitacao.empenhos.all():
-        for item in empenho.itens.all():
-            lote = str(item.lote or '').strip()
-            if lote:
-                lotes.add(lote)
+SEM_LOTES_EMBALAGENS = {'lotes': [], 'embalagens': []}
 
-        for item in empenho.historico_itens.all():
-            lote = str(item.lote or '').strip()
-            if lote:
-                lotes.add(lote)
 
-    return sorted(lotes)
+def _lotes_e_embalagens_dos_cards(solicitacoes):
+    """
+    Lotes e embalagens de todos os cards em uma única consulta,
+    pelo vínculo Empenho.solicitacao. Não depende do título do card.
+    """
+    return lotes_e_embalagens(
+        solicitacao.id
+        for solicitacao in solicitacoes
+    )
 
 
 def _serializar_tag(tag):
@@ -13005,12 +12362,18 @@ def _serializar_tag(tag):
     }
 
 
-def _serializar_card(solicitacao):
+def _serializar_card(solicitacao, lotes_embalagens=None):
+    """
+    lotes_embalagens vem de _lotes_e_embalagens_dos_cards (um dicionário
+    para todo o quadro); o kg empenhado é o total gravado na solicitação.
+    """
+    lotes_embalagens = (
+        lotes_embalagens
+        or _lotes_e_embalagens_dos_cards([solicitacao])
+    ).get(solicitacao.id, SEM_LOTES_EMBALAGENS)
+
     if solicitacao.unidade_controle == 'QUILOGRAMA':
-        qtd_empenhada_display = (
-            solicitacao.quantidade_empenhada_kg
-            or Decimal('0')
-        )
+        qtd_empenhada_display = kg_empenhado(solicitacao)
     else:
         qtd_empenhada_display = Decimal(
             str(solicitacao.quantidade_empenhada or 0)
@@ -13026,32 +12389,6 @@ def _serializar_card(solicitacao):
         else Decimal('0')
     )
 
-    embalagens = set()
-
-    for empenho in solicitacao.empenhos.all():
-
-        for item in empenho.itens.all():
-            embalagem = str(
-                getattr(
-                    item,
-                    'embalagem_snapshot',
-                    ''
-                )
-                or ''
-            ).strip().upper()
-
-            if embalagem:
-                embalagens.add(embalagem)
-
-        for historico in empenho.historico_itens.all():
-            embalagem = str(
-                historico.embalagem
-                or ''
-            ).strip().upper()
-
-            if embalagem:
-                embalagens.add(embalagem)
-                
     return {
         'id': solicitacao.id,
         'titulo': solicitacao.titulo,
@@ -13106,12 +12443,8 @@ def _serializar_card(solicitacao):
             'cliente': solicitacao.cliente or '',
             'destino': solicitacao.destino or '',
         },
-        'lotes': _lotes_da_solicitacao(solicitacao),
-
-
-        'embalagens': sorted(
-            embalagens
-        ),
+        'lotes': lotes_embalagens['lotes'],
+        'embalagens': lotes_embalagens['embalagens'],
 
         'tags': [
             _serializar_tag(tag)
@@ -13121,6 +12454,8 @@ def _serializar_card(solicitacao):
 
 
 def _queryset_kanban():
+    # Lotes/embalagens não são pré-carregados aqui: vêm de uma única
+    # consulta agrupada para o quadro todo (_lotes_e_embalagens_dos_cards).
     return (
         Solicitacao.objects
         .select_related(
@@ -13130,17 +12465,7 @@ def _queryset_kanban():
             'especie',
             'coluna_kanban',
         )
-        .prefetch_related(
-            'tags_kanban',
-            Prefetch(
-                'empenhos',
-                queryset=(
-                    Empenho.objects
-                    .prefetch_related('itens', 'historico_itens')
-                    .order_by('id')
-                ),
-            ),
-        )
+        .prefetch_related('tags_kanban')
     )
 
 
@@ -13157,9 +12482,66 @@ def pagina_kanban(request):
     )
 
 
+def _delta_kanban(since, versao):
+    """
+    Modo since=<versão> do api_kanban_dados: só os cards criados,
+    alterados ou movidos depois da versão do cliente, e os ids a
+    remover (cards excluídos ou que saíram das colunas ativas).
+    None quando o cliente precisa do quadro completo.
+    """
+    alteracoes = alteracoes_desde(since)
+
+    if alteracoes is None:
+        return None
+
+    alterados, removidos = alteracoes
+
+    solicitacoes = list(
+        _queryset_kanban()
+        .filter(pk__in=alterados.values('pk'))
+        .order_by('-prioridade', '-data_criacao')
+    )
+
+    ativos = [
+        solicitacao
+        for solicitacao in solicitacoes
+        if solicitacao.coluna_kanban and solicitacao.coluna_kanban.ativa
+    ]
+
+    removidos = sorted(set(removidos) | {
+        solicitacao.pk
+        for solicitacao in solicitacoes
+        if solicitacao not in ativos
+    })
+
+    lotes_embalagens = _lotes_e_embalagens_dos_cards(ativos)
+
+    return JsonResponse({
+        'success': True,
+        'delta': True,
+        'cards': [
+            _serializar_card(solicitacao, lotes_embalagens)
+            for solicitacao in ativos
+        ],
+        'removidos': removidos,
+        'versao': versao,
+        'timestamp': timezone.now().isoformat(),
+    })
+
+
 @login_required
 @require_GET
 def api_kanban_dados(request):
+    # Lida antes dos dados: se algo mudar no meio, o próximo polling recarrega
+    versao = obter_versao(CHAVE_VERSAO_KANBAN)
+
+    since = request.GET.get('since', '')
+
+    if since.isdigit():
+        delta = _delta_kanban(int(since), versao)
+        if delta is not None:
+            return delta
+
     colunas = list(
         ColunaKanban.objects
         .filter(ativa=True)
@@ -13172,12 +12554,14 @@ def api_kanban_dados(request):
         .order_by('-prioridade', '-data_criacao')
     )
 
+    lotes_embalagens = _lotes_e_embalagens_dos_cards(solicitacoes)
+
     por_coluna = {coluna.id: [] for coluna in colunas}
 
     for solicitacao in solicitacoes:
         if solicitacao.coluna_kanban_id in por_coluna:
             por_coluna[solicitacao.coluna_kanban_id].append(
-                _serializar_card(solicitacao)
+                _serializar_card(solicitacao, lotes_embalagens)
             )
 
     return JsonResponse({
@@ -13206,6 +12590,7 @@ def api_kanban_dados(request):
                 ativa=True
             ).order_by('ordem', 'nome')
         ],
+        'versao': versao,
         'timestamp': timezone.now().isoformat(),
     })
 
@@ -13238,6 +12623,9 @@ def api_pesquisar_kanban(request):
         .order_by('-data_criacao')[:50]
     )
 
+    queryset = list(queryset)
+    lotes_embalagens = _lotes_e_embalagens_dos_cards(queryset)
+
     return JsonResponse({
         'success': True,
         'resultados': [
@@ -13250,7 +12638,10 @@ def api_pesquisar_kanban(request):
                     solicitacao.coluna_kanban.nome
                     if solicitacao.coluna_kanban else ''
                 ),
-                'lotes': _lotes_da_solicitacao(solicitacao),
+                'lotes': lotes_embalagens.get(
+                    solicitacao.id,
+                    SEM_LOTES_EMBALAGENS,
+                )['lotes'],
                 'destino': solicitacao.destino or '',
                 'data_criacao': _formatar_data(
                     solicitacao.data_criacao
@@ -13641,20 +13032,6 @@ def api_atualizacoes_recentes(request):
     
     atualizacoes = query.order_by('-data')[:limite]
     
-    data = []
-    for a in atualizacoes:
-        data.append({
-            'id': a.id,
-            'usuario': a.usuario.get_full_name() or a.usuario.username,
-            'acao': a.get_acao_display(),
-            'descricao': a.descricao_completa(),
-            'lote': a.lote,
-            'quantidade': float(a.quantidade) if a.quantidade else None,
-            'unidade': a.unidade,
-            'card_id': a.solicitacao.id,
-            'card_titulo': a.solicitacao.titulo,
-            'data': a.data.strftime('%d/%m/%Y %H:%M:%S'),
-            'data_iso': a.data.isoformat(),
-        })
+    data = [serializar_atualizacao(a) for a in atualizacoes]
     
     return JsonResponse({'success': True, 'atualizacoes': data, 'total': len(data)})
@@ -13,4 +13,9 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'sementes.settings')
 
+# Em produção o app roda por aqui (dockerfile: gunicorn com
+# uvicorn.workers.UvicornWorker). O canal de atualizações do quadro
+# (/api/cards/eventos/, SSE) precisa de ASGI para não prender um
+# worker por cliente; sob WSGI (runserver, wsgi.py) o mesmo endpoint
+# atende só o long-poll.
 application = get_asgi_application()
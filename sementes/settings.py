@@ -217,7 +217,11 @@ CELERY_TASK_ALWAYS_EAGER = env.bool('CELERY_TASK_ALWAYS_EAGER', default=True)  #
 CELERY_TASK_EAGER_PROPAGATES = True
 
 # ========== CACHE ==========
-# Cache simples usando memória local (evita problemas com Redis)
+# Cache simples usando memória local (evita problemas com Redis).
+# Com REDIS_URL (produção) o cache passa a ser compartilhado entre os
+# processos, o que o aviso imediato do quadro (api_eventos_kanban)
+# exige; com LocMemCache o aviso entre workers atrasa alguns segundos
+# (services_versao.TEMPO_SINAL_VERSAO_LOCAL).
 CACHES = {
     'default': {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',